@@ -30,14 +30,31 @@ def get_quiz_by_name_and_author(db: Session, name: str, author: str) -> Optional
         models.Quiz.author == author
     ).first()
 
+# Saves the settings of a quiz as its next version, the bot only reads saved versions
+def add_quiz_version(db: Session, db_quiz: models.Quiz, question_ids: List[int]) -> None:
+    db_quiz.version = (db_quiz.version or 0) + 1
+    db.add(models.QuizVersion(
+        quiz_id=db_quiz.id,
+        version=db_quiz.version,
+        is_random=db_quiz.is_random,
+        show_results_after_quiz=db_quiz.show_results_after_quiz,
+        show_results_after_question=db_quiz.show_results_after_question,
+        bank=db_quiz.bank,
+        bank_draw_count=db_quiz.bank_draw_count,
+        bank_stratify_by=db_quiz.bank_stratify_by
+    ))
+    for position, question_id in enumerate(question_ids):
+        db.add(models.QuizQuestion(quiz_id=db_quiz.id, version=db_quiz.version,
+                                   position=position, question_id=question_id))
+
 def create_quiz(db: Session, quiz: schemas.QuizCreateWithQuestions) -> models.Quiz:
     # Create quiz
-    db_quiz = models.Quiz(**quiz.dict(exclude={'questions'}))
+    db_quiz = models.Quiz(**quiz.dict(exclude={'questions'}), version=0)
     db.add(db_quiz)
-    db.commit()
-    db.refresh(db_quiz)
+    db.flush()
     
     # Add questions
+    question_ids = []
     if quiz.questions:
         for q in quiz.questions:
             db_question = models.Question(
@@ -45,7 +62,11 @@ def create_quiz(db: Session, quiz: schemas.QuizCreateWithQuestions) -> models.Qu
                 **q.dict(exclude={'quiz_id'})
             )
             db.add(db_question)
+            db.flush()
+            question_ids.append(db_question.id)
     
+    # The quiz, its questions and its first version are committed together
+    add_quiz_version(db, db_quiz, question_ids)
     db.commit()
     db.refresh(db_quiz)
     return db_quiz
@@ -229,6 +250,17 @@ def update_quiz(db: Session, quiz_id: int, user_id: int, quiz_update: schemas.Qu
     for key, value in quiz_update.dict(exclude_unset=True).items():
         setattr(quiz, key, value)
     
+    # The new version keeps the questions of the latest one
+    links = db.query(models.QuizQuestion).filter(
+        models.QuizQuestion.quiz_id == quiz.id,
+        models.QuizQuestion.version == quiz.version
+    ).order_by(models.QuizQuestion.position).all()
+    if links:
+        question_ids = [link.question_id for link in links]
+    else:
+        # A quiz saved before the versions has all its questions
+        question_ids = [question.id for question in sorted(quiz.questions, key=lambda q: q.id)]
+    add_quiz_version(db, quiz, question_ids)
     db.commit()
     db.refresh(quiz)
     return quiz
\ No newline at end of file
@@ -1,5 +1,5 @@
 # api/models.py
-from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, DateTime, Text
+from sqlalchemy import Column, Integer, BigInteger, String, Boolean, ForeignKey, DateTime, Text, Float, Index, ForeignKeyConstraint
 from sqlalchemy.orm import relationship
 from .database import Base
 import datetime
@@ -25,6 +25,11 @@ class Quiz(Base):
     is_random = Column(Boolean, default=False)
     show_results_after_quiz = Column(Boolean, default=True)
     show_results_after_question = Column(Boolean, default=True)
+    bank = Column(String(255), nullable=True)
+    bank_draw_count = Column(Integer, default=0)
+    bank_stratify_by = Column(String(50), nullable=True)
+    # Latest saved version, see QuizVersion
+    version = Column(Integer, default=0)
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
 
     # Relationships
@@ -46,6 +51,53 @@ class Question(Base):
     quiz = relationship("Quiz", back_populates="questions")
     answers = relationship("Answer", back_populates="question")
 
+class QuizVersion(Base):
+    """Immutable settings of a saved version of a quiz"""
+    __tablename__ = "quiz_versions"
+    
+    quiz_id = Column(Integer, ForeignKey("quizzes.id"), primary_key=True)
+    version = Column(Integer, primary_key=True)
+    is_random = Column(Boolean, default=False)
+    show_results_after_quiz = Column(Boolean, default=True)
+    show_results_after_question = Column(Boolean, default=True)
+    bank = Column(String(255), nullable=True)
+    bank_draw_count = Column(Integer, default=0)
+    bank_stratify_by = Column(String(50), nullable=True)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+class QuizQuestion(Base):
+    """Questions of a version of a quiz. Unchanged questions are shared by versions."""
+    __tablename__ = "quiz_questions"
+    
+    quiz_id = Column(Integer, primary_key=True)
+    version = Column(Integer, primary_key=True)
+    position = Column(Integer, primary_key=True)
+    question_id = Column(Integer, ForeignKey("questions.id"), nullable=False)
+    
+    __table_args__ = (
+        ForeignKeyConstraint(["quiz_id", "version"],
+                             ["quiz_versions.quiz_id", "quiz_versions.version"]),
+    )
+
+class BankQuestion(Base):
+    __tablename__ = "bank_questions"
+    __table_args__ = (
+        Index("ix_bank_questions_rand_key", "bank", "rand_key"),
+        Index("ix_bank_questions_tag", "bank", "tag", "rand_key"),
+        Index("ix_bank_questions_difficulty", "bank", "difficulty", "rand_key"),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    bank = Column(String(255), nullable=False)
+    question_type = Column(String(50), nullable=False)
+    question_text = Column(Text, nullable=False)
+    correct_answer = Column(Text, nullable=False)
+    possible_answers = Column(Text, nullable=True)
+    tag = Column(String(100), nullable=True)
+    difficulty = Column(Integer, nullable=True)
+    # Random key assigned on insert, used to sample without sorting the bank
+    rand_key = Column(Float, nullable=False)
+
 class QuizAttempt(Base):
     __tablename__ = "quiz_attempts"
     
@@ -73,4 +125,38 @@ class Answer(Base):
     
     # Relationships
     attempt = relationship("QuizAttempt", back_populates="answers")
-    question = relationship("Question", back_populates="answers")
\ No newline at end of file
+    question = relationship("Question", back_populates="answers")
+
+class DailySubscriber(Base):
+    """Chat which gets the quiz of the day, read in the order of the chat ID"""
+    __tablename__ = "daily_subscribers"
+    
+    chat_id = Column(BigInteger, primary_key=True, autoincrement=False)
+    username = Column(String(255), nullable=True)
+    subscribed_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+class DailyRun(Base):
+    """Progress of the broadcast of the quiz of a day, the checkpoint to resume it"""
+    __tablename__ = "daily_runs"
+    
+    day = Column(String(10), primary_key=True)
+    quiz_name = Column(String(255), nullable=False)
+    quiz_author = Column(String(255), nullable=True)
+    # Last chat ID which was sent to, the broadcast continues after it
+    last_chat_id = Column(BigInteger, nullable=True)
+    sent = Column(Integer, nullable=False, default=0)
+    failed = Column(Integer, nullable=False, default=0)
+    # Worker which sends the broadcast until lease_until (seconds since the epoch)
+    owner = Column(String(255), nullable=True)
+    lease_until = Column(Float, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+class DailyFailure(Base):
+    """Failed delivery of the quiz of a day to a chat, retried a few times"""
+    __tablename__ = "daily_failures"
+    
+    day = Column(String(10), primary_key=True)
+    chat_id = Column(BigInteger, primary_key=True, autoincrement=False)
+    error = Column(Text, nullable=True)
+    tries = Column(Integer, nullable=False, default=1)
+    failed_at = Column(DateTime, default=datetime.datetime.utcnow)
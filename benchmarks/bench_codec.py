@@ -0,0 +1,98 @@
+"""
+Compares the binary quiz format of quizbot.quiz.codec with pickle and JSON.
+
+Run it with ``python benchmarks/bench_codec.py [number of questions]``.
+The JSON layout is the one of the questions table: one object per question
+with the possible answers as list.
+"""
+import json
+import pickle
+import sys
+import timeit
+from quizbot.quiz.codec import decode_quiz, encode_quiz
+from quizbot.quiz.question_factory import QuestionBool, QuestionChoice, \
+    QuestionChoiceSingle, QuestionNumber, QuestionString, build_question
+from quizbot.quiz.quiz import Quiz
+
+
+def create_quiz(question_count):
+    """Creates a quiz with questions of every type."""
+    quiz = Quiz("benchmark", "Benchmark quiz")
+    for number in range(question_count):
+        kind = number % 5
+        if kind == 0:
+            question = QuestionString("What is the name of city {}?".format(number), "City")
+        elif kind == 1:
+            question = QuestionNumber("What is {} times 3?".format(number), str(number * 3))
+        elif kind == 2:
+            question = QuestionBool("Is {} an even number?".format(number), str(number % 2 == 0))
+        elif kind == 3:
+            question = QuestionChoice("Which numbers divide {}?".format(number), "1, 2")
+            question.add_possible_answer("7")
+            question.add_possible_answer("11")
+        else:
+            question = QuestionChoiceSingle("What comes after {}?".format(number),
+                                            str(number + 1))
+            question.add_possible_answer(str(number + 2))
+            question.add_possible_answer(str(number - 1))
+        quiz.add_question(question)
+    return quiz
+
+
+def encode_json(quiz):
+    """Encodes a quiz to JSON."""
+    return json.dumps({
+        "name": quiz.name,
+        "author": quiz.author,
+        "is_random": quiz.is_random,
+        "show_results_after_quiz": quiz.show_results_after_quiz,
+        "show_results_after_question": quiz.show_results_after_question,
+        "questions": [{
+            "question_type": type(question).__name__,
+            "question_text": question.question,
+            "correct_answer": question.correct_answer,
+            "possible_answers": getattr(question, "possible_answers", None),
+            "is_random": getattr(question, "is_random", False)
+        } for question in quiz.questions]
+    }).encode("utf-8")
+
+
+def decode_json(data):
+    """Decodes a quiz encoded by encode_json."""
+    fields = json.loads(data)
+    quiz = Quiz(fields["author"], fields["name"])
+    quiz.is_random = fields["is_random"]
+    quiz.show_results_after_quiz = fields["show_results_after_quiz"]
+    quiz.show_results_after_question = fields["show_results_after_question"]
+    quiz.questions = [build_question(question["question_type"], question["question_text"],
+                                     question["correct_answer"], question["possible_answers"],
+                                     question["is_random"])
+                      for question in fields["questions"]]
+    return quiz
+
+
+def measure(name, encode, decode, quiz, repeat):
+    """Prints size and time per encode and decode of one format."""
+    data = encode(quiz)
+    encode_time = min(timeit.repeat(lambda: encode(quiz), number=repeat, repeat=5)) / repeat
+    decode_time = min(timeit.repeat(lambda: decode(data), number=repeat, repeat=5)) / repeat
+    print("{:<8} {:>9} {:>12.1f} {:>12.1f}".format(
+        name, len(data), encode_time * 1e6, decode_time * 1e6))
+
+
+def main():
+    """Runs the benchmark."""
+    question_count = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    quiz = create_quiz(question_count)
+    repeat = max(10, 20000 // question_count)
+
+    print("{} questions".format(question_count))
+    print("{:<8} {:>9} {:>12} {:>12}".format("format", "bytes", "encode µs", "decode µs"))
+    measure("codec", encode_quiz, decode_quiz, quiz, repeat)
+    measure("pickle", lambda quiz: pickle.dumps(quiz, pickle.HIGHEST_PROTOCOL),
+            pickle.loads, quiz, repeat)
+    measure("json", encode_json, decode_json, quiz, repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,426 @@
+"""
+CPU time and allocations of the conversation handlers of create_quiz, attempt_quiz
+and edit_quiz, without Telegram and without a database.
+
+Run it with ``python benchmarks/bench_handlers.py [--sizes 5 50 500] [--repeat N]``.
+
+The handlers get real ``Update`` objects, decoded from the JSON Telegram sends,
+and real ``CallbackContext`` objects. The Bot API is a stub which counts the requests,
+the MySQL layer is replaced by a dict in memory. The quiz cache, the
+name index and the user states are the real ones. For every quiz size a synthetic user
+
+* creates a quiz with questions of every type,
+* attempts it with text answers,
+* attempts it again with the true/false and single choice questions as quiz polls,
+  letting every fifth poll expire,
+* starts the quiz of the day and cancels it,
+* renames, clones and removes the quiz and cancels an edit.
+
+The updates and contexts are built before a handler is timed, so only the handler
+is measured. The CPU time is the time of the thread (``time.thread_time_ns``),
+the allocations are measured in a second pass with ``tracemalloc``: the peak is the
+highest memory above the start of the call, the retained memory is what the call
+left allocated. Logging is disabled during the measurement.
+"""
+import argparse
+import contextlib
+import itertools
+import logging
+import statistics
+import time
+import tracemalloc
+from collections import defaultdict
+from types import SimpleNamespace
+from telegram import Update
+from telegram.ext import CallbackContext, ConversationHandler
+from quizbot.bot import attempt_quiz, create_quiz, edit_quiz
+from quizbot.quiz.codec import decode_quiz, encode_quiz
+from quizbot.quiz.question_factory import QuestionChoice
+from quizbot.quiz.quiz import Quiz
+
+# Quiz sizes of the conversation walks
+SIZES = (5, 50, 500)
+
+# Day of the quiz of the day in the walk
+DAY = '2026-10-19'
+
+
+class StubBot:
+    """Bot API without network: counts the requests and returns minimal results."""
+
+    def __init__(self):
+        self.requests = 0
+        self.pending_poll = None
+
+    def _request(self, *_, **__):
+        self.requests += 1
+        return SimpleNamespace(message_id=self.requests)
+
+    send_message = send_chat_action = answer_callback_query = answer_inline_query = \
+        edit_message_text = edit_message_reply_markup = _request
+    # Some shortcuts of python-telegram-bot call the camel case aliases
+    answerCallbackQuery = answerInlineQuery = _request  # pylint: disable=invalid-name
+
+    def send_poll(self, chat_id, question, options, correct_option_id, **_):
+        """Sends a quiz poll, the walk answers it next."""
+        self.requests += 1
+        poll_id = str(self.requests)
+        self.pending_poll = (poll_id, question, options, correct_option_id)
+        return SimpleNamespace(message_id=self.requests, poll=SimpleNamespace(id=poll_id))
+
+
+class StubDatabase:
+    """
+    The quizzes of MySQL in memory.
+    Loaded quizzes are decoded copies, like quizzes loaded from a database.
+    """
+
+    def __init__(self):
+        self.quizzes = dict()
+        # Name and author of the quiz of the day
+        self.daily = None
+        self._ids = itertools.count(1)
+
+    def save(self, quiz):
+        """Saves a new version of a quiz."""
+        stored = self.quizzes.get((quiz.name, quiz.author))
+        quiz.id = stored.id if stored else next(self._ids)
+        quiz.version = stored.version + 1 if stored else 1
+        self.quizzes[(quiz.name, quiz.author)] = self._copy(quiz)
+
+    def find(self, name, author=None):
+        """Returns the stored quiz of a name and optional author or None."""
+        if author is not None:
+            return self.quizzes.get((name, author))
+        return next((quiz for (quiz_name, _), quiz in self.quizzes.items()
+                     if quiz_name == name), None)
+
+    def load(self, name, author=None, version=None):  # pylint: disable=unused-argument
+        """Loads a copy of a quiz."""
+        quiz = self.find(name, author)
+        return None if quiz is None else self._copy(quiz)
+
+    def get_version(self, name, author=None):
+        """Returns the ID and the version of a quiz or None."""
+        quiz = self.find(name, author)
+        return None if quiz is None else (quiz.id, quiz.version)
+
+    def clone(self, name, author, new_name, new_author):
+        """Copies a quiz, raises ValueError if the new name is taken."""
+        if (new_name, new_author) in self.quizzes:
+            raise ValueError('Quiz {} of {} exists already'.format(new_name, new_author))
+        quiz = self.load(name, author)
+        quiz.name, quiz.author = new_name, new_author
+        self.save(quiz)
+
+    def rename(self, name, author, new_name):
+        """Renames a quiz, raises ValueError if the new name is taken."""
+        if (new_name, author) in self.quizzes:
+            raise ValueError('Quiz {} of {} exists already'.format(new_name, author))
+        quiz = self.quizzes.pop((name, author), None)
+        if quiz is not None:
+            quiz.name = new_name
+            self.quizzes[(new_name, author)] = quiz
+        return quiz is not None
+
+    def delete(self, name, author):
+        """Deletes a quiz."""
+        return self.quizzes.pop((name, author), None) is not None
+
+    @staticmethod
+    def _copy(quiz):
+        copy = decode_quiz(encode_quiz(quiz))
+        copy.id, copy.version = quiz.id, quiz.version
+        return copy
+
+
+@contextlib.contextmanager
+def stubbed_layers(database):
+    """Replaces the database layers by a StubDatabase and restores them at the end."""
+    patches = [
+        (Quiz, 'save_to_db', lambda quiz: database.save(quiz)),
+        (Quiz, 'load_from_db', staticmethod(database.load)),
+        (Quiz, 'get_version', staticmethod(database.get_version)),
+        (Quiz, 'clone', staticmethod(database.clone)),
+        (Quiz, 'rename', staticmethod(database.rename)),
+        (Quiz, 'delete', staticmethod(database.delete)),
+        (attempt_quiz, 'load_run', lambda day: SimpleNamespace(
+            day=day, quiz_name=database.daily[0], quiz_author=database.daily[1])),
+        (attempt_quiz, 'end_conversation', lambda *_: None),
+    ]
+    originals = [(owner, name, owner.__dict__[name]) for owner, name, _ in patches]
+    for owner, name, value in patches:
+        setattr(owner, name, value)
+    try:
+        yield
+    finally:
+        for owner, name, value in originals:
+            setattr(owner, name, value)
+
+
+class Recorder:
+    """Measures the calls of the handlers, either the CPU time or the allocations."""
+
+    def __init__(self, bot, allocations=False):
+        self.bot = bot
+        self.allocations = allocations
+        self.samples = defaultdict(list)
+        self.walks = defaultdict(list)
+        self.walk = None
+
+    def call(self, handler, update, context):
+        """
+        Calls a handler and records its cost.
+
+        :returns: Return value of the handler.
+        """
+        name = '{}.{}'.format(handler.__module__.rsplit('.', 1)[-1], handler.__name__)
+        requests = self.bot.requests
+        if self.allocations:
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            result = handler(update, context)
+            current, peak = tracemalloc.get_traced_memory()
+            self.samples[name].append((peak - before, current - before))
+        else:
+            start = time.thread_time_ns()
+            result = handler(update, context)
+            elapsed = time.thread_time_ns() - start
+            self.samples[name].append((elapsed, self.bot.requests - requests))
+            self.walks[self.walk][-1] += elapsed
+        return result
+
+    def start_walk(self, name):
+        """Starts to sum the CPU time of a walk."""
+        self.walk = name
+        self.walks[name].append(0)
+
+
+class Chat:
+    """
+    The private chat of a synthetic user, builds the updates Telegram would send
+    and calls the handlers with them.
+    """
+
+    def __init__(self, recorder, user_id):
+        self.recorder = recorder
+        self.bot = recorder.bot
+        self.user_id = user_id
+        self.username = 'bench_{}'.format(user_id)
+        self.user = {'id': user_id, 'is_bot': False, 'first_name': 'Bench',
+                     'username': self.username}
+        self.dispatcher = SimpleNamespace(use_context=True, bot=self.bot, bot_data=dict(),
+                                          chat_data=defaultdict(dict),
+                                          user_data=defaultdict(dict))
+        self._ids = itertools.count(1)
+
+    def run(self, handler, update):
+        """Calls a handler with an update and a fresh context, like the dispatcher."""
+        context = CallbackContext.from_update(update, self.dispatcher)
+        return self.recorder.call(handler, update, context)
+
+    def message(self, text):
+        """Returns the update of a text message of the user."""
+        update_id = next(self._ids)
+        return self._update(update_id, message={
+            'message_id': update_id, 'date': 0, 'text': text, 'from': self.user,
+            'chat': {'id': self.user_id, 'type': 'private'}})
+
+    def callback(self, data):
+        """Returns the update of a pressed inline button."""
+        update_id = next(self._ids)
+        return self._update(update_id, callback_query={
+            'id': str(update_id), 'from': self.user, 'chat_instance': '1', 'data': data,
+            'message': {'message_id': 1, 'date': 0, 'text': 'Quiz of the day',
+                        'chat': {'id': self.user_id, 'type': 'private'}}})
+
+    def inline_query(self, query):
+        """Returns the update of an inline query."""
+        update_id = next(self._ids)
+        return self._update(update_id, inline_query={
+            'id': str(update_id), 'from': self.user, 'query': query, 'offset': ''})
+
+    def poll_answer(self, poll_id, option_id):
+        """Returns the update of an answer of a quiz poll."""
+        return self._update(next(self._ids), poll_answer={
+            'poll_id': poll_id, 'user': self.user, 'option_ids': [option_id]})
+
+    def closed_poll(self, poll_id, question, options):
+        """Returns the update of a quiz poll which closed."""
+        return self._update(next(self._ids), poll={
+            'id': poll_id, 'question': question, 'total_voter_count': 0, 'is_closed': True,
+            'is_anonymous': False, 'type': 'quiz', 'allows_multiple_answers': False,
+            'options': [{'text': option, 'voter_count': 0} for option in options]})
+
+    def _update(self, update_id, **content):
+        return Update.de_json(dict(content, update_id=update_id), self.bot)
+
+
+def question_input(number):
+    """
+    Returns the messages which create a question of every type in turn.
+
+    :returns: Tuple of the type, the question, the correct answer and the possible answers
+        or None.
+    """
+    types = list(create_quiz.dict_question_types)
+    kind = number % 5
+    if kind == 0:
+        return types[0], 'What is {} times 3?'.format(number), str(number * 3), None
+    if kind == 1:
+        return types[1], 'What is the name of city {}?'.format(number), 'City', None
+    if kind == 2:
+        return types[2], 'Is {} an even number?'.format(number), str(number % 2 == 0), None
+    if kind == 3:
+        return types[3], 'Which numbers divide {}?'.format(number), '1, 2', '7, 11'
+    return types[4], 'What comes after {}?'.format(number), str(number + 1), \
+        '{}, {}'.format(number + 2, number - 1)
+
+
+def walk_create(chat, name, size):
+    """Creates a quiz of size questions."""
+    chat.run(create_quiz.start, chat.message('/create'))
+    for number in range(size):
+        kind, question, answer, possible_answers = question_input(number)
+        chat.run(create_quiz.enter_type, chat.message(kind))
+        chat.run(create_quiz.enter_question, chat.message(question))
+        chat.run(create_quiz.enter_answer, chat.message(answer))
+        if possible_answers is not None:
+            chat.run(create_quiz.enter_possible_answer, chat.message(possible_answers))
+            chat.run(create_quiz.enter_randomness_question, chat.message('No'))
+    chat.run(create_quiz.enter_type, chat.message('Enter'))
+    chat.run(create_quiz.enter_randomness_quiz, chat.message('No'))
+    chat.run(create_quiz.enter_result_after_question, chat.message('Yes'))
+    chat.run(create_quiz.enter_result_after_quiz, chat.message('Yes'))
+    assert chat.run(create_quiz.enter_quiz_name, chat.message(name)) == ConversationHandler.END
+
+    chat.run(create_quiz.start, chat.message('/create'))
+    chat.run(create_quiz.cancel, chat.message('/cancelCreate'))
+
+
+def walk_attempt(chat, name, polls):
+    """Attempts a quiz, answering every question correctly, with or without quiz polls."""
+    attempt_quiz.poll_open_period = 30 if polls else None
+    chat.bot.pending_poll = None
+    chat.run(attempt_quiz.start, chat.message('/attempt'))
+    chat.run(attempt_quiz.search_quizzes, chat.inline_query(name[:4]))
+    assert chat.run(attempt_quiz.enter_quiz, chat.message('{} {}'.format(name, chat.username))) \
+        == 'ENTER_ANSWER'
+    for number in itertools.count():
+        if chat.user_id not in attempt_quiz.userDict:
+            break
+        poll, chat.bot.pending_poll = chat.bot.pending_poll, None
+        if poll is not None:
+            poll_id, question, options, correct_option_id = poll
+            if number % 5 == 4:
+                chat.run(attempt_quiz.close_poll, chat.closed_poll(poll_id, question, options))
+            else:
+                chat.run(attempt_quiz.enter_poll_answer,
+                         chat.poll_answer(poll_id, correct_option_id))
+            continue
+        question = attempt_quiz.userDict[chat.user_id].act_question()
+        if type(question) is QuestionChoice:  # pylint: disable=unidiomatic-typecheck
+            for answer in question.correct_answer.split(', '):
+                chat.run(attempt_quiz.enter_answer, chat.message(answer))
+            chat.run(attempt_quiz.enter_answer, chat.message('Enter'))
+        else:
+            chat.run(attempt_quiz.enter_answer, chat.message(question.correct_answer))
+    attempt_quiz.poll_open_period = None
+
+
+def walk_daily(chat, database, name):
+    """Starts the quiz of the day with its button and cancels the attempt."""
+    database.daily = (name, chat.username)
+    assert chat.run(attempt_quiz.start_daily, chat.callback('daily:' + DAY)) == 'ENTER_ANSWER'
+    chat.run(attempt_quiz.cancel, chat.message('/cancelAttempt'))
+
+
+def walk_edit(chat, name):
+    """Renames, clones and removes a quiz and cancels an edit."""
+    renamed = name + '_renamed'
+    chat.run(edit_quiz.start_rename, chat.message('/rename'))
+    chat.run(edit_quiz.enter_old_name, chat.message('missing'))
+    chat.run(edit_quiz.enter_old_name, chat.message(name))
+    chat.run(edit_quiz.enter_new_name, chat.message(renamed))
+    chat.run(edit_quiz.start_clone, chat.message('/clone'))
+    chat.run(edit_quiz.enter_clone_source, chat.message('{} {}'.format(renamed, chat.username)))
+    chat.run(edit_quiz.enter_clone_name, chat.message(name + '_copy'))
+    chat.run(edit_quiz.start_remove, chat.message('/remove'))
+    chat.run(edit_quiz.enter_name_remove, chat.message(renamed))
+    chat.run(edit_quiz.start_rename, chat.message('/rename'))
+    chat.run(edit_quiz.cancel_edit, chat.message('/cancelEdit'))
+
+
+def walk_all(recorder, database, size, run):
+    """Runs all walks of a quiz size with a new user."""
+    chat = Chat(recorder, 10 ** 6 * size + run)
+    name = 'Bench{}x{}'.format(size, run)
+    for walk, function, args in (
+            ('create', walk_create, (chat, name, size)),
+            ('attempt', walk_attempt, (chat, name, False)),
+            ('attempt polls', walk_attempt, (chat, name, True)),
+            ('daily', walk_daily, (chat, database, name)),
+            ('edit', walk_edit, (chat, name))):
+        recorder.start_walk(walk)
+        function(*args)
+
+
+def measure(size, repeat):
+    """
+    Runs the walks of a quiz size, first timed, then with tracemalloc.
+
+    :param size: Number of questions of the quiz.
+    :param repeat: Number of timed runs of the walks.
+    :returns: Pair of the timing and the allocation Recorder.
+    """
+    bot = StubBot()
+    database = StubDatabase()
+    timing = Recorder(bot)
+    allocations = Recorder(bot, allocations=True)
+    with stubbed_layers(database):
+        # The first run warms the caches up and isn't counted
+        walk_all(Recorder(bot), database, size, 0)
+        for run in range(1, repeat + 1):
+            walk_all(timing, database, size, run)
+        tracemalloc.start()
+        try:
+            walk_all(allocations, database, size, repeat + 1)
+        finally:
+            tracemalloc.stop()
+    return timing, allocations
+
+
+def report(size, timing, allocations):
+    """Prints the cost of every handler and of every walk."""
+    print('\nQuiz of {} questions'.format(size))
+    print('{:<40} {:>7} {:>9} {:>9} {:>10} {:>10} {:>8}'.format(
+        'handler', 'calls', 'mean us', 'p95 us', 'peak KiB', 'kept B', 'requests'))
+    for name in sorted(timing.samples):
+        times = sorted(elapsed for elapsed, _ in timing.samples[name])
+        requests = sum(count for _, count in timing.samples[name]) / len(times)
+        peaks = [peak for peak, _ in allocations.samples[name]]
+        kept = [retained for _, retained in allocations.samples[name]]
+        print('{:<40} {:>7} {:>9.1f} {:>9.1f} {:>10.1f} {:>10.0f} {:>8.2f}'.format(
+            name, len(times), statistics.mean(times) / 1e3,
+            times[min(len(times) - 1, int(len(times) * 0.95))] / 1e3,
+            statistics.mean(peaks) / 1024, statistics.mean(kept), requests))
+    print('Walks (fastest run): ' + ', '.join(
+        '{} {:.2f} ms'.format(walk, min(totals) / 1e6) for walk, totals in timing.walks.items()))
+
+
+def main():
+    """Runs the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n', 1)[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES,
+                        help='numbers of questions of the quizzes')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='timed runs of the walks per quiz size')
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    for size in args.sizes:
+        report(size, *measure(size, args.repeat))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""
+Report of the import time of the bot, which is the largest part of its cold start.
+
+Run it with ``python benchmarks/import_time.py [module] [--top N] [--budget SECONDS]``.
+
+The module (default ``quizbot.bot.bot``) is imported in a fresh interpreter with
+``python -X importtime``. The report shows the modules with the highest own and
+cumulative import time and the cost of every top-level package. With ``--budget``,
+the script fails if the whole import takes longer.
+"""
+import argparse
+import os
+import subprocess
+import sys
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def measure(module):
+    """
+    Imports a module in a fresh interpreter and returns the import time of every module.
+
+    :param module: Name of the module to import.
+    :returns: List of tuples (module, own microseconds, cumulative microseconds)
+        in the order the imports finished.
+    """
+    process = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+        cwd=ROOT, capture_output=True, text=True, check=True)
+    times = []
+    for line in process.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        own, cumulative, name = line[len('import time:'):].split('|')
+        times.append((name.strip(), int(own), int(cumulative)))
+    return times
+
+
+def report(module, times, top):
+    """Prints the most expensive modules and packages."""
+    total = next(cumulative for name, _, cumulative in reversed(times) if name == module)
+    print('Import of {}: {:.0f} ms, {} modules'.format(module, total / 1000, len(times)))
+
+    packages = defaultdict(int)
+    for name, own, _ in times:
+        packages[name.split('.')[0]] += own
+    print('\nPackages by own time:')
+    for name, own in sorted(packages.items(), key=lambda item: -item[1])[:top]:
+        print('  {:>8.1f} ms  {}'.format(own / 1000, name))
+
+    for title, index in (('own', 1), ('cumulative', 2)):
+        print('\nModules by {} time:'.format(title))
+        for entry in sorted(times, key=lambda entry: -entry[index])[:top]:
+            print('  {:>8.1f} ms  {}'.format(entry[index] / 1000, entry[0]))
+    return total
+
+
+def main():
+    """Runs the report."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n', maxsplit=1)[0])
+    parser.add_argument('module', nargs='?', default='quizbot.bot.bot')
+    parser.add_argument('--top', type=int, default=15, help='Modules per list')
+    parser.add_argument('--budget', type=float, help='Maximum import time in seconds')
+    args = parser.parse_args()
+
+    total = report(args.module, measure(args.module), args.top)
+    if args.budget is not None and total / 1e6 > args.budget:
+        print('\nImport takes {:.2f} s, the budget is {:.2f} s'.format(total / 1e6, args.budget))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,202 @@
+"""
+Load test of the bots with synthetic users against the fake Bot API of
+quizbot.bot.fake_telegram, without Telegram.
+
+Run it with ``python benchmarks/load_test.py [--bot quizbot|gpt|none] [--users N]
+[--concurrency N] [--questions N]``.
+
+* ``quizbot``: Starts ``quizbot/bot/bot.py``. Every user creates a quiz with /create
+  and attempts it with /attempt. The database settings are taken from the environment.
+* ``gpt``: Starts ``telegram-bot/bot_gpt/bot.py`` in a temporary directory. Every user
+  takes the default quiz with its native quiz polls.
+* ``none``: Waits for a bot started with TELEGRAM_BASE_URL set to the printed URL
+  and runs the quizbot scenario.
+
+Every step of a user is the time from sending an update until the expected answer
+of the bot. The report shows the percentiles of the steps and the throughput.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from quizbot.bot.fake_telegram import FakeBotAPI, contains, is_poll
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# IDs of the synthetic users start here
+FIRST_USER_ID = 10 ** 9
+
+
+class User:
+    """A synthetic user which measures how long the bot takes to answer."""
+
+    def __init__(self, api, user_id, timeout):
+        self.api = api
+        self.user_id = user_id
+        self.username = 'load_{}'.format(user_id)
+        self.timeout = timeout
+        self.latencies = defaultdict(list)
+
+    def say(self, step, text, predicate):
+        """Sends a text and waits for the expected answer."""
+        start = time.perf_counter()
+        self.api.send_text(self.user_id, text, self.username)
+        return self._expect(step, start, predicate)
+
+    def press(self, step, message, data, predicate):
+        """Presses an inline button and waits for the expected answer."""
+        start = time.perf_counter()
+        self.api.press_button(self.user_id, message, data, self.username)
+        return self._expect(step, start, predicate)
+
+    def vote(self, step, poll, option_ids, predicate):
+        """Answers a poll and waits for the expected answer."""
+        start = time.perf_counter()
+        self.api.answer_poll(self.user_id, poll['id'], option_ids, self.username)
+        return self._expect(step, start, predicate)
+
+    def wait(self, predicate):
+        """Waits for a message the bot sends by itself, it isn't measured."""
+        return self.api.expect(self.user_id, predicate, self.timeout)
+
+    def _expect(self, step, start, predicate):
+        event = self.api.expect(self.user_id, predicate, self.timeout)
+        self.latencies[step].append(time.perf_counter() - start)
+        return event
+
+
+def quizbot_scenario(user, questions, run):
+    """Creates a quiz with /create and attempts it with /attempt."""
+    name = 'load{}x{}'.format(run, user.user_id)
+    user.say('create', '/create', contains('first one be?'))
+    for number in range(questions):
+        user.say('create', 'Ask for a string', contains('What is the question?'))
+        user.say('create', 'Question {}?'.format(number), contains('correct answer'))
+        user.say('create', 'answer', contains('next one be?'))
+    user.say('create', 'Enter', contains('questions be displayed in random order'))
+    user.say('create', 'No', contains('displayed after the question?'))
+    user.say('create', 'Yes', contains('displayed after the quiz?'))
+    user.say('create', 'No', contains('How should I name it?'))
+    user.say('save', name, contains('I saved your new quiz'))
+    user.say('attempt', '/attempt', contains('Which quiz'))
+    user.say('enter quiz', '{} {}'.format(name, user.username), contains('Question 0?'))
+    for number in range(1, questions):
+        user.say('answer', 'answer', contains('Question {}?'.format(number)))
+    user.say('answer', 'answer', contains('Thanks for your participation'))
+
+
+def gpt_scenario(user, *_):
+    """Takes a quiz of bot_gpt and answers its quiz polls."""
+    menu = user.say('start', '/start', lambda event: 'reply_markup' in event.message)
+    event = user.press('take quiz', menu.message, 'take_quiz',
+                       lambda event: is_poll(event) or contains('Select a quiz')(event))
+    if not is_poll(event):
+        event = user.press('select quiz', event.message, 'select_quiz_0', contains('Get ready'))
+        event = user.press('ready', event.message, 'ready', is_poll)
+    while True:
+        poll = event.message['poll']
+        user.vote('answer', poll, [poll.get('correct_option_id', 0)],
+                  lambda event: contains('Correct!')(event) or contains('Incorrect')(event))
+        # The next question follows after a pause
+        event = user.wait(lambda event: is_poll(event) or contains('Quiz finished')(event))
+        if not is_poll(event):
+            break
+
+
+def start_bot(bot, api):
+    """Starts the process of a bot which uses the fake API."""
+    env = dict(os.environ, TELEGRAM_BASE_URL=api.base_url,
+               TELEGRAM_TOKEN=os.environ.get('TELEGRAM_TOKEN', '123456:LOAD-TEST'),
+               PYTHONPATH=ROOT)
+    if bot == 'quizbot':
+        return subprocess.Popen([sys.executable, '-m', 'quizbot.bot.bot'], cwd=ROOT, env=env)
+    # bot_gpt stores its quizzes and answers in the working directory
+    return subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, 'telegram-bot', 'bot_gpt', 'bot.py')],
+        cwd=tempfile.mkdtemp(prefix='bot_gpt_load_'), env=env)
+
+
+def percentile(values, fraction):
+    """Returns a percentile of sorted values."""
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def report(latencies, updates, failed, users, seconds, stats):
+    """Prints the percentiles of the steps and the throughput."""
+    print('Users: {} ({} failed) in {:.1f} s'.format(users, failed, seconds))
+    print('Updates: {}, {:.1f} per second'.format(updates, updates / seconds))
+    print('{:<12} {:>8} {:>9} {:>9} {:>9} {:>9}'.format(
+        'step', 'count', 'p50 ms', 'p90 ms', 'p99 ms', 'max ms'))
+    for step, values in list(latencies.items()) + [('all', [value for values in latencies.values()
+                                                              for value in values])]:
+        values = sorted(values)
+        if not values:
+            continue
+        print('{:<12} {:>8} {:>9.1f} {:>9.1f} {:>9.1f} {:>9.1f}'.format(
+            step, len(values), 1000 * percentile(values, 0.5), 1000 * percentile(values, 0.9),
+            1000 * percentile(values, 0.99), 1000 * values[-1]))
+    print('Bot API calls: {}'.format(', '.join('{} {}'.format(method, count) for method, count
+                                               in sorted(stats['calls'].items()))))
+
+
+def main():
+    """Runs the load test."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--bot', choices=('quizbot', 'gpt', 'none'), default='quizbot')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=200)
+    parser.add_argument('--questions', type=int, default=5)
+    parser.add_argument('--timeout', type=float, default=60.0,
+                        help='Seconds to wait for an answer of the bot')
+    parser.add_argument('--port', type=int, default=0)
+    args = parser.parse_args()
+
+    api = FakeBotAPI(args.port)
+    api.start()
+    process = None
+    if args.bot == 'none':
+        print('Start the bot with TELEGRAM_BASE_URL={}'.format(api.base_url))
+    else:
+        process = start_bot(args.bot, api)
+    try:
+        if not api.wait_for_bot(120):
+            sys.exit('The bot did not connect to {}'.format(api.base_url))
+        scenario = gpt_scenario if args.bot == 'gpt' else quizbot_scenario
+        run = int(time.time())
+        users = [User(api, FIRST_USER_ID + number, args.timeout) for number in range(args.users)]
+
+        def play(user):
+            try:
+                scenario(user, args.questions, run)
+                return True
+            except TimeoutError as err:
+                print('User {} failed: {}'.format(user.user_id, err), file=sys.stderr)
+                return False
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(args.concurrency) as executor:
+            failed = list(executor.map(play, users)).count(False)
+        seconds = time.perf_counter() - start
+
+        latencies = defaultdict(list)
+        for user in users:
+            for step, values in user.latencies.items():
+                latencies[step] += values
+        report(latencies, sum(len(values) for values in latencies.values()), failed,
+               args.users, seconds, api.stats())
+    finally:
+        if process is not None:
+            process.terminate()
+            try:
+                process.wait(30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        api.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -4,14 +4,19 @@ Module with methods to attempt to a quiz with a telegram bot
 # quizbot/bot/attempt_quiz.py
 import logging
 import random
+import threading
 from telegram.ext import ConversationHandler
-from telegram import ReplyKeyboardMarkup, ReplyKeyboardRemove, ChatAction
-from quizbot.quiz.question_factory import (
-    QuestionBool, QuestionChoice, QuestionChoiceSingle,
-    QuestionNumber, QuestionString
-)
+from telegram import ChatAction, InlineKeyboardButton, InlineKeyboardMarkup, \
+    InlineQueryResultArticle, InputTextMessageContent, Poll, User
+from quizbot.quiz.question_factory import QuestionBool, QuestionChoice, QuestionChoiceSingle
 from quizbot.quiz.attempt import Attempt
-from quizbot.quiz.quiz import Quiz
+from quizbot.quiz.cache import quiz_cache
+from quizbot.quiz.name_index import quiz_index
+from quizbot.quiz.subscription import load_run
+from quizbot.bot.keyboards import REMOVE, permutations, question_keyboard
+from quizbot.bot.results import send_results
+from quizbot.bot.send_queue import PROMPT, reply, send
+from quizbot.bot.user_state import UserStateStore
 
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -19,8 +24,34 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Maximum number of quizzes shown for an inline query
+SEARCH_LIMIT = 20
+
+# Button which starts an inline query in the chat to search a quiz
+SEARCH_BUTTON = InlineKeyboardMarkup(
+    [[InlineKeyboardButton('🔎 Search a quiz', switch_inline_query_current_chat='')]])
+
+# Limits of the quiz polls of Telegram
+POLL_QUESTION_LIMIT = 300
+POLL_OPTION_LIMIT = 100
+POLL_MAX_OPTIONS = 10
+
+# Seconds a quiz poll is open (5-600). If set, true/false and single choice questions
+# are sent as quiz polls, Telegram shows whether the answer is correct. Quizzes which
+# don't show the results after every question keep the keyboard. Set by the bot
+poll_open_period = None
+
+# Called like UserStateStore.on_expire with the ID of a user whose attempt was finished
+# by a poll, outside of the conversation, to end the conversation. Set by the bot
+end_conversation = None
+
 # Dict to store user data like an attempt instance
-userDict = dict()
+userDict = UserStateStore('attempt_quiz')
+
+# Open quiz polls by poll ID as dicts with the user, the chat, the number of the question
+# in the attempt, the question and the options, so an answer is graded without a search
+polls = UserStateStore('attempt_polls', idle_ttl=3600, max_entries=100000)
+_polls_lock = threading.Lock()
 
 
 def start(update, _):
@@ -31,16 +62,19 @@ def start(update, _):
 
     if user.id in userDict:
         logger.info('[%s] Attempt canceled because user is in middle of quiz.', username)
-        update.message.reply_text(
+        reply(
+            update,
             "You're in the middle of a quiz. You can't attempt a second one 😁\n"
             'If you want to cancel your attempt, enter /cancelAttempt.'
         )
         return ConversationHandler.END
 
-    update.message.reply_text(
+    reply(
+        update,
         'Hi 😃 Which quiz would you like to attempt?\n'
         'Please enter the quiz name. '
-        'If the quiz wasn\'t created by you, add the creator\'s username after the quiz name.'
+        'If the quiz wasn\'t created by you, add the creator\'s username after the quiz name.',
+        reply_markup=SEARCH_BUTTON
     )
     return 'ENTER_QUIZ'
 
@@ -52,21 +86,51 @@ def cancel(update, _):
                 update.message.from_user.username)
 
     # Remove all user data
-    userDict.pop(update.message.from_user.id)
-    update.message.reply_text(
+    userDict.pop(update.message.from_user.id, None)
+    reply(
+        update,
         "I canceled you attempt. See you next time. 🙋‍♂️")
     return ConversationHandler.END
 
 
+def search_quizzes(update, _):
+    """
+    Answers an inline query with the quizzes whose names or authors start with it.
+    Choosing a quiz sends its name and author, which enter_quiz understands.
+    """
+    query = update.inline_query
+    results = [
+        InlineQueryResultArticle(
+            id=str(number),
+            title=name,
+            description='by {}'.format(author),
+            input_message_content=InputTextMessageContent('{} {}'.format(name, author)))
+        for number, (name, author) in enumerate(quiz_index.search(query.query, SEARCH_LIMIT))
+    ]
+    query.answer(results, cache_time=10)
+
+
+def parse_quiz_name(text):
+    """
+    Splits an entered quiz into its name and optional creator.
+
+    :param text: Quiz name, optionally followed by the creator's username.
+    :returns: Pair of the quiz name and the creator or None.
+    """
+    # The index knows names with several words
+    resolved = quiz_index.resolve(text)
+    if resolved is None:
+        quiz_input = text.split()
+        resolved = (quiz_input[0], quiz_input[1] if len(quiz_input) > 1 else None)
+    return resolved
+
+
 def enter_quiz(update, context):
     """Handle quiz name entry"""
     user = update.message.from_user
     username = user.username or f"user_{user.id}"
-    quiz_input = update.message.text.split()
-    
-    # Get quiz name and optional creator
-    quiz_name = quiz_input[0]
-    quiz_creator = quiz_input[1] if len(quiz_input) > 1 else None
+
+    quiz_name, quiz_creator = parse_quiz_name(update.message.text)
     
     logger.info('[%s] Quiz "%s" entered', username, quiz_name)
 
@@ -77,11 +141,12 @@ def enter_quiz(update, context):
     )
 
     try:
-        # Try to load quiz from database
-        quiz = Quiz.load_from_db(quiz_name, quiz_creator)
+        # Try to load quiz from the cache or the database
+        quiz = quiz_cache.get(quiz_name, quiz_creator)
         
         if not quiz:
-            update.message.reply_text(
+            reply(
+                update,
                 f"Sorry, I couldn't find the quiz '{quiz_name}' 😕 Please try again."
             )
             logger.info('[%s] Couldn\'t find Quiz %s', username, quiz_name)
@@ -90,23 +155,52 @@ def enter_quiz(update, context):
         logger.info('[%s] Found Quiz %s', username, quiz_name)
         userDict[user.id] = Attempt(quiz)
         
-        update.message.reply_text(
+        reply(
+            update,
             f"Let's go! 🙌 Have fun with the quiz '{quiz_name}'!\n"
             "You can cancel your participation with /cancelAttempt."
         )
 
         # Ask first question
-        ask_question(update)
+        ask_question(context.bot, update.effective_chat.id, user)
         return 'ENTER_ANSWER'
 
     except Exception as e:
         logger.error(f"Database error: {str(e)}")
-        update.message.reply_text(
+        reply(
+            update,
             "Sorry, there was an error accessing the quiz. Please try again."
         )
         return 'ENTER_QUIZ'
 
-def enter_answer(update, _):
+def start_daily(update, context):
+    """Starts an attempt of the quiz of the day with the button of its message"""
+    query = update.callback_query
+    user = query.from_user
+    username = user.username or f"user_{user.id}"
+
+    if user.id in userDict:
+        query.answer("You're in the middle of a quiz. Enter /cancelAttempt first 😁")
+        return None
+
+    run = load_run(query.data.split(':', 1)[1])
+    quiz = quiz_cache.get(run.quiz_name, run.quiz_author) if run else None
+    if not quiz:
+        query.answer("Sorry, this quiz isn't available anymore 😕")
+        return ConversationHandler.END
+
+    logger.info('[%s] Quiz of the day %s started', username, quiz.name)
+    query.answer()
+    userDict[user.id] = Attempt(quiz)
+    send(
+        context.bot, query.message.chat_id, 'send_message', PROMPT,
+        text=f"Let's go! 🙌 Have fun with the quiz '{quiz.name}'!\n"
+             "You can cancel your participation with /cancelAttempt."
+    )
+    ask_question(context.bot, query.message.chat_id, user)
+    return 'ENTER_ANSWER'
+
+def enter_answer(update, context):
     """
     It processes the answer to a question and asks a new question, if possible.
     Otherwise, it prints results.
@@ -144,7 +238,8 @@ def enter_answer(update, _):
         userDict[user_id].user_answers.clear()
         logger.info("[%s] Something went wrong by entering the answer.",
                     update.message.from_user.username)
-        update.message.reply_text(
+        reply(
+            update,
             "Sorry 😕 Something went wrong by entering your answer. Please try again.")
         return 'ENTER_ANSWER'
 
@@ -153,75 +248,181 @@ def enter_answer(update, _):
     if userDict[user_id].quiz.show_results_after_question:
         # If creator of the quiz wants the user to see him/her results after the question
         if is_correct:
-            update.message.reply_text("Thats correct 😁")
+            reply(update, "Thats correct 😁")
         else:
-            update.message.reply_text(
+            reply(
+                update,
                 "Sorry, thats not correct. 😕\nThe correct answer is: {}".format(correct_answer))
 
-    if userDict[user_id].has_next_question():
+    return next_question(context.bot, update.effective_chat.id, update.message.from_user)
+
+
+def next_question(bot, chat_id, user):
+    """
+    Asks the next question of an attempt, if possible. Otherwise, it prints results.
+
+    :param bot: Bot of the attempt.
+    :param chat_id: ID of the chat of the attempt.
+    :param user: User who attempts the quiz.
+    :returns: Next state of the conversation.
+    """
+    if userDict[user.id].has_next_question():
         # check for next question
-        ask_question(update)
+        ask_question(bot, chat_id, user)
         return 'ENTER_ANSWER'
 
-    # no question left
-    update.message.reply_text(
-        "Thanks for your participation! ☺️", reply_markup=ReplyKeyboardRemove())
-    if userDict[user_id].quiz.show_results_after_quiz:
+    # no question left, the attempt is closed before anything is sent
+    attempt = userDict.pop(user.id)
+    send(bot, chat_id, 'send_message', text="Thanks for your participation! ☺️",
+         reply_markup=REMOVE)
+    if attempt.quiz.show_results_after_quiz:
         # If creator of the quiz wants the user to see him/her results after the quiz
-        count = 1
-        for is_correct, question in userDict[user_id].user_points:
-            update.message.reply_text(
-                "Question {}:\n".format(count)
-                + question.question + "\n"
-                "Your answer was " +
-                ("correct 😁" if is_correct else "wrong. 😕\nThe correct answer is: {}".format(
-                    question.correct_answer)),
-                reply_markup=ReplyKeyboardRemove())
-            count = count + 1
-
-    # Deletes the users entries to closes the attempt
-    del userDict[update.message.from_user.id]
-    logger.info('[%s] Quitting Quiz', update.message.from_user.username)
+        send_results(bot, chat_id, user, attempt.user_points)
+    logger.info('[%s] Quitting Quiz', user.username)
     return ConversationHandler.END
 
 
-def ask_question(update):
+def ask_question(bot, chat_id, user):
     """
-    Formats the keyboard and prints the current question.
+    Prints the current question with its keyboard or sends it as quiz poll.
+
+    :param bot: Bot of the attempt.
+    :param chat_id: ID of the chat of the attempt.
+    :param user: User who attempts the quiz.
     """
-    user_id = update.message.from_user.id
-    act_question = userDict[user_id].act_question()
+    act_question = userDict[user.id].act_question()
+
+    if poll_open_period and send_poll(bot, chat_id, user):
+        return
+
+    # The keyboard is cached per question, shuffled ones are cached variants
+    reply_markup = question_keyboard(act_question)
+
+    # print question, it goes ahead of the bulk messages of other users
+    send(bot, chat_id, 'send_message', PROMPT, text=act_question.question,
+         reply_markup=reply_markup)
+
+    logger.info('[%s] Printed new question', user.username)
+
+
+def poll_options(question):
+    """
+    Returns the options of a question as quiz poll.
 
-    if isinstance(act_question, (QuestionString, QuestionNumber)):
-        # String or number question: Use normal Keyboard
-        reply_markup = ReplyKeyboardRemove()
-    elif isinstance(act_question, QuestionBool):
-        # Bool question: Choose between true and false button
-        reply_markup = ReplyKeyboardMarkup(
-            [['True', 'False']], one_time_keyboard=True)
-    elif isinstance(act_question, QuestionChoiceSingle):
-        # Single choice question: Choose between possible answers buttons
-        list_of_answers = [[el] for el in act_question.possible_answers]
-        if act_question.is_random:
-            # Shuffle if necessary
-            random.shuffle(list_of_answers)
-        reply_markup = ReplyKeyboardMarkup(
-            list_of_answers, one_time_keyboard=True)
+    :param question: Instance of the class Question.
+    :returns: List of the options in the order they are shown, None if the question
+        can't be sent as quiz poll.
+    """
+    if isinstance(question, QuestionBool):
+        options = ['True', 'False']
+    elif isinstance(question, QuestionChoiceSingle):
+        options = question.possible_answers
+        if question.is_random:
+            options = [options[position]
+                       for position in random.choice(permutations(len(options)))]
     else:
-        # Single choice question: Choose between possible answers buttons
-        list_of_answers = [[el] for el in act_question.possible_answers]
-        if act_question.is_random:
-            # Shuffle if necessary
-            random.shuffle(list_of_answers)
-        # add termination button
-        list_of_answers.append(['Enter'])
-        reply_markup = ReplyKeyboardMarkup(
-            list_of_answers, one_time_keyboard=False)
-
-    # print question
-    update.message.reply_text(
-        act_question.question,
-        reply_markup=reply_markup
-    )
+        return None
+    if len(question.question) > POLL_QUESTION_LIMIT or not 2 <= len(options) <= POLL_MAX_OPTIONS \
+            or any(len(option) > POLL_OPTION_LIMIT for option in options):
+        return None
+    return list(options)
 
-    logger.info('[%s] Printed new question', update.message.from_user.username)
+
+def send_poll(bot, chat_id, user):
+    """
+    Sends the current question of an attempt as quiz poll and indexes the poll,
+    if the quiz shows the results after every question.
+
+    :param bot: Bot of the attempt.
+    :param chat_id: ID of the chat of the attempt.
+    :param user: User who attempts the quiz.
+    :returns: Whether the question was sent as quiz poll.
+    """
+    attempt = userDict[user.id]
+    if not attempt.quiz.show_results_after_question:
+        # A quiz poll always reveals the correct answer
+        return False
+    question = attempt.act_question()
+    options = poll_options(question)
+    if options is None:
+        return False
+    entry = {'user': user.id, 'username': user.username, 'chat': chat_id,
+             'number': len(attempt.user_points), 'question': question.question,
+             'options': options}
+    future = send(bot, chat_id, 'send_poll', PROMPT, question=question.question,
+                  options=options, type=Poll.QUIZ, is_anonymous=False,
+                  correct_option_id=options.index(question.correct_answer),
+                  open_period=poll_open_period)
+
+    def sent(done):
+        # The ID of the poll is needed to grade the answer, the handler doesn't wait for it
+        if done.exception() is None:
+            polls[done.result().poll.id] = entry
+            logger.info('[%s] Sent new question as poll', user.username)
+            return
+        logger.warning('[%s] Sending the poll failed, asking with a keyboard: %s',
+                       user.username, done.exception())
+        send(bot, chat_id, 'send_message', PROMPT, text=question.question,
+             reply_markup=question_keyboard(question))
+
+    future.add_done_callback(sent)
+    return True
+
+
+def take_poll(poll_id):
+    """
+    Removes an open poll of an attempt from the index.
+
+    :param poll_id: ID of the poll.
+    :returns: Entry of the poll and the attempt, None if the poll isn't open anymore
+        or the question was answered otherwise.
+    """
+    with _polls_lock:
+        entry = polls.pop(poll_id, None)
+    if entry is None:
+        return None
+    attempt = userDict.get(entry['user'])
+    if attempt is None or len(attempt.user_points) != entry['number'] \
+            or attempt.act_question().question != entry['question']:
+        return None
+    return entry, attempt
+
+
+def enter_poll_answer(update, context):
+    """
+    Grades the answer of a quiz poll and asks the next question.
+    Telegram already showed whether the answer is correct.
+    """
+    answer = update.poll_answer
+    taken = take_poll(answer.poll_id)
+    if taken is None or not answer.option_ids:
+        return
+    entry, attempt = taken
+    attempt.input_answer(entry['options'][answer.option_ids[0]])
+    attempt.enter_answer()
+    userDict[answer.user.id] = attempt
+    logger.info('[%s] Entered Answer by poll', answer.user.username)
+    if next_question(context.bot, entry['chat'], answer.user) == ConversationHandler.END \
+            and end_conversation is not None:
+        end_conversation(answer.user.id, None, 'finished by a poll')
+
+
+def close_poll(update, context):
+    """
+    Counts the question of a quiz poll which closed without an answer as wrong
+    and asks the next question.
+    """
+    if not update.poll.is_closed:
+        return
+    taken = take_poll(update.poll.id)
+    if taken is None:
+        return
+    entry, attempt = taken
+    attempt.skip_question()
+    userDict[entry['user']] = attempt
+    logger.info('[%s] Time of poll ran out', entry['username'])
+    # The poll update has no user, the entry knows who attempts the quiz
+    user = User(entry['user'], '', False, username=entry['username'])
+    if next_question(context.bot, entry['chat'], user) == ConversationHandler.END \
+            and end_conversation is not None:
+        end_conversation(user.id, None, 'finished by a poll')
@@ -3,16 +3,111 @@ Telegram bot to create and attempt to quizzes.
 """
 
 import os
+import socket
 import logging
-from telegram.ext import Updater, CommandHandler, MessageHandler, Filters, ConversationHandler
+from dotenv import load_dotenv
+from telegram import Bot
+from telegram.ext import Updater, CommandHandler, MessageHandler, Filters, ConversationHandler, \
+    CallbackQueryHandler, InlineQueryHandler, PollAnswerHandler, PollHandler
 import quizbot.bot.create_quiz as createQuiz
 import quizbot.bot.attempt_quiz as attemptQuiz
+import quizbot.bot.inline_attempt as inlineAttempt
 import quizbot.bot.edit_quiz as editQuiz
+import quizbot.bot.results as results
+import quizbot.bot.live as live
+import quizbot.bot.daily as daily
+from quizbot.quiz.cache import quiz_cache
+from quizbot.quiz.name_index import quiz_index
+from quizbot.bot.cluster import HANDOFF_PATH, handoff_route
+from quizbot.bot.dedupe import UpdateWindow
+from quizbot.bot.metrics import InstrumentedRequest, instrument_database, instrument_handlers, \
+    registry, start_metrics_server
+from quizbot.bot.persistence import SQLitePersistence
+from quizbot.bot.sharding import ShardedDispatcher
+from quizbot.bot.send_queue import outbound, reply
+from quizbot.bot.webhook import run_webhook
 
 
+# Read the settings below from a .env file, if there is one
+load_dotenv()
+
+# Base URL of the Bot API, e.g. the one of quizbot.bot.fake_telegram for load tests
+TELEGRAM_BASE_URL = os.environ.get('TELEGRAM_BASE_URL')
+
 # Heroku Port
 PORT = int(os.environ.get('PORT', '8443'))
 
+# File with the popular quizzes, which are loaded into the cache at startup
+WARMUP_FILE = os.environ.get('QUIZ_WARMUP_FILE', 'hot_quizzes.json')
+
+# Public URL of the webhook without path. If unset, the bot polls for updates
+WEBHOOK_URL = os.environ.get('WEBHOOK_URL')
+
+# Serve the webhook without registering it at Telegram, e.g. to replay recorded updates
+WEBHOOK_LOCAL = os.environ.get('WEBHOOK_LOCAL') == '1'
+
+# Path of the webhook URL, secret token Telegram sends with every update
+# (generated at startup if unset) and maximum number of waiting updates
+WEBHOOK_PATH = os.environ.get('WEBHOOK_PATH', 'telegram')
+WEBHOOK_SECRET = os.environ.get('WEBHOOK_SECRET')
+WEBHOOK_QUEUE_SIZE = int(os.environ.get('WEBHOOK_QUEUE_SIZE', '1000'))
+
+# Number of the last update IDs the webhook remembers to drop updates Telegram delivers
+# again and the file they're kept in across restarts. The router of a cluster drops them
+# for its workers
+UPDATE_WINDOW_SIZE = int(os.environ.get('UPDATE_WINDOW_SIZE', '10000'))
+UPDATE_WINDOW_FILE = os.environ.get('UPDATE_WINDOW_FILE', 'quizbot_updates.window')
+
+# Number of threads the handlers run in, every user is bound to one of them and the
+# users are served concurrently. The queue of every shard is exported as metric
+DISPATCH_SHARDS = int(os.environ.get('DISPATCH_SHARDS', '64'))
+
+# SQLite database with the conversation states and the user states,
+# which are written every STATE_FLUSH_INTERVAL seconds
+STATE_DB = os.environ.get('STATE_DB', 'quizbot_state.sqlite3')
+STATE_FLUSH_INTERVAL = float(os.environ.get('STATE_FLUSH_INTERVAL', '5'))
+
+# The state of a user who didn't continue a conversation for STATE_IDLE_TTL seconds expires,
+# at most STATE_MAX_ENTRIES users are kept in memory per conversation
+STATE_IDLE_TTL = float(os.environ.get('STATE_IDLE_TTL', '3600'))
+STATE_MAX_ENTRIES = int(os.environ.get('STATE_MAX_ENTRIES', '10000'))
+STATE_SWEEP_INTERVAL = 60
+
+# Name of the worker if the bot runs as worker of quizbot.bot.cluster. Quizzes created by
+# the other workers are added to the index every INDEX_RELOAD_INTERVAL seconds
+CLUSTER_NODE = os.environ.get('CLUSTER_NODE')
+INDEX_RELOAD_INTERVAL = 300
+
+# Messages per second the bot sends to all chats, the cluster sets the share of a worker
+OUTBOUND_GLOBAL_RATE = float(os.environ.get('OUTBOUND_GLOBAL_RATE', '30'))
+
+# If set, /attempt sends true/false and single choice questions as quiz polls of Telegram,
+# which close after QUIZ_POLL_OPEN_PERIOD seconds (5-600)
+QUIZ_POLL_OPEN_PERIOD = os.environ.get('QUIZ_POLL_OPEN_PERIOD')
+
+# If set, the results of an attempt start with a summary of the score
+RESULTS_SUMMARY = os.environ.get('RESULTS_SUMMARY')
+
+# Seconds every chat has to answer a question of a live quiz, maximum seconds between the
+# first and the last chat getting a question and messages per second of all live quizzes
+# together, at most two thirds of the global rate. A live quiz has at most
+# LIVE_MAX_SKEW * LIVE_RATE chats
+LIVE_QUESTION_SECONDS = float(os.environ.get('LIVE_QUESTION_SECONDS', '20'))
+LIVE_MAX_SKEW = float(os.environ.get('LIVE_MAX_SKEW', '5'))
+LIVE_RATE = min(float(os.environ.get('LIVE_RATE', '20')), OUTBOUND_GLOBAL_RATE * 2 / 3)
+
+# Quiz of the day as 'name [author]', sent to the subscribers every day at DAILY_QUIZ_TIME
+# (HH:MM UTC), DAILY_RATE messages per second and DAILY_BATCH_SIZE subscribers between two
+# checkpoints. Disabled if DAILY_QUIZ is unset
+DAILY_QUIZ = os.environ.get('DAILY_QUIZ')
+DAILY_QUIZ_TIME = os.environ.get('DAILY_QUIZ_TIME', '09:00')
+DAILY_RATE = float(os.environ.get('DAILY_RATE', '20'))
+DAILY_BATCH_SIZE = int(os.environ.get('DAILY_BATCH_SIZE', '200'))
+DAILY_CHECK_INTERVAL = 60
+
+# Port of the Prometheus metrics endpoint /metrics, disabled if unset
+METRICS_PORT = os.environ.get('METRICS_PORT')
+
 # Enable logging
 logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
                     level=logging.INFO)
@@ -21,10 +116,12 @@ logger = logging.getLogger(__name__)
 
 def print_help(update, _):
     """Send a message when the command /help is issued."""
-    update.message.reply_text(
+    reply(
+        update,
         'Hey! 🙋‍♂️ How can I help you?\n'
     )
-    update.message.reply_text(
+    reply(
+        update,
         'What QuizBot is? 😃\n\n'
         'With QuizBot you can create quizzes with different question types. 🧐 You can\n'
         '- ask for a number,\n'
@@ -34,8 +131,12 @@ def print_help(update, _):
         '- create multiple choice questions with one correct answer.\n'
         'If you want to create a new quiz, call /create. 🤓\n'
         'If you want to attempt a quiz, call /attempt. 🤔\n'
+        'If you want to play a quiz with buttons in one message, call /play. 🎮\n'
         'If you want to rename one of your quizzes, call /rename. ✏️\n'
-        'If you want to delete one of your quizzes, call /remove.\n\n'
+        'If you want to delete one of your quizzes, call /remove.\n'
+        'If you want to copy a quiz, call /clone. 📋\n'
+        'If you want to host a quiz for many chats at once, call /live. 🔴\n'
+        'If you want to get the quiz of the day, call /subscribe. 🗓\n\n'
         'Have fun! 🥳'
     )
 
@@ -45,9 +146,37 @@ def error(update, context):
     logger.warning('Update "%s" caused error "%s"', update, context.error)
 
 
+def end_conversations(dispatch, handler, message=None):
+    """
+    Returns a function which ends the conversations of a user whose state expired
+    or was evicted and notifies the user.
+    """
+    def on_expire(user_id, _, reason):
+        logger.info('[%s] State of conversation %s %s', user_id, handler.name, reason)
+        # Conversation keys end with the user ID
+        for key in [key for key in list(handler.conversations) if key[-1] == user_id]:
+            handler.conversations.pop(key, None)
+            if handler.persistent:
+                dispatch.persistence.update_conversation(handler.name, key, None)
+        if message:
+            dispatch.bot.send_message(chat_id=user_id, text=message)
+    return on_expire
+
+
+def expire_states(context):
+    """Removes the expired states of the users, called periodically by the job queue."""
+    dispatch = context.dispatcher
+    for store, handler in context.job.context:
+        store.expire()
+        if handler is not None and handler.persistent:
+            dispatch.persistence.purge_conversations(handler.name, STATE_IDLE_TTL)
+
+
 def setup_bot(updater):
     """Setups the handlers"""
     dispatch = updater.dispatcher
+    # The conversation states are persisted if the updater has a persistence
+    persistent = dispatch.persistence is not None
 
     # Conversation if the user wants to create a quiz
     create_states = {
@@ -64,6 +193,9 @@ def setup_bot(updater):
     create_handler = ConversationHandler(
         entry_points=[CommandHandler('create', createQuiz.start)],
         states=create_states,
+        name='create',
+        persistent=persistent,
+        conversation_timeout=STATE_IDLE_TTL,
         fallbacks=[CommandHandler('cancelCreate', createQuiz.cancel)]
     )
     dispatch.add_handler(create_handler)
@@ -74,45 +206,197 @@ def setup_bot(updater):
         'ENTER_ANSWER': [MessageHandler(Filters.text & ~Filters.command, attemptQuiz.enter_answer)]
     }
     attempt_handler = ConversationHandler(
-        entry_points=[CommandHandler('attempt', attemptQuiz.start)],
+        entry_points=[CommandHandler('attempt', attemptQuiz.start),
+                      CallbackQueryHandler(attemptQuiz.start_daily,
+                                           pattern='^' + daily.CALLBACK_PREFIX)],
         states=attempt_states,
+        name='attempt',
+        persistent=persistent,
+        conversation_timeout=STATE_IDLE_TTL,
         fallbacks=[CommandHandler('cancelAttempt', attemptQuiz.cancel)]
     )
     dispatch.add_handler(attempt_handler)
 
-    # Conversation about remove or renaming exisiting quiz
+    # Answers of the questions sent as quiz polls, they aren't part of the conversation
+    # because a poll answer has no chat
+    if QUIZ_POLL_OPEN_PERIOD:
+        attemptQuiz.poll_open_period = int(QUIZ_POLL_OPEN_PERIOD)
+    attemptQuiz.end_conversation = end_conversations(dispatch, attempt_handler)
+    dispatch.add_handler(PollAnswerHandler(attemptQuiz.enter_poll_answer))
+    dispatch.add_handler(PollHandler(attemptQuiz.close_poll))
+
+    # Conversation if the user wants to attempt a quiz in one message with inline buttons
+    play_states = {
+        'ENTER_QUIZ': [MessageHandler(Filters.text & ~Filters.command, inlineAttempt.enter_quiz)],
+        'ANSWER': [CallbackQueryHandler(inlineAttempt.choose,
+                                        pattern='^' + inlineAttempt.CALLBACK_PREFIX),
+                   MessageHandler(Filters.text & ~Filters.command, inlineAttempt.enter_text)]
+    }
+    play_handler = ConversationHandler(
+        entry_points=[CommandHandler('play', inlineAttempt.start)],
+        states=play_states,
+        name='play',
+        persistent=persistent,
+        conversation_timeout=STATE_IDLE_TTL,
+        fallbacks=[CommandHandler('cancelPlay', inlineAttempt.cancel)]
+    )
+    dispatch.add_handler(play_handler)
+
+    # Conversation about remove, renaming or cloning exisiting quiz
     edit_states = {
         'ENTER_NAME': [MessageHandler(Filters.text & ~Filters.command, editQuiz.enter_name_remove)],
         'ENTER_OLD_NAME': [MessageHandler(Filters.text & ~Filters.command, editQuiz.enter_old_name)],
-        'ENTER_NEW_NAME': [MessageHandler(Filters.text & ~Filters.command, editQuiz.enter_new_name)]
+        'ENTER_NEW_NAME': [MessageHandler(Filters.text & ~Filters.command, editQuiz.enter_new_name)],
+        'ENTER_CLONE_SOURCE': [MessageHandler(Filters.text & ~Filters.command, editQuiz.enter_clone_source)],
+        'ENTER_CLONE_NAME': [MessageHandler(Filters.text & ~Filters.command, editQuiz.enter_clone_name)]
     }
     edit_handler = ConversationHandler(
         entry_points=[CommandHandler('rename', editQuiz.start_rename), CommandHandler(
-            'remove', editQuiz.start_remove)],
+            'remove', editQuiz.start_remove), CommandHandler('clone', editQuiz.start_clone)],
         states=edit_states,
+        name='edit',
+        persistent=persistent,
+        conversation_timeout=STATE_IDLE_TTL,
         fallbacks=[CommandHandler('cancelEdit', editQuiz.cancel_edit)]
     )
     dispatch.add_handler(edit_handler)
 
+    # Forget the users who walked away in the middle of a conversation
+    stores = [
+        (createQuiz.userDict, create_handler,
+         "You didn't continue your quiz, so I discarded it 💤 Enter /create to start again."),
+        (attemptQuiz.userDict, attempt_handler,
+         "You didn't continue your attempt, so I ended it 💤 Enter /attempt to start again."),
+        (inlineAttempt.games, play_handler,
+         "You didn't continue your quiz, so I ended it 💤 Enter /play to start again."),
+        (editQuiz.user_dict, edit_handler, None),
+    ]
+    for store, handler, message in stores:
+        store.idle_ttl = STATE_IDLE_TTL
+        store.max_entries = STATE_MAX_ENTRIES
+        store.on_expire = end_conversations(dispatch, handler, message)
+    dispatch.job_queue.run_repeating(
+        expire_states, STATE_SWEEP_INTERVAL,
+        context=[(store, handler) for store, handler, _ in stores]
+        + [(attemptQuiz.polls, None), (results.reports, None)])
+
+    # Autocomplete of quiz names in inline mode
+    dispatch.add_handler(InlineQueryHandler(attemptQuiz.search_quizzes))
+
+    # Live quizzes played by many chats at the same time. They are kept in the memory of
+    # one process, while the router of a cluster spreads the chats over the workers
+    live.settings.update(period=LIVE_QUESTION_SECONDS, skew=LIVE_MAX_SKEW, rate=LIVE_RATE,
+                         enabled=not CLUSTER_NODE)
+    live.budget.rate = LIVE_RATE
+    dispatch.job_queue.run_repeating(lambda _: live.expire_sessions(), STATE_SWEEP_INTERVAL)
+    dispatch.add_handler(CommandHandler('live', live.host))
+    dispatch.add_handler(CommandHandler('join', live.join))
+    dispatch.add_handler(CommandHandler('startLive', live.start_live))
+    dispatch.add_handler(CommandHandler('stopLive', live.stop_live))
+    dispatch.add_handler(CommandHandler('leaderboard', live.show_leaderboard))
+    dispatch.add_handler(CallbackQueryHandler(live.answer, pattern='^' + live.CALLBACK_PREFIX))
+
+    # Quiz of the day, the workers of a cluster share the broadcast by a lease
+    daily.settings.update(quiz=DAILY_QUIZ, time=DAILY_QUIZ_TIME, rate=DAILY_RATE,
+                          batch_size=DAILY_BATCH_SIZE,
+                          owner=CLUSTER_NODE or '{}-{}'.format(socket.gethostname(), os.getpid()))
+    dispatch.add_handler(CommandHandler('subscribe', daily.subscribe))
+    dispatch.add_handler(CommandHandler('unsubscribe', daily.unsubscribe))
+    if DAILY_QUIZ:
+        dispatch.job_queue.run_repeating(daily.check_daily, DAILY_CHECK_INTERVAL)
+
+    # Page buttons of the results of an attempt
+    results.show_summary = bool(RESULTS_SUMMARY)
+    dispatch.add_handler(CallbackQueryHandler(results.turn_page,
+                                              pattern='^' + results.CALLBACK_PREFIX))
+
     # help command
     dispatch.add_handler(CommandHandler("help", print_help))
 
     # log all errors
     dispatch.add_error_handler(error)
 
+    # Measure the duration of every handler
+    for handlers in dispatch.handlers.values():
+        instrument_handlers(handlers)
+
 
 if __name__ == '__main__':
     # Get the token from environment variable
     TELEGRAM_TOKEN = os.environ['TELEGRAM_TOKEN']
     
-    # Create the Updater
-    updater = Updater(TELEGRAM_TOKEN, use_context=True)
+    # Persist the conversations and the data of the users
+    persistence = SQLitePersistence(
+        STATE_DB, [createQuiz.userDict, attemptQuiz.userDict, attemptQuiz.polls,
+                   inlineAttempt.games, editQuiz.user_dict, results.reports],
+        STATE_FLUSH_INTERVAL)
+    persistence.start()
+
+    # Create the Updater, the bot measures its requests of the Bot API
+    bot = Bot(TELEGRAM_TOKEN, base_url=TELEGRAM_BASE_URL,
+              request=InstrumentedRequest(
+                  con_pool_size=DISPATCH_SHARDS + 8))
+    updater = Updater(bot=bot, use_context=True, persistence=persistence)
     
     # Setup bot handlers
     setup_bot(updater)
-    
-    # Start the Bot in polling mode (instead of webhook)
-    updater.start_polling()
-    
-    # Run the bot until you press Ctrl-C
-    updater.idle()
+
+    # Send the messages of the bot within the rate limits of Telegram
+    outbound.start(updater.bot, OUTBOUND_GLOBAL_RATE)
+
+    # Process the updates of different users concurrently
+    runtime = ShardedDispatcher(updater.dispatcher, DISPATCH_SHARDS)
+    runtime.install()
+
+    # Index the quiz names for the autocomplete
+    quiz_index.load()
+    logger.info('Indexed %d quizzes', len(quiz_index))
+
+    # Load the popular quizzes of the last run in the background
+    quiz_cache.warm_up(WARMUP_FILE)
+
+    if METRICS_PORT:
+        # Export the metrics of the handlers, the database, the Bot API and the queues
+        instrument_database()
+        registry.stats('quizbot_runtime', runtime.stats, label='shard')
+        registry.stats('quizbot_outbound', outbound.stats)
+        registry.stats('quizbot_persistence', persistence.stats)
+        registry.stats('quizbot_quiz_cache', quiz_cache.stats)
+        registry.stats('quizbot_quiz_index', lambda: {'quizzes': len(quiz_index)})
+        registry.stats('quizbot_live', live.stats)
+        for store in (createQuiz.userDict, attemptQuiz.userDict, attemptQuiz.polls,
+                      inlineAttempt.games, editQuiz.user_dict, results.reports):
+            registry.stats('quizbot_user_states_' + store.name, store.stats)
+        start_metrics_server(int(METRICS_PORT))
+
+    routes = None
+    if CLUSTER_NODE:
+        # The router asks the worker to hand its states over when the workers change
+        routes = {HANDOFF_PATH: handoff_route(runtime, persistence)}
+        updater.job_queue.run_repeating(lambda _: quiz_index.load(), INDEX_RELOAD_INTERVAL)
+        logger.info('Running as cluster worker %s', CLUSTER_NODE)
+
+    if WEBHOOK_URL or WEBHOOK_LOCAL:
+        # Receive the updates with the webhook until you press Ctrl-C
+        window = None if CLUSTER_NODE else UpdateWindow(UPDATE_WINDOW_SIZE, UPDATE_WINDOW_FILE)
+        run_webhook(updater, PORT, None if WEBHOOK_LOCAL else WEBHOOK_URL, WEBHOOK_PATH,
+                    WEBHOOK_SECRET, WEBHOOK_QUEUE_SIZE, routes, window)
+    else:
+        # Start the Bot in polling mode
+        updater.start_polling()
+
+        # Run the bot until you press Ctrl-C
+        updater.idle()
+
+    runtime.stop(timeout=30)
+    logger.info('Sharded dispatcher: %s', runtime.stats())
+    outbound.stop()
+    logger.info('Outbound queue: %s', outbound.stats())
+    persistence.close()
+    logger.info('Persistence: %s', persistence.stats())
+    for store in (createQuiz.userDict, attemptQuiz.userDict, editQuiz.user_dict, results.reports):
+        logger.info('User states %s: %s', store.name, store.stats())
+
+    # Remember the popular quizzes for the next start
+    quiz_cache.save_hot_set(WARMUP_FILE)
+    logger.info('Quiz cache: %s', quiz_cache.stats())
@@ -0,0 +1,566 @@
+"""
+Deployment mode with several bot processes behind one webhook receiver.
+
+The router receives the updates of Telegram and forwards every update to the worker
+which owns its user. The owner is found on a consistent hash ring, so adding or removing
+a worker only moves the users of that worker. Every worker is a normal bot process in
+local webhook mode. The states of the users live in the shared SQLite database of the
+persistence (the local stand-in for a shared session store), every worker keeps the
+states of its users in memory as hot cache.
+
+When the workers change, the router parks the incoming updates, waits until the
+forwarded ones are processed and lets every worker write its states and drop them
+from memory (handoff). Then the new ring is used and the parked updates are forwarded.
+So a worker can be drained and restarted without losing a session.
+
+Every worker paces its own messages, so the global rate limit of Telegram is split
+evenly: a worker gets OUTBOUND_GLOBAL_RATE / WORKERS messages per second. The updates
+are routed by user, so the users of one group chat may be served by different workers,
+whose messages to that chat are paced separately. A busy group can then get more than
+one message per second from the bot and Telegram answers some of them with RetryAfter,
+which the outbound queue of the worker waits out.
+The router drops updates which Telegram delivers again before they're forwarded,
+its window of update IDs survives a restart of the cluster.
+
+Run a cluster with ``python -m quizbot.bot.cluster WORKERS``; SIGHUP restarts the
+workers one after the other, SIGINT or SIGTERM stops the cluster.
+"""
+import bisect
+import hashlib
+import hmac
+import http.client
+import json
+import logging
+import os
+import queue
+import signal
+import subprocess
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+from quizbot.bot.dedupe import UpdateWindow
+from quizbot.bot.webhook import MAX_UPDATE_SIZE, SECRET_HEADER, generate_secret_token
+
+logger = logging.getLogger(__name__)
+
+# Path of the handoff of the workers
+HANDOFF_PATH = '/cluster/handoff'
+
+# Seconds between two attempts to forward an update to a worker which isn't reachable
+RETRY_DELAY = 0.5
+
+
+def _hash(value):
+    """Returns a 64 bit hash of a string, the same in every process."""
+    return int.from_bytes(hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+class HashRing:
+    """
+    An Instance of the class HashRing maps keys to nodes by consistent hashing.
+    Every node has several points on the ring, a key belongs to the node of the next point.
+    """
+
+    def __init__(self, nodes=(), replicas=64) -> None:
+        """
+        Initializes an instance of the class HashRing.
+
+        :param nodes: Names of the nodes.
+        :param replicas: Number of points per node, more points spread the keys more evenly.
+        """
+        self.replicas = replicas
+        self._points = []
+        self._nodes = []
+        for node in nodes:
+            self.add(node)
+
+    @property
+    def nodes(self):
+        """Names of the nodes."""
+        return list(self._nodes)
+
+    def add(self, node):
+        """
+        Adds a node.
+
+        :param node: Name of the node.
+        """
+        if node in self._nodes:
+            return
+        self._nodes.append(node)
+        for replica in range(self.replicas):
+            bisect.insort(self._points, (_hash('{}#{}'.format(node, replica)), node))
+
+    def remove(self, node):
+        """
+        Removes a node, its keys move to the next nodes on the ring.
+
+        :param node: Name of the node.
+        """
+        self._nodes.remove(node)
+        self._points = [point for point in self._points if point[1] != node]
+
+    def node_for(self, key):
+        """
+        Returns the node of a key.
+
+        :param key: Key, e.g. the ID of a user.
+        :returns: Name of the node or None if the ring is empty.
+        """
+        if not self._points:
+            return None
+        position = bisect.bisect(self._points, (_hash(str(key)),))
+        return self._points[position % len(self._points)][1]
+
+
+def update_user_id(data):
+    """
+    Returns the ID of the user of an update as received from Telegram,
+    the ID of the chat if it has no user.
+
+    :param data: Update as dict.
+    :returns: ID or None, e.g. for the state of an anonymous poll.
+    """
+    for key, payload in data.items():
+        if key == 'update_id' or not isinstance(payload, dict):
+            continue
+        user = payload.get('from') or payload.get('user')
+        if user is not None:
+            return user.get('id')
+        chat = payload.get('chat')
+        if chat is not None:
+            return chat.get('id')
+    return None
+
+
+class _Forwarder:
+    """Forwards the updates of one worker in order over a persistent connection."""
+
+    def __init__(self, name, url, secret_token, queue_size):
+        self.name = name
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.path = parts.path or '/'
+        self.secret_token = secret_token
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.forwarded = 0
+        self.retries = 0
+        self._connection = None
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name='forward-{}'.format(name),
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stops the thread after the queued updates."""
+        self._stopped = True
+        self.queue.put(None)
+        self._thread.join()
+
+    def post(self, body):
+        """POSTs an update to the worker and returns the HTTP status."""
+        if self._connection is None:
+            self._connection = http.client.HTTPConnection(self.host, self.port, timeout=60)
+        headers = {'Content-Type': 'application/json'}
+        if self.secret_token is not None:
+            headers[SECRET_HEADER] = self.secret_token
+        try:
+            self._connection.request('POST', self.path, body, headers)
+            response = self._connection.getresponse()
+            response.read()
+            return response.status
+        except (OSError, http.client.HTTPException):
+            self._connection.close()
+            self._connection = None
+            raise
+
+    def _run(self):
+        while True:
+            body = self.queue.get()
+            if body is None:
+                self.queue.task_done()
+                break
+            # An update is retried until the worker took it, so no update is lost
+            while True:
+                try:
+                    status = self.post(body)
+                except (OSError, http.client.HTTPException):
+                    status = None
+                if status == 200 or self._stopped and status is None:
+                    break
+                if status not in (None, 503):
+                    logger.warning('Worker %s rejected an update with %s', self.name, status)
+                    break
+                self.retries += 1
+                time.sleep(RETRY_DELAY)
+            self.forwarded += 1
+            self.queue.task_done()
+
+
+class ClusterRouter:
+    """
+    An Instance of the class ClusterRouter receives the webhook of Telegram and
+    forwards the updates to the workers which own their users.
+    """
+
+    def __init__(self, workers, port, url_path='telegram', secret_token=None,
+                 worker_secret=None, queue_size=1000, listen='0.0.0.0', window=None) -> None:
+        """
+        Initializes an instance of the class ClusterRouter.
+
+        :param workers: Dict of the names of the workers and the URLs of their webhooks.
+        :param port: Port to listen on.
+        :param url_path: Path of the webhook URL.
+        :param secret_token: Secret token Telegram sends with every update.
+        :param worker_secret: Secret token of the webhooks of the workers.
+        :param queue_size: Maximum number of updates waiting for a worker.
+        :param listen: Address to listen on.
+        :param window: Optional UpdateWindow of the received update IDs, to drop duplicates.
+        """
+        self.url_path = '/' + url_path.strip('/')
+        self.secret_token = secret_token
+        self.worker_secret = worker_secret
+        self.window = window
+        self.queue_size = queue_size
+        self.received = 0
+        self.rejected = 0
+        self.ring = HashRing(workers)
+        self._workers = dict(workers)
+        self._forwarders = {name: _Forwarder(name, url, worker_secret, queue_size)
+                            for name, url in workers.items()}
+        self._parked = None
+        self._lock = threading.Lock()
+        self._change_lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((listen, port), self._handler_class())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def port(self):
+        """Port the router listens on."""
+        return self._httpd.server_address[1]
+
+    @property
+    def workers(self):
+        """Dict of the names of the workers and the URLs of their webhooks."""
+        return dict(self._workers)
+
+    def start(self):
+        """Starts to receive updates."""
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name='router-httpd',
+                                        daemon=True)
+        self._thread.start()
+        logger.info('Cluster router listening on port %d for %d workers', self.port,
+                    len(self._workers))
+
+    def stop(self):
+        """Stops receiving and forwards the queued updates."""
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        for forwarder in self._forwarders.values():
+            forwarder.stop()
+        if self.window is not None:
+            self.window.close()
+
+    def route(self, data):
+        """
+        Queues an update for the worker of its user, an update received before is dropped.
+
+        :param data: Update as dict.
+        :returns: Whether the update was queued or received before. It isn't if the queue
+            of the worker is full.
+        """
+        update_id = data.get('update_id')
+        with self._lock:
+            if self.window is not None and update_id is not None \
+                    and not self.window.add(update_id):
+                logger.info('Dropped update %s, which was received before', update_id)
+                return True
+            if self._parked is not None:
+                queued = len(self._parked) < self.queue_size
+                if queued:
+                    self._parked.append(data)
+            else:
+                queued = self._forward(data)
+            if queued:
+                self.received += 1
+            else:
+                # Telegram delivers the update again, it mustn't be dropped then
+                if self.window is not None:
+                    self.window.discard(update_id)
+                self.rejected += 1
+            return queued
+
+    def set_workers(self, workers, timeout=60.0):
+        """
+        Changes the workers without losing a session: the updates are parked,
+        the workers hand their states over to the shared store, then the new ring is used.
+
+        :param workers: Dict of the names of the workers and the URLs of their webhooks.
+        :param timeout: Maximum seconds to wait for the workers.
+        """
+        with self._change_lock:
+            with self._lock:
+                self._parked = []
+            deadline = time.monotonic() + timeout
+            for forwarder in self._forwarders.values():
+                while forwarder.queue.unfinished_tasks and time.monotonic() < deadline:
+                    time.sleep(0.01)
+                self._handoff(forwarder, max(0.0, deadline - time.monotonic()))
+
+            with self._lock:
+                for name in set(self._forwarders) - set(workers):
+                    self._forwarders.pop(name).stop()
+                for name, url in workers.items():
+                    if name not in self._forwarders or self._workers[name] != url:
+                        if name in self._forwarders:
+                            self._forwarders.pop(name).stop()
+                        self._forwarders[name] = _Forwarder(name, url, self.worker_secret,
+                                                            self.queue_size)
+                self._workers = dict(workers)
+                self.ring = HashRing(workers)
+                parked, self._parked = self._parked, None
+                for data in parked:
+                    if not self._forward(data):
+                        logger.warning('Dropped parked update %s', data.get('update_id'))
+            logger.info('Cluster workers: %s', ', '.join(sorted(workers)))
+
+    def stats(self):
+        """
+        Returns the counters of the router.
+
+        :returns: Dict with received, rejected and duplicate updates and the forwarded
+            and waiting updates of every worker.
+        """
+        names = sorted(self._forwarders)
+        return {
+            'received': self.received,
+            'rejected': self.rejected,
+            'duplicates': 0 if self.window is None else self.window.duplicates,
+            'parked': len(self._parked or ()),
+            'workers': names,
+            'forwarded': [self._forwarders[name].forwarded for name in names],
+            'queue_depth': [self._forwarders[name].queue.qsize() for name in names],
+        }
+
+    def _forward(self, data):
+        """Queues an update for the worker of its user. The lock has to be held."""
+        key = update_user_id(data)
+        node = self.ring.node_for(key if key is not None else data.get('update_id'))
+        try:
+            self._forwarders[node].queue.put_nowait(json.dumps(data).encode('utf-8'))
+        except queue.Full:
+            return False
+        return True
+
+    @staticmethod
+    def _handoff(forwarder, timeout):
+        """Lets a worker write its states and drop them from memory."""
+        connection = http.client.HTTPConnection(forwarder.host, forwarder.port,
+                                                timeout=timeout + 5)
+        headers = {'Content-Type': 'application/json'}
+        if forwarder.secret_token is not None:
+            headers[SECRET_HEADER] = forwarder.secret_token
+        try:
+            connection.request('POST', HANDOFF_PATH, json.dumps({'timeout': timeout}), headers)
+            response = connection.getresponse()
+            logger.info('Handoff of worker %s: %s %s', forwarder.name, response.status,
+                        response.read().decode('utf-8', 'replace'))
+        except (OSError, http.client.HTTPException) as err:
+            # A worker which is down has nothing in memory
+            logger.warning('Handoff of worker %s failed: %s', forwarder.name, err)
+        finally:
+            connection.close()
+
+    def _handler_class(self):
+        """Returns the request handler class bound to this router."""
+        router = self
+
+        class RouterHandler(BaseHTTPRequestHandler):
+            """Handles the POST requests of Telegram."""
+
+            def do_POST(self):  # pylint: disable=invalid-name
+                """Checks and routes one update."""
+                if self.path != router.url_path:
+                    self._respond(404)
+                    return
+                if router.secret_token is not None and not hmac.compare_digest(
+                        self.headers.get(SECRET_HEADER, ''), router.secret_token):
+                    self._respond(403)
+                    return
+                length = int(self.headers.get('Content-Length', 0))
+                if not 0 < length <= MAX_UPDATE_SIZE:
+                    self._respond(413 if length else 400)
+                    return
+                try:
+                    data = json.loads(self.rfile.read(length))
+                except ValueError:
+                    self._respond(400)
+                    return
+                if not isinstance(data, dict):
+                    self._respond(400)
+                elif router.route(data):
+                    self._respond(200)
+                else:
+                    self._respond(503, retry_after=1)
+
+            def _respond(self, status, retry_after=None):
+                self.send_response(status)
+                if retry_after is not None:
+                    self.send_header('Retry-After', str(retry_after))
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, *_):
+                """Requests aren't logged, there is one per update."""
+
+        return RouterHandler
+
+
+def handoff_route(runtime, persistence):
+    """
+    Returns the route of a worker which hands its states over to the shared store.
+
+    :param runtime: ShardedDispatcher of the worker.
+    :param persistence: SQLitePersistence of the worker.
+    :returns: Function for the routes of WebhookServer.
+    """
+    def handoff(server, data):
+        deadline = time.monotonic() + float(data.get('timeout', 60))
+        server.wait_idle(max(0.0, deadline - time.monotonic()))
+        while runtime.stats()['pending'] and time.monotonic() < deadline:
+            time.sleep(0.01)
+        released = persistence.release()
+        logger.info('Handed over %d user states', released)
+        return {'released': released}
+    return handoff
+
+
+class Cluster:
+    """
+    An Instance of the class Cluster runs the worker processes and the router.
+    """
+
+    def __init__(self, workers, port, base_port, url_path='telegram', secret_token=None,
+                 command=None, window=None, global_rate=30.0) -> None:
+        """
+        Initializes an instance of the class Cluster.
+
+        :param workers: Number of worker processes.
+        :param port: Port of the router.
+        :param base_port: Port of the first worker, the others follow.
+        :param url_path: Path of the webhook URL.
+        :param secret_token: Secret token Telegram sends with every update.
+        :param command: Command which starts a worker, the bot by default.
+        :param window: Optional UpdateWindow of the router, to drop duplicate updates.
+        :param global_rate: Messages per second of the whole bot, shared by the workers.
+        """
+        self.global_rate = global_rate
+        self.names = ['worker-{}'.format(number) for number in range(workers)]
+        self.ports = {name: base_port + number for number, name in enumerate(self.names)}
+        self.url_path = '/' + url_path.strip('/')
+        self.command = command or [sys.executable, '-m', 'quizbot.bot.bot']
+        self.worker_secret = generate_secret_token()
+        self.processes = dict()
+        self.router = ClusterRouter(
+            {name: self._url(name) for name in self.names}, port, url_path, secret_token,
+            self.worker_secret, window=window)
+
+    def start(self):
+        """Starts the workers and the router."""
+        for name in self.names:
+            self._spawn(name)
+        self.router.start()
+
+    def stop(self):
+        """Stops the router and the workers, which write their states."""
+        self.router.stop()
+        for name in self.names:
+            self._terminate(name)
+
+    def restart(self, name):
+        """
+        Drains a worker, restarts it and gives it its users back.
+
+        :param name: Name of the worker.
+        """
+        others = {other: url for other, url in self.router.workers.items() if other != name}
+        if others:
+            self.router.set_workers(others)
+        self._terminate(name)
+        self._spawn(name)
+        self.router.set_workers(dict(others, **{name: self._url(name)}))
+
+    def rolling_restart(self):
+        """Restarts the workers one after the other, e.g. to deploy a new version."""
+        for name in self.names:
+            logger.info('Restarting %s', name)
+            self.restart(name)
+
+    def _url(self, name):
+        return 'http://127.0.0.1:{}{}'.format(self.ports[name], self.url_path)
+
+    def _spawn(self, name):
+        env = dict(os.environ, PORT=str(self.ports[name]), WEBHOOK_LOCAL='1',
+                   WEBHOOK_PATH=self.url_path, WEBHOOK_SECRET=self.worker_secret,
+                   CLUSTER_NODE=name,
+                   OUTBOUND_GLOBAL_RATE=str(self.global_rate / len(self.names)))
+        env.pop('WEBHOOK_URL', None)
+        env.pop('METRICS_PORT', None)
+        self.processes[name] = subprocess.Popen(self.command, env=env)
+
+    def _terminate(self, name):
+        process = self.processes.pop(name, None)
+        if process is None:
+            return
+        process.terminate()
+        try:
+            process.wait(60)
+        except subprocess.TimeoutExpired:
+            logger.warning('Worker %s did not stop, killing it', name)
+            process.kill()
+
+
+def main():
+    """Runs a cluster until SIGINT or SIGTERM is received."""
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+                        level=logging.INFO)
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else os.cpu_count()
+    port = int(os.environ.get('PORT', '8443'))
+    secret_token = os.environ.get('WEBHOOK_SECRET') or generate_secret_token()
+    window = UpdateWindow(int(os.environ.get('UPDATE_WINDOW_SIZE', '10000')),
+                          os.environ.get('UPDATE_WINDOW_FILE', 'quizbot_updates.window'))
+    cluster = Cluster(workers, port, int(os.environ.get('CLUSTER_BASE_PORT', port + 1)),
+                      os.environ.get('WEBHOOK_PATH', 'telegram'), secret_token, window=window,
+                      global_rate=float(os.environ.get('OUTBOUND_GLOBAL_RATE', '30')))
+    cluster.start()
+
+    webhook_url = os.environ.get('WEBHOOK_URL')
+    if webhook_url:
+        # Imported here, the router itself doesn't need the bot
+        from telegram import Bot  # pylint: disable=import-outside-toplevel
+        bot = Bot(os.environ['TELEGRAM_TOKEN'], base_url=os.environ.get('TELEGRAM_BASE_URL'))
+        bot.set_webhook(url=webhook_url.rstrip('/') + cluster.url_path,
+                        secret_token=secret_token)
+        logger.info('Registered webhook %s%s', webhook_url.rstrip('/'), cluster.url_path)
+
+    stopped = threading.Event()
+    restart = threading.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda *_: stopped.set())
+    signal.signal(signal.SIGHUP, lambda *_: restart.set())
+    try:
+        while not stopped.wait(1):
+            if restart.is_set():
+                restart.clear()
+                cluster.rolling_restart()
+    finally:
+        cluster.stop()
+        logger.info('Router: %s', cluster.router.stats())
+
+
+if __name__ == '__main__':
+    main()
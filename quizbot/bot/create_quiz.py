@@ -3,15 +3,16 @@ Module with methods to create a quiz with a telegram bot
 """
 
 import logging
-import pickle
-import pymongo
-import os
-from telegram import ReplyKeyboardMarkup, ChatAction
+from telegram import ChatAction
 from telegram.ext import ConversationHandler
-from telegram.replykeyboardremove import ReplyKeyboardRemove
 from quizbot.quiz.question_factory import QuestionBool, QuestionChoice,\
     QuestionChoiceSingle, QuestionNumber, QuestionString
 from quizbot.quiz.quiz import Quiz
+from quizbot.quiz.cache import quiz_cache
+from quizbot.quiz.name_index import quiz_index
+from quizbot.bot.user_state import UserStateStore
+from quizbot.bot.keyboards import REMOVE, YES_NO, menu
+from quizbot.bot.send_queue import reply
 
 logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
                     level=logging.INFO)
@@ -20,7 +21,7 @@ logger = logging.getLogger(__name__)
 
 
 # Dict with user data like a quiz instance
-userDict = dict()
+userDict = UserStateStore('create_quiz')
 
 # Dict with string and associated question class
 dict_question_types = {
@@ -31,6 +32,10 @@ dict_question_types = {
     'Ask a multiple choice question with one correct answer': QuestionChoiceSingle
 }
 
+# Keyboards to choose the type of the first and of the next questions
+QUESTION_TYPE_MENU = menu(dict_question_types)
+NEXT_QUESTION_MENU = menu(list(dict_question_types) + ['Enter'])
+
 
 def start(update, _):
     """
@@ -43,11 +48,12 @@ def start(update, _):
         # user is in the middle of a quiz and cant attempt to a second one
         logger.info('[%s] Creation canceled, because the user is in the middle of a creation.',
                     update.message.from_user.username)
-        update.message.reply_text(
+        reply(
+            update,
             "You're in the middle of a creation 😉 "
             "You can't create a second one at the same time 😁\n"
             'If you want to cancel your creation, enter /cancelCreate.',
-            reply_markup=ReplyKeyboardRemove()
+            reply_markup=REMOVE
         )
         return ConversationHandler.END
 
@@ -56,13 +62,12 @@ def start(update, _):
         'quiz': Quiz(update.message.from_user.username)}
 
     # Asks for type of first question
-    list_question = [[el] for el in list(dict_question_types.keys())]
-    update.message.reply_text(
+    reply(
+        update,
         "Hi 😃 Let's create a new quiz!\n"
         "What type of question should the first one be?\n"
         'If you want to cancel your creation, enter /cancelCreate.',
-        reply_markup=ReplyKeyboardMarkup(
-            list_question, one_time_keyboard=True)
+        reply_markup=QUESTION_TYPE_MENU
     )
 
     return 'ENTER_TYPE'
@@ -76,10 +81,11 @@ def cancel(update, _):
                 update.message.from_user.username)
 
     # Delete user data
-    userDict.pop(update.message.from_user.id)
-    update.message.reply_text(
+    userDict.pop(update.message.from_user.id, None)
+    reply(
+        update,
         "I canceled the creation process. See you next time. 🙋‍♂️",
-        reply_markup=ReplyKeyboardRemove())
+        reply_markup=REMOVE)
     return ConversationHandler.END
 
 
@@ -93,10 +99,10 @@ def enter_type(update, _):
     if update.message.text == "Enter":
         # User dont want to add more questions
         # Asks for randomness
-        update.message.reply_text(
+        reply(
+            update,
             "Should the questions be displayed in random order? 🤔",
-            reply_markup=ReplyKeyboardMarkup(
-                [['Yes', 'No']], one_time_keyboard=True)
+            reply_markup=YES_NO
         )
         logger.info('[%s] Completed question creation',
                     update.message.from_user.username)
@@ -107,7 +113,7 @@ def enter_type(update, _):
     user_id = update.message.from_user.id
     userDict[user_id]['questtype'] = dict_question_types[update.message.text]
 
-    update.message.reply_text("What is the question? 🤔")
+    reply(update, "What is the question? 🤔")
     return 'ENTER_QUESTION'
 
 
@@ -131,7 +137,7 @@ def enter_question(update, _):
     else:
         reply_text = "Please enter the correct answer 🙆‍♂️"
 
-    update.message.reply_text(reply_text)
+    reply(update, reply_text)
     return 'ENTER_ANSWER'
 
 
@@ -157,7 +163,8 @@ def enter_answer(update, _):
     except AssertionError:
         # TODO specify exceptions
         # Error because it isnt a number, no entry, not True/False,...
-        update.message.reply_text(
+        reply(
+            update,
             "Sorry. Something went wrong by entering your answer. Please try again. 😕")
         logger.info('[%s] Entering correct answer "%s" failed',
                     update.message.from_user.username, update.message.text)
@@ -168,7 +175,8 @@ def enter_answer(update, _):
 
     if isinstance(userDict[user_id]['questionInstance'], QuestionChoice):
         # If QuestionChoice instance, ask for additional possible answers
-        update.message.reply_text(
+        reply(
+            update,
             "Please enter additional possible answers separated by ', ' 😁")
         return 'ENTER_POSSIBLE_ANSWER'
 
@@ -177,12 +185,11 @@ def enter_answer(update, _):
         userDict[user_id]['questionInstance'])
 
     # Asks for type of next question
-    list_question = [[el] for el in list(dict_question_types.keys())]
-    update.message.reply_text(
+    reply(
+        update,
         "What type of question should the next one be? "
         "If you don't have more questions, press 'Enter'.",
-        reply_markup=ReplyKeyboardMarkup(
-            list_question + [['Enter']], one_time_keyboard=True)
+        reply_markup=NEXT_QUESTION_MENU
     )
     return 'ENTER_TYPE'
 
@@ -203,10 +210,10 @@ def enter_possible_answer(update, _):
                 update.message.from_user.username)
 
     # Ask for
-    update.message.reply_text(
+    reply(
+        update,
         "Should the answers be displayed in random order? 🤔",
-        reply_markup=ReplyKeyboardMarkup(
-            [['Yes', 'No']], one_time_keyboard=True)
+        reply_markup=YES_NO
     )
 
     return 'ENTER_RANDOMNESS_QUESTION'
@@ -222,11 +229,11 @@ def enter_randomness_question(update, _):
 
     # Check for correct input
     if not update.message.text in ('Yes', 'No'):
-        update.message.reply_text(
+        reply(
+            update,
             "Thats not a 'Yes' or a 'No' 😕"
             "Should the answers be displayed in random order?",
-            reply_markup=ReplyKeyboardMarkup(
-                [['Yes', 'No']], one_time_keyboard=True)
+            reply_markup=YES_NO
         )
         return 'ENTER_RANDOMNESS_QUESTION'
 
@@ -241,12 +248,11 @@ def enter_randomness_question(update, _):
                 update.message.from_user.username)
 
     # Asks for type of next question
-    list_question = [[el] for el in list(dict_question_types.keys())]
-    update.message.reply_text(
+    reply(
+        update,
         "What type of question should the next one be? "
         "If you don't have more questions, press 'Enter'.",
-        reply_markup=ReplyKeyboardMarkup(
-            list_question + [['Enter']], one_time_keyboard=True)
+        reply_markup=NEXT_QUESTION_MENU
     )
     return 'ENTER_TYPE'
 
@@ -260,11 +266,11 @@ def enter_randomness_quiz(update, _):
 
     # Check for correct input
     if not update.message.text in ('Yes', 'No'):
-        update.message.reply_text(
+        reply(
+            update,
             "Thats not a 'Yes' or a 'No' 😕"
             "Should the questions be displayed in random order?",
-            reply_markup=ReplyKeyboardMarkup(
-                [['Yes', 'No']], one_time_keyboard=True)
+            reply_markup=YES_NO
         )
         return 'ENTER_RANDOMNESS_QUIZ'
 
@@ -272,10 +278,10 @@ def enter_randomness_quiz(update, _):
     userDict[user_id]['quiz'].is_random = update.message.text == 'Yes'
 
     # Ask for displaying result after question
-    update.message.reply_text(
+    reply(
+        update,
         "Should the result of the question be displayed after the question?",
-        reply_markup=ReplyKeyboardMarkup(
-            [['Yes', 'No']], one_time_keyboard=True)
+        reply_markup=YES_NO
     )
 
     return 'ENTER_RESULT_AFTER_QUESTION'
@@ -290,11 +296,11 @@ def enter_result_after_question(update, _):
 
     # Check for correct input
     if not update.message.text in ('Yes', 'No'):
-        update.message.reply_text(
+        reply(
+            update,
             "Thats not a 'Yes' or a 'No' 😕"
             "Should the result of the question be displayed after the question?",
-            reply_markup=ReplyKeyboardMarkup(
-                [['Yes', 'No']], one_time_keyboard=True)
+            reply_markup=YES_NO
         )
         return 'ENTER_RESULT_AFTER_QUESTION'
 
@@ -302,10 +308,10 @@ def enter_result_after_question(update, _):
     userDict[user_id]['quiz'].show_results_after_question = update.message.text == 'Yes'
 
     # Ask for displaying result of every question after quiz
-    update.message.reply_text(
+    reply(
+        update,
         "Should the result of every question be displayed after the quiz?",
-        reply_markup=ReplyKeyboardMarkup(
-            [['Yes', 'No']], one_time_keyboard=True)
+        reply_markup=YES_NO
     )
 
     return 'ENTER_RESULT_AFTER_QUIZ'
@@ -320,11 +326,11 @@ def enter_result_after_quiz(update, _):
 
     # Check for correct input
     if not update.message.text in ('Yes', 'No'):
-        update.message.reply_text(
+        reply(
+            update,
             "Thats not a 'Yes' or a 'No' 😕"
             "Should the result of every question be displayed after the quiz?",
-            reply_markup=ReplyKeyboardMarkup(
-                [['Yes', 'No']], one_time_keyboard=True)
+            reply_markup=YES_NO
         )
         return 'ENTER_RESULT_AFTER_QUIZ'
 
@@ -332,7 +338,8 @@ def enter_result_after_quiz(update, _):
     userDict[user_id]['quiz'].show_results_after_quiz = update.message.text == 'Yes'
 
     # Ask for name of quiz
-    update.message.reply_text(
+    reply(
+        update,
         "Great! 😃 I created a new quiz!\nHow should I name it? ✏️"
     )
 
@@ -360,37 +367,28 @@ def enter_quiz_name(update, context):
 
         # Save to MySQL using the Quiz class method
         userDict[user_id]['quiz'].save_to_db()
+        quiz_cache.invalidate(quizname, update.message.from_user.username)
+        quiz_index.add(quizname, update.message.from_user.username)
 
-        update.message.reply_text(
+        reply(
+            update,
             f"Great! 🥳 I saved your new quiz. "
             f"You can attempt it by using the name {quizname}.",
-            reply_markup=ReplyKeyboardRemove()
+            reply_markup=REMOVE
         )
         logger.info('[%s] Quiz saved as "%s"',
                     update.message.from_user.username, quizname)
         
         # Delete user data
-        userDict.pop(update.message.from_user.id)
+        userDict.pop(update.message.from_user.id, None)
         return ConversationHandler.END
 
     except Exception as e:
         logger.error('[%s] Error saving quiz: %s',
                     update.message.from_user.username, str(e))
-        update.message.reply_text(
+        reply(
+            update,
             "Sorry, there was an error saving your quiz. Please try a different name."
         )
         return 'ENTER_QUIZ_NAME'
 
-    # Insert Quiz with quizname in database
-    user_col.insert_one(
-        {'quizname': quizname, 'quizinstance': pickle.dumps(userDict[user_id]['quiz'])})
-    update.message.reply_text(
-        "Great! 🥳 I saved your new quiz."
-        "You can attempt to it by the name {}.".format(quizname),
-        reply_markup=ReplyKeyboardRemove()
-    )
-    logger.info('[%s] Quiz saved as "%s"',
-                update.message.from_user.username, update.message.text)
-    # Delete user data
-    userDict.pop(update.message.from_user.id)
-    return ConversationHandler.END
@@ -0,0 +1,263 @@
+"""
+Module with the quiz of the day, which is sent to the subscribed chats every day.
+
+Chats subscribe with /subscribe. At the configured time, one worker takes the lease of
+the broadcast of the day and sends every subscriber a message with a button, which
+starts an attempt of the quiz (see attempt_quiz.start_daily). The broadcast is a
+resumable batch job:
+
+* The subscribers are read in batches by keyset cursor (quizbot.quiz.subscription),
+  at most one batch is in memory.
+* The messages are staggered at the rate of the broadcast, below the global limit of
+  Telegram, and sent with bulk priority, so the prompts of the users go first and the
+  subscribers don't all press the button at the same moment.
+* After every batch, the last chat ID is stored as checkpoint. If the worker dies, the
+  lease expires and the broadcast continues after the checkpoint, so at most one batch
+  is sent twice.
+* Failed deliveries are recorded and retried a few times after the last batch.
+  Chats which blocked the bot are unsubscribed.
+"""
+import datetime
+import logging
+import threading
+import time
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import Unauthorized
+from quizbot.quiz import subscription
+from quizbot.quiz.quiz import Quiz
+from quizbot.bot.send_queue import BULK, reply, send
+
+logger = logging.getLogger(__name__)
+
+# Prefix of the callback data of the button which starts the quiz of the day
+CALLBACK_PREFIX = 'daily:'
+
+# Settings of the broadcast, set by the bot. The quiz is 'name [author]', the time 'HH:MM' UTC
+settings = {
+    'quiz': None,
+    'time': '09:00',
+    'owner': 'bot',
+    'batch_size': 200,
+    'rate': 20.0,
+    'lease_seconds': 300.0,
+    'max_tries': 3,
+    'retry_delay': 60.0,
+}
+
+
+class DailyBroadcast:
+    """
+    An Instance of the class DailyBroadcast sends the quiz of a day to the subscribers,
+    continuing after the checkpoint of an earlier run.
+    """
+
+    def __init__(self, bot, day, owner, batch_size=200, rate=20.0, lease_seconds=300.0,
+                 max_tries=3, retry_delay=60.0) -> None:
+        """
+        Initializes an instance of the class DailyBroadcast.
+
+        :param bot: Bot which sends the messages.
+        :param day: Day as ISO string.
+        :param owner: Name of the worker, which holds the lease while sending.
+        :param batch_size: Number of subscribers read and sent to between checkpoints.
+        :param rate: Messages per second.
+        :param lease_seconds: Duration of the lease, extended at every checkpoint.
+        :param max_tries: Number of tries to deliver the message to a chat.
+        :param retry_delay: Seconds before the failed deliveries are retried.
+        """
+        self.bot = bot
+        self.day = day
+        self.owner = owner
+        self.batch_size = batch_size
+        self.interval = 1 / rate
+        self.lease_seconds = lease_seconds
+        self.max_tries = max_tries
+        self.retry_delay = retry_delay
+        self.sent = 0
+        self.failed = 0
+        self._stopped = threading.Event()
+
+    def stop(self):
+        """Stops the broadcast after the current batch, it can be resumed later."""
+        self._stopped.set()
+
+    def run(self):
+        """
+        Sends the quiz of the day to every subscriber who didn't get it yet.
+
+        :returns: Whether the broadcast finished, False if another worker holds the lease,
+            the lease was lost or the broadcast was stopped.
+        """
+        run = subscription.load_run(self.day)
+        if run is None or run.finished_at is not None:
+            return run is not None
+        quiz = Quiz.load_from_db(run.quiz_name, run.quiz_author)
+        if quiz is None:
+            logger.error("Quiz of the day '%s' doesn't exist", run.quiz_name)
+            return False
+        if not subscription.claim_run(self.day, self.owner, self.lease_seconds):
+            return False
+        text, markup = invitation(quiz, self.day)
+        self.sent, self.failed = run.sent, run.failed
+        logger.info('Sending quiz of the day %s after chat %s', self.day, run.last_chat_id)
+
+        cursor = run.last_chat_id
+        while not self._stopped.is_set():
+            batch = subscription.subscriber_batch(cursor, self.batch_size)
+            if not batch:
+                break
+            for chat_id, error in self._send_batch(batch, text, markup):
+                self._failed(chat_id, error)
+            cursor = batch[-1]
+            if not subscription.checkpoint(self.day, self.owner, cursor, self.sent, self.failed,
+                                           self.lease_seconds):
+                logger.warning('Lost the lease of the quiz of the day %s', self.day)
+                return False
+        else:
+            return False
+
+        for _ in range(self.max_tries - 1):
+            if self._stopped.wait(self.retry_delay):
+                break
+            retried = self._retry(text, markup, cursor)
+            if retried is None:
+                return False
+            if not retried:
+                break
+        if self._stopped.is_set():
+            return False
+        subscription.finish_run(self.day)
+        logger.info('Sent quiz of the day %s to %d chats, %d failed',
+                    self.day, self.sent, self.failed)
+        return True
+
+    def _retry(self, text, markup, cursor):
+        """
+        Sends the message again to the chats whose delivery failed.
+
+        :returns: Whether any delivery was retried, None if the lease was lost.
+        """
+        retried = False
+        after = None
+        while not self._stopped.is_set():
+            batch = subscription.failure_batch(self.day, after, self.batch_size, self.max_tries)
+            if not batch:
+                break
+            retried = True
+            failures = dict(self._send_batch(batch, text, markup))
+            for chat_id in batch:
+                if chat_id in failures:
+                    # The chat is counted as failed already, only the try is recorded
+                    self._failed(chat_id, failures[chat_id], retry=True)
+                else:
+                    subscription.clear_failure(self.day, chat_id)
+                    self.failed -= 1
+            after = batch[-1]
+            if not subscription.checkpoint(self.day, self.owner, cursor, self.sent, self.failed,
+                                           self.lease_seconds):
+                logger.warning('Lost the lease of the quiz of the day %s while retrying',
+                               self.day)
+                return None
+        return retried
+
+    def _send_batch(self, batch, text, markup):
+        """
+        Sends the message to a batch of chats, staggered at the rate of the broadcast,
+        and waits until the messages were sent.
+
+        :returns: List of pairs of the chat ID and the error of the failed deliveries.
+        """
+        start = time.monotonic()
+        futures = []
+        failures = []
+        for index, chat_id in enumerate(batch):
+            delay = start + index * self.interval - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            try:
+                futures.append((chat_id, send(self.bot, chat_id, 'send_message', BULK,
+                                              text=text, reply_markup=markup)))
+            except Exception as err:  # pylint: disable=broad-except
+                failures.append((chat_id, err))
+        for chat_id, future in futures:
+            error = future.exception()
+            if error is not None:
+                failures.append((chat_id, error))
+        self.sent += len(batch) - len(failures)
+        return failures
+
+    def _failed(self, chat_id, error, retry=False):
+        """
+        Records a failed delivery, a chat which blocked the bot is unsubscribed.
+
+        :param retry: Whether the delivery failed before and is counted as failed already.
+        """
+        if isinstance(error, Unauthorized):
+            subscription.unsubscribe(chat_id)
+            logger.info('Unsubscribed chat %s from the quiz of the day: %s', chat_id, error)
+            if retry:
+                subscription.clear_failure(self.day, chat_id)
+                self.failed -= 1
+            return
+        subscription.record_failure(self.day, chat_id, error)
+        if not retry:
+            self.failed += 1
+
+
+def invitation(quiz, day):
+    """
+    Creates the message of the quiz of the day.
+
+    :param quiz: Instance of the class Quiz.
+    :param day: Day as ISO string.
+    :returns: Pair of the text and the InlineKeyboardMarkup with the button to start the quiz.
+    """
+    text = "🗓 Quiz of the day: '{}' by {}\nTap the button to play it!".format(
+        quiz.name, quiz.author)
+    markup = InlineKeyboardMarkup(
+        [[InlineKeyboardButton('Play ▶️', callback_data=CALLBACK_PREFIX + day)]])
+    return text, markup
+
+
+def subscribe(update, _):
+    """Subscribes the chat to the quiz of the day."""
+    chat = update.effective_chat
+    if subscription.subscribe(chat.id, update.effective_user.username):
+        logger.info('[%s] Subscribed chat %s to the quiz of the day',
+                    update.effective_user.username, chat.id)
+    reply(update, "You'll get the quiz of the day 🗓 Enter /unsubscribe to stop it.")
+
+
+def unsubscribe(update, _):
+    """Ends the subscription of the chat to the quiz of the day."""
+    subscription.unsubscribe(update.effective_chat.id)
+    reply(update, "You won't get the quiz of the day anymore.")
+
+
+# Broadcast sent by this worker
+_running = {'thread': None}
+
+
+def check_daily(context):
+    """
+    Starts or resumes the broadcast of the quiz of the day once its time has come,
+    called periodically by the job queue.
+    """
+    if not settings['quiz']:
+        return
+    now = datetime.datetime.utcnow()
+    if now.strftime('%H:%M') < settings['time']:
+        return
+    thread = _running['thread']
+    if thread is not None and thread.is_alive():
+        return
+    day = now.date().isoformat()
+    quiz_input = settings['quiz'].split()
+    run = subscription.start_run(day, quiz_input[0], quiz_input[1] if len(quiz_input) > 1 else None)
+    if run.finished_at is not None:
+        return
+    broadcast = DailyBroadcast(
+        context.bot, day, settings['owner'], settings['batch_size'], settings['rate'],
+        settings['lease_seconds'], settings['max_tries'], settings['retry_delay'])
+    _running['thread'] = threading.Thread(target=broadcast.run, name='daily-' + day, daemon=True)
+    _running['thread'].start()
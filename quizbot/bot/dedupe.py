@@ -0,0 +1,119 @@
+"""
+Window of the recently received update IDs, to drop updates Telegram delivers again.
+
+Telegram delivers an update again if the webhook doesn't answer in time, e.g. while
+the bot restarts. Processed twice, an answer of an attempt would count twice. The
+window remembers the last update IDs in a ring buffer with a dict of the IDs and
+their slots: a lookup and an insert are O(1) and the memory is fixed by the capacity.
+
+With a path, the ring buffer lives in a memory-mapped file. Every received ID is in
+the file as soon as it's written to the ring, so a redelivery right after a restart
+or a crash of the process is dropped, too. One process may use a file at a time.
+"""
+import logging
+import mmap
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Value of an empty slot of the ring buffer
+EMPTY = -1
+
+# Size of a slot in bytes, a signed 64 bit integer
+SLOT_SIZE = 8
+
+
+class UpdateWindow:
+    """
+    An Instance of the class UpdateWindow remembers the last update IDs
+    and tells whether an update was received before.
+    """
+
+    def __init__(self, capacity=10000, path=None) -> None:
+        """
+        Initializes an instance of the class UpdateWindow.
+
+        :param capacity: Number of update IDs which are remembered.
+        :param path: Optional path of the file the window is kept in across restarts.
+        """
+        self.capacity = capacity
+        self.path = path
+        self.duplicates = 0
+        self._lock = threading.Lock()
+        # Slot 0 holds the next slot of the ring, the IDs follow
+        size = (capacity + 1) * SLOT_SIZE
+        if path is None:
+            self._buffer = bytearray(size)
+        else:
+            self._buffer = self._map(path, size)
+        self._slots = memoryview(self._buffer).cast('q')
+        if path is None or self._slots[0] == 0:
+            for slot in range(1, capacity + 1):
+                self._slots[slot] = EMPTY
+            self._slots[0] = 1
+        self._ids = {update_id: slot for slot, update_id in enumerate(self._slots)
+                     if slot > 0 and update_id != EMPTY}
+        if self._ids:
+            logger.info('Loaded %d update IDs from %s', len(self._ids), path)
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, update_id):
+        return update_id in self._ids
+
+    def add(self, update_id):
+        """
+        Remembers an update ID, the oldest one is forgotten if the window is full.
+
+        :param update_id: ID of the update.
+        :returns: Whether the ID is new, False if the update was received before.
+        """
+        with self._lock:
+            if update_id in self._ids:
+                self.duplicates += 1
+                return False
+            slot = self._slots[0]
+            self._ids.pop(self._slots[slot], None)
+            self._slots[slot] = update_id
+            self._ids[update_id] = slot
+            self._slots[0] = slot % self.capacity + 1
+            return True
+
+    def discard(self, update_id):
+        """
+        Forgets an update ID, e.g. of an update which couldn't be queued and is delivered again.
+
+        :param update_id: ID of the update.
+        """
+        with self._lock:
+            slot = self._ids.pop(update_id, None)
+            if slot is not None:
+                self._slots[slot] = EMPTY
+
+    def stats(self):
+        """
+        Returns the counters of the window.
+
+        :returns: Dict with the remembered IDs and the dropped duplicates.
+        """
+        return {'window': len(self._ids), 'duplicates': self.duplicates}
+
+    def close(self):
+        """Writes the window to its file and closes it."""
+        if self.path is None:
+            return
+        with self._lock:
+            self._slots.release()
+            self._buffer.flush()
+            self._buffer.close()
+
+    @staticmethod
+    def _map(path, size):
+        """Maps the file of the window, a file of another capacity starts empty."""
+        with open(path, 'a+b') as window_file:
+            if os.fstat(window_file.fileno()).st_size != size:
+                window_file.truncate(0)
+                window_file.truncate(size)
+            return mmap.mmap(window_file.fileno(), size)
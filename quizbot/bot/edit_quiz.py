@@ -1,16 +1,18 @@
 """
-Module with methods to rename and remove a quiz with a telegram bot
+Module with methods to rename, remove and clone a quiz with a telegram bot
 """
 import logging
-import pymongo
-import os
 from telegram.chataction import ChatAction
 from telegram.ext.conversationhandler import ConversationHandler
-
-db = pymongo.MongoClient(os.environ.get('MONGODB')).quizzes
+from quizbot.quiz.quiz import Quiz
+from quizbot.quiz.cache import quiz_cache
+from quizbot.quiz.name_index import quiz_index
+from quizbot.bot.attempt_quiz import parse_quiz_name
+from quizbot.bot.user_state import UserStateStore
+from quizbot.bot.send_queue import reply
 
 # user data
-user_dict = dict()
+user_dict = UserStateStore('edit_quiz')
 
 logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
                     level=logging.INFO)
@@ -22,7 +24,8 @@ def start_remove(update, _):
 
     logger.info('[%s] Removing process initialized',
                 update.message.from_user.username)
-    update.message.reply_text(
+    reply(
+        update,
         "Which quiz do you want to delete? 🙂"
     )
     return 'ENTER_NAME'
@@ -36,23 +39,24 @@ def enter_name_remove(update, context):
 
     context.bot.send_chat_action(
         chat_id=update.effective_message.chat_id, action=ChatAction.TYPING)
-    user_col = db[quiz_creator]
 
-    # Checks if the quiz exists
-    if user_col.find_one({'quizname': quiz_name}) is None:
+    # Deletes the quiz if it exists
+    if not Quiz.delete(quiz_name, quiz_creator):
         logger.info('[%s] Entered quiz %s doesn\'t exist',
                     update.message.from_user.username, quiz_name)
-        update.message.reply_text(
+        reply(
+            update,
             "The quiz '{}' doesn't exist 😕\nPlease try again or cancel process with /cancelEdit 🙆‍♂️".format(
                 quiz_name)
         )
         return 'ENTER_NAME'
 
-    # Deletes the quiz
-    user_col.delete_one({'quizname': quiz_name})
+    quiz_cache.invalidate(quiz_name, quiz_creator)
+    quiz_index.remove(quiz_name, quiz_creator)
     logger.info('[%s] Removed %s',
                 update.message.from_user.username, quiz_name)
-    update.message.reply_text(
+    reply(
+        update,
         "I deleted '{}' 👍".format(quiz_name)
     )
     return ConversationHandler.END
@@ -63,7 +67,8 @@ def start_rename(update, _):
 
     logger.info('[%s] Renaming process initialized',
                 update.message.from_user.username)
-    update.message.reply_text(
+    reply(
+        update,
         "Which quiz do you want to rename? ✏️"
     )
     return 'ENTER_OLD_NAME'
@@ -77,14 +82,14 @@ def enter_old_name(update, context):
 
     context.bot.send_chat_action(
         chat_id=update.effective_message.chat_id, action=ChatAction.TYPING)
-    user_col = db[quiz_creator]
 
     # Checks if a quiz with this name exists
-    if user_col.find_one({'quizname': old_quiz_name}) is None:
+    if Quiz.get_version(old_quiz_name, quiz_creator) is None:
 
         logger.info("[%s] Entered old quiz '%s' doesn\'t exist",
                     update.message.from_user.username, old_quiz_name)
-        update.message.reply_text(
+        reply(
+            update,
             "The quiz '{}' doesn't exist 😕\nPlease try again or cancel process with /cancelEdit 🙆‍♂️".format(
                 old_quiz_name)
         )
@@ -93,8 +98,9 @@ def enter_old_name(update, context):
     logger.info("[%s] Entered old quiz name '%s'",
                 update.message.from_user.username, old_quiz_name)
     # Saves the new quiz name
-    user_dict[quiz_creator] = old_quiz_name
-    update.message.reply_text(
+    user_dict[update.message.from_user.id] = old_quiz_name
+    reply(
+        update,
         "How should I name it? 🤔"
     )
     return 'ENTER_NEW_NAME'
@@ -108,44 +114,140 @@ def enter_new_name(update, context):
 
     context.bot.send_chat_action(
         chat_id=update.effective_message.chat_id, action=ChatAction.TYPING)
-    user_col = db[quiz_creator]
-
-    # Check if a quiz with the name already exists
-    if not user_col.find_one({'quizname': new_quiz_name}) is None:
 
+    # Get old quizname and update database, fails if a quiz with the new name exists
+    old_quiz_name = user_dict[update.message.from_user.id]
+    try:
+        renamed = Quiz.rename(old_quiz_name, quiz_creator, new_quiz_name)
+    except ValueError:
         logger.info("[%s] Entered new quiz '%s' already exists",
                     update.message.from_user.username, new_quiz_name)
-        update.message.reply_text(
+        reply(
+            update,
             "The quiz '{}' already exists 😕\nPlease try again or cancel process with /cancelEdit 🙆‍♂️".format(
                 new_quiz_name)
         )
         return 'ENTER_NEW_NAME'
-
-    # Get old quizname and update database
-    old_quiz_name = user_dict[quiz_creator]
-    user_col.update_one({'quizname': old_quiz_name}, {
-                        "$set": {"quizname": new_quiz_name}})
-    update.message.reply_text(
+    if not renamed:
+        # The quiz was deleted since the user entered its name
+        logger.info("[%s] Quiz '%s' to rename was deleted meanwhile",
+                    update.message.from_user.username, old_quiz_name)
+        reply(
+            update,
+            "The quiz '{}' doesn't exist anymore 😕".format(old_quiz_name)
+        )
+        user_dict.pop(update.message.from_user.id, None)
+        return ConversationHandler.END
+    quiz_cache.invalidate(old_quiz_name, quiz_creator)
+    quiz_index.rename(old_quiz_name, quiz_creator, new_quiz_name)
+    reply(
+        update,
         "I renamed '{}' to '{}' 🥳".format(old_quiz_name, new_quiz_name)
     )
     logger.info("[%s] Updated quiz '%s' to '%s'",
                 update.message.from_user.username, new_quiz_name, old_quiz_name)
 
     # delete user data
-    user_dict.pop(quiz_creator)
+    user_dict.pop(update.message.from_user.id, None)
+    return ConversationHandler.END
+
+
+def start_clone(update, _):
+    """Starts a process to copy a quiz of any user."""
+
+    logger.info('[%s] Cloning process initialized',
+                update.message.from_user.username)
+    reply(
+        update,
+        "Which quiz do you want to copy? 📋\n"
+        "Please enter the quiz name followed by the creator's username."
+    )
+    return 'ENTER_CLONE_SOURCE'
+
+
+def enter_clone_source(update, context):
+    """After entering the quiz to copy, it asks for the name of the copy."""
+
+    username = update.message.from_user.username
+    source_name, source_creator = parse_quiz_name(update.message.text)
+    source_creator = source_creator or username
+
+    context.bot.send_chat_action(
+        chat_id=update.effective_message.chat_id, action=ChatAction.TYPING)
+
+    # Checks if the quiz exists
+    if Quiz.get_version(source_name, source_creator) is None:
+        logger.info("[%s] Entered quiz '%s' of %s doesn't exist",
+                    username, source_name, source_creator)
+        reply(
+            update,
+            "The quiz '{}' of {} doesn't exist 😕\nPlease try again or cancel process with /cancelEdit 🙆‍♂️".format(
+                source_name, source_creator)
+        )
+        return 'ENTER_CLONE_SOURCE'
+
+    # Saves the quiz to copy
+    user_dict[update.message.from_user.id] = (source_name, source_creator)
+    reply(
+        update,
+        "How should I name your copy? 🤔"
+    )
+    return 'ENTER_CLONE_NAME'
+
+
+def enter_clone_name(update, context):
+    """After entering the name of the copy, it copies the quiz."""
+
+    username = update.message.from_user.username
+    clone_name = update.message.text
+    source_name, source_creator = user_dict[update.message.from_user.id]
+
+    context.bot.send_chat_action(
+        chat_id=update.effective_message.chat_id, action=ChatAction.TYPING)
+
+    try:
+        clone_id = Quiz.clone(source_name, source_creator, clone_name, username)
+    except ValueError:
+        logger.info("[%s] Entered clone name '%s' already exists", username, clone_name)
+        reply(
+            update,
+            "The quiz '{}' already exists 😕\nPlease try again or cancel process with /cancelEdit 🙆‍♂️".format(
+                clone_name)
+        )
+        return 'ENTER_CLONE_NAME'
+    if clone_id is None:
+        # The quiz to copy was deleted since the user entered its name
+        logger.info("[%s] Quiz '%s' of %s to clone was deleted meanwhile",
+                    username, source_name, source_creator)
+        reply(
+            update,
+            "The quiz '{}' of {} doesn't exist anymore 😕".format(source_name, source_creator)
+        )
+        user_dict.pop(update.message.from_user.id, None)
+        return ConversationHandler.END
+    quiz_index.add(clone_name, username)
+
+    reply(
+        update,
+        "I copied '{}' to '{}' 🥳".format(source_name, clone_name)
+    )
+    logger.info("[%s] Cloned quiz '%s' of %s to '%s'",
+                username, source_name, source_creator, clone_name)
+
+    # delete user data
+    user_dict.pop(update.message.from_user.id, None)
     return ConversationHandler.END
 
 
 def cancel_edit(update, _):
     """Cancels the process of deletion or renaming."""
-    client = pymongo.MongoClient(os.environ.get('MONGODB'))
-    db = client.quizzes
-    update.message.reply_text(
+    reply(
+        update,
         "I canceled the editing process."
     )
     logger.info("[%s] Canceled editing process by user",
                 update.message.from_user.username)
 
     # delete user data
-    user_dict.pop(update.message.from_user.username, None)
+    user_dict.pop(update.message.from_user.id, None)
     return ConversationHandler.END
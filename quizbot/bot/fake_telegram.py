@@ -0,0 +1,511 @@
+"""
+Stand-in for the Telegram Bot API to run the bots without Telegram, e.g. for load tests.
+
+The server answers the methods the bots use, among them getUpdates, setWebhook,
+sendMessage, sendPoll, editMessageText and answerCallbackQuery. A bot uses it
+with the base URL ``http://<host>:<port>/bot`` (TELEGRAM_BASE_URL of quizbot.bot.bot);
+any token is accepted.
+
+Synthetic users talk to the bot through the methods of the server: send_text,
+press_button and answer_poll create updates, which the bot gets with getUpdates or,
+if it set a webhook, as POST requests to the webhook. Everything the bot sends
+to a chat is recorded as an event, which expect returns in order.
+"""
+import itertools
+import json
+import logging
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import Counter, deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+from quizbot.bot.webhook import SECRET_HEADER
+
+logger = logging.getLogger(__name__)
+
+# User of the bot returned by getMe
+BOT_USER = {'id': 1, 'is_bot': True, 'first_name': 'QuizBot', 'username': 'fake_quizbot',
+            'can_join_groups': True, 'can_read_all_group_messages': False,
+            'supports_inline_queries': True}
+
+# Parameters whose values are plain strings, the others may be JSON encoded
+TEXT_PARAMETERS = frozenset(('text', 'question', 'explanation', 'caption', 'url',
+                             'secret_token', 'callback_query_id', 'inline_message_id'))
+
+# Methods which are accepted without doing anything
+NOOP_METHODS = frozenset(('sendchataction', 'setmycommands', 'deletemycommands'))
+
+# A message or an edit the bot sent to a chat
+Event = namedtuple('Event', ('kind', 'message', 'at'))
+
+
+class ApiError(Exception):
+    """Error of a method, answered with ok = false."""
+
+    def __init__(self, code, description):
+        super().__init__(description)
+        self.code = code
+        self.description = description
+
+
+def contains(text):
+    """
+    Returns a predicate for expect which matches events whose text contains a text.
+
+    :param text: Expected part of the text.
+    """
+    return lambda event: text in (event.message.get('text') or '')
+
+
+def is_poll(event):
+    """Predicate for expect which matches polls."""
+    return 'poll' in event.message
+
+
+class FakeBotAPI:
+    """
+    An Instance of the class FakeBotAPI serves the Bot API for one bot and
+    plays the users who talk to it.
+    """
+
+    def __init__(self, port=0, listen='127.0.0.1', delivery_workers=8) -> None:
+        """
+        Initializes an instance of the class FakeBotAPI.
+
+        :param port: Port to listen on, a free one if 0.
+        :param listen: Address to listen on.
+        :param delivery_workers: Number of threads which POST updates to a webhook.
+        """
+        self.webhook_url = None
+        self.webhook_secret = None
+        self.calls = Counter()
+        self.delivered = 0
+        self.delivery_errors = 0
+        self._lock = threading.Lock()
+        self._updates_ready = threading.Condition(self._lock)
+        self._bot_seen = threading.Condition(self._lock)
+        self._chat_ready = dict()
+        self._updates = deque()
+        self._update_ids = itertools.count(1)
+        self._message_ids = dict()
+        self._messages = dict()
+        self._events = dict()
+        self._polls = dict()
+        self._poll_ids = itertools.count(1)
+        self._callback_ids = itertools.count(1)
+        self._stopped = False
+        self._connected = False
+        self._delivery = ThreadPoolExecutor(delivery_workers, thread_name_prefix='fake-delivery')
+        self._methods = {
+            'getme': lambda _: BOT_USER,
+            'getmycommands': lambda _: [],
+            'getupdates': self._get_updates,
+            'setwebhook': self._set_webhook,
+            'deletewebhook': self._delete_webhook,
+            'getwebhookinfo': self._get_webhook_info,
+            'sendmessage': self._send_message,
+            'sendpoll': self._send_poll,
+            'editmessagetext': self._edit_message_text,
+            'answercallbackquery': lambda _: True,
+            'answerinlinequery': lambda _: True,
+        }
+        self._httpd = ThreadingHTTPServer((listen, port), self._handler_class())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        """Base URL of the API for the bot, the token is appended."""
+        host, port = self._httpd.server_address[:2]
+        return 'http://{}:{}/bot'.format(host, port)
+
+    def start(self):
+        """Starts to serve the API in a daemon thread."""
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name='fake-telegram',
+                                        daemon=True)
+        self._thread.start()
+        logger.info('Serving a fake Bot API on %s', self.base_url)
+
+    def stop(self):
+        """Stops the server and wakes up waiting requests."""
+        with self._lock:
+            self._stopped = True
+            self._updates_ready.notify_all()
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        self._delivery.shutdown(wait=False)
+
+    def wait_for_bot(self, timeout=30.0):
+        """
+        Waits until a bot asks for updates or sets a webhook.
+
+        :param timeout: Maximum seconds to wait.
+        :returns: Whether a bot connected.
+        """
+        with self._lock:
+            return self._bot_seen.wait_for(lambda: self._connected, timeout)
+
+    def stats(self):
+        """
+        Returns the counters of the server.
+
+        :returns: Dict with the calls per method, the updates waiting for getUpdates
+            and the updates delivered to the webhook.
+        """
+        return {
+            'calls': dict(self.calls),
+            'pending_updates': len(self._updates),
+            'delivered': self.delivered,
+            'delivery_errors': self.delivery_errors,
+        }
+
+    # Users
+
+    def send_text(self, user_id, text, username=None):
+        """
+        Sends a text message of a user to the bot in the private chat of the user.
+
+        :param user_id: ID of the user, also the ID of the chat.
+        :param text: Text of the message. A leading /command is marked as bot command.
+        :param username: Username, user_<ID> if None.
+        :returns: The update.
+        """
+        user = self._user(user_id, username)
+        message = {'message_id': self._next_message_id(user_id), 'date': int(time.time()),
+                   'chat': self._chat(user), 'from': user, 'text': text}
+        if text.startswith('/'):
+            message['entities'] = [{'type': 'bot_command', 'offset': 0,
+                                    'length': len(text.split()[0])}]
+        return self._push({'message': message})
+
+    def press_button(self, user_id, message, data, username=None):
+        """
+        Presses an inline button of a message of the bot.
+
+        :param user_id: ID of the user.
+        :param message: Message of the bot as dict, e.g. the one of an event.
+        :param data: Callback data of the button.
+        :param username: Username, user_<ID> if None.
+        :returns: The update.
+        """
+        return self._push({'callback_query': {
+            'id': str(next(self._callback_ids)), 'from': self._user(user_id, username),
+            'message': self._public(message), 'chat_instance': str(message['chat']['id']), 'data': data}})
+
+    def answer_poll(self, user_id, poll_id, option_ids, username=None):
+        """
+        Answers a poll which isn't anonymous.
+
+        :param user_id: ID of the user.
+        :param poll_id: ID of the poll.
+        :param option_ids: Indexes of the chosen options.
+        :param username: Username, user_<ID> if None.
+        :returns: The update.
+        """
+        return self._push({'poll_answer': {'poll_id': poll_id,
+                                           'user': self._user(user_id, username),
+                                           'option_ids': list(option_ids)}})
+
+    def expect(self, chat_id, predicate=None, timeout=10.0):
+        """
+        Waits for the next message or edit of the bot in a chat which matches a predicate.
+        Events which don't match are dropped.
+
+        :param chat_id: ID of the chat.
+        :param predicate: Function which gets an Event and returns whether it matches,
+            every event matches if None.
+        :param timeout: Maximum seconds to wait.
+        :returns: The matching Event.
+        :raises TimeoutError: If no matching event arrived in time.
+        """
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            events = self._events.setdefault(chat_id, deque())
+            ready = self._chat_ready.setdefault(chat_id, threading.Condition(self._lock))
+            while True:
+                while events:
+                    event = events.popleft()
+                    if predicate is None or predicate(event):
+                        return event
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or self._stopped:
+                    raise TimeoutError('No expected message in chat {}'.format(chat_id))
+                ready.wait(remaining)
+
+    def _push(self, update):
+        """Gives an update to the bot, with getUpdates or the webhook."""
+        with self._lock:
+            update['update_id'] = next(self._update_ids)
+            if self.webhook_url is None:
+                self._updates.append(update)
+                self._updates_ready.notify_all()
+                return update
+        self._delivery.submit(self._deliver, update)
+        return update
+
+    def _deliver(self, update):
+        """POSTs an update to the webhook."""
+        request = urllib.request.Request(self.webhook_url, data=json.dumps(update).encode('utf-8'),
+                                         headers={'Content-Type': 'application/json'})
+        if self.webhook_secret:
+            request.add_header(SECRET_HEADER, self.webhook_secret)
+        try:
+            with urllib.request.urlopen(request, timeout=10):
+                pass
+        except (urllib.error.URLError, OSError) as err:
+            logger.warning('Delivering update %s failed: %s', update['update_id'], err)
+            with self._lock:
+                self.delivery_errors += 1
+            return
+        with self._lock:
+            self.delivered += 1
+
+    @staticmethod
+    def _user(user_id, username=None):
+        return {'id': user_id, 'is_bot': False, 'first_name': 'User {}'.format(user_id),
+                'username': username or 'user_{}'.format(user_id)}
+
+    @staticmethod
+    def _chat(user):
+        return {'id': user['id'], 'type': 'private', 'first_name': user['first_name'],
+                'username': user['username']}
+
+    def _next_message_id(self, chat_id):
+        """Returns the next message ID of a chat, message IDs are counted per chat."""
+        with self._lock:
+            ids = self._message_ids.get(chat_id)
+            if ids is None:
+                ids = self._message_ids[chat_id] = itertools.count(1)
+            return next(ids)
+
+    # Methods of the bot
+
+    def call(self, method, params):
+        """
+        Calls a method of the API.
+
+        :param method: Name of the method, e.g. 'sendMessage'.
+        :param params: Dict with the parameters.
+        :returns: Pair of the HTTP status and the response as dict.
+        """
+        name = method.lower()
+        with self._lock:
+            self.calls[method] += 1
+        handler = self._methods.get(name)
+        if handler is None and name in NOOP_METHODS:
+            handler = lambda _: True  # noqa: E731
+        if handler is None:
+            return 404, {'ok': False, 'error_code': 404,
+                         'description': 'Not Found: method not found'}
+        try:
+            return 200, {'ok': True, 'result': handler(params)}
+        except ApiError as err:
+            return err.code, {'ok': False, 'error_code': err.code,
+                              'description': err.description}
+
+    def _get_updates(self, params):
+        offset = int(params.get('offset') or 0)
+        limit = int(params.get('limit') or 100)
+        deadline = time.monotonic() + float(params.get('timeout') or 0)
+        with self._lock:
+            self._seen_bot()
+            if self.webhook_url is not None:
+                raise ApiError(409, "Conflict: can't use getUpdates method while webhook is "
+                                    "active; use deleteWebhook to delete the webhook first")
+            while True:
+                # Updates before the offset are confirmed
+                while self._updates and self._updates[0]['update_id'] < offset:
+                    self._updates.popleft()
+                remaining = deadline - time.monotonic()
+                if self._updates or remaining <= 0 or self._stopped:
+                    return list(itertools.islice(self._updates, limit))
+                self._updates_ready.wait(remaining)
+
+    def _set_webhook(self, params):
+        url = params.get('url') or None
+        with self._lock:
+            self._seen_bot()
+            self.webhook_url = url
+            self.webhook_secret = params.get('secret_token')
+            pending = list(self._updates) if url else []
+            if url:
+                self._updates.clear()
+        for update in pending:
+            self._delivery.submit(self._deliver, update)
+        return True
+
+    def _delete_webhook(self, params):
+        with self._lock:
+            self.webhook_url = None
+            self.webhook_secret = None
+            if str(params.get('drop_pending_updates')).lower() == 'true':
+                self._updates.clear()
+        return True
+
+    def _get_webhook_info(self, _):
+        return {'url': self.webhook_url or '', 'has_custom_certificate': False,
+                'pending_update_count': len(self._updates)}
+
+    def _send_message(self, params):
+        return self._record(params, {'text': str(params['text'])})
+
+    def _send_poll(self, params):
+        options = params['options']
+        poll = {
+            'id': str(next(self._poll_ids)),
+            'question': str(params['question']),
+            'options': [{'text': str(option), 'voter_count': 0} for option in options],
+            'total_voter_count': 0,
+            'is_closed': False,
+            'is_anonymous': params.get('is_anonymous', True) not in (False, 'false'),
+            'type': params.get('type', 'regular'),
+            'allows_multiple_answers': bool(params.get('allows_multiple_answers', False)),
+        }
+        for key in ('correct_option_id', 'explanation', 'open_period'):
+            if params.get(key) is not None:
+                poll[key] = params[key]
+        message = self._record(params, {'poll': poll})
+        with self._lock:
+            self._polls[poll['id']] = message
+        return message
+
+    def _edit_message_text(self, params):
+        if 'inline_message_id' in params:
+            return True
+        key = (int(params['chat_id']), int(params['message_id']))
+        with self._lock:
+            message = self._messages.get(key)
+            if message is None:
+                raise ApiError(400, 'Bad Request: message to edit not found')
+            message = dict(message, text=str(params['text']), edit_date=int(time.time()))
+            self._set_markup(message, params.get('reply_markup'))
+            self._messages[key] = message
+            self._add_event(key[0], Event('edit', message, time.monotonic()))
+        return self._public(message)
+
+    def _record(self, params, content):
+        """Stores a message of the bot and records it as event of its chat."""
+        chat_id = int(params['chat_id'])
+        message = {'message_id': self._next_message_id(chat_id), 'date': int(time.time()),
+                   'chat': {'id': chat_id, 'type': 'private'}, 'from': BOT_USER}
+        message.update(content)
+        self._set_markup(message, params.get('reply_markup'))
+        with self._lock:
+            self._messages[(chat_id, message['message_id'])] = message
+            self._add_event(chat_id, Event('message', message, time.monotonic()))
+        return self._public(message)
+
+    def _add_event(self, chat_id, event):
+        """Adds an event to its chat and wakes up expect. The lock has to be held."""
+        self._events.setdefault(chat_id, deque()).append(event)
+        ready = self._chat_ready.get(chat_id)
+        if ready is not None:
+            ready.notify_all()
+
+    def _seen_bot(self):
+        """Notes that the bot connected. The lock has to be held."""
+        if not self._connected:
+            self._connected = True
+            self._bot_seen.notify_all()
+
+    @staticmethod
+    def _set_markup(message, markup):
+        if markup:
+            message['reply_markup'] = markup
+        else:
+            message.pop('reply_markup', None)
+
+    @staticmethod
+    def _public(message):
+        """Returns a message as Telegram does, it only contains inline keyboards."""
+        markup = message.get('reply_markup')
+        if markup is not None and 'inline_keyboard' not in markup:
+            message = {key: value for key, value in message.items() if key != 'reply_markup'}
+        return message
+
+    def _handler_class(self):
+        """Creates the request handler class bound to this server."""
+        api = self
+
+        class BotAPIHandler(BaseHTTPRequestHandler):
+            """Handles the requests of the bot."""
+
+            def do_GET(self):  # pylint: disable=invalid-name
+                """Calls a method with the parameters of the query string."""
+                self._call(b'')
+
+            def do_POST(self):  # pylint: disable=invalid-name
+                """Calls a method with the parameters of the body."""
+                self._call(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+
+            def _call(self, body):
+                url = urlsplit(self.path)
+                parts = url.path.strip('/').split('/')
+                if len(parts) != 2 or not parts[0].startswith('bot'):
+                    self._respond(404, {'ok': False, 'error_code': 404,
+                                        'description': 'Not Found'})
+                    return
+                try:
+                    params = dict(parse_qsl(url.query))
+                    params.update(parse_body(self.headers.get('Content-Type', ''), body))
+                except ValueError:
+                    self._respond(400, {'ok': False, 'error_code': 400,
+                                        'description': 'Bad Request: invalid parameters'})
+                    return
+                self._respond(*api.call(parts[1], decode_parameters(params)))
+
+            def _respond(self, status, payload):
+                body = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *_):
+                """Requests aren't logged, there are several per update."""
+
+        return BotAPIHandler
+
+
+def parse_body(content_type, body):
+    """
+    Parses the body of a request, JSON (python-telegram-bot 12) or
+    form encoded (python-telegram-bot 20).
+
+    :param content_type: Value of the Content-Type header.
+    :param body: Body as bytes.
+    :returns: Dict with the parameters.
+    :raises ValueError: If the body can't be parsed.
+    """
+    if not body:
+        return {}
+    if content_type.startswith('application/json'):
+        params = json.loads(body)
+        if not isinstance(params, dict):
+            raise ValueError('Parameters have to be an object')
+        return params
+    if content_type.startswith('application/x-www-form-urlencoded'):
+        return dict(parse_qsl(body.decode('utf-8'), keep_blank_values=True))
+    raise ValueError('Unsupported content type {}'.format(content_type))
+
+
+def decode_parameters(params):
+    """
+    Decodes the parameters which are sent as JSON strings, e.g. reply_markup or chat_id.
+
+    :param params: Dict with the parameters.
+    :returns: Dict with the decoded parameters.
+    """
+    decoded = dict()
+    for key, value in params.items():
+        if isinstance(value, str) and key not in TEXT_PARAMETERS:
+            try:
+                value = json.loads(value)
+            except ValueError:
+                pass
+        decoded[key] = value
+    return decoded
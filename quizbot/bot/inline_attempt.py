@@ -0,0 +1,345 @@
+"""
+Module with an attempt of a quiz in one message with inline buttons (/play).
+
+The message of an attempt is edited in place: It shows the current question with its
+answers as inline buttons and the result of the previous question. True/false and
+single choice questions are answered with one button, the answers of a multiple choice
+question are toggled and entered with a button. A toggle doesn't edit the message, the
+chosen answers are shown in the notification of the button. String and number questions are answered
+with a text message. At the end, the message shows the results, paginated like the
+results of /attempt. Unlike /attempt, no message is sent per question or result.
+
+The callback data of a button is 'play:<attempt>:<question>:<answer>', with a random
+token of the attempt and the indexes of the question and the answer in hex, so buttons
+of an old attempt or of an answered question are recognized.
+"""
+import logging
+import random
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.ext import ConversationHandler
+from quizbot.quiz.attempt import Attempt
+from quizbot.quiz.cache import quiz_cache
+from quizbot.quiz.question_factory import QuestionBool, QuestionChoice, QuestionChoiceSingle
+from quizbot.bot.attempt_quiz import parse_quiz_name
+from quizbot.bot.keyboards import permutations
+from quizbot.bot.results import page_markup, page_text, paginate, render_results, reports, \
+    results_header
+from quizbot.bot.send_queue import PROMPT, edit, reply
+from quizbot.bot.user_state import UserStateStore
+
+logger = logging.getLogger(__name__)
+
+# Prefix of the callback data of the answer buttons
+CALLBACK_PREFIX = 'play:'
+
+# Answer index of the button which enters the chosen answers of a multiple choice question
+ENTER = 'e'
+
+# Answers of a true/false question
+BOOL_ANSWERS = ('True', 'False')
+
+# Running attempts by user ID as dicts with the attempt, its token, the ID of its message,
+# the order of the shown answers and the result of the previous question
+games = UserStateStore('inline_attempt')
+
+
+def encode_callback(token, question, answer):
+    """
+    Encodes the callback data of an answer button.
+
+    :param token: Token of the attempt.
+    :param question: Index of the question in the attempt.
+    :param answer: Index of the answer or ENTER.
+    :returns: Callback data as string.
+    """
+    if answer != ENTER:
+        answer = format(answer, 'x')
+    return '{}{}:{:x}:{}'.format(CALLBACK_PREFIX, token, question, answer)
+
+
+def decode_callback(data):
+    """
+    Decodes the callback data of an answer button.
+
+    :param data: Callback data as string.
+    :returns: Triple of the token, the question index and the answer index or ENTER,
+        None if the data is invalid.
+    """
+    try:
+        token, question, answer = data[len(CALLBACK_PREFIX):].split(':')
+        return token, int(question, 16), answer if answer == ENTER else int(answer, 16)
+    except ValueError:
+        return None
+
+
+def possible_answers(question):
+    """
+    Returns the answers of a question which are shown as buttons.
+
+    :param question: Instance of the class Question.
+    :returns: List of answers, None if the answer is entered as text.
+    """
+    if isinstance(question, QuestionBool):
+        return list(BOOL_ANSWERS)
+    if isinstance(question, QuestionChoice):
+        return question.possible_answers
+    return None
+
+
+def is_multiple(question):
+    """Checks if several answers of a question can be chosen."""
+    return isinstance(question, QuestionChoice) and not isinstance(question, QuestionChoiceSingle)
+
+
+def render(game):
+    """
+    Renders the message of an attempt with the current question.
+
+    :param game: Running attempt.
+    :returns: Pair of the text and the InlineKeyboardMarkup or None.
+    """
+    attempt = game['attempt']
+    number = len(attempt.user_points)
+    question = attempt.act_question()
+    lines = ['{} · Question {}/{}'.format(attempt.quiz.name, number + 1,
+                                          number + len(attempt.questions))]
+    if game['feedback']:
+        lines.append(game['feedback'])
+    lines += ['', question.question]
+
+    answers = possible_answers(question)
+    if answers is None:
+        lines.append('\nPlease send me your answer ✍️')
+        return '\n'.join(lines), None
+
+    buttons = [[InlineKeyboardButton(
+        answers[position], callback_data=encode_callback(game['token'], number, position))]
+               for position in game['order']]
+    if is_multiple(question):
+        lines.append('\nTap all correct answers, then Enter 👇')
+        buttons.append([InlineKeyboardButton(
+            'Enter ➡️', callback_data=encode_callback(game['token'], number, ENTER))])
+    return '\n'.join(lines), InlineKeyboardMarkup(buttons)
+
+
+def shuffle(game):
+    """Draws the order in which the answers of the current question are shown."""
+    question = game['attempt'].act_question()
+    answers = possible_answers(question)
+    if answers is None:
+        game['order'] = []
+    elif getattr(question, 'is_random', False):
+        # One of the cached permutations of the keyboards module
+        game['order'] = list(random.choice(permutations(len(answers))))
+    else:
+        game['order'] = list(range(len(answers)))
+
+
+def start(update, context):
+    """
+    Starts an attempt with inline buttons. The quiz can follow the command,
+    otherwise it is asked for.
+    """
+    user = update.message.from_user
+    logger.info('[%s] Inline attempt initialized', user.username)
+
+    if user.id in games:
+        reply(
+            update,
+            "You're in the middle of a quiz. You can't attempt a second one 😁\n"
+            'If you want to cancel your attempt, enter /cancelPlay.'
+        )
+        return ConversationHandler.END
+
+    if context.args:
+        return begin(update, ' '.join(context.args))
+    reply(
+        update,
+        'Hi 😃 Which quiz would you like to play?\n'
+        'Please enter the quiz name. '
+        'If the quiz wasn\'t created by you, add the creator\'s username after the quiz name.'
+    )
+    return 'ENTER_QUIZ'
+
+
+def enter_quiz(update, _):
+    """Handles the entered quiz name."""
+    return begin(update, update.message.text)
+
+
+def begin(update, text):
+    """
+    Loads the quiz and sends the message of the attempt with the first question.
+
+    :param update: Update with the entered quiz.
+    :param text: Quiz name, optionally followed by the creator's username.
+    :returns: Next state of the conversation.
+    """
+    user = update.message.from_user
+    quiz_name, quiz_creator = parse_quiz_name(text)
+    quiz = quiz_cache.get(quiz_name, quiz_creator)
+    attempt = Attempt(quiz) if quiz else None
+    if attempt is None or not attempt.has_next_question():
+        logger.info('[%s] Couldn\'t find Quiz %s', user.username, quiz_name)
+        reply(update, "Sorry, I couldn't find the quiz '{}' 😕 Please try again.".format(quiz_name))
+        return 'ENTER_QUIZ'
+
+    game = {
+        'attempt': attempt,
+        'token': format(random.getrandbits(32), 'x'),
+        'message_id': None,
+        'order': [],
+        'feedback': "Let's go! 🙌 You can cancel with /cancelPlay.",
+    }
+    shuffle(game)
+    text, markup = render(game)
+    games[user.id] = game
+    reply(update, text, PROMPT, reply_markup=markup).add_done_callback(
+        lambda done: sent(user, game['token'], done))
+    logger.info('[%s] Playing Quiz %s', user.username, quiz_name)
+    return 'ANSWER'
+
+
+def sent(user, token, done):
+    """
+    Stores the ID of the message of an attempt once it's sent, the edits need it.
+    The handler doesn't wait for it, an attempt whose message failed is dropped.
+
+    :param user: User who plays.
+    :param token: Token of the attempt.
+    :param done: Future of the sent message.
+    """
+    game = games.get(user.id)
+    if game is None or game['token'] != token:
+        return
+    if done.exception() is not None:
+        logger.warning('[%s] Sending the inline attempt failed: %s', user.username,
+                       done.exception())
+        games.pop(user.id, None)
+        return
+    game['message_id'] = done.result().message_id
+    games[user.id] = game
+
+
+def choose(update, context):
+    """Handles a pressed answer button: toggles the answer or enters it."""
+    query = update.callback_query
+    game = games.get(query.from_user.id)
+    decoded = decode_callback(query.data)
+    if game is None or decoded is None or decoded[0] != game['token'] \
+            or decoded[1] != len(game['attempt'].user_points):
+        query.answer('This question is already answered 🙂')
+        return None
+    _, _, position = decoded
+    if game['message_id'] is None:
+        # The button was pressed before the message was confirmed
+        game['message_id'] = query.message.message_id
+    attempt = game['attempt']
+    question = attempt.act_question()
+    answers = possible_answers(question)
+
+    if position == ENTER:
+        if not attempt.user_answers:
+            query.answer('Please choose at least one answer 🙂')
+            return None
+    elif position >= len(answers):
+        query.answer()
+        return None
+    elif is_multiple(question):
+        # Toggle the answer, the notification shows the chosen answers instead of an edit
+        answer = answers[position]
+        if answer in attempt.user_answers:
+            attempt.user_answers.discard(answer)
+        else:
+            attempt.user_answers.add(answer)
+        games[query.from_user.id] = game
+        chosen = [answers[index] for index in game['order']
+                  if answers[index] in attempt.user_answers]
+        query.answer('✅ ' + ', '.join(chosen) if chosen else 'Nothing chosen')
+        return None
+    else:
+        attempt.input_answer(answers[position])
+
+    return submit(update, context, game, query)
+
+
+def enter_text(update, context):
+    """Handles an answer sent as text message."""
+    user = update.message.from_user
+    game = games.get(user.id)
+    if game is None:
+        reply(update, "Sorry 😕 I lost your quiz. Please start again with /play.")
+        return ConversationHandler.END
+    game['attempt'].user_answers = {update.message.text}
+    return submit(update, context, game)
+
+
+def submit(update, context, game, query=None):
+    """
+    Enters the answer of the current question and shows the next question or the results.
+
+    :param update: Update with the answer.
+    :param context: Context of the handler.
+    :param game: Running attempt.
+    :param query: Callback query of the pressed button, None for a text message.
+    :returns: Next state of the conversation.
+    """
+    user = update.effective_user
+    attempt = game['attempt']
+    try:
+        is_correct, correct_answer = attempt.enter_answer()
+    except AssertionError:
+        attempt.user_answers.clear()
+        logger.info('[%s] Something went wrong by entering the answer.', user.username)
+        game['feedback'] = "Sorry 😕 I couldn't enter '{}'. Please try again.".format(
+            update.message.text if query is None else 'your answer')
+        return show(update, context, game, query)
+
+    if not attempt.quiz.show_results_after_question:
+        game['feedback'] = None
+    elif is_correct:
+        game['feedback'] = 'Question {}: Thats correct 😁'.format(len(attempt.user_points))
+    else:
+        game['feedback'] = 'Question {}: Sorry, thats not correct 😕 The correct answer is: {}' \
+            .format(len(attempt.user_points), correct_answer)
+    logger.info('[%s] Entered Answer', user.username)
+
+    if attempt.has_next_question():
+        shuffle(game)
+        return show(update, context, game, query)
+
+    # No question left, the message shows the results
+    text = 'Thanks for your participation! ☺️'
+    markup = None
+    if attempt.quiz.show_results_after_quiz:
+        pages = paginate(render_results(attempt.user_points),
+                         results_header(attempt.user_points, text))
+        text, markup = page_text(pages, 0), page_markup(0, len(pages))
+        if len(pages) > 1:
+            reports[(user.id, game['message_id'])] = pages
+    if query is not None:
+        query.answer()
+    edit(context.bot, update.effective_chat.id, game['message_id'], text, PROMPT,
+         reply_markup=markup)
+    del games[user.id]
+    logger.info('[%s] Quitting Quiz', user.username)
+    return ConversationHandler.END
+
+
+def show(update, context, game, query=None):
+    """Edits the message of an attempt to show its current question."""
+    games[update.effective_user.id] = game
+    if query is not None:
+        query.answer()
+    text, markup = render(game)
+    edit(context.bot, update.effective_chat.id, game['message_id'], text, PROMPT,
+         reply_markup=markup)
+    return 'ANSWER'
+
+
+def cancel(update, _):
+    """Cancels an attempt with inline buttons."""
+    logger.info('[%s] Inline attempt canceled by user', update.message.from_user.username)
+    games.pop(update.message.from_user.id, None)
+    reply(update, "I canceled you attempt. See you next time. 🙋‍♂️")
+    return ConversationHandler.END
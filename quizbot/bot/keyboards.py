@@ -0,0 +1,83 @@
+"""
+Module with the reply keyboards of the bot, built once and reused.
+
+The static menus are built at import. The keyboard of a question is built the first
+time the question is shown and cached by its possible answers. If the answers are
+shuffled, the keyboard is one of a few cached variants, each one built from a cached
+random permutation, instead of a new shuffle and a new keyboard per message.
+"""
+import random
+from functools import lru_cache
+from telegram import ReplyKeyboardMarkup, ReplyKeyboardRemove
+from quizbot.quiz.question_factory import QuestionBool, QuestionChoice, QuestionChoiceSingle
+
+# Number of shuffled variants of the keyboard of a question
+SHUFFLED_VARIANTS = 6
+
+# Button to enter the answers of a multiple choice question
+ENTER = 'Enter'
+
+
+def menu(labels, one_time_keyboard=True):
+    """
+    Builds a keyboard with one button per row.
+
+    :param labels: Labels of the buttons.
+    :param one_time_keyboard: Whether the keyboard is hidden after a button was pressed.
+    :returns: ReplyKeyboardMarkup.
+    """
+    return ReplyKeyboardMarkup([[label] for label in labels],
+                               one_time_keyboard=one_time_keyboard)
+
+
+# Static menus
+REMOVE = ReplyKeyboardRemove()
+YES_NO = ReplyKeyboardMarkup([['Yes', 'No']], one_time_keyboard=True)
+TRUE_FALSE = ReplyKeyboardMarkup([['True', 'False']], one_time_keyboard=True)
+
+
+@lru_cache(maxsize=64)
+def permutations(count):
+    """
+    Returns random permutations of the positions of count answers, drawn once per count.
+
+    :param count: Number of answers.
+    :returns: Tuple of permutations as tuples of positions.
+    """
+    variants = {tuple(random.sample(range(count), count)) for _ in range(SHUFFLED_VARIANTS)}
+    return tuple(variants)
+
+
+@lru_cache(maxsize=4096)
+def choice_keyboards(answers, multiple, is_random):
+    """
+    Builds the keyboards of a choice question.
+
+    :param answers: Possible answers as tuple.
+    :param multiple: Whether several answers can be chosen, then an Enter button is added.
+    :param is_random: Whether the answers are shuffled.
+    :returns: Tuple of the keyboard variants.
+    """
+    orders = permutations(len(answers)) if is_random else (range(len(answers)),)
+    extra = [ENTER] if multiple else []
+    return tuple(menu([answers[position] for position in order] + extra,
+                      one_time_keyboard=not multiple)
+                 for order in orders)
+
+
+def question_keyboard(question):
+    """
+    Returns the keyboard to answer a question.
+
+    :param question: Instance of the class Question.
+    :returns: Cached ReplyKeyboardMarkup or ReplyKeyboardRemove.
+    """
+    if isinstance(question, QuestionBool):
+        return TRUE_FALSE
+    if not isinstance(question, QuestionChoice):
+        # String or number question: Use normal Keyboard
+        return REMOVE
+    variants = choice_keyboards(tuple(question.possible_answers),
+                                not isinstance(question, QuestionChoiceSingle),
+                                bool(question.is_random))
+    return random.choice(variants) if len(variants) > 1 else variants[0]
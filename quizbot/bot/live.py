@@ -0,0 +1,552 @@
+"""
+Module with live quizzes, which are played by many chats at the same time.
+
+A host opens a live quiz with /live, group chats and private chats join it with /join
+and the code of the quiz, and the host starts it with /startLive. All chats get the
+same question at the same time and answer it with inline buttons. The answers of all
+chats count for one leaderboard, which is sent to every chat at the end.
+
+The questions run on a shared clock: Question i is sent at start + i * (period + skew).
+Sending a question to every chat at once would exceed the rate limits of Telegram and
+hold back the messages of everyone else, so the sends are staggered. All live quizzes
+share one budget of messages per second below the global rate of the bot. A live quiz
+which starts reserves chats / skew messages per second of the budget until it ends, so
+the last chat gets a question at most skew seconds after the first one, and it can't
+start while the other live quizzes use the budget. The number of chats is limited to
+skew * budget. Every chat has period seconds to answer from the time it got the
+question, so a late chat isn't at a disadvantage.
+
+Only true/false and single choice questions can be played live. The live quizzes are
+kept in memory and end with a restart of the bot. Live quizzes which aren't started
+within an hour are closed. The workers of a cluster don't share the live quizzes,
+so they can't be hosted in a cluster.
+"""
+import logging
+import random
+import string
+import threading
+import time
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from quizbot.quiz.cache import quiz_cache
+from quizbot.quiz.question_factory import QuestionBool, QuestionChoiceSingle
+from quizbot.bot.attempt_quiz import parse_quiz_name
+from quizbot.bot.keyboards import permutations
+from quizbot.bot.send_queue import PROMPT, reply, send
+
+logger = logging.getLogger(__name__)
+
+# Prefix of the callback data of the answer buttons
+CALLBACK_PREFIX = 'live:'
+
+# Characters and length of the code to join a live quiz
+CODE_ALPHABET = string.ascii_uppercase + string.digits
+CODE_LENGTH = 5
+
+# Number of players shown on the leaderboard
+LEADERBOARD_SIZE = 10
+
+
+class Leaderboard:
+    """
+    An Instance of the class Leaderboard ranks the players of a live quiz by their
+    correct answers and, if equal, by the total time they took to answer.
+    """
+
+    def __init__(self) -> None:
+        """Initializes an instance of the class Leaderboard."""
+        self._scores = dict()
+        self._lock = threading.Lock()
+
+    def record(self, user_id, name, is_correct, seconds):
+        """
+        Counts an answer of a player.
+
+        :param user_id: ID of the player.
+        :param name: Name shown on the leaderboard.
+        :param is_correct: Whether the answer is correct.
+        :param seconds: Time the player took to answer.
+        """
+        with self._lock:
+            correct, total_seconds, _ = self._scores.get(user_id, (0, 0.0, name))
+            self._scores[user_id] = (correct + bool(is_correct), total_seconds + seconds, name)
+
+    def __len__(self):
+        return len(self._scores)
+
+    def ranking(self, count=LEADERBOARD_SIZE):
+        """
+        Returns the best players.
+
+        :param count: Maximum number of players.
+        :returns: List of triples of the name, the correct answers and the total seconds.
+        """
+        with self._lock:
+            scores = list(self._scores.values())
+        scores.sort(key=lambda score: (-score[0], score[1]))
+        return [(name, correct, seconds) for correct, seconds, name in scores[:count]]
+
+    def render(self, count=LEADERBOARD_SIZE):
+        """
+        Renders the best players.
+
+        :param count: Maximum number of players.
+        :returns: Leaderboard as string.
+        """
+        ranking = self.ranking(count)
+        if not ranking:
+            return 'Nobody answered yet 🤷'
+        medals = ['🥇', '🥈', '🥉']
+        return '\n'.join('{} {}: {} correct ({:.1f} s)'.format(
+            medals[place] if place < len(medals) else '{}.'.format(place + 1),
+            name, correct, seconds)
+            for place, (name, correct, seconds) in enumerate(ranking))
+
+
+class RateBudget:
+    """
+    An Instance of the class RateBudget shares messages per second between the live
+    quizzes running at the same time.
+    """
+
+    def __init__(self, rate) -> None:
+        """
+        Initializes an instance of the class RateBudget.
+
+        :param rate: Messages per second of all live quizzes, below the global rate.
+        """
+        self.rate = rate
+        self.reserved = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self, rate):
+        """
+        Reserves a part of the budget.
+
+        :param rate: Messages per second.
+        :returns: Whether the rate was reserved, False if the budget is used up.
+        """
+        with self._lock:
+            if self.reserved + rate > self.rate + 1e-9:
+                return False
+            self.reserved += rate
+            return True
+
+    def release(self, rate):
+        """
+        Gives a reserved rate back.
+
+        :param rate: Messages per second.
+        """
+        with self._lock:
+            self.reserved = max(0.0, self.reserved - rate)
+
+
+class LiveQuiz:
+    """
+    An Instance of the class LiveQuiz sends the questions of a quiz to the joined chats
+    on a shared clock and collects their answers.
+    """
+
+    def __init__(self, code, quiz, host_id, period=20.0, skew=5.0, rate=20.0,
+                 budget=None) -> None:
+        """
+        Initializes an instance of the class LiveQuiz.
+
+        :param code: Code to join the live quiz.
+        :param quiz: Instance of the class Quiz.
+        :param host_id: ID of the user who may start and stop the live quiz.
+        :param period: Seconds every chat has to answer a question.
+        :param skew: Maximum seconds between the first and the last chat getting a question.
+        :param rate: Maximum messages per second of the live quiz, below the global limit
+            of Telegram.
+        :param budget: Optional instance of the class RateBudget shared with the other
+            live quizzes.
+        """
+        self.code = code
+        self.quiz = quiz
+        self.host_id = host_id
+        self.period = period
+        self.skew = skew
+        self.rate = rate
+        self.max_chats = max(1, int(skew * rate))
+        self.budget = budget
+        self.questions = [question for question in quiz.get_questions()
+                          if isinstance(question, (QuestionBool, QuestionChoiceSingle))]
+        self._options = [self._order(question) for question in self.questions]
+        self.leaderboard = Leaderboard()
+        self.chats = []
+        self.current = -1
+        self.last_sent = -1
+        self.started = False
+        self.opened_at = time.monotonic()
+        self._delivered = dict()
+        self._answered = set()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def join(self, chat_id):
+        """
+        Adds a chat to the live quiz.
+
+        :param chat_id: ID of the chat.
+        :returns: Whether the chat joined, False if it's full or already running.
+        """
+        with self._lock:
+            if chat_id in self.chats:
+                return True
+            if self.started or len(self.chats) >= self.max_chats:
+                return False
+            self.chats.append(chat_id)
+            return True
+
+    def options(self, number):
+        """
+        Returns the answers of a question in the order they are shown in every chat.
+
+        :param number: Index of the question.
+        :returns: List of the answers.
+        """
+        return self._options[number]
+
+    @staticmethod
+    def _order(question):
+        """Returns the answers of a question, shuffled once for all chats if it's random."""
+        if isinstance(question, QuestionBool):
+            return ['True', 'False']
+        answers = question.possible_answers
+        if question.is_random:
+            return [answers[position]
+                    for position in random.choice(permutations(len(answers)))]
+        return list(answers)
+
+    def render(self, number):
+        """
+        Renders the message of a question.
+
+        :param number: Index of the question.
+        :returns: Pair of the text and the InlineKeyboardMarkup.
+        """
+        lines = []
+        if number > 0:
+            lines.append('The answer to question {} was: {}\n'.format(
+                number, self.questions[number - 1].correct_answer))
+        lines.append('🔴 Live · Question {}/{} · {:.0f} s'.format(
+            number + 1, len(self.questions), self.period))
+        lines.append(self.questions[number].question)
+        buttons = [[InlineKeyboardButton(option, callback_data='{}{}:{:x}:{:x}'.format(
+            CALLBACK_PREFIX, self.code, number, position))]
+            for position, option in enumerate(self.options(number))]
+        return '\n'.join(lines), InlineKeyboardMarkup(buttons)
+
+    def answer(self, user_id, name, chat_id, number, position, now=None):
+        """
+        Counts the answer of a player, the first answer to a question counts.
+
+        :param user_id: ID of the player.
+        :param name: Name of the player.
+        :param chat_id: ID of the chat the player answered in.
+        :param number: Index of the answered question.
+        :param position: Index of the chosen answer.
+        :param now: Time of the answer, by default now.
+        :returns: Text shown to the player.
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            delivered = self._delivered.get((chat_id, number))
+            if number != self.current or delivered is None or now > delivered + self.period:
+                return "Time's up for this question ⏰"
+            options = self.options(number)
+            if not 0 <= position < len(options):
+                return 'This answer is unknown 😕'
+            if (user_id, number) in self._answered:
+                return 'You already answered this question 🙂'
+            self._answered.add((user_id, number))
+        is_correct = options[position] == self.questions[number].correct_answer
+        self.leaderboard.record(user_id, name, is_correct, now - delivered)
+        return 'Your answer is saved 👍'
+
+    def start(self, bot):
+        """
+        Starts sending the questions, staggered to reach every chat within skew seconds.
+
+        :param bot: Bot which sends the questions.
+        :returns: Whether the live quiz started, False if the budget is used up.
+        """
+        with self._lock:
+            if self.started:
+                return False
+            self.rate = min(self.rate, max(1, len(self.chats)) / self.skew)
+            if self.budget is not None and not self.budget.reserve(self.rate):
+                return False
+            self.started = True
+        self._thread = threading.Thread(target=self.run, args=(bot,),
+                                        name='live-{}'.format(self.code), daemon=True)
+        self._thread.start()
+        return True
+
+    def stop(self):
+        """Stops the live quiz after the current send."""
+        self._stopped.set()
+
+    def join_thread(self, timeout=None):
+        """Waits until the live quiz ended."""
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def run(self, bot):
+        """
+        Thread target: sends the questions on the shared clock and finally the leaderboard.
+
+        :param bot: Bot which sends the questions.
+        """
+        try:
+            self._run(bot)
+        finally:
+            if self.budget is not None:
+                self.budget.release(self.rate)
+            sessions.pop(self.code, None)
+
+    def _run(self, bot):
+        """Sends the questions and the leaderboard."""
+        start = time.monotonic()
+        for number in range(len(self.questions)):
+            if not self._wait_until(start + number * (self.period + self.skew)):
+                break
+            with self._lock:
+                self.current = number
+            text, markup = self.render(number)
+            self.fan_out(bot, text, reply_markup=markup, number=number)
+            self.last_sent = number
+        else:
+            self._wait_until(start + len(self.questions) * (self.period + self.skew))
+        with self._lock:
+            self.current = -1
+        text = 'The live quiz {} is over 🏁'.format(self.quiz.name)
+        # Only the answer of a sent question is revealed
+        if self.last_sent >= 0:
+            text += '\nThe answer to the last question was: {}'.format(
+                self.questions[self.last_sent].correct_answer)
+        self.fan_out(bot, '{}\n\n{}'.format(text, self.leaderboard.render()))
+        logger.info('Live quiz %s ended with %d players', self.code, len(self.leaderboard))
+
+    def fan_out(self, bot, text, reply_markup=None, number=None):
+        """
+        Sends a message to every chat, staggered to stay within the rate.
+
+        :param bot: Bot which sends the message.
+        :param text: Text of the message.
+        :param reply_markup: Optional keyboard of the message.
+        :param number: Index of the sent question, the time every chat got it is kept.
+        :returns: Seconds between the first and the last send.
+        """
+        interval = 1 / self.rate
+        first = time.monotonic()
+        for index, chat_id in enumerate(list(self.chats)):
+            self._wait_until(first + index * interval, stoppable=False)
+            if number is not None:
+                with self._lock:
+                    self._delivered[(chat_id, number)] = time.monotonic()
+            future = send(bot, chat_id, 'send_message', PROMPT, text=text,
+                          reply_markup=reply_markup)
+            if number is not None:
+                # The answer time of a chat starts when it got the question
+                future.add_done_callback(lambda _, key=(chat_id, number): self._mark(key))
+        return time.monotonic() - first
+
+    def stats(self):
+        """
+        Returns the state of the live quiz.
+
+        :returns: Dict with the chats, the players and the current question.
+        """
+        return {'chats': len(self.chats), 'players': len(self.leaderboard),
+                'question': self.current}
+
+    def _mark(self, key):
+        """Sets the time a chat got a question to now."""
+        with self._lock:
+            self._delivered[key] = time.monotonic()
+
+    def _wait_until(self, deadline, stoppable=True):
+        """
+        Sleeps until a time of the clock.
+
+        :returns: False if the live quiz was stopped meanwhile.
+        """
+        delay = deadline - time.monotonic()
+        if not stoppable:
+            if delay > 0:
+                time.sleep(delay)
+            return True
+        return not self._stopped.wait(max(0.0, delay))
+
+
+# Open and running live quizzes by code
+sessions = dict()
+_sessions_lock = threading.Lock()
+
+# Settings of new live quizzes, set by the bot. Live quizzes are disabled in a cluster
+settings = {'period': 20.0, 'skew': 5.0, 'rate': 20.0, 'enabled': True}
+
+# Messages per second shared by all running live quizzes, set by the bot
+budget = RateBudget(settings['rate'])
+
+# Seconds after which a live quiz which wasn't started is closed
+OPEN_SECONDS = 3600.0
+
+
+def new_code():
+    """Returns an unused code for a live quiz."""
+    while True:
+        code = ''.join(random.choice(CODE_ALPHABET) for _ in range(CODE_LENGTH))
+        if code not in sessions:
+            return code
+
+
+def find_session(update, context):
+    """
+    Returns the live quiz named by the argument of a command.
+
+    :returns: Instance of the class LiveQuiz or None.
+    """
+    if not context.args:
+        reply(update, 'Please add the code of the live quiz to the command.')
+        return None
+    session = sessions.get(context.args[0].upper())
+    if session is None:
+        reply(update, "I couldn't find the live quiz {} 😕".format(context.args[0]))
+    return session
+
+
+def host(update, context):
+    """Opens a live quiz, the quiz follows the command."""
+    user = update.effective_user
+    if not settings['enabled']:
+        reply(update, "Sorry, live quizzes aren't available on this bot 😕")
+        return
+    if not context.args:
+        reply(update, 'Please add the quiz name to the command, e.g. /live Capitals')
+        return
+    quiz_name, quiz_creator = parse_quiz_name(' '.join(context.args))
+    quiz = quiz_cache.get(quiz_name, quiz_creator)
+    if quiz is None:
+        reply(update, "Sorry, I couldn't find the quiz '{}' 😕".format(quiz_name))
+        return
+    with _sessions_lock:
+        session = LiveQuiz(new_code(), quiz, user.id, settings['period'], settings['skew'],
+                           settings['rate'], budget)
+        if not session.questions:
+            reply(update, "The quiz '{}' has no true/false or single choice questions, "
+                          "which can be played live 😕".format(quiz_name))
+            return
+        sessions[session.code] = session
+    session.join(update.effective_chat.id)
+    logger.info('[%s] Opened live quiz %s with %s', user.username, session.code, quiz_name)
+    reply(update, "The live quiz '{}' with {} questions is open 🔴\n"
+                  "Other chats join with /join {}, at most {} chats.\n"
+                  "Start it with /startLive {}.".format(
+                      quiz_name, len(session.questions), session.code, session.max_chats,
+                      session.code))
+
+
+def join(update, context):
+    """Adds the chat to a live quiz."""
+    session = find_session(update, context)
+    if session is None:
+        return
+    if session.join(update.effective_chat.id):
+        reply(update, "This chat plays the live quiz '{}' 🎉 The questions come when the host "
+                      "starts it.".format(session.quiz.name))
+    else:
+        reply(update, 'Sorry, the live quiz {} is full or already running 😕'.format(session.code))
+
+
+def start_live(update, context):
+    """Starts a live quiz of the host."""
+    session = find_session(update, context)
+    if session is None:
+        return
+    if session.host_id != update.effective_user.id or session.started:
+        reply(update, 'Only the host can start the live quiz, and only once.')
+        return
+    if not session.start(context.bot):
+        logger.info('[%s] Live quiz %s waits for the budget', update.effective_user.username,
+                    session.code)
+        reply(update, 'Too many live quizzes are running right now 😕 '
+                      'Please try again in a few minutes.')
+        return
+    logger.info('[%s] Started live quiz %s in %d chats', update.effective_user.username,
+                session.code, len(session.chats))
+
+
+def stop_live(update, context):
+    """Stops a live quiz of the host."""
+    session = find_session(update, context)
+    if session is None:
+        return
+    if session.host_id != update.effective_user.id:
+        reply(update, 'Only the host can stop the live quiz.')
+        return
+    if session.started:
+        session.stop()
+    else:
+        sessions.pop(session.code, None)
+        reply(update, 'I closed the live quiz {}.'.format(session.code))
+
+
+def show_leaderboard(update, context):
+    """Shows the leaderboard of a live quiz."""
+    session = find_session(update, context)
+    if session is not None:
+        reply(update, session.leaderboard.render())
+
+
+def answer(update, _):
+    """Counts a pressed answer button of a live quiz."""
+    query = update.callback_query
+    try:
+        code, number, position = query.data[len(CALLBACK_PREFIX):].split(':')
+        number, position = int(number, 16), int(position, 16)
+    except ValueError:
+        query.answer()
+        return
+    session = sessions.get(code)
+    if session is None:
+        query.answer('This live quiz is over 🏁')
+        return
+    user = query.from_user
+    query.answer(session.answer(user.id, user.username or user.first_name,
+                                query.message.chat_id, number, position))
+
+
+def expire_sessions(max_age=OPEN_SECONDS, now=None):
+    """
+    Closes the live quizzes which weren't started for a while.
+
+    :param max_age: Seconds since a live quiz was opened.
+    :param now: Current time of time.monotonic, by default now.
+    :returns: Number of closed live quizzes.
+    """
+    now = time.monotonic() if now is None else now
+    with _sessions_lock:
+        expired = [code for code, session in sessions.items()
+                   if not session.started and now - session.opened_at > max_age]
+        for code in expired:
+            del sessions[code]
+    if expired:
+        logger.info('Closed %d live quizzes which weren\'t started', len(expired))
+    return len(expired)
+
+
+def stats():
+    """
+    Returns the state of the live quizzes.
+
+    :returns: Dict with the number of live quizzes, chats, players and the reserved rate.
+    """
+    running = list(sessions.values())
+    return {'sessions': len(running),
+            'chats': sum(len(session.chats) for session in running),
+            'players': sum(len(session.leaderboard) for session in running),
+            'rate': budget.reserved}
@@ -0,0 +1,374 @@
+"""
+Metrics of the bot in the text format of Prometheus.
+
+Every handler is timed per conversation and state, the time spent in the database
+and in requests to the Bot API is measured separately, and the stats of the
+caches and queues are exported as gauges. Recording a metric is a dict lookup and
+an addition under a lock, so the metrics can stay on in production.
+
+The metrics are served on ``http://<host>:<METRICS_PORT>/metrics``.
+"""
+import bisect
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from telegram.ext import ConversationHandler
+from telegram.utils.request import Request
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the buckets of the histograms in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(names, values):
+    """Formats the labels of a sample, e.g. {state="ENTER_ANSWER"}."""
+    if not names:
+        return ''
+    pairs = ('{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"')
+                              .replace('\n', '\\n'))
+             for name, value in zip(names, values))
+    return '{' + ','.join(pairs) + '}'
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+class Counter:
+    """
+    An Instance of the class Counter counts events per combination of label values.
+    """
+
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labels=()) -> None:
+        """
+        Initializes an instance of the class Counter.
+
+        :param name: Name of the metric.
+        :param documentation: Help text of the metric.
+        :param labels: Names of the labels.
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = dict()
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        """
+        Increments the counter.
+
+        :param label_values: Values of the labels.
+        :param amount: Amount to add.
+        """
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values):
+        """Returns the count of the label values."""
+        return self._values.get(label_values, 0)
+
+    def samples(self):
+        """Returns the lines of the metric in the text format."""
+        with self._lock:
+            values = list(self._values.items())
+        return ['{}{} {}'.format(self.name, _format_labels(self.labels, label_values), value)
+                for label_values, value in values]
+
+
+class Histogram:
+    """
+    An Instance of the class Histogram counts observed durations in buckets
+    per combination of label values.
+    """
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS) -> None:
+        """
+        Initializes an instance of the class Histogram.
+
+        :param name: Name of the metric.
+        :param documentation: Help text of the metric.
+        :param labels: Names of the labels.
+        :param buckets: Sorted upper bounds of the buckets.
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._values = dict()
+        self._lock = threading.Lock()
+
+    def observe(self, seconds, *label_values):
+        """
+        Records a duration.
+
+        :param seconds: Observed duration.
+        :param label_values: Values of the labels.
+        """
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            values = self._values.get(label_values)
+            if values is None:
+                # Counts per bucket (the last one is +Inf), sum
+                values = self._values[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            values[0][index] += 1
+            values[1] += seconds
+
+    def count(self, *label_values):
+        """Returns the number of observations of the label values."""
+        values = self._values.get(label_values)
+        return sum(values[0]) if values else 0
+
+    def samples(self):
+        """Returns the lines of the metric in the text format."""
+        with self._lock:
+            values = [(label_values, list(counts), total)
+                      for label_values, (counts, total) in self._values.items()]
+        lines = []
+        for label_values, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                lines.append('{}_bucket{} {}'.format(
+                    self.name, _format_labels(self.labels + ('le',), label_values + (bound,)),
+                    cumulative))
+            labels = _format_labels(self.labels, label_values)
+            lines.append('{}_sum{} {}'.format(self.name, labels, total))
+            lines.append('{}_count{} {}'.format(self.name, labels, cumulative))
+        return lines
+
+
+class StatsGauges:
+    """
+    An Instance of the class StatsGauges exports the numbers of a stats() method as gauges.
+    """
+
+    kind = 'gauge'
+
+    def __init__(self, prefix, stats, label='index') -> None:
+        """
+        Initializes an instance of the class StatsGauges.
+
+        :param prefix: Prefix of the names of the gauges.
+        :param stats: Function which returns a dict of names and numbers or lists of numbers.
+        :param label: Name of the label of the position of a number in a list.
+        """
+        self.name = prefix
+        self.documentation = 'Stats of {}'.format(prefix)
+        self.stats = stats
+        self.label = label
+
+    def samples(self):
+        """Returns the lines of the gauges in the text format."""
+        lines = []
+        for key, value in self.stats().items():
+            if isinstance(value, (list, tuple)):
+                lines += ['{}_{}{} {}'.format(self.name, key,
+                                              _format_labels((self.label,), (index,)),
+                                              float(number))
+                          for index, number in enumerate(value) if _is_number(number)]
+            elif _is_number(value):
+                lines.append('{}_{} {}'.format(self.name, key, float(value)))
+        return lines
+
+
+class Registry:
+    """
+    An Instance of the class Registry holds the metrics of the bot.
+    """
+
+    def __init__(self) -> None:
+        """
+        Initializes an empty instance of the class Registry.
+        """
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        """
+        Adds a metric.
+
+        :param metric: Counter, Histogram or StatsGauges.
+        :returns: The metric.
+        """
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labels=()):
+        """Creates and adds a Counter."""
+        return self.register(Counter(name, documentation, labels))
+
+    def histogram(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        """Creates and adds a Histogram."""
+        return self.register(Histogram(name, documentation, labels, buckets))
+
+    def stats(self, prefix, stats, label='index'):
+        """Exports the numbers of a stats() method as gauges."""
+        return self.register(StatsGauges(prefix, stats, label))
+
+    def render(self):
+        """
+        Renders all metrics in the text format of Prometheus.
+
+        :returns: Metrics as string.
+        """
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            try:
+                samples = metric.samples()
+            except Exception as err:  # pylint: disable=broad-except
+                logger.warning('Collecting metric %s failed: %s', metric.name, err)
+                continue
+            if metric.kind != 'gauge':
+                lines.append('# HELP {} {}'.format(metric.name, metric.documentation))
+                lines.append('# TYPE {} {}'.format(metric.name, metric.kind))
+            lines += samples
+        return '\n'.join(lines) + '\n'
+
+
+# Metrics of the bot
+registry = Registry()
+handler_seconds = registry.histogram(
+    'quizbot_handler_seconds', 'Duration of the handlers', ('conversation', 'state'))
+handler_errors = registry.counter(
+    'quizbot_handler_errors_total', 'Exceptions raised by handlers', ('conversation', 'state'))
+conversations_ended = registry.counter(
+    'quizbot_conversations_ended_total', 'Conversations ended by a handler', ('conversation',))
+db_seconds = registry.histogram(
+    'quizbot_db_seconds', 'Duration of the database statements')
+telegram_seconds = registry.histogram(
+    'quizbot_telegram_seconds', 'Duration of the requests to the Bot API', ('method',))
+telegram_errors = registry.counter(
+    'quizbot_telegram_errors_total', 'Failed requests to the Bot API', ('method',))
+
+
+def timed(callback, conversation, state):
+    """
+    Wraps a handler callback to measure it.
+
+    :param callback: Callback of a handler.
+    :param conversation: Name of the conversation, '' for handlers outside of conversations.
+    :param state: Name of the state of the handler.
+    :returns: Wrapped callback.
+    """
+    def timed_callback(update, context):
+        start = time.perf_counter()
+        try:
+            result = callback(update, context)
+        except Exception:
+            handler_errors.inc(conversation, state)
+            raise
+        finally:
+            handler_seconds.observe(time.perf_counter() - start, conversation, state)
+        if result == ConversationHandler.END:
+            conversations_ended.inc(conversation)
+        return result
+
+    timed_callback.__wrapped__ = callback
+    return timed_callback
+
+
+def instrument_handlers(handlers):
+    """
+    Measures the callbacks of handlers. The handlers of a ConversationHandler are measured
+    per state, its entry points as 'entry' and its fallbacks as 'fallback'.
+
+    :param handlers: Handlers of the dispatcher.
+    """
+    for handler in handlers:
+        if isinstance(handler, ConversationHandler):
+            conversation = handler.name or 'conversation'
+            groups = [('entry', handler.entry_points), ('fallback', handler.fallbacks)]
+            groups += [(str(state), state_handlers)
+                       for state, state_handlers in handler.states.items()]
+            for state, state_handlers in groups:
+                for state_handler in state_handlers:
+                    _instrument(state_handler, conversation, state)
+        else:
+            _instrument(handler, '', getattr(handler.callback, '__name__', 'handler'))
+
+
+def _instrument(handler, conversation, state):
+    """Wraps the callback of a handler once."""
+    if not hasattr(handler.callback, '__wrapped__'):
+        handler.callback = timed(handler.callback, conversation, state)
+
+
+def _before_execute(_conn, _cursor, _statement, _parameters, context, _executemany):
+    # The start lives on the execution context, it's dropped with it if the statement fails
+    if context is not None:
+        context.quizbot_query_start = time.perf_counter()
+
+
+def _after_execute(_conn, _cursor, _statement, _parameters, context, _executemany):
+    start = getattr(context, 'quizbot_query_start', None)
+    if start is not None:
+        db_seconds.observe(time.perf_counter() - start)
+
+
+def instrument_database():
+    """Measures the statements of every SQLAlchemy engine."""
+    if not event.contains(Engine, 'before_cursor_execute', _before_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_execute)
+
+
+class InstrumentedRequest(Request):
+    """
+    Request of python-telegram-bot which measures every call of the Bot API per method.
+    """
+
+    def post(self, url, data, timeout=None):
+        method = url.rsplit('/', 1)[-1]
+        start = time.perf_counter()
+        try:
+            return super().post(url, data, timeout)
+        except Exception:
+            telegram_errors.inc(method)
+            raise
+        finally:
+            telegram_seconds.observe(time.perf_counter() - start, method)
+
+
+def start_metrics_server(port, listen='0.0.0.0'):
+    """
+    Serves the metrics on /metrics in a daemon thread.
+
+    :param port: Port to listen on.
+    :param listen: Address to listen on.
+    :returns: The HTTP server.
+    """
+    class MetricsHandler(BaseHTTPRequestHandler):
+        """Answers the requests of Prometheus."""
+
+        def do_GET(self):  # pylint: disable=invalid-name
+            """Sends the metrics."""
+            if self.path.split('?')[0] != '/metrics':
+                self.send_response(404)
+                self.end_headers()
+                return
+            body = registry.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *_):
+            """Scrapes aren't logged."""
+
+    server = ThreadingHTTPServer((listen, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics-httpd', daemon=True).start()
+    logger.info('Serving metrics on port %d', server.server_address[1])
+    return server
@@ -0,0 +1,309 @@
+"""
+Persistence of the conversation states and the user states of the bot in SQLite.
+
+Nothing is written while a message is handled. Changed conversation states and
+user states are only marked dirty and a background thread writes them in one
+transaction every few seconds (write-behind). After a restart, the state of a user
+is read the first time the user sends a message, not at startup.
+"""
+import logging
+import sqlite3
+import threading
+import time
+from telegram.ext import BasePersistence
+from quizbot.bot.user_state import ABSENT_LIMIT, decode_state, encode_key, encode_state
+
+logger = logging.getLogger(__name__)
+
+
+class LazyConversations(dict):
+    """
+    Dict of the conversation states of a ConversationHandler,
+    which loads the state of a conversation key when it's looked up the first time.
+    """
+
+    def __init__(self, persistence, name) -> None:
+        """
+        Initializes an instance of the class LazyConversations.
+
+        :param persistence: SQLitePersistence the states are loaded from.
+        :param name: Name of the ConversationHandler.
+        """
+        super().__init__()
+        self.persistence = persistence
+        self.name = name
+        self._checked = set()
+
+    def _load(self, key):
+        """Loads the state of a key once."""
+        if key in self._checked or dict.__contains__(self, key):
+            return
+        self._checked.add(key)
+        if len(self._checked) > ABSENT_LIMIT:
+            # Only ended conversations which aren't written yet have to be remembered
+            self._checked = self.persistence.dirty_conversations(self.name)
+        state = self.persistence.load_conversation(self.name, key)
+        if state is not None:
+            dict.__setitem__(self, key, state)
+
+    def get(self, key, default=None):
+        self._load(key)
+        return dict.get(self, key, default)
+
+    def __getitem__(self, key):
+        self._load(key)
+        return dict.__getitem__(self, key)
+
+    def __contains__(self, key):
+        self._load(key)
+        return dict.__contains__(self, key)
+
+    def __delitem__(self, key):
+        self._load(key)
+        dict.__delitem__(self, key)
+
+    def release(self):
+        """Drops the loaded states, they're loaded again when they're looked up."""
+        self.clear()
+        self._checked.clear()
+
+
+class SQLitePersistence(BasePersistence):
+    """
+    An Instance of the class SQLitePersistence stores the conversation states
+    and the user states of the bot in a SQLite database.
+    user_data, chat_data and bot_data of python-telegram-bot aren't stored, the handlers
+    keep their data in UserStateStores.
+    """
+
+    def __init__(self, path, stores=(), flush_interval=5.0) -> None:
+        """
+        Initializes an instance of the class SQLitePersistence.
+
+        :param path: Path of the SQLite database.
+        :param stores: UserStateStores to persist.
+        :param flush_interval: Seconds between two batches of writes.
+        """
+        super().__init__(store_user_data=False, store_chat_data=False, store_bot_data=False)
+        self.path = path
+        self.flush_interval = flush_interval
+        self.stores = list(stores)
+        self.writes = 0
+        self.batches = 0
+        self._conversations = dict()
+        self._dirty_conversations = dict()
+        # Conversation states of the batch being written
+        self._writing_conversations = dict()
+        # User states of a failed batch, keyed by the store and the encoded key
+        self._dirty_user_states = dict()
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        # Several processes of a cluster may share the database
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.executescript(
+            """CREATE TABLE IF NOT EXISTS conversations (
+                   name TEXT NOT NULL, key TEXT NOT NULL, state TEXT NOT NULL,
+                   updated_at REAL NOT NULL, PRIMARY KEY (name, key));
+               CREATE TABLE IF NOT EXISTS user_states (
+                   store TEXT NOT NULL, key TEXT NOT NULL, state TEXT NOT NULL,
+                   updated_at REAL NOT NULL, PRIMARY KEY (store, key));""")
+        for store in self.stores:
+            store.bind(self)
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Starts the thread which writes the dirty states periodically."""
+        self._thread = threading.Thread(target=self._run, name='persistence-flush', daemon=True)
+        self._thread.start()
+
+    def close(self):
+        """Writes the dirty states, stops the thread and closes the database."""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+        with self._db_lock:
+            self._db.close()
+
+    def get_user_data(self):
+        return dict()
+
+    def get_chat_data(self):
+        return dict()
+
+    def get_bot_data(self):
+        return dict()
+
+    def update_user_data(self, user_id, data):
+        pass
+
+    def update_chat_data(self, chat_id, data):
+        pass
+
+    def update_bot_data(self, data):
+        pass
+
+    def get_conversations(self, name):
+        """
+        Returns the conversation states of a ConversationHandler, which are loaded lazily.
+
+        :param name: Name of the ConversationHandler.
+        :returns: Instance of LazyConversations.
+        """
+        return self._conversations.setdefault(name, LazyConversations(self, name))
+
+    def update_conversation(self, name, key, new_state):
+        """
+        Marks the state of a conversation dirty. It's written with the next batch.
+
+        :param name: Name of the ConversationHandler.
+        :param key: Key of the conversation.
+        :param new_state: New state, None if the conversation ended.
+        """
+        with self._lock:
+            self._dirty_conversations[(name, key)] = new_state
+
+    def dirty_conversations(self, name):
+        """
+        Returns the conversations whose states aren't written yet.
+
+        :param name: Name of the ConversationHandler.
+        :returns: Set of the keys of the conversations.
+        """
+        with self._lock:
+            return {key for handler, key in list(self._dirty_conversations)
+                    + list(self._writing_conversations) if handler == name}
+
+    def load_conversation(self, name, key):
+        """
+        Reads the state of a conversation.
+
+        :param name: Name of the ConversationHandler.
+        :param key: Key of the conversation.
+        :returns: State or None if the conversation isn't running.
+        """
+        with self._db_lock:
+            row = self._db.execute('SELECT state FROM conversations WHERE name = ? AND key = ?',
+                                   (name, encode_key(key))).fetchone()
+        return None if row is None else decode_state(row[0])
+
+    def load_user_state(self, name, key):
+        """
+        Reads the state of a user.
+
+        :param name: Name of the UserStateStore.
+        :param key: Encoded key of the user.
+        :returns: Encoded state or None if the user has none.
+        """
+        with self._db_lock:
+            row = self._db.execute('SELECT state FROM user_states WHERE store = ? AND key = ?',
+                                   (name, key)).fetchone()
+        return None if row is None else row[0]
+
+    def flush(self):
+        """
+        Writes all dirty states in one transaction. If the transaction fails, the states
+        are written with the next batch, unless they changed again in the meantime.
+
+        :raises sqlite3.Error: If the states couldn't be written.
+        """
+        with self._lock:
+            conversations, self._dirty_conversations = self._dirty_conversations, dict()
+            self._writing_conversations = conversations
+            user_states, self._dirty_user_states = self._dirty_user_states, dict()
+        for store in self.stores:
+            for key, state in store.take_dirty():
+                user_states[(store.name, key)] = state
+        conversation_rows = [(name, encode_key(key), None if state is None else encode_state(state))
+                             for (name, key), state in conversations.items()]
+        user_rows = [(name, key, state) for (name, key), state in user_states.items()]
+        if not conversation_rows and not user_rows:
+            return
+
+        try:
+            with self._db_lock, self._db:
+                self._write(conversation_rows, 'conversations', 'name')
+                self._write(user_rows, 'user_states', 'store')
+        except Exception:
+            with self._lock:
+                for key, state in conversations.items():
+                    self._dirty_conversations.setdefault(key, state)
+                for key, state in user_states.items():
+                    self._dirty_user_states.setdefault(key, state)
+            logger.warning('Persisting %d states failed, retrying with the next batch',
+                           len(conversation_rows) + len(user_rows))
+            raise
+        finally:
+            with self._lock:
+                self._writing_conversations = dict()
+        self.writes += len(conversation_rows) + len(user_rows)
+        self.batches += 1
+        logger.debug('Persisted %d states', len(conversation_rows) + len(user_rows))
+
+    def release(self):
+        """
+        Writes the dirty states and drops all states from memory, e.g. before
+        another process of a cluster takes the users over. They're loaded again
+        from the database when they're used.
+
+        :returns: Number of dropped user states.
+        """
+        self.flush()
+        for conversations in self._conversations.values():
+            conversations.release()
+        return sum(store.release() for store in self.stores)
+
+    def stats(self):
+        """
+        Returns the counters of the persistence.
+
+        :returns: Dict with written states and batches.
+        """
+        return {'writes': self.writes, 'batches': self.batches}
+
+    def purge_user_states(self, name, max_age):
+        """
+        Deletes the persisted states of a store which weren't written for a while,
+        e.g. of users who never came back after a restart.
+
+        :param name: Name of the UserStateStore.
+        :param max_age: Seconds since the last write.
+        """
+        self._purge('user_states', 'store', name, max_age)
+
+    def purge_conversations(self, name, max_age):
+        """
+        Deletes the persisted conversation states which weren't written for a while.
+
+        :param name: Name of the ConversationHandler.
+        :param max_age: Seconds since the last write.
+        """
+        self._purge('conversations', 'name', name, max_age)
+
+    def _purge(self, table, owner, name, max_age):
+        """Deletes the rows of a store or conversation older than max_age."""
+        with self._db_lock, self._db:
+            self._db.execute('DELETE FROM {} WHERE {} = ? AND updated_at < ?'.format(table, owner),
+                             (name, time.time() - max_age))
+
+    def _write(self, rows, table, owner):
+        """Upserts the rows with a state and deletes the rows without one."""
+        now = time.time()
+        self._db.executemany(
+            'INSERT OR REPLACE INTO {} ({}, key, state, updated_at) VALUES (?, ?, ?, ?)'.format(
+                table, owner),
+            [row + (now,) for row in rows if row[2] is not None])
+        self._db.executemany(
+            'DELETE FROM {} WHERE {} = ? AND key = ?'.format(table, owner),
+            [row[:2] for row in rows if row[2] is None])
+
+    def _run(self):
+        """Thread target: writes the dirty states until the persistence is closed."""
+        while not self._stop_event.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception:  # pylint: disable=broad-except
+                logger.exception('Persisting the states failed')
+
@@ -0,0 +1,164 @@
+"""
+Module with methods to send the results of an attempt as one paginated message.
+
+The results of all questions are packed into pages of at most 4096 characters,
+the limit of a Telegram message. If enabled, the first page starts with a summary of
+the score.
+If there is more than one page, the user turns the pages with inline buttons,
+which edit the message in place.
+"""
+import logging
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from quizbot.bot.send_queue import BULK, message_length, send
+from quizbot.bot.user_state import UserStateStore
+
+logger = logging.getLogger(__name__)
+
+# Maximum length of a Telegram message
+MESSAGE_LIMIT = 4096
+
+# Prefix of the callback data of the page buttons
+CALLBACK_PREFIX = 'results:'
+
+# Whether the results start with a summary of the score, set by the bot
+show_summary = False
+
+# Pages of the sent reports by user ID and message ID, kept for a day
+reports = UserStateStore('results', idle_ttl=24 * 3600, max_entries=10000)
+
+
+def summarize(user_points):
+    """
+    Summarizes the score of an attempt.
+
+    :param user_points: List of pairs of whether the answer was correct and the question.
+    :returns: Summary as string.
+    """
+    correct = sum(1 for is_correct, _ in user_points if is_correct)
+    total = len(user_points)
+    return 'You answered {} of {} questions correctly ({:.0f} %) {}'.format(
+        correct, total, 100 * correct / total if total else 0,
+        '🏆' if correct == total else '💪')
+
+
+def results_header(user_points, text=''):
+    """
+    Returns the header of the results: a text and, if enabled, the summary of the score.
+
+    :param user_points: List of pairs of whether the answer was correct and the question.
+    :param text: Text the header starts with.
+    :returns: Header as string.
+    """
+    if not show_summary:
+        return text
+    return '{}\n\n{}'.format(text, summarize(user_points)) if text else summarize(user_points)
+
+
+def render_results(user_points):
+    """
+    Renders the result of every question.
+
+    :param user_points: List of pairs of whether the answer was correct and the question.
+    :returns: List of the results as strings.
+    """
+    return ['Question {}: {}\n{}'.format(
+        number, '✅' if is_correct else '❌',
+        question.question if is_correct else '{}\nThe correct answer is: {}'.format(
+            question.question, question.correct_answer))
+        for number, (is_correct, question) in enumerate(user_points, 1)]
+
+
+def paginate(blocks, header='', limit=MESSAGE_LIMIT, footer_size=20):
+    """
+    Packs blocks of text into as few pages as possible.
+    A block which doesn't fit on a page by itself is split.
+
+    :param blocks: List of strings, separated by an empty line on a page.
+    :param header: Text at the start of the first page.
+    :param limit: Maximum length of a page.
+    :param footer_size: Length reserved on every page for a page number.
+    :returns: List of pages as strings.
+    """
+    limit -= footer_size
+    pages = []
+    page = header
+    for block in blocks:
+        candidate = page + '\n\n' + block if page else block
+        if message_length(candidate) <= limit:
+            page = candidate
+            continue
+        if page:
+            pages.append(page)
+        while message_length(block) > limit:
+            # Characters outside the BMP count twice, so the cut may be shorter than the limit
+            cut = limit
+            while message_length(block[:cut]) > limit:
+                cut -= 1
+            pages.append(block[:cut])
+            block = block[cut:]
+        page = block
+    if page or not pages:
+        pages.append(page)
+    return pages
+
+
+def page_markup(page, page_count):
+    """
+    Creates the inline buttons to turn the pages.
+
+    :param page: Index of the shown page.
+    :param page_count: Number of pages.
+    :returns: InlineKeyboardMarkup or None if there is one page.
+    """
+    if page_count <= 1:
+        return None
+    buttons = []
+    if page > 0:
+        buttons.append(InlineKeyboardButton('◀️', callback_data=CALLBACK_PREFIX + str(page - 1)))
+    if page < page_count - 1:
+        buttons.append(InlineKeyboardButton('▶️', callback_data=CALLBACK_PREFIX + str(page + 1)))
+    return InlineKeyboardMarkup([buttons])
+
+
+def page_text(pages, page):
+    """Returns the text of a page with its page number if there is more than one page."""
+    if len(pages) == 1:
+        return pages[0]
+    return '{}\n\n📄 {}/{}'.format(pages[page], page + 1, len(pages))
+
+
+def send_results(bot, chat_id, user, user_points):
+    """
+    Sends the results of an attempt as one message, paginated if necessary.
+
+    :param bot: Bot which sends the results.
+    :param chat_id: ID of the chat of the attempt.
+    :param user: User who attempted the quiz.
+    :param user_points: List of pairs of whether the answer was correct and the question.
+    """
+    pages = paginate(render_results(user_points), results_header(user_points))
+    future = send(bot, chat_id, 'send_message', BULK, text=page_text(pages, 0),
+                  reply_markup=page_markup(0, len(pages)))
+
+    def sent(done):
+        # The ID of the message is needed to turn its pages, the handler doesn't wait for it
+        if done.exception() is not None:
+            logger.warning('[%s] Sending the results failed: %s', user.username, done.exception())
+            return
+        if len(pages) > 1:
+            reports[(user.id, done.result().message_id)] = pages
+        logger.info('[%s] Sent results on %d pages', user.username, len(pages))
+
+    future.add_done_callback(sent)
+
+
+def turn_page(update, _):
+    """Shows another page of the results after a page button was pressed."""
+    query = update.callback_query
+    pages = reports.get((query.from_user.id, query.message.message_id))
+    if pages is None:
+        query.answer("These results aren't available anymore 😕")
+        return
+    page = min(max(int(query.data[len(CALLBACK_PREFIX):]), 0), len(pages) - 1)
+    query.edit_message_text(page_text(pages, page), reply_markup=page_markup(page, len(pages)))
+    query.answer()
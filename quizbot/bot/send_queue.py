@@ -0,0 +1,404 @@
+"""
+Shared outbound queue for the messages of the bot.
+
+Telegram allows about one message per second to a chat and about 30 messages per second
+overall. Messages sent faster are answered with 429 (RetryAfter). The scheduler queues
+every outgoing request and a small pool of threads sends them while pacing every chat
+and the whole bot with token buckets:
+
+* The requests to a chat are sent in the order they were queued. A chat has at most one
+  request in flight, so a slow request or a paused chat doesn't hold up the other chats.
+* Among the chats which may get a message, the one whose next request has the highest
+  priority goes first, so question prompts overtake bulk reports of other users.
+* Texts queued for the same chat are coalesced into one message if they fit.
+* An edit of a message which is queued behind an edit of the same message replaces it,
+  only the latest content is sent.
+* If Telegram answers with RetryAfter, the chat pauses for the given time and
+  the request is sent again.
+"""
+import heapq
+import itertools
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from telegram.error import RetryAfter
+
+logger = logging.getLogger(__name__)
+
+# Priorities of the requests, lower ones are sent first
+PROMPT = 0
+NORMAL = 1
+BULK = 2
+
+# Maximum length of a coalesced message
+MESSAGE_LIMIT = 4096
+
+# Methods which edit a sent message
+EDIT_METHODS = ('edit_message_text', 'edit_message_reply_markup')
+
+
+def message_length(text):
+    """
+    Returns the length of a text as Telegram counts it (UTF-16 code units).
+
+    :param text: Text of a message.
+    :returns: Length of the text.
+    """
+    return len(text.encode('utf-16-le')) // 2
+
+
+class TokenBucket:
+    """
+    An Instance of the class TokenBucket allows a rate of events with bursts up to its capacity.
+    """
+
+    def __init__(self, rate, capacity=None) -> None:
+        """
+        Initializes an instance of the class TokenBucket. It starts full.
+
+        :param rate: Tokens added per second.
+        :param capacity: Maximum number of tokens, the rate if None.
+        """
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+
+    def delay(self, now):
+        """
+        Returns the seconds until a token is available.
+
+        :param now: Current time of time.monotonic.
+        """
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        """Takes a token, delay has to be 0 before."""
+        self.tokens -= 1
+
+
+class _Request:
+    """A queued request of the Bot API."""
+
+    __slots__ = ('method', 'kwargs', 'priority', 'queued_at', 'futures')
+
+    def __init__(self, method, kwargs, priority):
+        self.method = method
+        self.kwargs = kwargs
+        self.priority = priority
+        self.queued_at = time.monotonic()
+        self.futures = [Future()]
+
+
+class OutboundScheduler:
+    """
+    An Instance of the class OutboundScheduler sends the requests of the bot
+    with a rate limit per chat and for the whole bot.
+    """
+
+    def __init__(self, chat_rate=1.0, global_rate=30.0, workers=8) -> None:
+        """
+        Initializes an instance of the class OutboundScheduler.
+
+        :param chat_rate: Messages per second to one chat.
+        :param global_rate: Messages per second to all chats.
+        :param workers: Number of threads which send requests at the same time.
+        """
+        self.workers = workers
+        self.chat_interval = 1 / chat_rate
+        self.bucket = TokenBucket(global_rate)
+        self.bot = None
+        self.sent = 0
+        self.coalesced = 0
+        self.retries = 0
+        self.failed = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+        self._queues = dict()
+        self._chat_ready_at = dict()
+        self._ready = []
+        self._waiting = []
+        self._order = itertools.count()
+        self._depth = 0
+        self._condition = threading.Condition()
+        self._running = False
+        self._threads = []
+
+    @property
+    def running(self):
+        """Whether the scheduler sends the queued requests."""
+        return self._running
+
+    def start(self, bot, global_rate=None):
+        """
+        Starts the threads which send the requests.
+
+        :param bot: Bot which sends the requests.
+        :param global_rate: Messages per second to all chats, e.g. the share of a worker
+            of a cluster. None keeps the rate of the scheduler.
+        """
+        if global_rate is not None:
+            self.bucket = TokenBucket(global_rate)
+        self.bot = bot
+        self._running = True
+        self._threads = [threading.Thread(target=self._run, name='outbound-queue-{}'.format(number),
+                                          daemon=True)
+                         for number in range(self.workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self, timeout=10.0):
+        """
+        Sends the queued requests and stops the threads.
+
+        :param timeout: Maximum seconds to wait for the queued requests.
+        """
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while self._depth and time.monotonic() < deadline:
+                self._condition.wait(0.1)
+            self._running = False
+            self._condition.notify_all()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        if self._depth:
+            logger.warning('Stopped outbound queue with %d unsent requests', self._depth)
+
+    def send(self, chat_id, method, priority=NORMAL, **kwargs):
+        """
+        Queues a request of the Bot API to a chat.
+
+        :param chat_id: ID of the chat.
+        :param method: Name of the method of the bot, e.g. 'send_message'.
+        :param priority: PROMPT, NORMAL or BULK.
+        :param kwargs: Arguments of the method besides the chat ID.
+        :returns: Future of the result of the method.
+        """
+        request = _Request(method, dict(kwargs, chat_id=chat_id), priority)
+        with self._condition:
+            queue = self._queues.get(chat_id)
+            if queue is None:
+                queue = self._queues[chat_id] = deque()
+                self._schedule(chat_id, request)
+            queue.append(request)
+            self._depth += 1
+            self._condition.notify()
+        return request.futures[0]
+
+    def stats(self):
+        """
+        Returns the state of the queue.
+
+        :returns: Dict with the queue depth, the number of sent, coalesced, retried and
+            failed requests and the average and maximum seconds a request waited.
+        """
+        return {
+            'queue_depth': self._depth,
+            'waiting_chats': len(self._queues),
+            'sent': self.sent,
+            'coalesced': self.coalesced,
+            'retries': self.retries,
+            'failed': self.failed,
+            'wait_time_avg': self.wait_time_total / self.sent if self.sent else 0.0,
+            'wait_time_max': self.wait_time_max,
+        }
+
+    def _schedule(self, chat_id, head):
+        """Puts a chat into the ready or waiting heap by its next request."""
+        ready_at = self._chat_ready_at.get(chat_id, 0.0)
+        if ready_at <= time.monotonic():
+            heapq.heappush(self._ready, (head.priority, next(self._order), chat_id))
+        else:
+            heapq.heappush(self._waiting, (ready_at, next(self._order), chat_id))
+
+    def _next_chat(self):
+        """
+        Waits until a chat may get its next request and the global bucket has a token.
+        The chat leaves the heaps until its request is finished, so no other thread
+        sends to it meanwhile.
+
+        :returns: ID of the chat or None if the scheduler was stopped.
+        """
+        with self._condition:
+            while self._running:
+                now = time.monotonic()
+                while self._waiting and self._waiting[0][0] <= now:
+                    _, _, chat_id = heapq.heappop(self._waiting)
+                    heapq.heappush(self._ready, (self._queues[chat_id][0].priority,
+                                                 next(self._order), chat_id))
+                timeout = self._waiting[0][0] - now if self._waiting else None
+                if self._ready:
+                    delay = self.bucket.delay(now)
+                    if not delay:
+                        self.bucket.take()
+                        return heapq.heappop(self._ready)[2]
+                    timeout = delay if timeout is None else min(timeout, delay)
+                self._condition.wait(timeout)
+        return None
+
+    def _take(self, chat_id):
+        """
+        Removes the next request of a chat from its queue and coalesces the following texts
+        or edits into it.
+        """
+        with self._condition:
+            queue = self._queues[chat_id]
+            request = queue.popleft()
+            while queue and self._can_coalesce(request, queue[0]):
+                following = queue.popleft()
+                if following.method in EDIT_METHODS:
+                    # The later edit shows the latest content of the message
+                    request.method = following.method
+                    request.kwargs = following.kwargs
+                else:
+                    request.kwargs = dict(following.kwargs, text=request.kwargs['text']
+                                          + '\n\n' + following.kwargs['text'])
+                request.priority = min(request.priority, following.priority)
+                request.futures += following.futures
+                self.coalesced += 1
+            self._depth -= len(request.futures)
+            return request
+
+    @staticmethod
+    def _can_coalesce(request, following):
+        """Checks if a text can be appended to the text of a request or an edit replaces it."""
+        if request.method in EDIT_METHODS and following.method in EDIT_METHODS:
+            # Editing only the keyboard keeps the text of the earlier edit
+            return request.kwargs['message_id'] == following.kwargs['message_id'] \
+                and (following.method == 'edit_message_text'
+                     or request.method == 'edit_message_reply_markup')
+        if request.method != 'send_message' or following.method != 'send_message' \
+                or request.kwargs.get('reply_markup') is not None:
+            return False
+        others = {key: value for key, value in request.kwargs.items() if key != 'text'}
+        following_others = {key: value for key, value in following.kwargs.items()
+                             if key not in ('text', 'reply_markup')}
+        return others == following_others and message_length(request.kwargs['text']) \
+            + message_length(following.kwargs['text']) + 2 <= MESSAGE_LIMIT
+
+    def _finish(self, chat_id, request=None):
+        """
+        Paces the chat after a request and schedules its next one.
+
+        :param request: Request to send again first, None if it was sent or failed.
+        """
+        with self._condition:
+            queue = self._queues[chat_id]
+            if request is not None:
+                queue.appendleft(request)
+                self._depth += len(request.futures)
+            elif self._chat_ready_at.get(chat_id, 0.0) < time.monotonic() + self.chat_interval:
+                self._chat_ready_at[chat_id] = time.monotonic() + self.chat_interval
+            if queue:
+                self._schedule(chat_id, queue[0])
+            else:
+                del self._queues[chat_id]
+                self._prune()
+            self._condition.notify_all()
+
+    def _prune(self):
+        """Forgets the pacing of chats which may get a message again."""
+        if len(self._chat_ready_at) > 10 * len(self._queues) + 1000:
+            now = time.monotonic()
+            self._chat_ready_at = {chat_id: ready_at for chat_id, ready_at
+                                   in self._chat_ready_at.items() if ready_at > now}
+
+    def _run(self):
+        """Thread target: sends the queued requests until the scheduler is stopped."""
+        while True:
+            chat_id = self._next_chat()
+            if chat_id is None:
+                break
+            request = self._take(chat_id)
+            try:
+                result = getattr(self.bot, request.method)(**request.kwargs)
+            except RetryAfter as err:
+                logger.warning('Chat %s is paused for %s seconds', chat_id, err.retry_after)
+                with self._condition:
+                    self.retries += 1
+                    self._chat_ready_at[chat_id] = time.monotonic() + err.retry_after
+                self._finish(chat_id, request)
+                continue
+            except Exception as err:  # pylint: disable=broad-except
+                logger.warning('Sending %s to chat %s failed: %s', request.method, chat_id, err)
+                with self._condition:
+                    self.failed += 1
+                for future in request.futures:
+                    future.set_exception(err)
+                self._finish(chat_id)
+                continue
+
+            waited = time.monotonic() - request.queued_at
+            with self._condition:
+                self.sent += 1
+                self.wait_time_total += waited
+                self.wait_time_max = max(self.wait_time_max, waited)
+            for future in request.futures:
+                future.set_result(result)
+            self._finish(chat_id)
+
+
+# Queue shared by the handlers of the bot
+outbound = OutboundScheduler()
+
+
+def reply(update, text, priority=NORMAL, **kwargs):
+    """
+    Sends a text to the chat of an update through the outbound queue.
+    If the queue isn't started, e.g. in tests, the text is sent directly.
+
+    :param update: Update to reply to.
+    :param text: Text of the message.
+    :param priority: PROMPT, NORMAL or BULK.
+    :param kwargs: Further arguments of send_message, e.g. reply_markup.
+    :returns: Future of the sent message.
+    """
+    if not outbound.running:
+        future = Future()
+        future.set_result(update.effective_message.reply_text(text, **kwargs))
+        return future
+    return outbound.send(update.effective_chat.id, 'send_message', priority, text=text, **kwargs)
+
+
+def send(bot, chat_id, method, priority=NORMAL, **kwargs):
+    """
+    Sends a request of the Bot API to a chat through the outbound queue, e.g. to a user
+    of an update without a message. If the queue isn't started, it's sent directly.
+
+    :param bot: Bot which sends the request.
+    :param chat_id: ID of the chat.
+    :param method: Name of the method of the bot, e.g. 'send_poll'.
+    :param priority: PROMPT, NORMAL or BULK.
+    :param kwargs: Arguments of the method besides the chat ID.
+    :returns: Future of the result of the method.
+    """
+    if not outbound.running:
+        future = Future()
+        future.set_result(getattr(bot, method)(chat_id=chat_id, **kwargs))
+        return future
+    return outbound.send(chat_id, method, priority, **kwargs)
+
+
+def edit(bot, chat_id, message_id, text=None, priority=NORMAL, **kwargs):
+    """
+    Edits a message of the bot through the outbound queue.
+    If the queue isn't started, e.g. in tests, the message is edited directly.
+
+    :param bot: Bot which sent the message.
+    :param chat_id: ID of the chat of the message.
+    :param message_id: ID of the message.
+    :param text: New text of the message, None to edit only its keyboard.
+    :param priority: PROMPT, NORMAL or BULK.
+    :param kwargs: Further arguments of the edit, e.g. reply_markup.
+    :returns: Future of the edited message.
+    """
+    if text is None:
+        return send(bot, chat_id, 'edit_message_reply_markup', priority,
+                    message_id=message_id, **kwargs)
+    return send(bot, chat_id, 'edit_message_text', priority, message_id=message_id, text=text,
+                **kwargs)
@@ -0,0 +1,154 @@
+"""
+Dispatcher which processes the updates of many users concurrently on worker threads.
+
+The dispatcher of python-telegram-bot v12 processes one update after the other,
+so every DB call and every message sent by a handler keeps all other users waiting.
+The sharded dispatcher takes the updates over: the update of a user is hashed to a
+shard. Every shard has its own queue and one thread which processes the updates of
+the queue one after the other, so the updates of a user are processed strictly in
+order and never at the same time, while the shards work in parallel. The handlers
+stay synchronous, a slow DB call or Telegram request only blocks the users of its
+shard, and the queue of every shard can be watched.
+"""
+import itertools
+import logging
+import queue
+import threading
+import zlib
+
+logger = logging.getLogger(__name__)
+
+# Put into the queue of a shard to stop its thread
+_STOP = object()
+
+
+def update_key(update):
+    """
+    Returns the key by which the updates are ordered: the user, else the chat of the update.
+
+    :param update: Received update.
+    :returns: ID of the user or chat, None if the update has neither.
+    """
+    user = getattr(update, 'effective_user', None)
+    if user is not None:
+        return user.id
+    chat = getattr(update, 'effective_chat', None)
+    if chat is not None:
+        return chat.id
+    return None
+
+
+class ShardedDispatcher:
+    """
+    An Instance of the class ShardedDispatcher processes the updates of a dispatcher
+    on worker threads, each one responsible for a fixed share of the users.
+    """
+
+    def __init__(self, dispatcher, shards=64, max_pending=10000, key=update_key) -> None:
+        """
+        Initializes an instance of the class ShardedDispatcher.
+
+        :param dispatcher: Dispatcher whose handlers process the updates.
+        :param shards: Number of worker threads.
+        :param max_pending: Maximum number of waiting updates of all shards.
+            Further submits to a full shard wait, so the receiver is pushed back.
+        :param key: Function which returns the key of an update. Updates with the same
+            key go to the same shard, updates with the key None to any shard.
+        """
+        self.dispatcher = dispatcher
+        self.key = key
+        self.shards = shards
+        self._process_update = dispatcher.process_update
+        self._queues = [queue.Queue(maxsize=max(1, max_pending // shards))
+                        for _ in range(shards)]
+        self._processed = [0] * shards
+        self._round_robin = itertools.count()
+        self._threads = []
+
+    def shard_of(self, update):
+        """
+        Returns the shard of an update.
+
+        :param update: Received update.
+        :returns: Index of the shard.
+        """
+        key = self.key(update)
+        if key is None:
+            return next(self._round_robin) % self.shards
+        # CRC32 spreads IDs with a common remainder over all shards
+        return zlib.crc32(str(key).encode('ascii')) % self.shards
+
+    def start(self):
+        """Starts the worker threads."""
+        for shard in range(self.shards):
+            thread = threading.Thread(target=self._run, args=(shard,),
+                                      name='shard-{}'.format(shard), daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def install(self):
+        """
+        Starts the workers and lets them process every update passed to the dispatcher,
+        whether the updates are polled or received by the webhook.
+        """
+        if not self._threads:
+            self.start()
+        self.dispatcher.process_update = self.submit
+
+    def stop(self, timeout=None):
+        """
+        Waits until the queued updates are processed and stops the workers.
+
+        :param timeout: Maximum seconds to wait for every worker.
+        """
+        if self.dispatcher.process_update == self.submit:
+            self.dispatcher.process_update = self._process_update
+        for shard_queue in self._queues:
+            shard_queue.put(_STOP)
+        for thread in self._threads:
+            thread.join(timeout)
+        pending = self.stats()['pending']
+        if pending:
+            logger.warning('Stopped sharded dispatcher with %d pending updates', pending)
+        self._threads = []
+
+    def submit(self, update):
+        """
+        Queues an update at its shard and returns without waiting for it to be processed.
+        Waits if the queue of the shard is full.
+
+        :param update: Received update.
+        """
+        self._queues[self.shard_of(update)].put(update)
+
+    def stats(self):
+        """
+        Returns the state of the shards.
+
+        :returns: Dict with the processed and waiting updates in total and per shard.
+        """
+        depths = [shard_queue.qsize() for shard_queue in self._queues]
+        return {
+            'processed': sum(self._processed),
+            # Waiting and running updates
+            'pending': sum(shard_queue.unfinished_tasks for shard_queue in self._queues),
+            'queue_depth_max': max(depths),
+            'queue_depth': depths,
+            'shard_processed': list(self._processed),
+        }
+
+    def _run(self, shard):
+        """Thread target: processes the updates of a shard until it is stopped."""
+        shard_queue = self._queues[shard]
+        while True:
+            update = shard_queue.get()
+            if update is _STOP:
+                shard_queue.task_done()
+                break
+            try:
+                self._process_update(update)
+            except Exception:  # pylint: disable=broad-except
+                logger.exception('Processing update %s failed',
+                                 getattr(update, 'update_id', None))
+            self._processed[shard] += 1
+            shard_queue.task_done()
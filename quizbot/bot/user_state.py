@@ -0,0 +1,382 @@
+"""
+With this module, the handlers keep the state of their users, e.g. a half-built quiz
+or a running attempt, in a store which can be persisted.
+
+A UserStateStore behaves like the dicts the handlers used before. Every entry which is
+set or read is marked dirty, because the handlers change the stored objects in place.
+A persistence writes the dirty entries in batches (write-behind) and the store restores
+an entry from the persistence the first time it's used after a restart.
+Entries of users who walked away expire, so the store doesn't grow forever.
+
+The entries are encoded as JSON. Quizzes, questions and attempts are stored with
+the fields of their instances, so the state survives without pickle.
+"""
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from quizbot.quiz.attempt import Attempt
+from quizbot.quiz.question_factory import QUESTION_TYPES
+from quizbot.quiz.quiz import Quiz
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of keys a store remembers as missing in the persistence
+ABSENT_LIMIT = 100000
+
+# Classes whose instances can be stored
+STATE_CLASSES = dict(QUESTION_TYPES, Quiz=Quiz, Attempt=Attempt)
+
+
+def encode_state(value):
+    """
+    Encodes the state of a user as JSON. An object referenced several times is encoded once.
+
+    :param value: State made of dicts, lists, tuples, sets, strings, numbers, None,
+        instances and classes of STATE_CLASSES.
+    :returns: Encoded state as string.
+    :raises TypeError: If the state contains other types.
+    """
+    return json.dumps(_encode(value, dict()), separators=(',', ':'))
+
+
+def decode_state(data):
+    """
+    Decodes a state encoded by encode_state.
+
+    :param data: Encoded state as string.
+    :returns: Decoded state.
+    :raises ValueError: If the data isn't an encoded state.
+    """
+    try:
+        return _decode(json.loads(data), dict())
+    except (KeyError, TypeError) as err:
+        raise ValueError('Data is not an encoded state') from err
+
+
+def encode_key(key):
+    """
+    Encodes the key of a state, e.g. a user ID, a username or a conversation key.
+
+    :param key: Key as string, number or tuple of them.
+    :returns: Encoded key as string.
+    """
+    return json.dumps(key)
+
+
+def decode_key(data):
+    """
+    Decodes a key encoded by encode_key.
+
+    :param data: Encoded key as string.
+    :returns: Key, lists are turned back into tuples.
+    """
+    key = json.loads(data)
+    return tuple(key) if isinstance(key, list) else key
+
+
+def _encode(value, seen):
+    """Encodes a value to JSON types, see encode_state."""
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, list):
+        return [_encode(item, seen) for item in value]
+    if isinstance(value, tuple):
+        return {'$tuple': [_encode(item, seen) for item in value]}
+    if isinstance(value, (set, frozenset)):
+        return {'$set': [_encode(item, seen) for item in value]}
+    if isinstance(value, dict):
+        return {'$dict': [[_encode(key, seen), _encode(item, seen)]
+                          for key, item in value.items()]}
+    if isinstance(value, type) and STATE_CLASSES.get(value.__name__) is value:
+        return {'$class': value.__name__}
+    if STATE_CLASSES.get(type(value).__name__) is type(value):
+        if id(value) in seen:
+            return {'$ref': seen[id(value)]}
+        seen[id(value)] = len(seen)
+        return {'$obj': type(value).__name__, 'id': seen[id(value)],
+                'fields': {name: _encode(field, seen) for name, field in vars(value).items()}}
+    raise TypeError("Can't store {} in the state of a user".format(type(value).__name__))
+
+
+def _decode(value, seen):
+    """Decodes a value encoded by _encode."""
+    if isinstance(value, list):
+        return [_decode(item, seen) for item in value]
+    if not isinstance(value, dict):
+        return value
+    if '$tuple' in value:
+        return tuple(_decode(item, seen) for item in value['$tuple'])
+    if '$set' in value:
+        return {_decode(item, seen) for item in value['$set']}
+    if '$dict' in value:
+        return {_decode(key, seen): _decode(item, seen) for key, item in value['$dict']}
+    if '$class' in value:
+        return STATE_CLASSES[value['$class']]
+    if '$ref' in value:
+        return seen[value['$ref']]
+    # Instances are restored without running their validations again
+    cls = STATE_CLASSES[value['$obj']]
+    instance = cls.__new__(cls)
+    seen[value['id']] = instance
+    for name, field in value['fields'].items():
+        setattr(instance, name, _decode(field, seen))
+    return instance
+
+
+class UserStateStore(MutableMapping):
+    """
+    An Instance of the class UserStateStore maps users to their state.
+    Without a persistence it's a dict in memory.
+    Entries which weren't used for idle_ttl seconds expire and if the store has more than
+    max_entries entries, the least recently used ones are evicted.
+    """
+
+    def __init__(self, name, idle_ttl=None, max_entries=None, on_expire=None) -> None:
+        """
+        Initializes an instance of the class UserStateStore.
+
+        :param name: Name of the store, unique per persistence.
+        :param idle_ttl: Seconds after which an unused entry expires, None to keep entries.
+        :param max_entries: Maximum number of entries in memory, None for no limit.
+        :param on_expire: Function called with the key, the state and the reason
+            ('expired' or 'evicted') of every removed entry, e.g. to notify the user.
+        """
+        self.name = name
+        self.idle_ttl = idle_ttl
+        self.max_entries = max_entries
+        self.on_expire = on_expire
+        self.persistence = None
+        self.expired = 0
+        self.evicted = 0
+        self._data = OrderedDict()
+        self._used = dict()
+        self._absent = set()
+        self._dirty = set()
+        self._releases = 0
+        self._lock = threading.RLock()
+
+    def bind(self, persistence):
+        """
+        Persists the store. Entries are restored from the persistence when they're used.
+
+        :param persistence: Persistence with the methods load_user_state(name, key)
+            and purge_user_states(name, max_age).
+        """
+        self.persistence = persistence
+
+    def __getitem__(self, key):
+        removed = []
+        loaded = self._fetch(key)
+        try:
+            with self._lock:
+                self._lookup(key, removed, loaded)
+                value = self._data[key]
+                self._touch(key)
+                return value
+        finally:
+            self._notify(removed)
+
+    def __setitem__(self, key, value):
+        removed = []
+        with self._lock:
+            self._data[key] = value
+            self._absent.discard(key)
+            self._touch(key)
+            while self.max_entries is not None and len(self._data) > self.max_entries:
+                removed.append(self._remove(next(iter(self._data)), 'evicted'))
+        self._notify(removed)
+
+    def __delitem__(self, key):
+        removed = []
+        loaded = self._fetch(key)
+        try:
+            with self._lock:
+                self._lookup(key, removed, loaded)
+                del self._data[key]
+                del self._used[key]
+                self._forget(key)
+                self._mark_dirty(key)
+        finally:
+            self._notify(removed)
+
+    def __contains__(self, key):
+        removed = []
+        loaded = self._fetch(key)
+        try:
+            with self._lock:
+                self._lookup(key, removed, loaded)
+                return True
+        except KeyError:
+            return False
+        finally:
+            self._notify(removed)
+
+    def __iter__(self):
+        """Iterates over the entries in memory, not over the persisted ones."""
+        return iter(list(self._data))
+
+    def __len__(self):
+        """Counts the entries in memory, not the persisted ones."""
+        return len(self._data)
+
+    def expire(self):
+        """
+        Removes the entries which weren't used for idle_ttl seconds,
+        from memory and from the persistence.
+
+        :returns: Number of removed entries.
+        """
+        if self.idle_ttl is None:
+            return 0
+        removed = []
+        deadline = time.monotonic() - self.idle_ttl
+        with self._lock:
+            # The entries are ordered by their last use
+            while self._data:
+                key = next(iter(self._data))
+                if self._used[key] > deadline:
+                    break
+                removed.append(self._remove(key, 'expired'))
+        self._notify(removed)
+        if self.persistence is not None:
+            self.persistence.purge_user_states(self.name, self.idle_ttl)
+        return len(removed)
+
+    def stats(self):
+        """
+        Returns the state of the store.
+
+        :returns: Dict with the number of live, expired and evicted entries.
+        """
+        return {'entries': len(self._data), 'expired': self.expired, 'evicted': self.evicted}
+
+    def release(self):
+        """
+        Drops the entries from memory without removing them from the persistence,
+        e.g. before another process takes the users over. The dirty entries have to be
+        written before. The entries are restored when they're used again.
+
+        :returns: Number of dropped entries.
+        """
+        with self._lock:
+            count = len(self._data)
+            self._data.clear()
+            self._used.clear()
+            self._absent.clear()
+            self._releases += 1
+        return count
+
+    def take_dirty(self):
+        """
+        Returns the changed entries since the last call and marks them clean.
+
+        :returns: List of pairs of the encoded key and the encoded state,
+            None as state if the entry was removed.
+        """
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            values = [(key, self._data.get(key)) for key in dirty]
+        entries = []
+        for key, value in values:
+            try:
+                entries.append((encode_key(key), None if value is None else encode_state(value)))
+            except (TypeError, RuntimeError):
+                # The state was changed while it was encoded, it's written with the next batch
+                with self._lock:
+                    self._dirty.add(key)
+        return entries
+
+    def _fetch(self, key):
+        """
+        Reads an entry which isn't in memory from the persistence, outside of the lock,
+        so a slow read doesn't block the other users of the store.
+
+        :returns: Pair of the number of releases before the read and the encoded state,
+            None if nothing was read.
+        """
+        with self._lock:
+            if self.persistence is None or key in self._data or key in self._absent:
+                return None
+            releases = self._releases
+        return releases, self.persistence.load_user_state(self.name, encode_key(key))
+
+    def _lookup(self, key, removed, loaded=None):
+        """
+        Makes sure that a used entry is in memory and not expired.
+
+        :param loaded: Result of _fetch for the key.
+        :raises KeyError: If the entry doesn't exist or expired.
+        """
+        if key not in self._data:
+            self._restore(key, loaded)
+        elif self.idle_ttl is not None \
+                and time.monotonic() - self._used[key] > self.idle_ttl:
+            removed.append(self._remove(key, 'expired'))
+            raise KeyError(key)
+
+    def _touch(self, key):
+        """Marks an entry as used now."""
+        self._data.move_to_end(key)
+        self._used[key] = time.monotonic()
+        self._mark_dirty(key)
+
+    def _mark_dirty(self, key):
+        """Marks an entry dirty if the store is persisted."""
+        if self.persistence is not None:
+            self._dirty.add(key)
+
+    def _remove(self, key, reason):
+        """Removes an expired or evicted entry and returns the arguments of on_expire."""
+        value = self._data.pop(key)
+        del self._used[key]
+        self._forget(key)
+        self._mark_dirty(key)
+        if reason == 'expired':
+            self.expired += 1
+        else:
+            self.evicted += 1
+        return key, value, reason
+
+    def _forget(self, key):
+        """
+        Remembers that an entry doesn't exist, so it isn't looked up in the persistence.
+        Only removals which aren't written yet have to be remembered if there are too many.
+        """
+        if self.persistence is None:
+            return
+        self._absent.add(key)
+        if len(self._absent) > ABSENT_LIMIT:
+            self._absent &= self._dirty
+
+    def _notify(self, removed):
+        """Calls on_expire for removed entries, outside of the lock."""
+        if self.on_expire is None:
+            return
+        for key, value, reason in removed:
+            try:
+                self.on_expire(key, value, reason)
+            except Exception:  # pylint: disable=broad-except
+                logger.exception('Notifying the removal of state %s failed', key)
+
+    def _restore(self, key, loaded=None):
+        """
+        Puts an entry of the persistence into memory. It's read again under the lock
+        if it wasn't read before or the store was released since.
+
+        :param loaded: Result of _fetch for the key.
+        :raises KeyError: If the entry doesn't exist.
+        """
+        if self.persistence is None or key in self._absent:
+            raise KeyError(key)
+        if loaded is not None and loaded[0] == self._releases:
+            data = loaded[1]
+        else:
+            data = self.persistence.load_user_state(self.name, encode_key(key))
+        if data is None:
+            self._forget(key)
+            raise KeyError(key)
+        self._data[key] = decode_state(data)
+        self._used[key] = time.monotonic()
@@ -0,0 +1,321 @@
+"""
+Embedded HTTP receiver for the webhook of the telegram bot.
+
+Telegram POSTs every update to the webhook. The receiver checks the secret token,
+puts the update into a bounded queue and answers immediately. A worker thread
+takes the updates out of the queue and lets the dispatcher process them.
+If the queue is full, the receiver answers with 503 and Telegram delivers
+the update again later, so a slow bot pushes back instead of growing its memory.
+With an UpdateWindow, updates which Telegram delivers again are answered with 200
+and dropped before the dispatcher sees them.
+
+Recorded updates (one JSON object per line) can be replayed against a local receiver::
+
+    python -m quizbot.bot.webhook updates.jsonl http://localhost:8443/telegram SECRET
+"""
+import hmac
+import json
+import logging
+import queue
+import secrets
+import signal
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from telegram import Update
+
+logger = logging.getLogger(__name__)
+
+# Header in which Telegram sends the secret token of the webhook
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+# Updates larger than this are rejected
+MAX_UPDATE_SIZE = 1024 * 1024
+
+
+def generate_secret_token():
+    """
+    Generates a secret token in the format Telegram accepts (1-256 characters A-Z, a-z, 0-9, _ and -).
+
+    :returns: Secret token as string.
+    """
+    return secrets.token_urlsafe(32)
+
+
+class WebhookServer:
+    """
+    An Instance of the class WebhookServer receives the updates of a webhook
+    and feeds them to a dispatcher.
+    """
+
+    def __init__(self, dispatcher, port, url_path='telegram', secret_token=None,
+                 queue_size=1000, enqueue_timeout=1.0, listen='0.0.0.0', routes=None,
+                 window=None) -> None:
+        """
+        Initializes an instance of the class WebhookServer.
+
+        :param dispatcher: Dispatcher which processes the updates.
+        :param port: Port to listen on.
+        :param url_path: Path of the webhook URL.
+        :param secret_token: Secret token Telegram sends with every update.
+            Requests without it are rejected. If None, every request is accepted.
+        :param queue_size: Maximum number of received updates waiting for the dispatcher.
+        :param enqueue_timeout: Seconds a request waits for space in a full queue
+            before it's answered with 503.
+        :param listen: Address to listen on.
+        :param routes: Dict of further paths and functions which get the receiver and
+            the posted JSON and return a JSON result, e.g. to control a cluster worker.
+            They're protected by the secret token, too.
+        :param window: Optional UpdateWindow of the received update IDs, to drop duplicates.
+        """
+        self.dispatcher = dispatcher
+        self.routes = dict(routes or {})
+        self.url_path = '/' + url_path.strip('/')
+        self.secret_token = secret_token
+        self.enqueue_timeout = enqueue_timeout
+        self.window = window
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.received = 0
+        self.rejected = 0
+        self.processed = 0
+        self._stop_event = threading.Event()
+        self._httpd = ThreadingHTTPServer((listen, port), self._handler_class())
+        self._httpd.daemon_threads = True
+        self._threads = []
+
+    @property
+    def port(self):
+        """Port the receiver listens on."""
+        return self._httpd.server_address[1]
+
+    def start(self):
+        """Starts the HTTP receiver and the worker thread."""
+        self._threads = [
+            threading.Thread(target=self._httpd.serve_forever, name='webhook-httpd',
+                             daemon=True),
+            threading.Thread(target=self._work, name='webhook-worker', daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+        logger.info('Webhook receiver listening on port %d at %s', self.port, self.url_path)
+
+    def stop(self):
+        """Stops receiving and waits until the queued updates are processed."""
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        self._stop_event.set()
+        for thread in self._threads:
+            thread.join()
+        logger.info('Webhook receiver stopped')
+
+    def stats(self):
+        """
+        Returns the counters of the receiver.
+
+        :returns: Dict with received, rejected, duplicate and processed updates
+            and the queue depth.
+        """
+        return {
+            'received': self.received,
+            'rejected': self.rejected,
+            'duplicates': 0 if self.window is None else self.window.duplicates,
+            'processed': self.processed,
+            'queue_depth': self.queue.qsize(),
+        }
+
+    def wait_idle(self, timeout=None):
+        """
+        Waits until every received update is processed.
+
+        :param timeout: Maximum seconds to wait.
+        :returns: Whether the receiver is idle.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.processed < self.received:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def enqueue(self, data):
+        """
+        Puts a received update into the queue.
+
+        :param data: Update as dict.
+        :returns: Whether the update was queued or received before. It isn't if the queue
+            stays full.
+        """
+        update_id = data.get('update_id')
+        if self.window is not None and update_id is not None \
+                and not self.window.add(update_id):
+            logger.info('Dropped update %s, which was received before', update_id)
+            return True
+        update = Update.de_json(data, self.dispatcher.bot)
+        try:
+            self.queue.put(update, timeout=self.enqueue_timeout)
+        except queue.Full:
+            # Telegram delivers the update again, it mustn't be dropped then
+            if self.window is not None:
+                self.window.discard(update_id)
+            self.rejected += 1
+            return False
+        self.received += 1
+        return True
+
+    def _work(self):
+        """Thread target of the worker: processes the queued updates in order."""
+        while not (self._stop_event.is_set() and self.queue.empty()):
+            try:
+                update = self.queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            try:
+                self.dispatcher.process_update(update)
+            except Exception:  # pylint: disable=broad-except
+                logger.exception('Processing update %s failed', update.update_id)
+            self.processed += 1
+
+    def _handler_class(self):
+        """Returns the request handler class bound to this receiver."""
+        server = self
+
+        class WebhookHandler(BaseHTTPRequestHandler):
+            """Handles the POST requests of Telegram."""
+
+            def do_POST(self):  # pylint: disable=invalid-name
+                """Checks and queues one update."""
+                if self.path != server.url_path and self.path not in server.routes:
+                    self._respond(404)
+                    return
+                if server.secret_token is not None and not hmac.compare_digest(
+                        self.headers.get(SECRET_HEADER, ''), server.secret_token):
+                    logger.warning('Rejected webhook request with wrong secret token')
+                    self._respond(403)
+                    return
+                length = int(self.headers.get('Content-Length', 0))
+                if not 0 < length <= MAX_UPDATE_SIZE:
+                    self._respond(413 if length else 400)
+                    return
+                try:
+                    data = json.loads(self.rfile.read(length))
+                except ValueError:
+                    self._respond(400)
+                    return
+                if self.path in server.routes:
+                    self._call_route(server.routes[self.path], data)
+                    return
+                if not server.enqueue(data):
+                    # Telegram retries the update later
+                    logger.warning('Update queue is full, rejected update %s',
+                                   data.get('update_id'))
+                    self._respond(503, retry_after=1)
+                    return
+                self._respond(200)
+
+            def _call_route(self, route, data):
+                try:
+                    body = json.dumps(route(server, data)).encode('utf-8')
+                except Exception:  # pylint: disable=broad-except
+                    logger.exception('Route %s failed', self.path)
+                    self._respond(500)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _respond(self, status, retry_after=None):
+                self.send_response(status)
+                if retry_after is not None:
+                    self.send_header('Retry-After', str(retry_after))
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, *_):
+                """Requests aren't logged, there is one per update."""
+
+        return WebhookHandler
+
+
+def run_webhook(updater, port, webhook_url=None, url_path='telegram', secret_token=None,
+                queue_size=1000, routes=None, window=None):
+    """
+    Runs the bot with a webhook until SIGINT or SIGTERM is received.
+
+    :param updater: Updater of the bot with the handlers set up.
+    :param port: Port to listen on.
+    :param webhook_url: Public URL of the receiver without path. If None, the webhook isn't
+        registered at Telegram, e.g. to replay recorded updates locally.
+    :param url_path: Path of the webhook URL.
+    :param secret_token: Secret token of the webhook, generated if None.
+    :param queue_size: Maximum number of received updates waiting for the dispatcher.
+    :param routes: Further paths of the receiver, see WebhookServer.
+    :param window: Optional UpdateWindow to drop duplicate updates, closed at the end.
+    """
+    if secret_token is None:
+        secret_token = generate_secret_token()
+    server = WebhookServer(updater.dispatcher, port, url_path, secret_token, queue_size,
+                           routes=routes, window=window)
+    updater.job_queue.start()
+    server.start()
+
+    if webhook_url is not None:
+        updater.bot.set_webhook(url=webhook_url.rstrip('/') + server.url_path,
+                                secret_token=secret_token)
+        logger.info('Registered webhook %s%s', webhook_url.rstrip('/'), server.url_path)
+    else:
+        logger.info('Webhook is not registered, running in local mode')
+
+    # Updater.idle exits immediately if the updater wasn't started, so the signals are handled here
+    stopped = threading.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda *_: stopped.set())
+    try:
+        while not stopped.wait(1):
+            pass
+    finally:
+        logger.info('Stopping webhook mode')
+        server.stop()
+        updater.job_queue.stop()
+        if window is not None:
+            window.close()
+
+
+def replay_updates(path, url, secret_token=None, delay=0.0):
+    """
+    POSTs recorded updates to a webhook receiver.
+
+    :param path: Path of a file with one update as JSON object per line.
+    :param url: URL of the webhook receiver.
+    :param secret_token: Secret token of the receiver.
+    :param delay: Seconds between two updates.
+    :returns: Dict of the HTTP status codes and how often they were answered.
+    """
+    statuses = dict()
+    with open(path, encoding='utf-8') as updates_file:
+        for line in updates_file:
+            if not line.strip():
+                continue
+            request = urllib.request.Request(url, data=line.strip().encode('utf-8'),
+                                             headers={'Content-Type': 'application/json'})
+            if secret_token is not None:
+                request.add_header(SECRET_HEADER, secret_token)
+            try:
+                with urllib.request.urlopen(request) as response:
+                    status = response.status
+            except urllib.error.HTTPError as err:
+                status = err.code
+            statuses[status] = statuses.get(status, 0) + 1
+            if delay:
+                time.sleep(delay)
+    return statuses
+
+
+if __name__ == '__main__':
+    if len(sys.argv) not in (3, 4):
+        sys.exit('usage: python -m quizbot.bot.webhook <updates file> <url> [secret token]')
+    print(replay_updates(*sys.argv[1:]))
@@ -61,3 +61,15 @@ class Attempt:
                         self.act_question().correct_answer)
         self.user_points.append((return_value[0], self.questions.pop(0)))
         return return_value
+
+    def skip_question(self):
+        """
+        Counts the current question as answered wrong and removes it from the list,
+        e.g. if the time to answer it ran out.
+
+        :returns: The correct answer.
+        """
+        self.user_answers.clear()
+        question = self.questions.pop(0)
+        self.user_points.append((False, question))
+        return question.correct_answer
@@ -0,0 +1,244 @@
+"""
+With this module, you can cache loaded quizzes, track how popular they are
+and warm the cache up with the popular quizzes after a restart.
+
+Quizzes are cached in the binary format of quizbot.quiz.codec. Every hit decodes
+a new instance, so attempts never share the questions (and their user answers)
+of a cached quiz.
+"""
+import json
+import logging
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from quizbot.quiz.codec import decode_quiz, encode_quiz
+from quizbot.quiz.quiz import Quiz
+
+logger = logging.getLogger(__name__)
+
+
+class QuizCache:
+    """
+    An Instance of the class QuizCache holds the latest loaded quizzes (LRU)
+    and a popularity score of every requested quiz, which halves after a given time.
+    """
+
+    def __init__(self, max_size=256, half_life=3600, revalidate_after=60) -> None:
+        """
+        Initializes an instance of the class QuizCache.
+
+        :param max_size: Maximum number of cached quizzes.
+        :param half_life: Seconds after which the popularity of a quiz halves.
+        :param revalidate_after: Seconds after which a cached quiz is compared with
+            the latest version in the database before it is used again.
+        """
+        self.max_size = max_size
+        self.half_life = half_life
+        self.revalidate_after = revalidate_after
+        self._entries = OrderedDict()
+        self._popularity = dict()
+        self._loading = dict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.warmup_total = 0
+        self.warmup_done = 0
+
+    def get(self, name, author=None):
+        """
+        Returns a quiz from the cache or loads it from the database.
+        If several threads miss the same quiz at once, only one of them loads it.
+
+        :param name: Name of the quiz.
+        :param author: Optional author of the quiz.
+        :returns: New instance of the class Quiz or None if not found.
+        """
+        key = (name, author)
+        self._count(key)
+        return self._fetch(key)
+
+    def _fetch(self, key, count_hit=True):
+        """
+        Returns a quiz from the cache or loads it once, see get.
+        """
+        data = self._lookup(key, count_hit)
+        if data is not None:
+            return decode_quiz(data)
+
+        with self._lock:
+            loading = self._loading.get(key)
+            if loading is None:
+                self._loading[key] = threading.Event()
+        if loading is not None:
+            # Another thread is loading the quiz, wait for it
+            loading.wait()
+            data = self._lookup(key, count_hit=False)
+            return None if data is None else decode_quiz(data)
+
+        if count_hit:
+            self.misses += 1
+        try:
+            quiz = self._load(key)
+        finally:
+            with self._lock:
+                self._loading.pop(key).set()
+        return quiz
+
+    def invalidate(self, name, author=None):
+        """
+        Removes a quiz from the cache, e.g. after it was saved, renamed or removed.
+
+        :param name: Name of the quiz.
+        :param author: Author of the quiz. Entries looked up without author are removed, too.
+        """
+        with self._lock:
+            self._entries.pop((name, author), None)
+            self._entries.pop((name, None), None)
+
+    def hot_quizzes(self, limit=50):
+        """
+        Returns the most popular quizzes.
+
+        :param limit: Maximum number of quizzes.
+        :returns: List of tuples of name, author and current popularity score.
+        """
+        now = time.time()
+        with self._lock:
+            scores = [(key, self._decayed(key, now)) for key in self._popularity]
+        scores.sort(key=lambda item: item[1], reverse=True)
+        return [(name, author, score) for (name, author), score in scores[:limit]]
+
+    def save_hot_set(self, path, limit=50):
+        """
+        Writes the most popular quizzes to a warm-up file.
+
+        :param path: Path of the warm-up file.
+        :param limit: Maximum number of quizzes.
+        """
+        hot_set = [{'name': name, 'author': author, 'score': score}
+                   for name, author, score in self.hot_quizzes(limit)]
+        temp_path = path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as warmup_file:
+            json.dump({'saved_at': time.time(), 'quizzes': hot_set}, warmup_file)
+        os.replace(temp_path, path)
+        logger.info('Saved %d hot quizzes to %s', len(hot_set), path)
+
+    def warm_up(self, path, background=True):
+        """
+        Loads the quizzes of a warm-up file into the cache, most popular first.
+        Their popularity scores are restored, too.
+
+        :param path: Path of the warm-up file.
+        :param background: Whether the quizzes are loaded by a daemon thread.
+        :returns: The started thread or None.
+        """
+        try:
+            with open(path, encoding='utf-8') as warmup_file:
+                hot_set = json.load(warmup_file)
+        except (OSError, ValueError) as err:
+            logger.info('No warm-up of the quiz cache: %s', err)
+            return None
+
+        now = time.time()
+        keys = []
+        with self._lock:
+            for entry in hot_set.get('quizzes', []):
+                key = (entry['name'], entry['author'])
+                self._popularity.setdefault(key, (entry.get('score', 0.0), now))
+                keys.append(key)
+        self.warmup_total = len(keys)
+        self.warmup_done = 0
+
+        if not background:
+            self._warm_up(keys)
+            return None
+        thread = threading.Thread(target=self._warm_up, args=(keys,),
+                                  name='quiz-cache-warmup', daemon=True)
+        thread.start()
+        return thread
+
+    def stats(self):
+        """
+        Returns the state of the cache.
+
+        :returns: Dict with size, hits, misses, hit rate and warm-up progress.
+        """
+        requests = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / requests if requests else 0.0,
+            'warmup_total': self.warmup_total,
+            'warmup_done': self.warmup_done,
+        }
+
+    def _warm_up(self, keys):
+        """Loads the quizzes which aren't cached yet."""
+        for key in keys:
+            try:
+                self._fetch(key, count_hit=False)
+            except Exception as err:  # pylint: disable=broad-except
+                logger.warning('Warm-up of quiz %s failed: %s', key, err)
+            self.warmup_done += 1
+        logger.info('Warmed up %d quizzes', self.warmup_done)
+
+    def _lookup(self, key, count_hit=True):
+        """
+        Returns the encoded quiz of a key if it is cached and up to date.
+        Quizzes older than revalidate_after are compared with the latest version.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        if entry is None:
+            return None
+
+        data, etag, cached_at = entry
+        if time.time() - cached_at > self.revalidate_after:
+            latest = Quiz.get_version(*key)
+            if latest is None or '{}-{}'.format(*latest) != etag:
+                self.invalidate(*key)
+                return None
+            with self._lock:
+                if key in self._entries:
+                    self._entries[key] = (data, etag, time.time())
+        if count_hit:
+            self.hits += 1
+        return data
+
+    def _load(self, key):
+        """Loads a quiz from the database and caches it."""
+        quiz = Quiz.load_from_db(*key)
+        if quiz is not None:
+            with self._lock:
+                self._entries[key] = (encode_quiz(quiz), quiz.etag, time.time())
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+        return quiz
+
+    def _count(self, key):
+        """
+        Increments the decayed popularity score of a quiz.
+        If too many quizzes are tracked, the less popular half is forgotten.
+        """
+        now = time.time()
+        with self._lock:
+            self._popularity[key] = (self._decayed(key, now) + 1.0, now)
+            if len(self._popularity) > 10 * self.max_size:
+                scores = sorted(self._popularity, key=lambda other: self._decayed(other, now))
+                for other in scores[:len(scores) // 2]:
+                    del self._popularity[other]
+
+    def _decayed(self, key, now):
+        """Returns the popularity score of a quiz at the given time."""
+        score, updated_at = self._popularity.get(key, (0.0, now))
+        return score * math.pow(0.5, (now - updated_at) / self.half_life)
+
+
+# Cache shared by the handlers of the bot
+quiz_cache = QuizCache()
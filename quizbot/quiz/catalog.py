@@ -0,0 +1,406 @@
+"""
+With this module, you can compile published quizzes into a read-only catalog file
+and read it through memory-mapped views.
+
+The catalog is columnar: every attribute of the quizzes and questions is stored
+in its own column (type codes, flags, string ids and offset tables) and all texts
+live in one deduplicated string blob. The reader maps the file instead of reading it,
+so every worker process on a host shares the same page-cache copy and opening a
+catalog doesn't hydrate a single quiz.
+
+Layout (little endian, every section is aligned to four bytes)::
+
+    header            magic "QZCT", version (u16), reserved (u16),
+                      quiz count Q, question count N, answer count A, string count S (u32)
+    quiz_name         u32[Q]    string id
+    quiz_author       u32[Q]    string id
+    quiz_questions    u32[Q+1]  offset table into the question columns
+    quiz_flags        u8[Q]     is_random, results after quiz, results after question
+    question_type     u8[N]     see QUESTION_TYPE_CODES
+    question_flags    u8[N]     is_random
+    question_text     u32[N]    string id
+    question_correct  u32[N]    string id
+    question_answers  u32[N+1]  offset table into answer_string
+    answer_string     u32[A]    string id
+    string_offsets    u32[S+1]  offset table into string_blob
+    string_blob       utf-8
+
+The quizzes are sorted by name and author, so a quiz is found by binary search.
+"""
+import mmap
+import os
+import struct
+import sys
+from typing import List
+
+from quizbot.quiz.question_factory import (
+    Question, QuestionChoice, QUESTION_TYPE_CODES, build_question
+)
+from quizbot.quiz.quiz import Quiz
+
+MAGIC = b'QZCT'
+VERSION = 1
+
+_HEADER = struct.Struct('<4sHHIIII')
+_U32 = struct.Struct('<I')
+
+# Bits of the quiz and question flag columns
+_QUIZ_RANDOM = 1
+_QUIZ_RESULTS_AFTER_QUIZ = 2
+_QUIZ_RESULTS_AFTER_QUESTION = 4
+_QUESTION_RANDOM = 1
+
+_TYPE_NAMES = {code: name for name, code in QUESTION_TYPE_CODES.items()}
+
+
+def _padded(size):
+    """Returns the size rounded up to the next multiple of four."""
+    return (size + 3) & ~3
+
+
+def _u32_column(values):
+    """Packs a list of integers to a little endian u32 column."""
+    return struct.pack('<%dI' % len(values), *values)
+
+
+def _u8_column(values):
+    """Packs a list of small integers to a u8 column padded to four bytes."""
+    column = bytes(values)
+    return column + bytes(_padded(len(column)) - len(column))
+
+
+def compile_catalog(quizzes, path):
+    """
+    Compiles quizzes into a catalog file.
+    The file is written next to the target and moved into place afterwards,
+    so readers which still map an older catalog are not affected.
+
+    :param quizzes: Iterable of instances of the class Quiz.
+    :param path: Path of the catalog file.
+    :returns: Number of quizzes in the catalog.
+    """
+    strings = dict()
+
+    def string_id(text):
+        return strings.setdefault(text, len(strings))
+
+    quiz_name, quiz_author, quiz_questions, quiz_flags = [], [], [0], []
+    question_type, question_flags, question_text, question_correct = [], [], [], []
+    question_answers, answer_string = [0], []
+
+    for quiz in sorted(quizzes, key=lambda quiz: (quiz.name, quiz.author)):
+        quiz_name.append(string_id(quiz.name))
+        quiz_author.append(string_id(quiz.author))
+        quiz_flags.append(
+            (_QUIZ_RANDOM if quiz.is_random else 0)
+            | (_QUIZ_RESULTS_AFTER_QUIZ if quiz.show_results_after_quiz else 0)
+            | (_QUIZ_RESULTS_AFTER_QUESTION if quiz.show_results_after_question else 0))
+
+        for question in quiz.questions:
+            question_type.append(QUESTION_TYPE_CODES[type(question).__name__])
+            question_text.append(string_id(question.question))
+            question_correct.append(string_id(question.correct_answer))
+            if isinstance(question, QuestionChoice):
+                question_flags.append(_QUESTION_RANDOM if question.is_random else 0)
+                answer_string.extend(string_id(answer) for answer in question.possible_answers)
+            else:
+                question_flags.append(0)
+            question_answers.append(len(answer_string))
+        quiz_questions.append(len(question_type))
+
+    blob = bytearray()
+    string_offsets = [0]
+    for text in strings:
+        blob += text.encode('utf-8')
+        string_offsets.append(len(blob))
+
+    sections = [
+        _HEADER.pack(MAGIC, VERSION, 0, len(quiz_name), len(question_type),
+                     len(answer_string), len(strings)),
+        _u32_column(quiz_name),
+        _u32_column(quiz_author),
+        _u32_column(quiz_questions),
+        _u8_column(quiz_flags),
+        _u8_column(question_type),
+        _u8_column(question_flags),
+        _u32_column(question_text),
+        _u32_column(question_correct),
+        _u32_column(question_answers),
+        _u32_column(answer_string),
+        _u32_column(string_offsets),
+        bytes(blob),
+    ]
+
+    temp_path = '{}.{}.tmp'.format(path, os.getpid())
+    with open(temp_path, 'wb') as catalog_file:
+        for section in sections:
+            catalog_file.write(section)
+    os.replace(temp_path, path)
+    return len(quiz_name)
+
+
+def export_catalog(path, author=None):
+    """
+    Compiles the quizzes stored in the database into a catalog file.
+
+    :param path: Path of the catalog file.
+    :param author: Optional author to export only his/her quizzes.
+    :returns: Number of quizzes in the catalog.
+    """
+    quizzes = []
+    for row in Quiz.list_quizzes(author):
+        quiz = Quiz.load_from_db(row.name, row.author)
+        if quiz is not None:
+            quizzes.append(quiz)
+    return compile_catalog(quizzes, path)
+
+
+class QuizCatalog:
+    """
+    An Instance of the class QuizCatalog maps a catalog file into memory
+    and gives read-only views on its quizzes.
+    """
+
+    def __init__(self, path) -> None:
+        """
+        Initializes an instance of the class QuizCatalog by mapping the catalog file.
+
+        :param path: Path of the catalog file.
+        :raises ValueError: If the file isn't a catalog of a supported version.
+        """
+        with open(path, 'rb') as catalog_file:
+            self._mmap = mmap.mmap(catalog_file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._buffer = memoryview(self._mmap)
+
+        magic, version, _, quiz_count, question_count, answer_count, string_count = \
+            _HEADER.unpack_from(self._buffer, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError('{} is not a quiz catalog of version {}'.format(path, VERSION))
+        self.quiz_count = quiz_count
+        self.question_count = question_count
+
+        # Compute the start of every column
+        offset = _HEADER.size
+        columns = dict()
+        for name, size in (
+                ('quiz_name', 4 * quiz_count),
+                ('quiz_author', 4 * quiz_count),
+                ('quiz_questions', 4 * (quiz_count + 1)),
+                ('quiz_flags', _padded(quiz_count)),
+                ('question_type', _padded(question_count)),
+                ('question_flags', _padded(question_count)),
+                ('question_text', 4 * question_count),
+                ('question_correct', 4 * question_count),
+                ('question_answers', 4 * (question_count + 1)),
+                ('answer_string', 4 * answer_count),
+                ('string_offsets', 4 * (string_count + 1))):
+            columns[name] = offset
+            offset += size
+        columns['string_blob'] = offset
+        self._columns = columns
+
+    def close(self):
+        """Releases the memory map. Views of the catalog can't be used afterwards."""
+        self._buffer.release()
+        self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def __len__(self):
+        return self.quiz_count
+
+    def __getitem__(self, index):
+        """
+        Returns a view on the quiz at the index.
+
+        :param index: Index of the quiz in the catalog.
+        :returns: Instance of QuizView.
+        :raises IndexError: If the index is out of range.
+        """
+        if not 0 <= index < self.quiz_count:
+            raise IndexError('quiz index out of range')
+        return QuizView(self, index)
+
+    def __iter__(self):
+        for index in range(self.quiz_count):
+            yield QuizView(self, index)
+
+    def find(self, name, author=None):
+        """
+        Finds a quiz by its name and optionally by its author.
+
+        :param name: Name of the quiz.
+        :param author: Optional author of the quiz.
+        :returns: Instance of QuizView or None if not found.
+        """
+        key = (name, author or '')
+        low, high = 0, self.quiz_count
+        while low < high:
+            middle = (low + high) // 2
+            if (self._quiz_name(middle), self._quiz_author(middle)) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.quiz_count and self._quiz_name(low) == name \
+                and (author is None or self._quiz_author(low) == author):
+            return QuizView(self, low)
+        return None
+
+    def _u32(self, column, index):
+        return _U32.unpack_from(self._buffer, self._columns[column] + 4 * index)[0]
+
+    def _u8(self, column, index):
+        return self._buffer[self._columns[column] + index]
+
+    def _string(self, string_id):
+        start = self._u32('string_offsets', string_id)
+        end = self._u32('string_offsets', string_id + 1)
+        blob = self._columns['string_blob']
+        return str(self._buffer[blob + start:blob + end], 'utf-8')
+
+    def _quiz_name(self, index):
+        return self._string(self._u32('quiz_name', index))
+
+    def _quiz_author(self, index):
+        return self._string(self._u32('quiz_author', index))
+
+
+class QuizView:
+    """
+    Read-only view on a quiz in a catalog.
+    It offers the attributes of the class Quiz, so it can be attempted like a quiz.
+    """
+
+    def __init__(self, catalog: QuizCatalog, index) -> None:
+        """
+        Initializes an instance of the class QuizView.
+
+        :param catalog: Catalog of the quiz.
+        :param index: Index of the quiz in the catalog.
+        """
+        self._catalog = catalog
+        self._index = index
+        self._flags = catalog._u8('quiz_flags', index)
+
+    @property
+    def name(self):
+        """Name of the quiz."""
+        return self._catalog._quiz_name(self._index)
+
+    @property
+    def author(self):
+        """Author of the quiz."""
+        return self._catalog._quiz_author(self._index)
+
+    @property
+    def is_random(self):
+        """Whether the order of the questions is random."""
+        return bool(self._flags & _QUIZ_RANDOM)
+
+    @property
+    def show_results_after_quiz(self):
+        """Whether the result of every question is shown after the quiz."""
+        return bool(self._flags & _QUIZ_RESULTS_AFTER_QUIZ)
+
+    @property
+    def show_results_after_question(self):
+        """Whether the result of the entered answer is shown after the question."""
+        return bool(self._flags & _QUIZ_RESULTS_AFTER_QUESTION)
+
+    @property
+    def questions(self):
+        """
+        Views on the questions of the quiz.
+
+        :returns: List of QuestionView.
+        """
+        start = self._catalog._u32('quiz_questions', self._index)
+        end = self._catalog._u32('quiz_questions', self._index + 1)
+        return [QuestionView(self._catalog, index) for index in range(start, end)]
+
+    def get_questions(self) -> List[Question]:
+        """
+        Returns new question instances of the quiz.
+        The user answers of an attempt are stored in the instances,
+        which is why they can't be shared and are built on every call.
+
+        :returns: List of questions.
+        """
+        return [question_view.to_question() for question_view in self.questions]
+
+    def to_quiz(self):
+        """
+        Hydrates the view to an instance of the class Quiz.
+
+        :returns: Instance of the class Quiz.
+        """
+        quiz = Quiz(author=self.author, name=self.name)
+        quiz.is_random = self.is_random
+        quiz.show_results_after_quiz = self.show_results_after_quiz
+        quiz.show_results_after_question = self.show_results_after_question
+        quiz.questions = self.get_questions()
+        return quiz
+
+
+class QuestionView:
+    """
+    Read-only view on a question in a catalog.
+    """
+
+    def __init__(self, catalog: QuizCatalog, index) -> None:
+        """
+        Initializes an instance of the class QuestionView.
+
+        :param catalog: Catalog of the question.
+        :param index: Index of the question in the catalog.
+        """
+        self._catalog = catalog
+        self._index = index
+
+    @property
+    def question_type(self):
+        """Class name of the question."""
+        return _TYPE_NAMES[self._catalog._u8('question_type', self._index)]
+
+    @property
+    def question(self):
+        """Question as string."""
+        return self._catalog._string(self._catalog._u32('question_text', self._index))
+
+    @property
+    def correct_answer(self):
+        """Correct answer as string."""
+        return self._catalog._string(self._catalog._u32('question_correct', self._index))
+
+    @property
+    def is_random(self):
+        """Whether the possible answers are displayed in random order."""
+        return bool(self._catalog._u8('question_flags', self._index) & _QUESTION_RANDOM)
+
+    @property
+    def possible_answers(self):
+        """Possible answers of a choice question as list, otherwise an empty list."""
+        start = self._catalog._u32('question_answers', self._index)
+        end = self._catalog._u32('question_answers', self._index + 1)
+        return [self._catalog._string(self._catalog._u32('answer_string', index))
+                for index in range(start, end)]
+
+    def to_question(self):
+        """
+        Hydrates the view to an instance of its question class.
+
+        :returns: New question instance.
+        """
+        return build_question(self.question_type, self.question, self.correct_answer,
+                              self.possible_answers, self.is_random)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        sys.exit('usage: python -m quizbot.quiz.catalog <catalog file>')
+    print('Exported {} quizzes'.format(export_catalog(sys.argv[1])))
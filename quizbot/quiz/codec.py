@@ -0,0 +1,173 @@
+"""
+With this module, you can encode quizzes to a compact binary format and decode them again.
+The format is used instead of pickle or JSON to cache, snapshot and transfer quizzes.
+
+Layout of format version 2 (little endian)::
+
+    header         magic "QB", format version (u8), quiz flags (u8),
+                   question count N (u32), string count S (u32)
+    saved version  quiz ID and version (u32, 0 if the quiz isn't saved)
+    bank           draw count (u32), only if the quiz draws from a question bank
+    types          u8[N]   type code of every question, see QUESTION_TYPE_CODES
+    flags          u8[N]   is_random of every question
+    answer counts  u16[N]  number of possible answers of every question
+    question IDs   u32[N]  ID of every saved question, 0 if the question isn't saved
+    lengths        u32[S]  length of every string in characters
+    strings        utf-8   name, author, [bank, stratify_by,]
+                           then question, correct answer and possible answers of every question
+
+All strings are concatenated and decoded at once and all numbers are packed in arrays,
+so a quiz is encoded and decoded with a few calls of struct instead of one per field.
+The decoded questions are restored without running their validations again,
+because they were validated when they were created.
+Format version 1 has no saved version and no question IDs and can still be decoded.
+"""
+import struct
+from quizbot.quiz.question_factory import QuestionChoice, QUESTION_TYPES, QUESTION_TYPE_CODES
+from quizbot.quiz.quiz import Quiz
+
+MAGIC = b'QB'
+FORMAT_VERSION = 2
+
+_HEADER = struct.Struct('<2sBBII')
+_SAVED_VERSION = struct.Struct('<II')
+_BANK = struct.Struct('<I')
+
+# Bits of the quiz flags
+_RANDOM = 1
+_RESULTS_AFTER_QUIZ = 2
+_RESULTS_AFTER_QUESTION = 4
+_BANK_DRAW = 8
+
+_TYPE_CLASSES = {code: QUESTION_TYPES[name] for name, code in QUESTION_TYPE_CODES.items()}
+
+
+def encode_quiz(quiz: Quiz) -> bytes:
+    """
+    Encodes a quiz with its questions.
+
+    :param quiz: Instance of the class Quiz.
+    :returns: Encoded quiz as bytes.
+    """
+    flags = (_RANDOM if quiz.is_random else 0) \
+        | (_RESULTS_AFTER_QUIZ if quiz.show_results_after_quiz else 0) \
+        | (_RESULTS_AFTER_QUESTION if quiz.show_results_after_question else 0)
+    strings = [quiz.name, quiz.author]
+    bank = b''
+    if quiz.bank is not None:
+        flags |= _BANK_DRAW
+        strings += [quiz.bank, quiz.bank_stratify_by or '']
+        bank = _BANK.pack(quiz.bank_draw_count)
+
+    types, question_flags, answer_counts, question_ids = [], [], [], []
+    for question in quiz.questions:
+        types.append(QUESTION_TYPE_CODES[type(question).__name__])
+        question_ids.append(question.question_id or 0)
+        strings += [question.question, question.correct_answer]
+        if isinstance(question, QuestionChoice):
+            question_flags.append(1 if question.is_random else 0)
+            answer_counts.append(len(question.possible_answers))
+            strings += question.possible_answers
+        else:
+            question_flags.append(0)
+            answer_counts.append(0)
+
+    count = len(types)
+    return b''.join((
+        _HEADER.pack(MAGIC, FORMAT_VERSION, flags, count, len(strings)),
+        _SAVED_VERSION.pack(quiz.id or 0, quiz.version),
+        bank,
+        bytes(types),
+        bytes(question_flags),
+        struct.pack('<%dH' % count, *answer_counts),
+        struct.pack('<%dI' % count, *question_ids),
+        struct.pack('<%dI' % len(strings), *map(len, strings)),
+        ''.join(strings).encode('utf-8')
+    ))
+
+
+def decode_quiz(data) -> Quiz:
+    """
+    Decodes a quiz encoded by encode_quiz.
+
+    :param data: Encoded quiz as bytes-like object.
+    :returns: New instance of the class Quiz.
+    :raises ValueError: If the data isn't an encoded quiz of a supported version.
+    """
+    data = memoryview(data)
+    try:
+        return _decode_quiz(data)
+    except struct.error as err:
+        raise ValueError('Encoded quiz is truncated') from err
+
+
+def _decode_quiz(data):
+    """Decodes a quiz from a memoryview, see decode_quiz."""
+    magic, version, flags, count, string_count = _HEADER.unpack_from(data, 0)
+    if magic != MAGIC or not 1 <= version <= FORMAT_VERSION:
+        raise ValueError('Data is not an encoded quiz of a supported version')
+    offset = _HEADER.size
+
+    quiz_id, quiz_version = 0, 0
+    if version >= 2:
+        quiz_id, quiz_version = _SAVED_VERSION.unpack_from(data, offset)
+        offset += _SAVED_VERSION.size
+
+    bank_draw_count = 0
+    if flags & _BANK_DRAW:
+        bank_draw_count, = _BANK.unpack_from(data, offset)
+        offset += _BANK.size
+
+    types = data[offset:offset + count]
+    question_flags = data[offset + count:offset + 2 * count]
+    offset += 2 * count
+    answer_counts = struct.unpack_from('<%dH' % count, data, offset)
+    offset += 2 * count
+    question_ids = (0,) * count
+    if version >= 2:
+        question_ids = struct.unpack_from('<%dI' % count, data, offset)
+        offset += 4 * count
+    lengths = struct.unpack_from('<%dI' % string_count, data, offset)
+    offset += 4 * string_count
+
+    text = str(data[offset:], 'utf-8')
+    if sum(lengths) != len(text):
+        raise ValueError('Encoded quiz has {} characters too many or too few'.format(
+            len(text) - sum(lengths)))
+    strings = []
+    position = 0
+    for length in lengths:
+        strings.append(text[position:position + length])
+        position += length
+
+    quiz = Quiz(author=strings[1], name=strings[0])
+    quiz.id = quiz_id or None
+    quiz.version = quiz_version
+    quiz.is_random = bool(flags & _RANDOM)
+    quiz.show_results_after_quiz = bool(flags & _RESULTS_AFTER_QUIZ)
+    quiz.show_results_after_question = bool(flags & _RESULTS_AFTER_QUESTION)
+    position = 2
+    if flags & _BANK_DRAW:
+        quiz.bank = strings[2]
+        quiz.bank_stratify_by = strings[3] or None
+        quiz.bank_draw_count = bank_draw_count
+        position = 4
+
+    for index in range(count):
+        question_class = _TYPE_CLASSES[types[index]]
+        question = question_class.__new__(question_class)
+        question.question = strings[position]
+        question.correct_answer = strings[position + 1]
+        question.user_answer = str()
+        answer_count = answer_counts[index]
+        if issubclass(question_class, QuestionChoice):
+            question.is_random = bool(question_flags[index])
+            question.possible_answers = strings[position + 2:position + 2 + answer_count]
+        if question_ids[index]:
+            question.mark_saved(question_ids[index])
+        else:
+            question.question_id = None
+            question.saved_fingerprint = None
+        quiz.questions.append(question)
+        position += 2 + answer_count
+    return quiz
@@ -0,0 +1,45 @@
+"""
+Connection to the MySQL database of the quizzes.
+
+The engine is created when the first session is opened, so importing the
+quiz modules neither loads the MySQL driver nor connects to the database.
+"""
+import os
+import threading
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from dotenv import load_dotenv
+
+_lock = threading.Lock()
+_engine = None
+_session_factory = None
+
+
+def get_engine():
+    """
+    Returns the engine of the database and creates it on the first call.
+
+    :returns: SQLAlchemy engine of DATABASE_URL.
+    """
+    global _engine, _session_factory  # pylint: disable=global-statement
+    if _engine is None:
+        with _lock:
+            if _engine is None:
+                load_dotenv()
+                # MySQL Connection
+                database_url = os.getenv("DATABASE_URL",
+                                         "mysql+mysqlconnector://root@localhost/quizbot")
+                engine = create_engine(database_url)
+                _session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+                _engine = engine
+    return _engine
+
+
+def SessionLocal():  # pylint: disable=invalid-name
+    """
+    Opens a session of the database.
+
+    :returns: New SQLAlchemy session.
+    """
+    get_engine()
+    return _session_factory()
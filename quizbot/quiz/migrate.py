@@ -0,0 +1,99 @@
+"""
+With this module, you can migrate a database of quizzes saved before the quizzes
+had versions.
+
+The bot reads a quiz through its latest row in quiz_versions and the questions linked
+to it in quiz_questions. Quizzes written by older versions of the bot have neither,
+so they can't be found. The migration adds the version column of the quizzes if it's
+missing and saves every quiz without a version as version 1 with its current settings
+and questions. It can run again at any time, migrated quizzes are skipped.
+
+The tables quiz_versions and quiz_questions have to exist, see api/models.py::
+
+    python -m quizbot.quiz.migrate
+"""
+import logging
+from sqlalchemy import inspect
+from quizbot.quiz.database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+
+def add_version_column():
+    """
+    Adds the column with the latest version to the quizzes if it's missing.
+
+    :returns: Whether the column was added.
+    """
+    db = SessionLocal()
+    try:
+        columns = {column['name'] for column in inspect(db.get_bind()).get_columns('quizzes')}
+        if 'version' in columns:
+            return False
+        db.execute("ALTER TABLE quizzes ADD COLUMN version INTEGER DEFAULT 0")
+        db.commit()
+        return True
+    finally:
+        db.close()
+
+
+def backfill_versions():
+    """
+    Saves every quiz without a version as version 1, with the settings of the quiz
+    and its questions in the order they were inserted.
+
+    :returns: Number of migrated quizzes.
+    """
+    db = SessionLocal()
+    try:
+        quizzes = db.execute(
+            """SELECT id, is_random, show_results_after_quiz, show_results_after_question,
+                      bank, bank_draw_count, bank_stratify_by
+               FROM quizzes q
+               WHERE NOT EXISTS (SELECT 1 FROM quiz_versions v WHERE v.quiz_id = q.id)
+               ORDER BY id"""
+        ).fetchall()
+        for quiz in quizzes:
+            db.execute(
+                """INSERT INTO quiz_versions
+                   (quiz_id, version, is_random, show_results_after_quiz,
+                    show_results_after_question, bank, bank_draw_count, bank_stratify_by)
+                   VALUES (:quiz_id, 1, :is_random, :show_results_after_quiz,
+                          :show_results_after_question, :bank, :bank_draw_count,
+                          :bank_stratify_by)""",
+                {
+                    "quiz_id": quiz.id,
+                    "is_random": quiz.is_random,
+                    "show_results_after_quiz": quiz.show_results_after_quiz,
+                    "show_results_after_question": quiz.show_results_after_question,
+                    "bank": quiz.bank,
+                    "bank_draw_count": quiz.bank_draw_count,
+                    "bank_stratify_by": quiz.bank_stratify_by
+                }
+            )
+            question_ids = db.execute(
+                "SELECT id FROM questions WHERE quiz_id = :quiz_id ORDER BY id",
+                {"quiz_id": quiz.id}
+            ).fetchall()
+            for position, (question_id,) in enumerate(question_ids):
+                db.execute(
+                    """INSERT INTO quiz_questions (quiz_id, version, position, question_id)
+                       VALUES (:quiz_id, 1, :position, :question_id)""",
+                    {"quiz_id": quiz.id, "position": position, "question_id": question_id}
+                )
+            db.execute("UPDATE quizzes SET version = 1 WHERE id = :quiz_id",
+                       {"quiz_id": quiz.id})
+            # Every quiz is migrated on its own, an interrupted migration continues
+            db.commit()
+            logger.info('Migrated quiz %d with %d questions', quiz.id, len(question_ids))
+        return len(quizzes)
+    finally:
+        db.close()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+                        level=logging.INFO)
+    if add_version_column():
+        print('Added the version column of the quizzes')
+    print('Migrated {} quizzes'.format(backfill_versions()))
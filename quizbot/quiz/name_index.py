@@ -0,0 +1,171 @@
+"""
+With this module, you can look up quizzes by the beginning of their names or authors
+without a database query, e.g. to autocomplete quiz names.
+
+The index is a sorted array of search keys: every word of a quiz name starts a key,
+so "geo" finds "World geography", and the author is a key, too. A prefix search is
+a binary search to the first matching key followed by a scan of the matching keys.
+Quizzes are added and removed one by one when they are created, renamed or removed.
+"""
+import threading
+from bisect import bisect_left, insort
+from quizbot.quiz.quiz import Quiz
+
+# Maximum number of keys scanned by a search
+SCAN_LIMIT = 2000
+
+# Ranks of the kinds of matches, lower ones are shown first
+_NAME_START = 0
+_NAME_WORD = 1
+_AUTHOR = 2
+
+
+def normalize(text):
+    """
+    Normalizes a text for a case insensitive search.
+
+    :param text: Text as string.
+    :returns: Normalized text.
+    """
+    return ' '.join(text.casefold().split())
+
+
+class QuizNameIndex:
+    """
+    An Instance of the class QuizNameIndex holds the names and authors of all quizzes
+    in a sorted array of search keys.
+    """
+
+    def __init__(self) -> None:
+        """
+        Initializes an empty instance of the class QuizNameIndex.
+        """
+        self._keys = []
+        self._quizzes = set()
+        self._lock = threading.Lock()
+
+    def load(self, quizzes=None):
+        """
+        Replaces the indexed quizzes.
+
+        :param quizzes: Iterable of pairs of name and author, all quizzes of the database if None.
+        """
+        if quizzes is None:
+            quizzes = Quiz.list_quizzes()
+        quizzes = {(name, author) for name, author in quizzes}
+        keys = sorted(key for name, author in quizzes for key in self._keys_of(name, author))
+        with self._lock:
+            self._keys = keys
+            self._quizzes = quizzes
+
+    def add(self, name, author):
+        """
+        Adds a quiz to the index.
+
+        :param name: Name of the quiz.
+        :param author: Author of the quiz.
+        """
+        with self._lock:
+            if (name, author) in self._quizzes:
+                return
+            self._quizzes.add((name, author))
+            for key in self._keys_of(name, author):
+                insort(self._keys, key)
+
+    def remove(self, name, author):
+        """
+        Removes a quiz from the index.
+
+        :param name: Name of the quiz.
+        :param author: Author of the quiz.
+        """
+        with self._lock:
+            if (name, author) not in self._quizzes:
+                return
+            self._quizzes.discard((name, author))
+            for key in self._keys_of(name, author):
+                position = bisect_left(self._keys, key)
+                if position < len(self._keys) and self._keys[position] == key:
+                    del self._keys[position]
+
+    def rename(self, name, author, new_name):
+        """
+        Renames a quiz in the index.
+
+        :param name: Current name of the quiz.
+        :param author: Author of the quiz.
+        :param new_name: New name of the quiz.
+        """
+        self.remove(name, author)
+        self.add(new_name, author)
+
+    def __len__(self):
+        return len(self._quizzes)
+
+    def __contains__(self, quiz):
+        return quiz in self._quizzes
+
+    def search(self, query, limit=20):
+        """
+        Finds quizzes whose name or a word of it or whose author starts with the query.
+        Quizzes whose names start with the query come first, then alphabetically.
+        At most SCAN_LIMIT keys are scanned, so short queries stay fast in a large index.
+
+        :param query: Beginning of a name, a word of a name or an author.
+        :param limit: Maximum number of quizzes.
+        :returns: List of pairs of name and author.
+        """
+        prefix = normalize(query)
+        matches = dict()
+        with self._lock:
+            position = bisect_left(self._keys, (prefix,))
+            end = min(position + SCAN_LIMIT, len(self._keys))
+            while position < end and self._keys[position][0].startswith(prefix):
+                _, rank, name, author = self._keys[position]
+                matches[(name, author)] = min(rank, matches.get((name, author), rank))
+                position += 1
+        ranked = sorted(matches, key=lambda quiz: (matches[quiz], normalize(quiz[0]), quiz[1]))
+        return ranked[:limit]
+
+    def resolve(self, text):
+        """
+        Splits a text into a quiz name and an optional author, e.g. "World geography alice".
+        Names with several words are found if they are in the index.
+
+        :param text: Entered text.
+        :returns: Pair of name and author (None if not given) or None if no quiz matches.
+        """
+        words = text.split()
+        with self._lock:
+            for split in range(len(words), 0, -1):
+                name = ' '.join(words[:split])
+                author = ' '.join(words[split:]) or None
+                if author is None and any(quiz_name == name for quiz_name, _ in
+                                          self._by_name(name)):
+                    return name, None
+                if (name, author) in self._quizzes:
+                    return name, author
+        return None
+
+    def _by_name(self, name):
+        """Returns the indexed quizzes of a name. The lock has to be held."""
+        key = (normalize(name), _NAME_START)
+        position = bisect_left(self._keys, key)
+        quizzes = []
+        while position < len(self._keys) and self._keys[position][:2] == key:
+            quizzes.append(self._keys[position][2:])
+            position += 1
+        return quizzes
+
+    @staticmethod
+    def _keys_of(name, author):
+        """Returns the search keys of a quiz."""
+        words = normalize(name).split(' ')
+        keys = [(' '.join(words[start:]), _NAME_START if start == 0 else _NAME_WORD,
+                 name, author) for start in range(len(words))]
+        keys.append((normalize(author or ''), _AUTHOR, name, author))
+        return keys
+
+
+# Index shared by the handlers of the bot
+quiz_index = QuizNameIndex()
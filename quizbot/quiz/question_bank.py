@@ -0,0 +1,197 @@
+"""
+With this module, you can store questions in banks and draw random samples of them.
+
+Every question of a bank gets a random key when it is stored. Drawing a sample
+seeks to random positions of the index over (bank, key) and reads the following
+rows, so the cost of a draw depends on the size of the sample and not on the size
+of the bank. Neither the database sorts the whole bank nor the bot loads it.
+"""
+import json
+import random
+from quizbot.quiz.database import SessionLocal
+from quizbot.quiz.question_factory import Question, QuestionChoice, build_question
+
+# Number of random positions a sample is drawn from
+SAMPLE_PROBES = 8
+
+# Columns a sample can be stratified by
+STRATA = ('tag', 'difficulty')
+
+
+def allocate_quotas(sizes, count):
+    """
+    Splits the size of a sample over strata proportionally to their sizes
+    (largest remainder method). No stratum gets more questions than it has.
+
+    :param sizes: Dict of the strata and their number of questions.
+    :param count: Size of the sample.
+    :returns: Dict of the strata and their number of questions in the sample.
+    """
+    total = sum(sizes.values())
+    if total <= count:
+        return dict(sizes)
+
+    quotas = {stratum: count * size // total for stratum, size in sizes.items()}
+    # Distribute the remaining questions by the largest remainders
+    remainders = sorted(sizes, key=lambda stratum: count * sizes[stratum] % total, reverse=True)
+    left = count - sum(quotas.values())
+    for stratum in remainders:
+        if not left:
+            break
+        if quotas[stratum] < sizes[stratum]:
+            quotas[stratum] += 1
+            left -= 1
+    return quotas
+
+
+class QuestionBank:
+    """
+    An Instance of the class QuestionBank gives access to the questions
+    of a bank in the database. Questions can be tagged and rated by difficulty.
+    """
+
+    def __init__(self, name) -> None:
+        """
+        Initializes an instance of the class QuestionBank.
+
+        :param name: Name of the bank.
+        """
+        self.name = name
+
+    def add_question(self, question: Question, tag=None, difficulty=None):
+        """
+        Stores a question in the bank.
+
+        :param question: Instance of the class Question.
+        :param tag: Optional tag of the question as string.
+        :param difficulty: Optional difficulty of the question as integer.
+        """
+        db = SessionLocal()
+        try:
+            db.execute(
+                """INSERT INTO bank_questions
+                   (bank, question_type, question_text, correct_answer, possible_answers,
+                    tag, difficulty, rand_key)
+                   VALUES (:bank, :question_type, :question_text, :correct_answer,
+                           :possible_answers, :tag, :difficulty, :rand_key)""",
+                {
+                    "bank": self.name,
+                    "question_type": question.__class__.__name__,
+                    "question_text": question.question,
+                    "correct_answer": question.correct_answer,
+                    "possible_answers": json.dumps(question.possible_answers)
+                    if isinstance(question, QuestionChoice) else None,
+                    "tag": tag,
+                    "difficulty": difficulty,
+                    "rand_key": random.random()
+                }
+            )
+            db.commit()
+        finally:
+            db.close()
+
+    def size(self):
+        """
+        Counts the questions of the bank.
+
+        :returns: Number of questions.
+        """
+        db = SessionLocal()
+        try:
+            return db.execute(
+                "SELECT COUNT(*) FROM bank_questions WHERE bank = :bank",
+                {"bank": self.name}
+            ).scalar()
+        finally:
+            db.close()
+
+    def sample(self, count, stratify_by=None):
+        """
+        Draws random questions of the bank.
+        If the bank has fewer questions, all of them are returned.
+
+        :param count: Number of questions to draw.
+        :param stratify_by: Optional column ('tag' or 'difficulty'). Every value of the column
+            gets a share of the sample proportional to its number of questions.
+        :returns: List of new question instances in random order.
+        :raises ValueError: If the sample can't be stratified by the column.
+        """
+        if stratify_by is not None and stratify_by not in STRATA:
+            raise ValueError("Can't stratify by '{}'".format(stratify_by))
+        if count <= 0:
+            return []
+
+        db = SessionLocal()
+        try:
+            if stratify_by is None:
+                rows = self._draw(db, "", {}, count)
+            else:
+                sizes = dict(db.execute(
+                    "SELECT {0}, COUNT(*) FROM bank_questions WHERE bank = :bank "
+                    "GROUP BY {0}".format(stratify_by),
+                    {"bank": self.name}
+                ).fetchall())
+                rows = []
+                for stratum, quota in allocate_quotas(sizes, count).items():
+                    if stratum is None:
+                        condition = " AND {} IS NULL".format(stratify_by)
+                    else:
+                        condition = " AND {} = :stratum".format(stratify_by)
+                    rows += self._draw(db, condition, {"stratum": stratum}, quota)
+        finally:
+            db.close()
+
+        random.shuffle(rows)
+        return [build_question(row.question_type, row.question_text, row.correct_answer,
+                               json.loads(row.possible_answers) if row.possible_answers else None)
+                for row in rows]
+
+    def _draw(self, db, condition, params, count):
+        """
+        Reads rows of the bank from random positions of the key index.
+
+        :param db: Database session.
+        :param condition: Additional SQL condition of the rows.
+        :param params: Parameters of the condition.
+        :param count: Number of rows to draw.
+        :returns: List of distinct rows.
+        """
+        query = ("SELECT id, question_type, question_text, correct_answer, possible_answers "
+                 "FROM bank_questions WHERE bank = :bank" + condition +
+                 " AND rand_key {} :rand_key ORDER BY rand_key LIMIT :limit")
+        params = dict(params, bank=self.name)
+        chunk = -(-count // SAMPLE_PROBES)
+        drawn = dict()
+
+        for _ in range(SAMPLE_PROBES):
+            limit = min(chunk, count - len(drawn))
+            if limit <= 0:
+                break
+            rows = self._read(db, query, params, limit)
+            for row in rows:
+                drawn.setdefault(row.id, row)
+            if len(rows) < limit:
+                # Every row of the bank was read
+                return list(drawn.values())
+
+        if len(drawn) < count:
+            # Some probes overlapped, so one range is read which surely has enough new rows
+            for row in self._read(db, query, params, count):
+                if len(drawn) == count:
+                    break
+                drawn.setdefault(row.id, row)
+        return list(drawn.values())
+
+    @staticmethod
+    def _read(db, query, params, limit):
+        """
+        Reads the rows following a random key and wraps around at the end of the key range.
+
+        :returns: List of at most limit rows.
+        """
+        params = dict(params, rand_key=random.random(), limit=limit)
+        rows = db.execute(query.format('>='), params).fetchall()
+        if len(rows) < limit:
+            params['limit'] = limit - len(rows)
+            rows += db.execute(query.format('<'), params).fetchall()
+        return rows
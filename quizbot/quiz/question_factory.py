@@ -11,7 +11,8 @@ class Question:
     def __init__(self, question, correct_answer):
         """
         Initialize a question by the question and the correct answer.
-        Additionally, it initializes the user answer as an empty string.
+        Additionally, it initializes the user answer as an empty string
+        and marks the question as not saved.
 
         :param question: Question of the question-instance as string.
         :param correct_answer: Correct answer of the question in (question specific) type.
@@ -21,6 +22,26 @@ class Question:
         self.question = question
         self.correct_answer = correct_answer
         self.user_answer = str()
+        self.question_id = None
+        self.saved_fingerprint = None
+
+    def fingerprint(self):
+        """
+        Returns the stored content of the question.
+
+        :returns: Tuple of the question type, the question and the correct answer.
+        """
+        return (type(self).__name__, self.question, self.correct_answer)
+
+    def mark_saved(self, question_id):
+        """
+        Remembers the ID and the content of the question in the database.
+        A saved question is shared by the next version of its quiz if it isn't changed.
+
+        :param question_id: ID of the question in the database.
+        """
+        self.question_id = question_id
+        self.saved_fingerprint = self.fingerprint()
 
     def check_solution(self):
         """
@@ -158,6 +179,15 @@ class QuestionChoice(Question):
         self.is_random = False
         self.possible_answers = correct_answer.split(', ')
 
+    def fingerprint(self):
+        """
+        Returns the stored content of the question.
+
+        :returns: Tuple of the question type, the question, the correct answer
+            and the possible answers.
+        """
+        return super().fingerprint() + (tuple(self.possible_answers),)
+
     def add_possible_answer(self, new_answer):
         """
         Adds an answer to the list of possible answers.
@@ -208,3 +238,42 @@ class QuestionChoiceSingle(QuestionChoice):
         """
         assert len(answer.split(", ")) == 1
         return super().enter_solution(answer)
+
+
+# Question classes by the type name stored in the database
+QUESTION_TYPES = {
+    question_class.__name__: question_class
+    for question_class in (QuestionString, QuestionNumber, QuestionBool,
+                           QuestionChoice, QuestionChoiceSingle)
+}
+
+# Stable numeric codes of the question types used by the binary formats
+QUESTION_TYPE_CODES = {
+    'QuestionString': 1,
+    'QuestionNumber': 2,
+    'QuestionBool': 3,
+    'QuestionChoice': 4,
+    'QuestionChoiceSingle': 5,
+}
+
+
+def build_question(question_type, question, correct_answer, possible_answers=None,
+                   is_random=False):
+    """
+    Creates a question instance from its stored fields.
+
+    :param question_type: Class name of the question, e.g. "QuestionBool".
+    :param question: Question of the question-instance as string.
+    :param correct_answer: Correct answer of the question as string.
+    :param possible_answers: Possible answers of a choice question as list.
+    :param is_random: Whether the possible answers of a choice question are shuffled.
+    :returns: New instance of the question type.
+    :raises KeyError: If the question type is unknown.
+    :raises AssertionError: If the fields are invalid for the question type.
+    """
+    new_question = QUESTION_TYPES[question_type](question, correct_answer)
+    if isinstance(new_question, QuestionChoice):
+        if possible_answers:
+            new_question.possible_answers = list(possible_answers)
+        new_question.is_random = is_random
+    return new_question
@@ -1,23 +1,11 @@
 """
 With this module, you can create quizzes with questions of different kinds.
 """
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-import os
-from quizbot.quiz.question_factory import (
-    Question, QuestionString, QuestionNumber, 
-    QuestionBool, QuestionChoice, QuestionChoiceSingle
-)
+from quizbot.quiz.database import SessionLocal
+from quizbot.quiz.question_factory import Question, QuestionChoice, build_question
+from quizbot.quiz.question_bank import QuestionBank
 from typing import List
 import json
-from dotenv import load_dotenv
-
-load_dotenv()
-
-# MySQL Connection
-DATABASE_URL = os.getenv("DATABASE_URL", "mysql+mysqlconnector://root@localhost/quizbot")
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 class Quiz:
     """
@@ -26,6 +14,8 @@ class Quiz:
         - the order of the questions is random
         - the result of the entered answer is shown after the question
         - the result of the entered answer of every question is shown after the quiz
+    Additionally, a quiz can draw random questions of a question bank for every attempt.
+    Every save creates a new immutable version of the quiz.
     """
 
     def __init__(self, author="", name="") -> None:
@@ -40,6 +30,11 @@ class Quiz:
         self.name = name
         self.show_results_after_quiz = True
         self.show_results_after_question = True
+        self.bank = None
+        self.bank_draw_count = 0
+        self.bank_stratify_by = None
+        self.id = None
+        self.version = 0
 
     def add_question(self, new_question: Question):
         """
@@ -48,122 +43,345 @@ class Quiz:
         """
         self.questions.append(new_question)
 
+    def draw_from_bank(self, bank, count, stratify_by=None):
+        """
+        Lets every attempt draw random questions of a question bank
+        in addition to the questions of the quiz.
+        :param bank: Name of the question bank.
+        :param count: Number of questions to draw.
+        :param stratify_by: Optional column ('tag' or 'difficulty') to stratify the draw by.
+        :raises AssertionError: If the number of questions isn't positive.
+        """
+        assert count > 0
+        self.bank = bank
+        self.bank_draw_count = count
+        self.bank_stratify_by = stratify_by
+
     def get_questions(self):
         """
         Returns a copy of the list of questions.
+        If the quiz draws from a question bank, a new sample is added on every call.
         :returns: List of questions.
         """
-        return self.questions.copy()
+        if self.bank is None:
+            return self.questions.copy()
+        return self.questions + QuestionBank(self.bank).sample(
+            self.bank_draw_count, self.bank_stratify_by)
+
+    @property
+    def etag(self):
+        """
+        Identifies the saved version of the quiz, e.g. as cache key or HTTP ETag.
+        :returns: String of the quiz ID and the version or None if the quiz isn't saved.
+        """
+        if self.id is None:
+            return None
+        return '{}-{}'.format(self.id, self.version)
 
     def save_to_db(self):
-        """Save quiz to MySQL database"""
+        """
+        Save quiz to MySQL database as a new version.
+        Saved versions are immutable: questions which weren't changed since they were
+        loaded or saved are shared with the previous version instead of being inserted again.
+        """
         db = SessionLocal()
         try:
-            # First insert/update the quiz
-            quiz_data = {
+            settings = {
                 "name": self.name,
                 "author": self.author,
                 "is_random": self.is_random,
                 "show_results_after_quiz": self.show_results_after_quiz,
-                "show_results_after_question": self.show_results_after_question
+                "show_results_after_question": self.show_results_after_question,
+                "bank": self.bank,
+                "bank_draw_count": self.bank_draw_count,
+                "bank_stratify_by": self.bank_stratify_by
             }
-            
-            # Insert quiz and get its ID
-            result = db.execute(
-                """INSERT INTO quizzes 
-                   (name, author, is_random, show_results_after_quiz, show_results_after_question)
-                   VALUES (:name, :author, :is_random, :show_results_after_quiz, 
-                          :show_results_after_question)
-                   ON DUPLICATE KEY UPDATE
-                   author=:author, is_random=:is_random,
-                   show_results_after_quiz=:show_results_after_quiz,
-                   show_results_after_question=:show_results_after_question""",
-                quiz_data
+
+            # Increment the version of an existing quiz. The update locks the row,
+            # so concurrent saves get consecutive versions.
+            updated = db.execute(
+                """UPDATE quizzes SET
+                   is_random=:is_random, show_results_after_quiz=:show_results_after_quiz,
+                   show_results_after_question=:show_results_after_question,
+                   bank=:bank, bank_draw_count=:bank_draw_count,
+                   bank_stratify_by=:bank_stratify_by, version=version + 1
+                   WHERE name = :name AND author = :author""",
+                settings
             )
-            db.commit()
-            
-            # Get quiz ID
-            quiz_id = db.execute(
-                "SELECT id FROM quizzes WHERE name = :name",
-                {"name": self.name}
-            ).scalar()
-            
-            # Delete old questions
-            db.execute("DELETE FROM questions WHERE quiz_id = :quiz_id", {"quiz_id": quiz_id})
-            
-            # Insert new questions
-            for q in self.questions:
-                question_data = {
-                    "quiz_id": quiz_id,
-                    "question_type": q.__class__.__name__,
-                    "question_text": q.question,
-                    "correct_answer": q.correct_answer,
-                    "possible_answers": json.dumps(q.possible_answers) if hasattr(q, 'possible_answers') else None
-                }
+            if updated.rowcount == 0:
                 db.execute(
-                    """INSERT INTO questions 
-                       (quiz_id, question_type, question_text, correct_answer, possible_answers)
-                       VALUES (:quiz_id, :question_type, :question_text, :correct_answer, 
-                              :possible_answers)""",
-                    question_data
+                    """INSERT INTO quizzes
+                       (name, author, is_random, show_results_after_quiz,
+                        show_results_after_question, bank, bank_draw_count, bank_stratify_by,
+                        version)
+                       VALUES (:name, :author, :is_random, :show_results_after_quiz,
+                              :show_results_after_question, :bank, :bank_draw_count,
+                              :bank_stratify_by, 1)""",
+                    settings
                 )
-            
+            quiz_id, version = db.execute(
+                "SELECT id, version FROM quizzes WHERE name = :name AND author = :author",
+                settings
+            ).fetchone()
+
+            db.execute(
+                """INSERT INTO quiz_versions
+                   (quiz_id, version, is_random, show_results_after_quiz,
+                    show_results_after_question, bank, bank_draw_count, bank_stratify_by)
+                   VALUES (:quiz_id, :version, :is_random, :show_results_after_quiz,
+                          :show_results_after_question, :bank, :bank_draw_count,
+                          :bank_stratify_by)""",
+                dict(settings, quiz_id=quiz_id, version=version)
+            )
+
+            # Link the questions to the new version, insert only new or changed ones
+            question_ids = []
+            for position, q in enumerate(self.questions):
+                question_id = q.question_id
+                if question_id is None or q.saved_fingerprint != q.fingerprint():
+                    question_id = db.execute(
+                        """INSERT INTO questions
+                           (quiz_id, question_type, question_text, correct_answer,
+                            possible_answers)
+                           VALUES (:quiz_id, :question_type, :question_text, :correct_answer,
+                                  :possible_answers)""",
+                        {
+                            "quiz_id": quiz_id,
+                            "question_type": q.__class__.__name__,
+                            "question_text": q.question,
+                            "correct_answer": q.correct_answer,
+                            "possible_answers": json.dumps(q.possible_answers)
+                            if isinstance(q, QuestionChoice) else None
+                        }
+                    ).lastrowid
+                db.execute(
+                    """INSERT INTO quiz_questions (quiz_id, version, position, question_id)
+                       VALUES (:quiz_id, :version, :position, :question_id)""",
+                    {"quiz_id": quiz_id, "version": version, "position": position,
+                     "question_id": question_id}
+                )
+                question_ids.append(question_id)
+
+            db.commit()
+        finally:
+            db.close()
+
+        # Only mark the instance as saved after the commit succeeded
+        self.id = quiz_id
+        self.version = version
+        for q, question_id in zip(self.questions, question_ids):
+            q.mark_saved(question_id)
+
+    @staticmethod
+    def clone(name: str, author: str, new_name: str, new_author: str):
+        """
+        Copies the latest version of a quiz to a new quiz.
+        The copy shares the questions of the original, so only the settings and the links
+        to the questions are written, independent of the number of questions.
+        Editing a question of the copy creates a new question (copy-on-write).
+        :param name: Name of the quiz to copy
+        :param author: Author of the quiz to copy
+        :param new_name: Name of the copy
+        :param new_author: Author of the copy
+        :returns: ID of the copy or None if the quiz to copy was not found
+        :raises ValueError: If the author of the copy already has a quiz with its name
+        """
+        db = SessionLocal()
+        try:
+            source = db.execute(
+                "SELECT id, version FROM quizzes WHERE name = :name AND author = :author",
+                {"name": name, "author": author}
+            ).first()
+            if source is None:
+                return None
+            if db.execute(
+                    "SELECT id FROM quizzes WHERE name = :name AND author = :author",
+                    {"name": new_name, "author": new_author}).first() is not None:
+                raise ValueError("Quiz '{}' of {} already exists".format(new_name, new_author))
+
+            settings = db.execute(
+                """SELECT is_random, show_results_after_quiz, show_results_after_question,
+                          bank, bank_draw_count, bank_stratify_by
+                   FROM quiz_versions WHERE quiz_id = :quiz_id AND version = :version""",
+                {"quiz_id": source.id, "version": source.version}
+            ).first()
+            params = dict(settings._mapping, name=new_name, author=new_author,
+                          source_id=source.id, source_version=source.version)
+
+            params["quiz_id"] = db.execute(
+                """INSERT INTO quizzes
+                   (name, author, is_random, show_results_after_quiz,
+                    show_results_after_question, bank, bank_draw_count, bank_stratify_by,
+                    version)
+                   VALUES (:name, :author, :is_random, :show_results_after_quiz,
+                          :show_results_after_question, :bank, :bank_draw_count,
+                          :bank_stratify_by, 1)""",
+                params
+            ).lastrowid
+            db.execute(
+                """INSERT INTO quiz_versions
+                   (quiz_id, version, is_random, show_results_after_quiz,
+                    show_results_after_question, bank, bank_draw_count, bank_stratify_by)
+                   VALUES (:quiz_id, 1, :is_random, :show_results_after_quiz,
+                          :show_results_after_question, :bank, :bank_draw_count,
+                          :bank_stratify_by)""",
+                params
+            )
+            # Share the questions of the original in one statement
+            db.execute(
+                """INSERT INTO quiz_questions (quiz_id, version, position, question_id)
+                   SELECT :quiz_id, 1, position, question_id FROM quiz_questions
+                   WHERE quiz_id = :source_id AND version = :source_version""",
+                params
+            )
+            db.commit()
+            return params["quiz_id"]
+        finally:
+            db.close()
+
+    @staticmethod
+    def rename(name: str, author: str, new_name: str):
+        """
+        Renames a quiz, its versions keep their questions.
+        :param name: Name of the quiz
+        :param author: Author of the quiz
+        :param new_name: New name of the quiz
+        :returns: Whether the quiz was found
+        :raises ValueError: If the author already has a quiz with the new name
+        """
+        db = SessionLocal()
+        try:
+            if db.execute(
+                    "SELECT id FROM quizzes WHERE name = :name AND author = :author",
+                    {"name": new_name, "author": author}).first() is not None:
+                raise ValueError("Quiz '{}' of {} already exists".format(new_name, author))
+            renamed = db.execute(
+                "UPDATE quizzes SET name = :new_name WHERE name = :name AND author = :author",
+                {"name": name, "author": author, "new_name": new_name}
+            ).rowcount
             db.commit()
+            return renamed > 0
         finally:
             db.close()
 
     @staticmethod
-    def load_from_db(name: str, author: str = None):
+    def delete(name: str, author: str):
+        """
+        Deletes a quiz with all its versions.
+        Questions which copies of the quiz share are kept and handed over to a copy.
+        :param name: Name of the quiz
+        :param author: Author of the quiz
+        :returns: Whether the quiz was found
+        """
+        db = SessionLocal()
+        try:
+            row = db.execute(
+                "SELECT id FROM quizzes WHERE name = :name AND author = :author",
+                {"name": name, "author": author}
+            ).first()
+            if row is None:
+                return False
+            params = {"quiz_id": row.id}
+            db.execute("DELETE FROM quiz_questions WHERE quiz_id = :quiz_id", params)
+            db.execute("DELETE FROM quiz_versions WHERE quiz_id = :quiz_id", params)
+            db.execute(
+                """DELETE FROM questions WHERE quiz_id = :quiz_id AND id NOT IN
+                   (SELECT question_id FROM quiz_questions)""",
+                params
+            )
+            # The remaining questions are shared by copies, one of them owns them now
+            db.execute(
+                """UPDATE questions SET quiz_id =
+                   (SELECT MIN(quiz_id) FROM quiz_questions
+                    WHERE quiz_questions.question_id = questions.id)
+                   WHERE quiz_id = :quiz_id""",
+                params
+            )
+            db.execute("DELETE FROM quizzes WHERE id = :quiz_id", params)
+            db.commit()
+            return True
+        finally:
+            db.close()
+
+    @staticmethod
+    def get_version(name: str, author: str = None):
+        """
+        Looks up the latest version of a quiz without loading it,
+        e.g. to check whether a cached quiz is stale.
+        :param name: Name of the quiz
+        :param author: Optional author of the quiz
+        :returns: Pair of quiz ID and latest version or None if not found
+        """
+        db = SessionLocal()
+        try:
+            query = "SELECT id, version FROM quizzes WHERE name = :name"
+            params = {"name": name}
+            if author:
+                query += " AND author = :author"
+                params["author"] = author
+            row = db.execute(query, params).first()
+            return None if row is None else (row.id, row.version)
+        finally:
+            db.close()
+
+    @staticmethod
+    def load_from_db(name: str, author: str = None, version: int = None):
         """
         Load quiz from MySQL database
         :param name: Name of the quiz to load
         :param author: Optional author of the quiz
+        :param version: Optional version of the quiz, the latest version by default
         :returns: Quiz object or None if not found
         """
         db = SessionLocal()
         try:
             # First get the quiz
-            query = """
-                SELECT q.*, qq.question_type, qq.question_text, 
-                       qq.correct_answer, qq.possible_answers 
-                FROM quizzes q
-                LEFT JOIN questions qq ON q.id = qq.quiz_id
-                WHERE q.name = :name
-            """
+            query = "SELECT id, name, author, version FROM quizzes WHERE name = :name"
             params = {"name": name}
             if author:
-                query += " AND q.author = :author"
+                query += " AND author = :author"
                 params["author"] = author
+            quiz_row = db.execute(query, params).first()
 
-            result = db.execute(query, params).fetchall()
-            
-            if not result:
+            if not quiz_row:
                 return None
 
-            # Create quiz instance from first row
-            quiz = Quiz(author=result[0].author, name=result[0].name)
-            quiz.is_random = result[0].is_random
-            quiz.show_results_after_quiz = result[0].show_results_after_quiz
-            quiz.show_results_after_question = result[0].show_results_after_question
-
-            # Add each question
-            for row in result:
-                if row.question_text:  # Skip if no question (in case of LEFT JOIN)
-                    if row.question_type == "QuestionString":
-                        question = QuestionString(row.question_text, row.correct_answer)
-                    elif row.question_type == "QuestionNumber":
-                        question = QuestionNumber(row.question_text, row.correct_answer)
-                    elif row.question_type == "QuestionBool":
-                        question = QuestionBool(row.question_text, row.correct_answer)
-                    elif row.question_type == "QuestionChoice":
-                        question = QuestionChoice(row.question_text, row.correct_answer)
-                        if row.possible_answers:
-                            question.possible_answers = json.loads(row.possible_answers)
-                    elif row.question_type == "QuestionChoiceSingle":
-                        question = QuestionChoiceSingle(row.question_text, row.correct_answer)
-                        if row.possible_answers:
-                            question.possible_answers = json.loads(row.possible_answers)
-                    quiz.add_question(question)
+            # Get the settings of the version
+            version_row = db.execute(
+                """SELECT * FROM quiz_versions
+                   WHERE quiz_id = :quiz_id AND version = :version""",
+                {"quiz_id": quiz_row.id, "version": version or quiz_row.version}
+            ).first()
+
+            if not version_row:
+                return None
+
+            quiz = Quiz(author=quiz_row.author, name=quiz_row.name)
+            quiz.id = quiz_row.id
+            quiz.version = version_row.version
+            quiz.is_random = version_row.is_random
+            quiz.show_results_after_quiz = version_row.show_results_after_quiz
+            quiz.show_results_after_question = version_row.show_results_after_question
+            quiz.bank = version_row.bank
+            quiz.bank_draw_count = version_row.bank_draw_count or 0
+            quiz.bank_stratify_by = version_row.bank_stratify_by
+
+            # Add each question of the version in order
+            rows = db.execute(
+                """SELECT qq.id, qq.question_type, qq.question_text,
+                          qq.correct_answer, qq.possible_answers
+                   FROM quiz_questions l
+                   JOIN questions qq ON qq.id = l.question_id
+                   WHERE l.quiz_id = :quiz_id AND l.version = :version
+                   ORDER BY l.position""",
+                {"quiz_id": quiz.id, "version": quiz.version}
+            ).fetchall()
+            for row in rows:
+                question = build_question(
+                    row.question_type, row.question_text, row.correct_answer,
+                    json.loads(row.possible_answers) if row.possible_answers else None)
+                question.mark_saved(row.id)
+                quiz.add_question(question)
 
             return quiz
         finally:
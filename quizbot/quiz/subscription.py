@@ -0,0 +1,251 @@
+"""
+With this module, chats subscribe to the quiz of the day and the broadcast of the
+quiz keeps its progress in the database.
+
+The subscribers are read in batches in the order of their chat ID, each batch starts
+after the last chat ID of the previous one (keyset pagination). So no batch scans
+the rows before it and no list of all subscribers is held in memory. The broadcast
+of a day stores the last chat ID it sent to as checkpoint, a restarted broadcast
+continues after it. Only the worker which holds the lease of a broadcast sends it.
+"""
+import datetime
+import time
+from sqlalchemy.exc import IntegrityError
+from quizbot.quiz.database import SessionLocal
+
+
+def subscribe(chat_id, username=None):
+    """
+    Subscribes a chat to the quiz of the day.
+
+    :param chat_id: ID of the chat.
+    :param username: Optional username of the subscriber.
+    :returns: Whether the chat wasn't subscribed before.
+    """
+    db = SessionLocal()
+    try:
+        if db.execute("SELECT 1 FROM daily_subscribers WHERE chat_id = :chat_id",
+                      {"chat_id": chat_id}).first():
+            return False
+        db.execute(
+            """INSERT INTO daily_subscribers (chat_id, username, subscribed_at)
+               VALUES (:chat_id, :username, :subscribed_at)""",
+            {"chat_id": chat_id, "username": username,
+             "subscribed_at": datetime.datetime.utcnow()})
+        db.commit()
+        return True
+    except IntegrityError:
+        # The chat subscribed twice at the same time
+        db.rollback()
+        return False
+    finally:
+        db.close()
+
+
+def unsubscribe(chat_id):
+    """
+    Ends the subscription of a chat.
+
+    :param chat_id: ID of the chat.
+    :returns: Whether the chat was subscribed.
+    """
+    db = SessionLocal()
+    try:
+        removed = db.execute("DELETE FROM daily_subscribers WHERE chat_id = :chat_id",
+                             {"chat_id": chat_id}).rowcount
+        db.commit()
+        return removed > 0
+    finally:
+        db.close()
+
+
+def subscriber_batch(after, limit):
+    """
+    Reads the next subscribers in the order of their chat ID.
+
+    :param after: Last chat ID of the previous batch, None to start at the beginning.
+    :param limit: Maximum number of subscribers.
+    :returns: List of chat IDs.
+    """
+    db = SessionLocal()
+    try:
+        if after is None:
+            rows = db.execute("SELECT chat_id FROM daily_subscribers ORDER BY chat_id "
+                              "LIMIT :limit", {"limit": limit}).fetchall()
+        else:
+            rows = db.execute("SELECT chat_id FROM daily_subscribers WHERE chat_id > :after "
+                              "ORDER BY chat_id LIMIT :limit",
+                              {"after": after, "limit": limit}).fetchall()
+        return [row.chat_id for row in rows]
+    finally:
+        db.close()
+
+
+def load_run(day):
+    """
+    Loads the broadcast of a day.
+
+    :param day: Day as ISO string, e.g. '2026-10-19'.
+    :returns: Row with the quiz, the last chat ID sent to, the counters and the lease or None.
+    """
+    db = SessionLocal()
+    try:
+        return db.execute("SELECT * FROM daily_runs WHERE day = :day", {"day": day}).first()
+    finally:
+        db.close()
+
+
+def start_run(day, quiz_name, quiz_author=None):
+    """
+    Creates the broadcast of a day, unless it exists already. Several workers may
+    create it at the same time, the first one wins and the lease decides who sends it.
+
+    :param day: Day as ISO string.
+    :param quiz_name: Name of the quiz of the day.
+    :param quiz_author: Optional author of the quiz.
+    :returns: Row of the broadcast.
+    """
+    db = SessionLocal()
+    try:
+        if not db.execute("SELECT 1 FROM daily_runs WHERE day = :day", {"day": day}).first():
+            db.execute(
+                """INSERT INTO daily_runs (day, quiz_name, quiz_author, sent, failed)
+                   VALUES (:day, :quiz_name, :quiz_author, 0, 0)""",
+                {"day": day, "quiz_name": quiz_name, "quiz_author": quiz_author})
+            db.commit()
+    except IntegrityError:
+        # Another worker created the broadcast between the SELECT and the INSERT
+        db.rollback()
+    finally:
+        db.close()
+    return load_run(day)
+
+
+def claim_run(day, owner, lease_seconds, now=None):
+    """
+    Takes the lease of an unfinished broadcast if nobody else holds it.
+
+    :param day: Day as ISO string.
+    :param owner: Name of the worker.
+    :param lease_seconds: Duration of the lease.
+    :param now: Current time in seconds since the epoch, by default now.
+    :returns: Whether the worker holds the lease.
+    """
+    now = time.time() if now is None else now
+    db = SessionLocal()
+    try:
+        claimed = db.execute(
+            """UPDATE daily_runs SET owner = :owner, lease_until = :lease_until
+               WHERE day = :day AND finished_at IS NULL
+               AND (owner = :owner OR lease_until IS NULL OR lease_until < :now)""",
+            {"day": day, "owner": owner, "lease_until": now + lease_seconds, "now": now}
+        ).rowcount
+        db.commit()
+        return claimed > 0
+    finally:
+        db.close()
+
+
+def checkpoint(day, owner, cursor, sent, failed, lease_seconds):
+    """
+    Stores the progress of a broadcast and extends the lease.
+
+    :param day: Day as ISO string.
+    :param owner: Name of the worker which holds the lease.
+    :param cursor: Last chat ID which was sent to.
+    :param sent: Number of sent messages.
+    :param failed: Number of failed messages.
+    :param lease_seconds: Duration of the extended lease.
+    :returns: Whether the worker still holds the lease.
+    """
+    db = SessionLocal()
+    try:
+        updated = db.execute(
+            """UPDATE daily_runs SET last_chat_id = :cursor, sent = :sent, failed = :failed,
+                   lease_until = :lease_until
+               WHERE day = :day AND owner = :owner""",
+            {"day": day, "owner": owner, "cursor": cursor, "sent": sent, "failed": failed,
+             "lease_until": time.time() + lease_seconds}
+        ).rowcount
+        db.commit()
+        return updated > 0
+    finally:
+        db.close()
+
+
+def finish_run(day):
+    """
+    Marks the broadcast of a day as finished.
+
+    :param day: Day as ISO string.
+    """
+    db = SessionLocal()
+    try:
+        db.execute("UPDATE daily_runs SET finished_at = :finished_at, lease_until = NULL "
+                   "WHERE day = :day",
+                   {"day": day, "finished_at": datetime.datetime.utcnow()})
+        db.commit()
+    finally:
+        db.close()
+
+
+def record_failure(day, chat_id, error):
+    """
+    Records a failed delivery, a repeated failure counts another try.
+
+    :param day: Day as ISO string.
+    :param chat_id: ID of the chat.
+    :param error: Description of the error.
+    """
+    db = SessionLocal()
+    try:
+        params = {"day": day, "chat_id": chat_id, "error": str(error)[:1000],
+                  "failed_at": datetime.datetime.utcnow()}
+        if not db.execute(
+                """UPDATE daily_failures SET tries = tries + 1, error = :error,
+                       failed_at = :failed_at
+                   WHERE day = :day AND chat_id = :chat_id""", params).rowcount:
+            db.execute(
+                """INSERT INTO daily_failures (day, chat_id, error, tries, failed_at)
+                   VALUES (:day, :chat_id, :error, 1, :failed_at)""", params)
+        db.commit()
+    finally:
+        db.close()
+
+
+def clear_failure(day, chat_id):
+    """
+    Removes a failed delivery after it succeeded.
+
+    :param day: Day as ISO string.
+    :param chat_id: ID of the chat.
+    """
+    db = SessionLocal()
+    try:
+        db.execute("DELETE FROM daily_failures WHERE day = :day AND chat_id = :chat_id",
+                   {"day": day, "chat_id": chat_id})
+        db.commit()
+    finally:
+        db.close()
+
+
+def failure_batch(day, after, limit, max_tries):
+    """
+    Reads the next failed deliveries of a day which are retried, in the order of the chat ID.
+
+    :param day: Day as ISO string.
+    :param after: Last chat ID of the previous batch, None to start at the beginning.
+    :param limit: Maximum number of failures.
+    :param max_tries: Failures with this many tries aren't retried anymore.
+    :returns: List of chat IDs.
+    """
+    db = SessionLocal()
+    try:
+        rows = db.execute(
+            "SELECT chat_id FROM daily_failures WHERE day = :day AND tries < :max_tries "
+            "AND chat_id > :after ORDER BY chat_id LIMIT :limit",
+            {"day": day, "max_tries": max_tries, "limit": limit,
+             "after": -2 ** 63 if after is None else after}).fetchall()
+        return [row.chat_id for row in rows]
+    finally:
+        db.close()
@@ -728,7 +728,11 @@ async def on_startup(app: Application) -> None:
 # -------------------------------
 def main():
     TOKEN = "7699629853:AAHwJfx-IOBtndlnrTyzJ9G3YKKp-367BhU"
-    app = Application.builder().token(TOKEN).build()
+    builder = Application.builder().token(TOKEN)
+    if os.environ.get("TELEGRAM_BASE_URL"):
+        # e.g. the fake Bot API of quizbot.bot.fake_telegram for load tests
+        builder = builder.base_url(os.environ["TELEGRAM_BASE_URL"])
+    app = builder.build()
 
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("export_quizzes", export_quizzes_handler))
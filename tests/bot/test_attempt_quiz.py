@@ -0,0 +1,191 @@
+"""
+Tests the module quizbot.bot.attempt_quiz
+"""
+from types import SimpleNamespace
+import pytest
+from telegram import Poll, User
+from telegram.error import TimedOut
+from telegram.ext import ConversationHandler
+from quizbot.bot import attempt_quiz
+from quizbot.bot.attempt_quiz import poll_options
+from quizbot.bot.send_queue import outbound
+from quizbot.quiz.attempt import Attempt
+from quizbot.quiz.question_factory import QuestionBool, QuestionChoice, QuestionChoiceSingle, \
+    QuestionString
+from quizbot.quiz.quiz import Quiz
+
+USER = User(7, 'Player', False, username='player')
+
+
+class PollBot:
+    """Records the sent messages and polls."""
+
+    def __init__(self):
+        self.sent = []
+
+    def send_message(self, chat_id, text, **_):
+        self.sent.append(('message', chat_id, text))
+        return SimpleNamespace(message_id=len(self.sent))
+
+    def send_poll(self, chat_id, question, options, **kwargs):
+        self.sent.append(('poll', chat_id, question, options, kwargs))
+        return SimpleNamespace(message_id=len(self.sent),
+                               poll=SimpleNamespace(id=str(len(self.sent))))
+
+
+@pytest.fixture(name='ended')
+def fixture_ended(monkeypatch):
+    """Enables the quiz polls and records the ended conversations."""
+    ended = []
+    monkeypatch.setattr(attempt_quiz, 'poll_open_period', 30)
+    monkeypatch.setattr(attempt_quiz, 'end_conversation',
+                        lambda user_id, _, reason: ended.append((user_id, reason)))
+    yield ended
+    attempt_quiz.userDict.clear()
+    attempt_quiz.polls.clear()
+
+
+def create_quiz():
+    """Creates a quiz with a true/false, a single choice and a string question."""
+    quiz = Quiz('alice', 'Polls')
+    quiz.show_results_after_quiz = False
+    quiz.add_question(QuestionBool('Is the earth round?', 'True'))
+    single = QuestionChoiceSingle('Which is a color?', 'red')
+    single.add_possible_answer('dog')
+    quiz.add_question(single)
+    quiz.add_question(QuestionString('Say hi', 'hi'))
+    return quiz
+
+
+def answer(poll_id, option_ids):
+    """Creates the update of a poll answer."""
+    return SimpleNamespace(poll_answer=SimpleNamespace(poll_id=poll_id, user=USER,
+                                                       option_ids=option_ids))
+
+
+def closed(poll_id):
+    """Creates the update of a closed poll."""
+    return SimpleNamespace(poll=SimpleNamespace(id=poll_id, is_closed=True))
+
+
+def test_poll_options():
+    """
+    Test that only true/false and single choice questions within the limits are polls.
+    """
+    assert poll_options(QuestionBool('Is it?', 'False')) == ['True', 'False']
+    single = QuestionChoiceSingle('Which?', 'a')
+    single.add_possible_answer('b')
+    assert poll_options(single) == ['a', 'b']
+    assert poll_options(QuestionChoice('Which?', 'a, b')) is None
+    assert poll_options(QuestionChoiceSingle('Which?', 'a')) is None
+    assert poll_options(QuestionString('Which?' * 100, 'a')) is None
+
+
+def test_poll_attempt(ended):
+    """
+    Test that poll answers are graded without a reply, a closed poll counts as wrong
+    and the conversation ends after the last question.
+    """
+    bot = PollBot()
+    context = SimpleNamespace(bot=bot)
+    attempt_quiz.userDict[USER.id] = Attempt(create_quiz())
+    attempt_quiz.ask_question(bot, USER.id, USER)
+    kind, chat_id, question, options, kwargs = bot.sent[-1]
+    assert (kind, chat_id, question, options) == ('poll', 7, 'Is the earth round?',
+                                                  ['True', 'False'])
+    assert kwargs['type'] == Poll.QUIZ and kwargs['correct_option_id'] == 0
+    assert kwargs['open_period'] == 30
+
+    attempt_quiz.enter_poll_answer(answer('1', [0]), context)
+    # A poll is graded once
+    attempt_quiz.close_poll(closed('1'), context)
+    assert bot.sent[-1][:3] == ('poll', 7, 'Which is a color?')
+    assert len(bot.sent) == 2
+
+    attempt_quiz.close_poll(closed('2'), context)
+    assert bot.sent[-1] == ('message', 7, 'Say hi')
+    assert [is_correct for is_correct, _ in attempt_quiz.userDict[USER.id].user_points] \
+        == [True, False]
+
+    # The last question is answered with a message
+    message = SimpleNamespace(from_user=USER, text='hi',
+                              reply_text=lambda text, **_: bot.send_message(7, text))
+    update = SimpleNamespace(message=message, effective_message=message,
+                             effective_chat=SimpleNamespace(id=7))
+    assert attempt_quiz.enter_answer(update, context) == ConversationHandler.END
+    assert not ended
+
+    # An attempt which ends with a poll answer ends the conversation
+    quiz = Quiz('alice', 'Short')
+    quiz.add_question(QuestionBool('Is it?', 'False'))
+    attempt_quiz.userDict[USER.id] = Attempt(quiz)
+    attempt_quiz.ask_question(bot, USER.id, USER)
+    attempt_quiz.enter_poll_answer(answer(str(len(bot.sent)), [0]), context)
+    assert ended == [(7, 'finished by a poll')]
+    assert USER.id not in attempt_quiz.userDict
+
+
+def test_failed_results(ended):
+    """
+    Test that the last answer doesn't wait for the results and the attempt is closed
+    even if the results can't be sent.
+    """
+    class FailingBot(PollBot):
+        """Fails to send the results."""
+
+        def send_message(self, chat_id, text, **kwargs):
+            if 'Question 1:' in text:
+                raise TimedOut()
+            return super().send_message(chat_id, text, **kwargs)
+
+    quiz = Quiz('alice', 'Short')
+    quiz.add_question(QuestionBool('Is it?', 'False'))
+    attempt = Attempt(quiz)
+    attempt.input_answer('False')
+    attempt.enter_answer()
+    attempt_quiz.userDict[USER.id] = attempt
+    bot = FailingBot()
+    failed = outbound.stats()['failed']
+    outbound.start(bot)
+    try:
+        assert attempt_quiz.next_question(bot, 7, USER) == ConversationHandler.END
+        assert USER.id not in attempt_quiz.userDict
+    finally:
+        outbound.stop()
+    assert [text for _, _, text in bot.sent] == ['Thanks for your participation! ☺️']
+    assert outbound.stats()['failed'] == failed + 1
+    assert not ended
+
+
+def test_failed_poll(ended):
+    """
+    Test that a question whose poll can't be sent is asked with a keyboard.
+    """
+    class FailingBot(PollBot):
+        """Fails to send polls."""
+
+        def send_poll(self, chat_id, question, options, **kwargs):
+            raise TimedOut()
+
+    attempt_quiz.userDict[USER.id] = Attempt(create_quiz())
+    bot = FailingBot()
+    outbound.start(bot)
+    try:
+        attempt_quiz.ask_question(bot, USER.id, USER)
+    finally:
+        outbound.stop()
+    assert bot.sent == [('message', 7, 'Is the earth round?')]
+    assert len(attempt_quiz.polls) == 0
+
+
+def test_hidden_results(ended):
+    """
+    Test that a quiz which hides the results after every question isn't sent as quiz polls.
+    """
+    quiz = create_quiz()
+    quiz.show_results_after_question = False
+    attempt_quiz.userDict[USER.id] = Attempt(quiz)
+    bot = PollBot()
+    attempt_quiz.ask_question(bot, USER.id, USER)
+    assert bot.sent == [('message', 7, 'Is the earth round?')]
+    assert len(attempt_quiz.polls) == 0
@@ -0,0 +1,193 @@
+"""
+Tests the module quizbot.bot.cluster
+"""
+import json
+import threading
+import time
+import urllib.request
+from collections import Counter
+from quizbot.bot import cluster
+from quizbot.bot.cluster import HANDOFF_PATH, Cluster, ClusterRouter, HashRing, handoff_route, \
+    update_user_id
+from quizbot.bot.dedupe import UpdateWindow
+from quizbot.bot.webhook import SECRET_HEADER, WebhookServer
+
+
+class Worker:
+    """A worker which records the updates it processed and its handoffs."""
+
+    def __init__(self, name):
+        self.name = name
+        self.bot = None
+        self.updates = []
+        self.released = 0
+        self.server = WebhookServer(self, 0, secret_token='worker-secret', listen='127.0.0.1',
+                                    routes={HANDOFF_PATH: handoff_route(self, self)})
+        self.server.start()
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}/telegram'.format(self.server.port)
+
+    def process_update(self, update):
+        self.updates.append((update.effective_user.id, update.update_id))
+
+    def stats(self):
+        return {'pending': 0}
+
+    def release(self):
+        self.released += 1
+        return 0
+
+
+def message(update_id, user_id):
+    """Creates a text message update of a user."""
+    user = {'id': user_id, 'is_bot': False, 'first_name': 'User'}
+    return {'update_id': update_id, 'message': {
+        'message_id': update_id, 'date': 0, 'chat': {'id': user_id, 'type': 'private'},
+        'from': user, 'text': 'Hi'}}
+
+
+def post(router, data):
+    """POSTs an update to the router and returns the status code."""
+    request = urllib.request.Request(
+        'http://127.0.0.1:{}/telegram'.format(router.port), data=json.dumps(data).encode(),
+        headers={SECRET_HEADER: 'secret'})
+    with urllib.request.urlopen(request) as response:
+        return response.status
+
+
+def wait_for(condition, timeout=5.0):
+    """Waits until a condition is true."""
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_hash_ring():
+    """
+    Test that the keys are spread over the nodes and a removed node only moves its keys.
+    """
+    ring = HashRing(['a', 'b', 'c'])
+    owners = {key: ring.node_for(key) for key in range(3000)}
+    counts = Counter(owners.values())
+    assert all(700 < count < 1300 for count in counts.values())
+
+    ring.remove('b')
+    assert all(ring.node_for(key) == node for key, node in owners.items() if node != 'b')
+    assert {ring.node_for(key) for key, node in owners.items() if node == 'b'} <= {'a', 'c'}
+    assert HashRing().node_for(1) is None
+
+
+def test_update_user_id():
+    """
+    Test that the user of an update is found in the different kinds of updates.
+    """
+    assert update_user_id(message(1, 42)) == 42
+    assert update_user_id({'update_id': 1, 'callback_query': {'from': {'id': 7}}}) == 7
+    assert update_user_id({'update_id': 1, 'poll_answer': {'user': {'id': 8}}}) == 8
+    assert update_user_id({'update_id': 1, 'channel_post': {'chat': {'id': -5}}}) == -5
+    assert update_user_id({'update_id': 1, 'poll': {'id': '1'}}) is None
+
+
+def test_route_and_handoff():
+    """
+    Test that the updates of a user go to one worker in order and that the workers
+    hand their states over before a removed worker's users move.
+    """
+    workers = [Worker('a'), Worker('b')]
+    router = ClusterRouter({worker.name: worker.url for worker in workers}, 0,
+                           secret_token='secret', worker_secret='worker-secret',
+                           listen='127.0.0.1')
+    router.start()
+    try:
+        for update_id in range(60):
+            assert post(router, message(update_id, update_id % 6)) == 200
+        wait_for(lambda: sum(len(worker.updates) for worker in workers) == 60)
+
+        owners = dict()
+        for worker in workers:
+            for user_id in {user for user, _ in worker.updates}:
+                assert user_id not in owners
+                owners[user_id] = worker.name
+                assert [update for user, update in worker.updates if user == user_id] \
+                    == list(range(user_id, 60, 6))
+        assert set(owners.values()) == {'a', 'b'}
+
+        router.set_workers({'a': workers[0].url})
+        assert [worker.released for worker in workers] == [1, 1]
+        moved = [user_id for user_id, name in owners.items() if name == 'b']
+        assert post(router, message(100, moved[0])) == 200
+        wait_for(lambda: (moved[0], 100) in workers[0].updates)
+        assert router.stats()['workers'] == ['a']
+    finally:
+        router.stop()
+        for worker in workers:
+            worker.server.stop()
+
+
+def test_park_during_change():
+    """
+    Test that updates received while the workers change are forwarded afterwards.
+    """
+    worker = Worker('a')
+    router = ClusterRouter({'a': worker.url}, 0, worker_secret='worker-secret',
+                           listen='127.0.0.1')
+    router.start()
+    blocked = threading.Event()
+    original = worker.release
+
+    def slow_release():
+        blocked.set()
+        time.sleep(0.2)
+        return original()
+
+    worker.release = slow_release
+    try:
+        change = threading.Thread(target=router.set_workers, args=({'a': worker.url},))
+        change.start()
+        assert blocked.wait(5)
+        assert router.route(message(1, 5))
+        assert router.stats()['parked'] == 1
+        change.join()
+        wait_for(lambda: worker.updates == [(5, 1)])
+    finally:
+        router.stop()
+        worker.server.stop()
+
+
+def test_duplicates():
+    """
+    Test that the router forwards an update delivered again only once.
+    """
+    worker = Worker('a')
+    router = ClusterRouter({'a': worker.url}, 0, worker_secret='worker-secret',
+                           listen='127.0.0.1', window=UpdateWindow(10))
+    router.start()
+    try:
+        for update_id in (1, 2, 1, 2, 3):
+            assert router.route(message(update_id, 5))
+        wait_for(lambda: len(worker.updates) == 3)
+        time.sleep(0.1)
+        assert worker.updates == [(5, 1), (5, 2), (5, 3)]
+        assert router.stats()['duplicates'] == 2
+    finally:
+        router.stop()
+        worker.server.stop()
+
+
+def test_rate_share(monkeypatch):
+    """
+    Test that the workers share the global rate limit of the bot.
+    """
+    environments = []
+    monkeypatch.setattr(cluster.subprocess, 'Popen',
+                        lambda command, env: environments.append(env))
+    workers = Cluster(3, 0, 9000, global_rate=30.0)
+    try:
+        workers.start()
+        assert [float(env['OUTBOUND_GLOBAL_RATE']) for env in environments] == [10.0] * 3
+        assert [env['CLUSTER_NODE'] for env in environments] == workers.names
+    finally:
+        workers.router.stop()
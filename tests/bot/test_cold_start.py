@@ -0,0 +1,35 @@
+"""
+Tests the cold start of the module quizbot.bot.bot
+"""
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Maximum seconds to import the bot in a fresh interpreter
+IMPORT_BUDGET = 2.0
+
+# Drivers which are loaded on the first use of a database, not at import
+LAZY_MODULES = ('pymongo', 'mysql.connector')
+
+SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import quizbot.bot.bot
+print(json.dumps({'seconds': time.perf_counter() - start, 'modules': list(sys.modules)}))
+"""
+
+
+def test_import_budget():
+    """
+    Test that the bot is imported within the budget and without connecting to the databases.
+    """
+    process = subprocess.run([sys.executable, '-c', SCRIPT], cwd=ROOT, capture_output=True,
+                             text=True, check=True,
+                             env=dict(os.environ, MONGODB='mongodb://unreachable:1'))
+    result = json.loads(process.stdout.splitlines()[-1])
+
+    assert result['seconds'] < IMPORT_BUDGET
+    assert not [module for module in result['modules'] if module.startswith(LAZY_MODULES)]
@@ -0,0 +1,164 @@
+"""
+Tests the module quizbot.bot.daily
+"""
+from types import SimpleNamespace
+from telegram.error import TimedOut, Unauthorized
+from telegram.ext import ConversationHandler
+from quizbot.bot import attempt_quiz
+from quizbot.bot.daily import DailyBroadcast
+from quizbot.quiz.cache import quiz_cache
+from quizbot.quiz import subscription
+from quizbot.quiz.question_factory import QuestionBool
+from quizbot.quiz.quiz import Quiz
+
+DAY = '2026-10-19'
+
+
+class BroadcastBot:
+    """Records the messages and fails for some chats."""
+
+    def __init__(self, fail_once=(), blocked=(), on_send=None, failures=None):
+        self.sent = []
+        # Number of times the delivery to a chat fails
+        self.failures = dict.fromkeys(fail_once, 1)
+        self.failures.update(failures or {})
+        self.blocked = set(blocked)
+        self.on_send = on_send
+
+    def send_message(self, chat_id, text, reply_markup=None):
+        if self.on_send:
+            self.on_send(chat_id)
+        if chat_id in self.blocked:
+            raise Unauthorized('Forbidden: bot was blocked by the user')
+        if self.failures.get(chat_id):
+            self.failures[chat_id] -= 1
+            raise TimedOut()
+        self.sent.append((chat_id, text, reply_markup))
+
+
+def create_run(count):
+    """Saves the quiz of the day, subscribes count chats and creates the broadcast."""
+    quiz = Quiz('alice', 'Daily')
+    quiz.add_question(QuestionBool('Is water wet?', 'True'))
+    quiz.save_to_db()
+    for chat_id in range(count):
+        subscription.subscribe(chat_id)
+    subscription.start_run(DAY, 'Daily', 'alice')
+
+
+def broadcast(bot, owner='a'):
+    """Creates a broadcast which sends fast and retries at once."""
+    return DailyBroadcast(bot, DAY, owner, batch_size=10, rate=1000, retry_delay=0)
+
+
+def test_broadcast(database):
+    """
+    Test that every subscriber gets the quiz once, failed deliveries are retried
+    and chats which blocked the bot are unsubscribed.
+    """
+    create_run(25)
+    bot = BroadcastBot(fail_once=[3, 17], blocked=[9])
+    assert broadcast(bot).run()
+
+    chats = [chat_id for chat_id, _, _ in bot.sent]
+    assert sorted(chats) == [chat_id for chat_id in range(25) if chat_id != 9]
+    assert len(set(chats)) == len(chats)
+    assert chats[-2:] == [3, 17]
+    assert bot.sent[0][2].inline_keyboard[0][0].callback_data == 'daily:' + DAY
+    run = subscription.load_run(DAY)
+    assert (run.sent, run.failed, run.last_chat_id) == (24, 0, 24)
+    assert run.finished_at is not None
+    assert subscription.failure_batch(DAY, None, 10, 3) == []
+    assert 9 not in subscription.subscriber_batch(None, 100)
+    # A finished broadcast isn't sent again
+    assert broadcast(bot, 'b').run()
+    assert len(bot.sent) == 24
+
+
+def test_retry_counts(database):
+    """
+    Test that a chat which fails on every try counts as one failed delivery
+    and a chat which succeeds on a retry doesn't count.
+    """
+    create_run(10)
+    bot = BroadcastBot(failures={3: 2, 5: 5})
+    assert broadcast(bot).run()
+
+    assert sorted(chat_id for chat_id, _, _ in bot.sent) == [0, 1, 2, 3, 4, 6, 7, 8, 9]
+    run = subscription.load_run(DAY)
+    assert (run.sent, run.failed) == (9, 1)
+    assert database.execute("SELECT chat_id, tries FROM daily_failures").fetchall() == [(5, 3)]
+
+
+def test_lost_lease_retry(database):
+    """
+    Test that a worker which lost the lease while retrying stops and doesn't finish
+    the broadcast.
+    """
+    create_run(10)
+    tries = []
+
+    def take_lease(chat_id):
+        if chat_id == 3:
+            tries.append(chat_id)
+            if len(tries) == 2:
+                # Another worker took the expired lease over
+                database.execute("UPDATE daily_runs SET owner = 'b'")
+
+    bot = BroadcastBot(failures={3: 2}, on_send=take_lease)
+    assert not broadcast(bot).run()
+    assert len(tries) == 2
+    assert subscription.load_run(DAY).finished_at is None
+
+
+def test_resume(database):
+    """
+    Test that a stopped broadcast continues after its checkpoint
+    and that another worker doesn't send it while the lease is held.
+    """
+    create_run(25)
+    first = None
+
+    def stop(chat_id):
+        if chat_id == 12:
+            first.stop()
+
+    bot = BroadcastBot(on_send=stop)
+    first = broadcast(bot)
+    assert not first.run()
+    # The batch in flight is finished and checkpointed
+    assert [chat_id for chat_id, _, _ in bot.sent] == list(range(20))
+    assert subscription.load_run(DAY).last_chat_id == 19
+
+    assert not broadcast(BroadcastBot(), 'b').run()
+    bot.on_send = None
+    assert broadcast(bot).run()
+    assert [chat_id for chat_id, _, _ in bot.sent] == list(range(25))
+    assert subscription.load_run(DAY).sent == 25
+
+
+def test_start_daily(database, monkeypatch):
+    """
+    Test that the button of the quiz of the day starts an attempt of the quiz.
+    """
+    create_run(1)
+    monkeypatch.setattr(quiz_cache, 'get', Quiz.load_from_db)
+    answers = []
+    bot = BroadcastBot()
+    user = SimpleNamespace(id=7, username='player')
+
+    def press(data):
+        query = SimpleNamespace(from_user=user, data=data, message=SimpleNamespace(chat_id=7),
+                                answer=lambda text=None: answers.append(text))
+        return attempt_quiz.start_daily(SimpleNamespace(callback_query=query),
+                                        SimpleNamespace(bot=bot))
+
+    try:
+        assert press('daily:2026-10-18') == ConversationHandler.END
+        assert answers == ["Sorry, this quiz isn't available anymore 😕"]
+        assert press('daily:' + DAY) == 'ENTER_ANSWER'
+        assert attempt_quiz.userDict[7].quiz.name == 'Daily'
+        assert [text for _, text, _ in bot.sent][1] == 'Is water wet?'
+        assert press('daily:' + DAY) is None
+    finally:
+        attempt_quiz.userDict.clear()
@@ -0,0 +1,42 @@
+"""
+Tests the module quizbot.bot.dedupe
+"""
+from quizbot.bot.dedupe import UpdateWindow
+
+
+def test_window():
+    """
+    Test that an update ID is new once and the oldest ID is forgotten when the window is full.
+    """
+    window = UpdateWindow(3)
+    assert [window.add(update_id) for update_id in (1, 2, 1, 3, 4)] \
+        == [True, True, False, True, True]
+    assert len(window) == 3
+    assert 1 not in window and window.add(1)
+    assert not window.add(4)
+    window.discard(4)
+    assert window.add(4)
+    assert window.stats() == {'window': 2, 'duplicates': 2}
+
+
+def test_restart(tmp_path):
+    """
+    Test that the window continues after a restart with the IDs of its file
+    and that a file of another capacity starts empty.
+    """
+    path = str(tmp_path / 'updates.window')
+    window = UpdateWindow(3, path)
+    for update_id in range(5):
+        window.add(update_id)
+    window.close()
+
+    window = UpdateWindow(3, path)
+    assert [update_id in window for update_id in range(5)] == [False, False, True, True, True]
+    assert window.add(5)
+    # The oldest ID is still replaced first
+    assert 2 not in window and 3 in window
+    window.close()
+
+    window = UpdateWindow(4, path)
+    assert len(window) == 0
+    window.close()
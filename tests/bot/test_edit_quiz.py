@@ -0,0 +1,81 @@
+"""
+Tests the module quizbot.bot.edit_quiz
+"""
+from types import SimpleNamespace
+from telegram.ext import ConversationHandler
+from quizbot.bot import edit_quiz
+from quizbot.quiz.name_index import quiz_index
+from quizbot.quiz.question_factory import QuestionString
+from quizbot.quiz.quiz import Quiz
+
+
+class Chat:
+    """Sends the messages of a user to the handlers and records the replies."""
+
+    def __init__(self, username):
+        self.user = SimpleNamespace(id=7, username=username)
+        self.replies = []
+        self.context = SimpleNamespace(bot=SimpleNamespace(send_chat_action=lambda **_: None))
+
+    def send(self, handler, text):
+        message = SimpleNamespace(text=text, from_user=self.user, chat_id=7,
+                                  reply_text=lambda reply, **_: self.replies.append(reply))
+        return handler(SimpleNamespace(message=message, effective_message=message), self.context)
+
+
+def test_clone_rename_and_remove(database):
+    """
+    Test that a quiz with spaces in its name is cloned and the copy is renamed and removed.
+    """
+    quiz = Quiz('alice', 'World geography')
+    quiz.add_question(QuestionString('Capital of France?', 'Paris'))
+    quiz.save_to_db()
+    quiz_index.add('World geography', 'alice')
+    chat = Chat('bob')
+    try:
+        assert chat.send(edit_quiz.enter_clone_source, 'World geography alice') == \
+            'ENTER_CLONE_NAME'
+        assert chat.send(edit_quiz.enter_clone_name, 'My geography') == ConversationHandler.END
+        assert Quiz.load_from_db('My geography', 'bob').questions[0].correct_answer == 'Paris'
+
+        assert chat.send(edit_quiz.enter_old_name, 'Missing') == 'ENTER_OLD_NAME'
+        assert chat.send(edit_quiz.enter_old_name, 'My geography') == 'ENTER_NEW_NAME'
+        assert chat.send(edit_quiz.enter_new_name, 'Capitals') == ConversationHandler.END
+        assert chat.replies[-1] == "I renamed 'My geography' to 'Capitals' 🥳"
+        assert quiz_index.resolve('Capitals bob') == ('Capitals', 'bob')
+
+        assert chat.send(edit_quiz.enter_name_remove, 'My geography') == 'ENTER_NAME'
+        assert chat.send(edit_quiz.enter_name_remove, 'Capitals') == ConversationHandler.END
+        assert Quiz.get_version('Capitals', 'bob') is None
+        assert Quiz.load_from_db('World geography', 'alice') is not None
+    finally:
+        quiz_index.remove('World geography', 'alice')
+        quiz_index.remove('Capitals', 'bob')
+        edit_quiz.user_dict.pop(7, None)
+
+
+def test_deleted_meanwhile(database):
+    """
+    Test that renaming or cloning a quiz which was deleted after its name was entered
+    tells the user and doesn't index the quiz.
+    """
+    quiz = Quiz('bob', 'Rivers')
+    quiz.add_question(QuestionString('Longest river?', 'Nile'))
+    quiz.save_to_db()
+    chat = Chat('bob')
+    try:
+        assert chat.send(edit_quiz.enter_old_name, 'Rivers') == 'ENTER_NEW_NAME'
+        assert chat.send(edit_quiz.enter_clone_source, 'Rivers') == 'ENTER_CLONE_NAME'
+        assert Quiz.delete('Rivers', 'bob')
+
+        assert chat.send(edit_quiz.enter_clone_name, 'Streams') == ConversationHandler.END
+        assert chat.replies[-1] == "The quiz 'Rivers' of bob doesn't exist anymore 😕"
+        assert quiz_index.resolve('Streams bob') is None
+
+        edit_quiz.user_dict[7] = 'Rivers'
+        assert chat.send(edit_quiz.enter_new_name, 'Lakes') == ConversationHandler.END
+        assert chat.replies[-1] == "The quiz 'Rivers' doesn't exist anymore 😕"
+        assert quiz_index.resolve('Lakes bob') is None
+        assert 7 not in edit_quiz.user_dict
+    finally:
+        edit_quiz.user_dict.pop(7, None)
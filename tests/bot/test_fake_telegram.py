@@ -0,0 +1,113 @@
+"""
+Tests the module quizbot.bot.fake_telegram
+"""
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+from telegram import Bot, InlineKeyboardButton, InlineKeyboardMarkup, Poll
+from telegram.ext import CallbackQueryHandler, CommandHandler, Updater
+from quizbot.bot.fake_telegram import FakeBotAPI, contains, is_poll
+
+TOKEN = '123456:TEST'
+
+
+@pytest.fixture
+def api():
+    """Serves a fake Bot API."""
+    fake = FakeBotAPI()
+    fake.start()
+    yield fake
+    fake.stop()
+
+
+def test_methods(api):
+    """
+    Test that the messages, polls and edits of a bot are answered and recorded.
+    """
+    bot = Bot(TOKEN, base_url=api.base_url)
+    assert bot.get_me().username == 'fake_quizbot'
+
+    markup = InlineKeyboardMarkup([[InlineKeyboardButton('Next', callback_data='next')]])
+    message = bot.send_message(42, 'Hi 😃', reply_markup=markup)
+    assert message.text == 'Hi 😃'
+    assert message.reply_markup.inline_keyboard[0][0].callback_data == 'next'
+    poll_message = bot.send_poll(42, 'Is Telegram a messenger?', ['True', 'False'],
+                                 type=Poll.QUIZ, correct_option_id=0, is_anonymous=False)
+    assert poll_message.poll.correct_option_id == 0
+    edited = bot.edit_message_text('Bye', chat_id=42, message_id=message.message_id)
+    assert edited.text == 'Bye'
+    assert bot.answer_callback_query('1')
+
+    assert api.expect(42, contains('Hi')).message['message_id'] == message.message_id
+    assert is_poll(api.expect(42))
+    assert api.expect(42).kind == 'edit'
+    with pytest.raises(TimeoutError):
+        api.expect(42, timeout=0.05)
+    assert api.stats()['calls']['sendMessage'] == 1
+
+
+def test_polling(api):
+    """
+    Test that a bot gets the updates of the users with getUpdates and answers them.
+    """
+    def start(update, _):
+        update.message.reply_text('Welcome {}'.format(update.message.from_user.username),
+                                  reply_markup=InlineKeyboardMarkup(
+                                      [[InlineKeyboardButton('Go', callback_data='go')]]))
+
+    def go(update, _):
+        update.callback_query.edit_message_text('Gone')
+
+    updater = Updater(bot=Bot(TOKEN, base_url=api.base_url), use_context=True)
+    updater.dispatcher.add_handler(CommandHandler('start', start))
+    updater.dispatcher.add_handler(CallbackQueryHandler(go))
+    updater.start_polling(poll_interval=0, timeout=0.2)
+    try:
+        assert api.wait_for_bot(5)
+        api.send_text(7, '/start', 'alice')
+        event = api.expect(7, contains('Welcome alice'), timeout=5)
+        api.press_button(7, event.message, 'go')
+        assert api.expect(7, contains('Gone'), timeout=5).kind == 'edit'
+    finally:
+        updater.stop()
+
+
+def test_webhook(api):
+    """
+    Test that the updates are POSTed to the webhook with its secret token.
+    """
+    received = []
+    delivered = threading.Event()
+
+    class WebhookHandler(BaseHTTPRequestHandler):
+        """Records the delivered updates."""
+
+        def do_POST(self):  # pylint: disable=invalid-name
+            """Records one update."""
+            body = self.rfile.read(int(self.headers['Content-Length']))
+            received.append((self.headers.get('X-Telegram-Bot-Api-Secret-Token'),
+                             json.loads(body)))
+            self.send_response(200)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            delivered.set()
+
+        def log_message(self, *_):
+            """Requests aren't logged."""
+
+    webhook = ThreadingHTTPServer(('127.0.0.1', 0), WebhookHandler)
+    threading.Thread(target=webhook.serve_forever, daemon=True).start()
+    try:
+        bot = Bot(TOKEN, base_url=api.base_url)
+        bot.set_webhook('http://127.0.0.1:{}/telegram'.format(webhook.server_address[1]),
+                        secret_token='secret')
+        api.answer_poll(7, '1', [0])
+        assert delivered.wait(5)
+        secret, update = received[0]
+        assert secret == 'secret'
+        assert update['poll_answer']['option_ids'] == [0]
+        assert api.stats()['delivered'] == 1
+    finally:
+        webhook.shutdown()
+        webhook.server_close()
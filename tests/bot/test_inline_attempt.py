@@ -0,0 +1,226 @@
+"""
+Tests the module quizbot.bot.inline_attempt
+"""
+from concurrent.futures import Future
+from types import SimpleNamespace
+import pytest
+from telegram.error import TimedOut
+from telegram.ext import ConversationHandler
+from quizbot.bot import attempt_quiz, inline_attempt
+from quizbot.bot.inline_attempt import ENTER, decode_callback, encode_callback
+from quizbot.quiz.cache import quiz_cache
+from quizbot.quiz.question_factory import QuestionBool, QuestionChoice, QuestionChoiceSingle, \
+    QuestionString
+from quizbot.quiz.quiz import Quiz
+
+USER_ID = 7
+
+
+class Chat:
+    """A private chat which records the requests of the bot and the messages in the chat."""
+
+    def __init__(self):
+        self.requests = []
+        self.messages = []
+        self.notifications = []
+        self.text = None
+        self.markup = None
+        self.bot = SimpleNamespace(send_chat_action=lambda **_: self.request('sendChatAction'),
+                                   send_message=lambda chat_id, **kw: self.reply_text(**kw),
+                                   edit_message_text=self.edit_message_text,
+                                   edit_message_reply_markup=self.edit_message_reply_markup)
+        self.user = SimpleNamespace(id=USER_ID, username='player')
+
+    def request(self, method):
+        self.requests.append(method)
+
+    def reply_text(self, text, reply_markup=None, **_):
+        self.request('sendMessage')
+        self.messages.append(('bot', text))
+        self.text, self.markup = text, reply_markup
+        return SimpleNamespace(message_id=len(self.messages))
+
+    def edit_message_text(self, text, reply_markup=None, **_):
+        self.request('editMessageText')
+        self.text, self.markup = text, reply_markup
+
+    def edit_message_reply_markup(self, reply_markup=None, **_):
+        self.request('editMessageReplyMarkup')
+        self.markup = reply_markup
+
+    def send(self, text):
+        """Sends a text message of the user and returns its update."""
+        self.messages.append(('user', text))
+        message = SimpleNamespace(from_user=self.user, text=text, chat_id=USER_ID,
+                                  reply_text=self.reply_text)
+        return SimpleNamespace(message=message, effective_message=message, callback_query=None,
+                               effective_user=self.user, effective_chat=SimpleNamespace(id=USER_ID))
+
+    def press(self, label):
+        """Presses the inline button with a label and returns the update."""
+        data = next(button.callback_data for row in self.markup.inline_keyboard
+                    for button in row if button.text.endswith(label))
+        return self.press_data(data)
+
+    def press_data(self, data):
+        """Presses an inline button with callback data and returns the update."""
+        query = SimpleNamespace(from_user=self.user, data=data,
+                                message=SimpleNamespace(chat_id=USER_ID, message_id=1),
+                                answer=self.answer)
+        return SimpleNamespace(message=None, callback_query=query, effective_user=self.user,
+                               effective_chat=SimpleNamespace(id=USER_ID))
+
+    def answer(self, text=None, **_):
+        """Answers a callback query with an optional notification."""
+        self.request('answerCallbackQuery')
+        self.notifications.append(text)
+
+    def context(self, args=None):
+        """Returns a context of the handlers."""
+        return SimpleNamespace(bot=self.bot, args=args or [])
+
+
+def create_quiz(count=20):
+    """
+    Creates a quiz with true/false, single choice, multiple choice and string questions.
+    """
+    quiz = Quiz('alice', 'Mixed')
+    for number in range(count // 4):
+        quiz.add_question(QuestionBool('Is {} even?'.format(number), 'True'))
+        single = QuestionChoiceSingle('Which is {}?'.format(number), str(number))
+        single.add_possible_answer('x')
+        quiz.add_question(single)
+        multiple = QuestionChoice('Which are correct {}?'.format(number), 'a, b')
+        multiple.add_possible_answer('c')
+        quiz.add_question(multiple)
+        quiz.add_question(QuestionString('Say {}'.format(number), str(number)))
+    return quiz
+
+
+@pytest.fixture(name='quiz')
+def fixture_quiz(monkeypatch):
+    """Serves a quiz of 20 questions without a database."""
+    quiz = create_quiz()
+    monkeypatch.setattr(quiz_cache, 'get', lambda *_: quiz)
+    yield quiz
+    inline_attempt.games.clear()
+    attempt_quiz.userDict.clear()
+
+
+def play(chat, quiz):
+    """Plays a quiz with the inline buttons, answering all questions correctly."""
+    assert inline_attempt.start(chat.send('/play Mixed alice'), chat.context(['Mixed', 'alice'])) \
+        == 'ANSWER'
+    state = None
+    for question in quiz.questions:
+        if isinstance(question, QuestionString):
+            state = inline_attempt.enter_text(chat.send(question.correct_answer), chat.context())
+        elif isinstance(question, QuestionChoiceSingle) or isinstance(question, QuestionBool):
+            state = inline_attempt.choose(chat.press(question.correct_answer), chat.context())
+        else:
+            for answer in question.correct_answer.split(', '):
+                assert inline_attempt.choose(chat.press(answer), chat.context()) is None
+            state = inline_attempt.choose(chat.press('Enter ➡️'), chat.context())
+    return state
+
+
+def attempt(chat, quiz):
+    """Attempts a quiz with /attempt, answering all questions correctly."""
+    attempt_quiz.start(chat.send('/attempt'), chat.context())
+    attempt_quiz.enter_quiz(chat.send('Mixed alice'), chat.context())
+    state = None
+    for question in quiz.questions:
+        if type(question) is QuestionChoice:
+            for answer in question.correct_answer.split(', '):
+                attempt_quiz.enter_answer(chat.send(answer), chat.context())
+            state = attempt_quiz.enter_answer(chat.send('Enter'), chat.context())
+        else:
+            state = attempt_quiz.enter_answer(chat.send(question.correct_answer), chat.context())
+    return state
+
+
+def test_callback_data():
+    """
+    Test that the callback data is compact and decoded again.
+    """
+    data = encode_callback('ffffffff', 499, 11)
+    assert data == 'play:ffffffff:1f3:b'
+    assert len(encode_callback('ffffffff', 10 ** 6, ENTER).encode()) <= 64
+    assert decode_callback(data) == ('ffffffff', 499, 11)
+    assert decode_callback('play:ab:2:e') == ('ab', 2, ENTER)
+    assert decode_callback('play:broken') is None
+
+
+def test_play(quiz):
+    """
+    Test that a quiz is played in one message, toggles don't edit it
+    and the message shows the results at the end.
+    """
+    chat = Chat()
+    assert play(chat, quiz) == ConversationHandler.END
+
+    assert [sender for sender, _ in chat.messages].count('bot') == 1
+    assert chat.text.startswith('Thanks for your participation! ☺️\n\nQuestion 1:')
+    assert chat.requests.count('editMessageReplyMarkup') == 0
+    assert chat.requests.count('editMessageText') == 20
+    assert USER_ID not in inline_attempt.games
+
+
+def test_toggle_and_stale_buttons(quiz):
+    """
+    Test that answers of a multiple choice question are toggled and buttons
+    of answered questions are ignored.
+    """
+    chat = Chat()
+    inline_attempt.start(chat.send('/play'), chat.context(['Mixed']))
+    old_button = next(button.callback_data for row in chat.markup.inline_keyboard
+                      for button in row if button.text == 'True')
+    inline_attempt.choose(chat.press('False'), chat.context())
+    assert 'Question 1: Sorry, thats not correct' in chat.text
+    # The button of the first question doesn't answer the second one
+    assert inline_attempt.choose(chat.press_data(old_button), chat.context()) is None
+    assert len(inline_attempt.games[USER_ID]['attempt'].user_points) == 1
+
+    inline_attempt.choose(chat.press('x'), chat.context())
+    inline_attempt.choose(chat.press('a'), chat.context())
+    inline_attempt.choose(chat.press('c'), chat.context())
+    assert chat.notifications[-2:] == ['✅ a', '✅ a, c']
+    inline_attempt.choose(chat.press('a'), chat.context())
+    inline_attempt.choose(chat.press('c'), chat.context())
+    assert chat.notifications[-1] == 'Nothing chosen'
+    # Nothing chosen, nothing entered
+    inline_attempt.choose(chat.press('Enter ➡️'), chat.context())
+    assert len(inline_attempt.games[USER_ID]['attempt'].user_points) == 2
+
+
+def test_fewer_messages_than_attempt(quiz):
+    """
+    Test that a quiz of 20 questions leaves at most 40 % of the messages of /attempt
+    in the chat and sends about half of its paced messages and edits. One edit per
+    question is needed, /attempt sends about two messages per question.
+    """
+    inline = Chat()
+    play(inline, quiz)
+    classic = Chat()
+    assert attempt(classic, quiz) == ConversationHandler.END
+
+    assert len(inline.messages) <= 0.4 * len(classic.messages)
+    paced = ('sendMessage', 'editMessageText', 'editMessageReplyMarkup')
+    assert sum(map(inline.requests.count, paced)) <= 0.5 * sum(map(classic.requests.count, paced))
+
+
+def test_failed_message(quiz, monkeypatch):
+    """
+    Test that an attempt whose message couldn't be sent is dropped without blocking.
+    """
+    chat = Chat()
+    future = Future()
+    replies = []
+    monkeypatch.setattr(inline_attempt, 'reply',
+                        lambda update, text, *_, **__: replies.append(text) or future)
+    assert inline_attempt.start(chat.send('/play'), chat.context(['Mixed'])) == 'ANSWER'
+    assert inline_attempt.games[USER_ID]['message_id'] is None
+    future.set_exception(TimedOut())
+    assert USER_ID not in inline_attempt.games
+    assert inline_attempt.enter_text(chat.send('1'), chat.context()) == ConversationHandler.END
+    assert replies[-1] == "Sorry 😕 I lost your quiz. Please start again with /play."
@@ -0,0 +1,53 @@
+"""
+Tests the module quizbot.bot.keyboards
+"""
+from quizbot.bot.keyboards import ENTER, REMOVE, SHUFFLED_VARIANTS, TRUE_FALSE, \
+    choice_keyboards, question_keyboard
+from quizbot.quiz.question_factory import QuestionBool, QuestionChoice, QuestionChoiceSingle, \
+    QuestionString
+
+
+def labels(markup):
+    """Returns the labels of the buttons of a keyboard."""
+    return [button for row in markup.keyboard for button in row]
+
+
+def test_static_keyboards():
+    """
+    Test that questions without possible answers share the static keyboards.
+    """
+    assert question_keyboard(QuestionString("Best Telegram bot?", "QuizBot")) is REMOVE
+    assert question_keyboard(QuestionBool("Is Telegram a messenger?", "True")) is TRUE_FALSE
+
+
+def test_cached_keyboards():
+    """
+    Test that the keyboard of a question is built once and reused.
+    """
+    question = QuestionChoiceSingle("Best messenger?", "Telegram")
+    question.add_possible_answer("Signal")
+    question.is_random = False
+    same_question = QuestionChoiceSingle("Which messenger is the best?", "Telegram")
+    same_question.add_possible_answer("Signal")
+    same_question.is_random = False
+
+    assert question_keyboard(question) is question_keyboard(same_question)
+    assert labels(question_keyboard(question)) == question.possible_answers
+
+
+def test_shuffled_keyboards():
+    """
+    Test that a shuffled question gets one of its cached variants.
+    """
+    question = QuestionChoice("Which are messengers?", "Telegram, Signal")
+    for answer in ("Excel", "Word", "Paint"):
+        question.add_possible_answer(answer)
+    question.is_random = True
+    variants = choice_keyboards(tuple(question.possible_answers), True, True)
+
+    assert 1 <= len(variants) <= SHUFFLED_VARIANTS
+    for _ in range(20):
+        keyboard = question_keyboard(question)
+        assert keyboard in variants
+        assert labels(keyboard)[-1] == ENTER
+        assert sorted(labels(keyboard)[:-1]) == sorted(question.possible_answers)
@@ -0,0 +1,191 @@
+"""
+Tests the module quizbot.bot.live
+"""
+import threading
+import time
+from types import SimpleNamespace
+from quizbot.bot import live as live_module
+from quizbot.bot.live import Leaderboard, LiveQuiz, RateBudget, expire_sessions, sessions
+from quizbot.quiz.question_factory import QuestionBool, QuestionChoiceSingle, QuestionString
+from quizbot.quiz.quiz import Quiz
+
+
+class FanOutBot:
+    """Records the time every chat got a message."""
+
+    def __init__(self):
+        self.sent = []
+        self.lock = threading.Lock()
+
+    def send_message(self, chat_id, text, reply_markup=None):
+        with self.lock:
+            self.sent.append((time.monotonic(), chat_id, text, reply_markup))
+
+
+def create_quiz():
+    """Creates a quiz with two questions which can be played live and one which can't."""
+    quiz = Quiz('host', 'Live')
+    quiz.add_question(QuestionBool('Is water wet?', 'True'))
+    quiz.add_question(QuestionString('Say hi', 'hi'))
+    single = QuestionChoiceSingle('Which is a planet?', 'Mars')
+    single.add_possible_answer('Moon')
+    quiz.add_question(single)
+    return quiz
+
+
+def test_leaderboard():
+    """
+    Test that the players are ranked by correct answers and then by time.
+    """
+    leaderboard = Leaderboard()
+    leaderboard.record(1, 'ann', True, 3.0)
+    leaderboard.record(2, 'bob', True, 1.0)
+    leaderboard.record(3, 'cid', False, 0.5)
+    leaderboard.record(1, 'ann', True, 2.0)
+    assert leaderboard.ranking() == [('ann', 2, 5.0), ('bob', 1, 1.0), ('cid', 0, 0.5)]
+    assert leaderboard.render().splitlines()[0] == '🥇 ann: 2 correct (5.0 s)'
+    assert Leaderboard().render() == 'Nobody answered yet 🤷'
+
+
+def test_join_limit():
+    """
+    Test that a live quiz takes at most skew * rate chats and none after the start.
+    """
+    live = LiveQuiz('ABCDE', create_quiz(), 1, skew=1.0, rate=3.0)
+    assert [question.question for question in live.questions] \
+        == ['Is water wet?', 'Which is a planet?']
+    assert all(live.join(chat_id) for chat_id in range(3))
+    assert live.join(0)
+    assert not live.join(3)
+    assert live.stats()['chats'] == 3
+
+
+def test_live_quiz():
+    """
+    Test that every chat gets the questions staggered within the skew on the shared clock
+    and that the answers of all chats count for one leaderboard.
+    """
+    live = LiveQuiz('LIVE1', create_quiz(), 1, period=0.6, skew=0.2, rate=50.0)
+    sessions[live.code] = live
+    for chat_id in range(10):
+        assert live.join(-chat_id)
+    bot = FanOutBot()
+    live.start(bot)
+
+    time.sleep(0.3)
+    assert len(bot.sent) == 10
+    times = [sent_at for sent_at, _, _, _ in bot.sent]
+    assert times[-1] - times[0] <= live.skew
+    # Staggered by the rate instead of sent at once
+    assert all(later - earlier >= 0.015 for earlier, later in zip(times, times[1:]))
+    assert [chat_id for _, chat_id, _, _ in bot.sent] == [-chat_id for chat_id in range(10)]
+    assert bot.sent[0][3].inline_keyboard[0][0].callback_data == 'live:LIVE1:0:0'
+
+    assert live.answer(1, 'ann', 0, 0, 0) == 'Your answer is saved 👍'
+    assert live.answer(1, 'ann', -1, 0, 1) == 'You already answered this question 🙂'
+    assert live.answer(2, 'bob', -9, 0, 1) == 'Your answer is saved 👍'
+    # The next question isn't sent yet
+    assert live.answer(3, 'cid', -1, 1, 0) == "Time's up for this question ⏰"
+
+    live.join_thread(5)
+    assert 'The answer to question 1 was: True' in bot.sent[10][2]
+    assert all(bot.sent[index + 10][0] - bot.sent[index][0] >= 0.75 for index in range(10))
+    last = bot.sent[-10:]
+    assert all(text.startswith('The live quiz Live is over 🏁') and '🥇 ann: 1 correct' in text
+               for _, _, text, _ in last)
+    assert live.answer(1, 'ann', 0, 1, 0) == "Time's up for this question ⏰"
+    assert live.code not in sessions
+
+
+def test_answer_validation():
+    """
+    Test that an unknown answer doesn't use up the answer of a player.
+    """
+    live = LiveQuiz('CHECK', create_quiz(), 1)
+    live.join(5)
+    live.current = 0
+    live._delivered[(5, 0)] = time.monotonic()  # pylint: disable=protected-access
+    assert live.answer(1, 'ann', 5, 0, 7) == 'This answer is unknown 😕'
+    assert live.answer(1, 'ann', 5, 0, 0) == 'Your answer is saved 👍'
+    assert [(name, correct) for name, correct, _ in live.leaderboard.ranking()] == [('ann', 1)]
+
+
+def test_stop_before_questions():
+    """
+    Test that a live quiz stopped before a question was sent doesn't reveal an answer.
+    """
+    live = LiveQuiz('STOP1', create_quiz(), 1, period=0.2, skew=0.1, rate=50.0)
+    live.join(5)
+    live.stop()
+    bot = FanOutBot()
+    live.start(bot)
+    live.join_thread(5)
+    assert len(bot.sent) == 1
+    assert bot.sent[0][2].startswith('The live quiz Live is over 🏁\n\n')
+    assert 'The answer' not in bot.sent[0][2]
+
+
+def test_sessions():
+    """
+    Test that live quizzes which weren't started expire and that they can't be
+    hosted in a cluster.
+    """
+    open_quiz = LiveQuiz('OPEN1', create_quiz(), 1)
+    started = LiveQuiz('OPEN2', create_quiz(), 1)
+    started.started = True
+    sessions.update({live.code: live for live in (open_quiz, started)})
+    try:
+        assert expire_sessions(60, now=open_quiz.opened_at + 30) == 0
+        assert expire_sessions(60, now=open_quiz.opened_at + 61) == 1
+        assert list(sessions) == ['OPEN2']
+    finally:
+        sessions.clear()
+
+    replies = []
+    message = SimpleNamespace(reply_text=lambda text, **_: replies.append(text))
+    update = SimpleNamespace(effective_user=SimpleNamespace(id=1, username='host'),
+                             effective_message=message)
+    live_module.settings['enabled'] = False
+    try:
+        live_module.host(update, SimpleNamespace(args=['Live']))
+    finally:
+        live_module.settings['enabled'] = True
+    assert replies == ["Sorry, live quizzes aren't available on this bot 😕"]
+    assert not sessions
+
+
+def test_shared_budget():
+    """
+    Test that two live quizzes running at the same time share the budget and a live
+    quiz which doesn't fit into it can't start.
+    """
+    budget = RateBudget(30.0)
+    first = LiveQuiz('BIG01', create_quiz(), 1, period=0.2, skew=0.2, rate=30.0, budget=budget)
+    second = LiveQuiz('BIG02', create_quiz(), 2, period=0.2, skew=0.2, rate=30.0, budget=budget)
+    for chat_id in range(4):
+        assert first.join(chat_id)
+        assert second.join(-chat_id)
+    bot = FanOutBot()
+    try:
+        assert first.start(bot)
+        assert first.rate == 20.0
+        assert not second.start(bot)
+        assert not second.started
+        assert budget.reserved == 20.0
+    finally:
+        first.stop()
+        first.join_thread(5)
+    assert budget.reserved == 0.0
+
+    # The second fits after the first ended, together with a smaller live quiz
+    smaller = LiveQuiz('SMALL', create_quiz(), 3, period=0.2, skew=0.2, rate=30.0, budget=budget)
+    smaller.join(9)
+    try:
+        assert second.start(bot)
+        assert smaller.start(bot)
+        assert budget.reserved == 25.0
+    finally:
+        for live in (second, smaller):
+            live.stop()
+            live.join_thread(5)
+    assert budget.reserved == 0.0
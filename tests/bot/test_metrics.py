@@ -0,0 +1,105 @@
+"""
+Tests the module quizbot.bot.metrics
+"""
+import urllib.request
+import pytest
+from sqlalchemy import create_engine, text
+from telegram.ext import CommandHandler, ConversationHandler, Filters, MessageHandler
+from quizbot.bot import metrics
+from quizbot.bot.metrics import Counter, Histogram, Registry, instrument_database, \
+    instrument_handlers, start_metrics_server
+
+
+def test_render():
+    """
+    Test that counters, histograms and stats are rendered in the text format of Prometheus.
+    """
+    registry = Registry()
+    counter = registry.register(Counter('updates_total', 'Updates', ('state',)))
+    histogram = registry.register(Histogram('seconds', 'Duration', buckets=(0.1, 1.0)))
+    registry.stats('cache', lambda: {'size': 3, 'name': 'quizzes'})
+    registry.stats('shards', lambda: {'queue_depth': [2, 0]}, label='shard')
+    counter.inc('ENTER_ANSWER')
+    counter.inc('ENTER_ANSWER', amount=2)
+    histogram.observe(0.05)
+    histogram.observe(0.5)
+    histogram.observe(5)
+
+    lines = registry.render().splitlines()
+    assert '# TYPE updates_total counter' in lines
+    assert 'updates_total{state="ENTER_ANSWER"} 3' in lines
+    assert '# TYPE seconds histogram' in lines
+    assert 'seconds_bucket{le="0.1"} 1' in lines
+    assert 'seconds_bucket{le="1.0"} 2' in lines
+    assert 'seconds_bucket{le="+Inf"} 3' in lines
+    assert 'seconds_count 3' in lines
+    assert 'seconds_sum 5.55' in lines
+    assert 'cache_size 3.0' in lines
+    assert not any(line.startswith('cache_name') for line in lines)
+    assert 'shards_queue_depth{shard="1"} 0.0' in lines
+
+
+def test_instrument_handlers():
+    """
+    Test that the handlers of a conversation are measured per state and that
+    errors and ended conversations are counted.
+    """
+    def start(*_):
+        return 'ENTER_ANSWER'
+
+    def enter_answer(*_):
+        return ConversationHandler.END
+
+    def fail(*_):
+        raise ValueError('Broken handler')
+
+    conversation = ConversationHandler(
+        entry_points=[CommandHandler('test', start)],
+        states={'ENTER_ANSWER': [MessageHandler(Filters.text, enter_answer)]},
+        fallbacks=[CommandHandler('fail', fail)],
+        name='metrics_test')
+    instrument_handlers([conversation])
+    # Instrumenting twice doesn't wrap the callbacks twice
+    instrument_handlers([conversation])
+
+    assert conversation.entry_points[0].callback(None, None) == 'ENTER_ANSWER'
+    assert conversation.states['ENTER_ANSWER'][0].callback(None, None) == ConversationHandler.END
+    with pytest.raises(ValueError):
+        conversation.fallbacks[0].callback(None, None)
+
+    assert metrics.handler_seconds.count('metrics_test', 'entry') == 1
+    assert metrics.handler_seconds.count('metrics_test', 'ENTER_ANSWER') == 1
+    assert metrics.handler_seconds.count('metrics_test', 'fallback') == 1
+    assert metrics.handler_errors.value('metrics_test', 'fallback') == 1
+    assert metrics.conversations_ended.value('metrics_test') == 1
+
+
+def test_database_time():
+    """
+    Test that the statements of an engine are measured and a failed statement is skipped.
+    """
+    instrument_database()
+    engine = create_engine('sqlite://')
+    before = metrics.db_seconds.count()
+    with engine.connect() as connection:
+        connection.execute(text('SELECT 1'))
+        with pytest.raises(Exception):
+            connection.execute(text('SELECT * FROM missing'))
+        connection.execute(text('SELECT 2'))
+    assert metrics.db_seconds.count() == before + 2
+
+
+def test_metrics_server():
+    """
+    Test that the metrics are served on /metrics.
+    """
+    metrics.conversations_ended.inc('server_test')
+    server = start_metrics_server(0, listen='127.0.0.1')
+    try:
+        url = 'http://127.0.0.1:{}/metrics'.format(server.server_address[1])
+        with urllib.request.urlopen(url) as response:
+            body = response.read().decode('utf-8')
+        assert 'quizbot_conversations_ended_total{conversation="server_test"} 1' in body
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,232 @@
+"""
+Tests the modules quizbot.bot.user_state and quizbot.bot.persistence
+"""
+import sqlite3
+import threading
+import pytest
+from quizbot.bot import persistence as persistence_module
+from quizbot.bot.persistence import SQLitePersistence
+from quizbot.bot.user_state import UserStateStore, decode_state, encode_state
+from quizbot.quiz.attempt import Attempt
+from quizbot.quiz.question_factory import QuestionChoice, QuestionString
+from quizbot.quiz.quiz import Quiz
+
+
+def create_attempt():
+    """
+    Creates an attempt of a quiz with two questions, the first one answered.
+    """
+    quiz = Quiz("me", "Telegram")
+    quiz.add_question(QuestionString("Best Telegram bot?", "QuizBot"))
+    question = QuestionChoice("Which are messengers?", "Telegram, Signal")
+    question.add_possible_answer("Excel")
+    quiz.add_question(question)
+    attempt = Attempt(quiz)
+    attempt.input_answer("QuizBot")
+    attempt.enter_answer()
+    attempt.input_answer("Signal")
+    return attempt
+
+
+def test_encode_state():
+    """
+    Test that the state of a user is restored with shared objects.
+    """
+    attempt = create_attempt()
+    state = {'attempt': attempt, 'questtype': QuestionChoice, 'answers': ('a', 1)}
+    restored = decode_state(encode_state(state))
+
+    assert restored['questtype'] is QuestionChoice
+    assert restored['answers'] == ('a', 1)
+    restored_attempt = restored['attempt']
+    assert restored_attempt.user_answers == {"Signal"}
+    assert restored_attempt.user_points[0][0]
+    assert restored_attempt.act_question().possible_answers \
+        == attempt.act_question().possible_answers
+    assert restored_attempt.act_question() is restored_attempt.quiz.questions[1]
+
+
+def test_write_behind(tmp_path):
+    """
+    Test that states are only written by flush and restored lazily by a new persistence.
+    """
+    path = str(tmp_path / 'state.sqlite3')
+    store = UserStateStore('attempt_quiz')
+    persistence = SQLitePersistence(path, [store])
+    store[1] = create_attempt()
+    store['removed'] = {'quiz': Quiz("me")}
+    persistence.update_conversation('attempt', (1, 1), 'ENTER_ANSWER')
+    assert persistence.batches == 0
+
+    persistence.flush()
+    del store['removed']
+    store[1].input_answer("Telegram")
+    persistence.close()
+    assert persistence.stats() == {'writes': 5, 'batches': 2}
+
+    store = UserStateStore('attempt_quiz')
+    persistence = SQLitePersistence(path, [store])
+    assert len(store) == 0
+    assert store[1].user_answers == {"Signal", "Telegram"}
+    assert 'removed' not in store
+    assert 2 not in store
+    conversations = persistence.get_conversations('attempt')
+    assert conversations.get((1, 1)) == 'ENTER_ANSWER'
+    assert conversations.get((2, 2)) is None
+    persistence.close()
+
+
+def test_failed_flush(tmp_path, monkeypatch):
+    """
+    Test that the states of a failed batch are written with the next batch,
+    unless they changed in the meantime.
+    """
+    path = str(tmp_path / 'state.sqlite3')
+    store = UserStateStore('attempt_quiz')
+    persistence = SQLitePersistence(path, [store])
+    store[1] = {'quiz': Quiz("me")}
+    store[2] = {'quiz': Quiz("me")}
+    persistence.update_conversation('attempt', (1, 1), 'ENTER_ANSWER')
+    persistence.update_conversation('attempt', (2, 2), 'ENTER_ANSWER')
+    write = persistence._write  # pylint: disable=protected-access
+
+    def fail(*_):
+        monkeypatch.setattr(persistence, '_write', write)
+        raise sqlite3.OperationalError('database is locked')
+
+    monkeypatch.setattr(persistence, '_write', fail)
+    with pytest.raises(sqlite3.OperationalError):
+        persistence.flush()
+    assert persistence.batches == 0
+
+    store[2] = {'quiz': Quiz("you")}
+    persistence.update_conversation('attempt', (2, 2), None)
+    persistence.flush()
+    assert persistence.stats() == {'writes': 4, 'batches': 1}
+    persistence.close()
+
+    store = UserStateStore('attempt_quiz')
+    persistence = SQLitePersistence(path, [store])
+    assert store[1]['quiz'].author == "me"
+    assert store[2]['quiz'].author == "you"
+    conversations = persistence.get_conversations('attempt')
+    assert conversations.get((1, 1)) == 'ENTER_ANSWER'
+    assert conversations.get((2, 2)) is None
+    persistence.close()
+
+
+def test_expire(monkeypatch):
+    """
+    Test that unused states expire and the expiry is notified.
+    """
+    now = [1000.0]
+    monkeypatch.setattr('quizbot.bot.user_state.time.monotonic', lambda: now[0])
+    expired = []
+    store = UserStateStore('create_quiz', idle_ttl=60,
+                           on_expire=lambda key, state, reason: expired.append((key, reason)))
+    store[1] = {'quiz': Quiz("me")}
+    store[2] = {'quiz': Quiz("you")}
+    now[0] += 40
+    store[2]['quiz'].name = "Telegram"
+    now[0] += 40
+
+    assert 1 not in store
+    assert expired == [(1, 'expired')]
+    assert store.expire() == 0
+    now[0] += 40
+    assert store.expire() == 1
+    assert store.stats() == {'entries': 0, 'expired': 2, 'evicted': 0}
+
+
+def test_evict():
+    """
+    Test that the least recently used states are evicted.
+    """
+    evicted = []
+    store = UserStateStore('attempt_quiz', max_entries=2,
+                           on_expire=lambda key, state, reason: evicted.append((key, reason)))
+    store[1] = 'a'
+    store[2] = 'b'
+    assert store[1] == 'a'
+    store[3] = 'c'
+
+    assert evicted == [(2, 'evicted')]
+    assert sorted(store) == [1, 3]
+    assert store.stats()['evicted'] == 1
+
+
+def test_release(tmp_path):
+    """
+    Test that released states are written and restored from the database when they're used.
+    """
+    store = UserStateStore('attempt_quiz')
+    persistence = SQLitePersistence(str(tmp_path / 'state.sqlite3'), [store])
+    conversations = persistence.get_conversations('attempt')
+    store[1] = create_attempt()
+    assert 2 not in store
+    conversations[(1, 1)] = 'ENTER_ANSWER'
+    persistence.update_conversation('attempt', (1, 1), 'ENTER_ANSWER')
+
+    # Another process wrote the state of user 2 meanwhile
+    other_store = UserStateStore('attempt_quiz')
+    other = SQLitePersistence(str(tmp_path / 'state.sqlite3'), [other_store])
+    other_store[2] = {'quiz': Quiz("me")}
+    other.close()
+
+    assert persistence.release() == 1
+    assert len(store) == 0
+    assert len(conversations) == 0
+    assert store[1].user_answers == {"Signal"}
+    assert store[2]['quiz'].author == "me"
+    assert conversations.get((1, 1)) == 'ENTER_ANSWER'
+    persistence.close()
+
+
+def test_bounded_conversations(tmp_path, monkeypatch):
+    """
+    Test that the looked up conversation keys are bounded and an ended conversation
+    which isn't written yet isn't loaded again.
+    """
+    monkeypatch.setattr(persistence_module, 'ABSENT_LIMIT', 3)
+    persistence = SQLitePersistence(str(tmp_path / 'state.sqlite3'))
+    conversations = persistence.get_conversations('attempt')
+    persistence.update_conversation('attempt', (1, 1), 'ENTER_ANSWER')
+    persistence.flush()
+    assert conversations.get((1, 1)) == 'ENTER_ANSWER'
+    del conversations[(1, 1)]
+    persistence.update_conversation('attempt', (1, 1), None)
+
+    for user_id in range(2, 12):
+        assert (user_id, user_id) not in conversations
+    assert len(conversations._checked) <= 4  # pylint: disable=protected-access
+    assert (1, 1) not in conversations
+    persistence.close()
+
+
+def test_restore_without_lock():
+    """
+    Test that a state is read from the persistence while other users can use the store.
+    """
+    store = UserStateStore('attempt_quiz')
+    acquired = []
+
+    def try_lock():
+        lock = store._lock  # pylint: disable=protected-access
+        acquired.append(lock.acquire(timeout=1))
+        if acquired[-1]:
+            lock.release()
+
+    class SlowPersistence:
+        """Checks that the store isn't locked while a state is read."""
+
+        @staticmethod
+        def load_user_state(_, key):
+            other = threading.Thread(target=try_lock)
+            other.start()
+            other.join()
+            return encode_state({'quiz': Quiz("me")}) if key == '1' else None
+
+    store.bind(SlowPersistence())
+    assert store[1]['quiz'].author == "me"
+    assert 2 not in store
+    assert acquired == [True, True]
@@ -0,0 +1,60 @@
+"""
+Tests the module quizbot.bot.results
+"""
+from quizbot.bot import results
+from quizbot.bot.results import MESSAGE_LIMIT, message_length, page_markup, paginate, \
+    render_results, results_header, summarize
+from quizbot.quiz.question_factory import QuestionString
+
+
+def create_points(count):
+    """
+    Creates the points of an attempt, every third answer wrong.
+    """
+    return [(number % 3 != 0, QuestionString("What is the answer to question {}?".format(number),
+                                             "Answer {}".format(number)))
+            for number in range(count)]
+
+
+def test_summarize():
+    """
+    Test the summary of the score.
+    """
+    assert summarize(create_points(3)).startswith('You answered 2 of 3 questions correctly (67 %)')
+
+
+def test_results_header(monkeypatch):
+    """
+    Test that the results only start with the summary if it's enabled.
+    """
+    points = create_points(3)
+    assert results_header(points) == ''
+    assert results_header(points, 'Thanks') == 'Thanks'
+    monkeypatch.setattr(results, 'show_summary', True)
+    assert results_header(points) == summarize(points)
+    assert results_header(points, 'Thanks') == 'Thanks\n\n' + summarize(points)
+
+
+def test_paginate():
+    """
+    Test that the results are packed into few pages within the message limit.
+    """
+    points = create_points(500)
+    blocks = render_results(points)
+    pages = paginate(blocks, summarize(points))
+
+    # Every page but the last one is nearly full
+    assert len(pages) == -(-sum(map(message_length, blocks)) // (MESSAGE_LIMIT - 100))
+    assert all(message_length(page) <= MESSAGE_LIMIT - 20 for page in pages)
+    assert pages[0].startswith('You answered')
+    assert '\n\n'.join(pages).count('Question ') == 500
+    assert page_markup(0, len(pages)).inline_keyboard[0][0].callback_data == 'results:1'
+    assert page_markup(0, 1) is None
+
+
+def test_paginate_long_block():
+    """
+    Test that a block longer than a page is split.
+    """
+    pages = paginate(['🙂' * 3000], limit=4000, footer_size=0)
+    assert [message_length(page) for page in pages] == [4000, 2000]
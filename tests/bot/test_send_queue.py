@@ -0,0 +1,184 @@
+"""
+Tests the module quizbot.bot.send_queue
+"""
+import threading
+import time
+from telegram.error import RetryAfter
+from quizbot.bot.send_queue import BULK, MESSAGE_LIMIT, PROMPT, OutboundScheduler, \
+    TokenBucket, message_length
+
+
+class FakeBot:
+    """Records the sent messages, optionally failing the first one with RetryAfter."""
+
+    def __init__(self, retry_after=None):
+        self.sent = []
+        self.retry_after = retry_after
+        self.release = threading.Event()
+        self.release.set()
+
+    def send_message(self, chat_id, text, reply_markup=None):
+        self.release.wait()
+        if self.retry_after is not None:
+            retry_after, self.retry_after = self.retry_after, None
+            raise RetryAfter(retry_after)
+        self.sent.append((time.monotonic(), chat_id, text, reply_markup))
+        return len(self.sent)
+
+    def edit_message_text(self, chat_id, message_id, text, reply_markup=None):
+        self.sent.append((time.monotonic(), chat_id, (message_id, text), reply_markup))
+        return len(self.sent)
+
+    def edit_message_reply_markup(self, chat_id, message_id, reply_markup=None):
+        self.sent.append((time.monotonic(), chat_id, (message_id, None), reply_markup))
+        return len(self.sent)
+
+
+def test_token_bucket():
+    """
+    Test that the bucket allows bursts up to its capacity.
+    """
+    bucket = TokenBucket(10, capacity=2)
+    now = bucket.updated_at
+    for _ in range(2):
+        assert bucket.delay(now) == 0
+        bucket.take()
+    assert abs(bucket.delay(now) - 0.1) < 1e-9
+    assert bucket.delay(now + 0.11) == 0
+
+
+def test_pacing_and_coalescing():
+    """
+    Test that a chat gets at most one message per interval and queued texts are coalesced.
+    """
+    bot = FakeBot()
+    scheduler = OutboundScheduler(chat_rate=10, global_rate=1000)
+    scheduler.start(bot)
+    bot.release.clear()
+    first = scheduler.send(1, 'send_message', text='a')
+    time.sleep(0.05)
+    futures = [scheduler.send(1, 'send_message', text=text) for text in 'bcd']
+    futures.append(scheduler.send(1, 'send_message', text='e', reply_markup='keyboard'))
+    futures.append(scheduler.send(1, 'send_message', text='f'))
+    bot.release.set()
+    scheduler.stop()
+
+    assert [(text, markup) for _, _, text, markup in bot.sent] \
+        == [('a', None), ('b\n\nc\n\nd\n\ne', 'keyboard'), ('f', None)]
+    assert all(later[0] - earlier[0] >= 0.09 for earlier, later in zip(bot.sent, bot.sent[1:]))
+    assert first.result() == 1
+    assert [future.result() for future in futures] == [2, 2, 2, 2, 3]
+    assert scheduler.stats()['coalesced'] == 3
+    assert scheduler.stats()['queue_depth'] == 0
+
+
+def test_edit_coalescing():
+    """
+    Test that a queued edit of a message is replaced by a later edit of the same message.
+    """
+    bot = FakeBot()
+    scheduler = OutboundScheduler(chat_rate=10, global_rate=1000)
+    scheduler.start(bot)
+    bot.release.clear()
+    scheduler.send(1, 'send_message', text='a')
+    time.sleep(0.05)
+    scheduler.send(1, 'edit_message_text', message_id=5, text='b', reply_markup='1')
+    scheduler.send(1, 'edit_message_reply_markup', message_id=5, reply_markup='2')
+    scheduler.send(1, 'edit_message_reply_markup', message_id=5, reply_markup='3')
+    scheduler.send(1, 'edit_message_reply_markup', message_id=6, reply_markup='4')
+    scheduler.send(1, 'edit_message_text', message_id=6, text='c')
+    bot.release.set()
+    scheduler.stop()
+
+    # Editing only the keyboard doesn't replace an edit of the text
+    assert [(text, markup) for _, _, text, markup in bot.sent] \
+        == [('a', None), ((5, 'b'), '1'), ((5, None), '3'), ((6, 'c'), None)]
+    assert scheduler.stats()['coalesced'] == 2
+
+
+def test_priority():
+    """
+    Test that prompts overtake bulk messages of other chats.
+    """
+    bot = FakeBot()
+    scheduler = OutboundScheduler(chat_rate=1, global_rate=1, workers=1)
+    scheduler.bucket.tokens = 0
+    for chat_id in range(3):
+        scheduler.send(chat_id, 'send_message', BULK, text='report')
+    scheduler.send(3, 'send_message', PROMPT, text='question')
+    scheduler.bucket = TokenBucket(1000)
+    scheduler.start(bot)
+    scheduler.stop()
+
+    assert [chat_id for _, chat_id, _, _ in bot.sent] == [3, 0, 1, 2]
+
+
+def test_retry_after():
+    """
+    Test that a message is sent again after the time Telegram asked for.
+    """
+    bot = FakeBot(retry_after=0.2)
+    scheduler = OutboundScheduler(chat_rate=100, global_rate=1000)
+    scheduler.start(bot)
+    start = time.monotonic()
+    assert scheduler.send(1, 'send_message', text='a').result(timeout=2) == 1
+    scheduler.stop()
+
+    assert bot.sent[0][0] - start >= 0.2
+    assert scheduler.stats()['retries'] == 1
+
+
+def test_coalescing_limit():
+    """
+    Test that texts are only coalesced if the message fits in UTF-16 code units.
+    """
+    bot = FakeBot()
+    scheduler = OutboundScheduler(chat_rate=10, global_rate=1000)
+    scheduler.start(bot)
+    bot.release.clear()
+    scheduler.send(1, 'send_message', text='a')
+    time.sleep(0.05)
+    # 1500 emojis are 1500 code points, but 3000 UTF-16 code units
+    for length in (MESSAGE_LIMIT - 3002, MESSAGE_LIMIT - 3001):
+        scheduler.send(1, 'send_message', text='😀' * 1500)
+        scheduler.send(1, 'send_message', text='b' * length)
+    bot.release.set()
+    scheduler.stop()
+
+    assert [message_length(text) for _, _, text, _ in bot.sent] \
+        == [1, MESSAGE_LIMIT, 3000, MESSAGE_LIMIT - 3001]
+    assert scheduler.stats()['coalesced'] == 1
+
+class SlowBot:
+    """Answers every request after a round trip time, like the Bot API."""
+
+    def __init__(self, round_trip):
+        self.round_trip = round_trip
+        self.sent = []
+
+    def send_message(self, chat_id, text, reply_markup=None):  # pylint: disable=unused-argument
+        time.sleep(self.round_trip)
+        self.sent.append((chat_id, text))
+        return len(self.sent)
+
+
+def test_throughput():
+    """
+    Test that requests to many chats are sent in parallel and each chat keeps its order.
+    """
+    bot = SlowBot(round_trip=0.1)
+    scheduler = OutboundScheduler(chat_rate=1000, global_rate=1000, workers=8)
+    for number in range(2):
+        for chat_id in range(16):
+            # The keyboards keep the texts from being coalesced
+            scheduler.send(chat_id, 'send_message', text=str(number), reply_markup='keyboard')
+    start = time.monotonic()
+    scheduler.start(bot)
+    scheduler.stop()
+    elapsed = time.monotonic() - start
+
+    # One thread needs 3.2 seconds for the 32 requests (10 per second), eight threads about 0.4
+    assert len(bot.sent) == 32
+    assert 32 / elapsed > 20
+    for chat_id in range(16):
+        assert [text for chat, text in bot.sent if chat == chat_id] == ['0', '1']
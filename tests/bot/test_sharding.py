@@ -0,0 +1,77 @@
+"""
+Tests the module quizbot.bot.sharding
+"""
+import threading
+import time
+from types import SimpleNamespace
+from quizbot.bot.sharding import ShardedDispatcher
+
+
+class RecordingDispatcher:
+    """Records the processed updates and the threads which processed them."""
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.processed = []
+        self.lock = threading.Lock()
+
+    def process_update(self, update):
+        time.sleep(self.delay)
+        with self.lock:
+            self.processed.append((update.effective_user.id, update.update_id,
+                                   threading.current_thread().name))
+
+
+def make_update(update_id, user_id):
+    """Creates an update of a user."""
+    return SimpleNamespace(update_id=update_id, effective_user=SimpleNamespace(id=user_id))
+
+
+def test_order_per_user():
+    """
+    Test that the updates of a user are processed in order on one thread.
+    """
+    dispatcher = RecordingDispatcher()
+    sharded = ShardedDispatcher(dispatcher, shards=4)
+    sharded.install()
+    for update_id in range(200):
+        dispatcher.process_update(make_update(update_id, update_id % 10))
+    sharded.stop()
+
+    assert len(dispatcher.processed) == 200
+    for user_id in range(10):
+        updates = [(update_id, thread) for user, update_id, thread in dispatcher.processed
+                   if user == user_id]
+        assert [update_id for update_id, _ in updates] == list(range(user_id, 200, 10))
+        assert len({thread for _, thread in updates}) == 1
+    assert sharded.stats()['processed'] == 200
+    assert dispatcher.process_update.__self__ is dispatcher
+
+
+def test_parallel_shards():
+    """
+    Test that the shards process the updates of different users at the same time
+    and that the depth of every queue is reported.
+    """
+    dispatcher = RecordingDispatcher(0.1)
+    sharded = ShardedDispatcher(dispatcher, shards=8)
+    users = []
+    user_id = 0
+    # One user per shard
+    while len(users) < 8:
+        if sharded.shard_of(make_update(0, user_id)) not in {shard for shard, _ in users}:
+            users.append((sharded.shard_of(make_update(0, user_id)), user_id))
+        user_id += 1
+
+    for _, user in users:
+        sharded.submit(make_update(0, user))
+        sharded.submit(make_update(1, user))
+    stats = sharded.stats()
+    assert stats['queue_depth'] == [2] * 8
+    assert stats['pending'] == 16
+
+    start = time.perf_counter()
+    sharded.start()
+    sharded.stop()
+    assert time.perf_counter() - start < 0.8
+    assert sharded.stats()['shard_processed'] == [2] * 8
@@ -0,0 +1,126 @@
+"""
+Tests the module quizbot.bot.webhook
+"""
+import json
+import threading
+import urllib.error
+import urllib.request
+from quizbot.bot.dedupe import UpdateWindow
+from quizbot.bot.webhook import SECRET_HEADER, WebhookServer, replay_updates
+
+
+class FakeDispatcher:
+    """Records the processed updates, optionally blocking until released."""
+
+    def __init__(self):
+        self.bot = None
+        self.updates = []
+        self.release = threading.Event()
+        self.release.set()
+
+    def process_update(self, update):
+        self.release.wait()
+        self.updates.append(update.update_id)
+
+
+def post(server, data, secret='secret'):
+    """POSTs an update to the server and returns the status code."""
+    request = urllib.request.Request(
+        'http://127.0.0.1:{}/telegram'.format(server.port), data=json.dumps(data).encode())
+    if secret is not None:
+        request.add_header(SECRET_HEADER, secret)
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status
+    except urllib.error.HTTPError as err:
+        return err.code
+
+
+def test_receive():
+    """
+    Test that updates with the secret token are processed in order
+    and requests without it are rejected.
+    """
+    dispatcher = FakeDispatcher()
+    server = WebhookServer(dispatcher, 0, secret_token='secret', listen='127.0.0.1')
+    server.start()
+    try:
+        assert post(server, {'update_id': 1}) == 200
+        assert post(server, {'update_id': 2}, secret='wrong') == 403
+        assert post(server, {'update_id': 3}, secret=None) == 403
+        assert post(server, {'update_id': 4}) == 200
+    finally:
+        server.stop()
+    assert dispatcher.updates == [1, 4]
+    assert server.stats()['processed'] == 2
+
+
+def test_backpressure():
+    """
+    Test that updates are rejected with 503 while the queue is full.
+    """
+    dispatcher = FakeDispatcher()
+    dispatcher.release.clear()
+    server = WebhookServer(dispatcher, 0, secret_token='secret', queue_size=1,
+                           enqueue_timeout=0.1, listen='127.0.0.1')
+    server.start()
+    try:
+        statuses = [post(server, {'update_id': update_id}) for update_id in range(4)]
+        assert statuses[:2] == [200, 200]
+        assert 503 in statuses
+        assert server.stats()['rejected'] == statuses.count(503)
+    finally:
+        dispatcher.release.set()
+        server.stop()
+    assert len(dispatcher.updates) == statuses.count(200)
+
+
+def test_duplicates(tmp_path):
+    """
+    Test that an update delivered again is answered but not processed, also after a restart,
+    and that an update rejected with 503 is processed when it's delivered again.
+    """
+    path = str(tmp_path / 'updates.window')
+    dispatcher = FakeDispatcher()
+    dispatcher.release.clear()
+    server = WebhookServer(dispatcher, 0, secret_token='secret', queue_size=1,
+                           enqueue_timeout=0.1, listen='127.0.0.1', window=UpdateWindow(100, path))
+    server.start()
+    try:
+        assert post(server, {'update_id': 1}) == 200
+        assert post(server, {'update_id': 1}) == 200
+        statuses = [post(server, {'update_id': update_id}) for update_id in (2, 3)]
+        assert 503 in statuses
+    finally:
+        dispatcher.release.set()
+        server.stop()
+        server.window.close()
+
+    server = WebhookServer(dispatcher, 0, secret_token='secret', listen='127.0.0.1',
+                           window=UpdateWindow(100, path))
+    server.start()
+    try:
+        for update_id in (1, 2, 3, 3):
+            assert post(server, {'update_id': update_id}) == 200
+    finally:
+        server.stop()
+        server.window.close()
+    assert sorted(dispatcher.updates) == [1, 2, 3]
+    assert server.stats()['duplicates'] == 3
+
+
+def test_replay(tmp_path):
+    """
+    Test that recorded updates are replayed against the receiver.
+    """
+    path = tmp_path / 'updates.jsonl'
+    path.write_text('{"update_id": 7}\n\n{"update_id": 8}\n')
+    dispatcher = FakeDispatcher()
+    server = WebhookServer(dispatcher, 0, secret_token='secret', listen='127.0.0.1')
+    server.start()
+    try:
+        url = 'http://127.0.0.1:{}/telegram'.format(server.port)
+        assert replay_updates(str(path), url, 'secret') == {200: 2}
+    finally:
+        server.stop()
+    assert dispatcher.updates == [7, 8]
@@ -0,0 +1,24 @@
+"""
+Fixtures of the tests of the packages quizbot.quiz and quizbot.bot
+"""
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from api import models
+from quizbot.quiz import migrate, question_bank, quiz, subscription
+
+
+@pytest.fixture
+def database(monkeypatch):
+    """
+    Replaces the MySQL database by an in-memory SQLite database with the same tables.
+    """
+    engine = create_engine("sqlite://", poolclass=StaticPool,
+                           connect_args={"check_same_thread": False})
+    models.Base.metadata.create_all(bind=engine)
+    session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    for module in (quiz, question_bank, subscription, migrate):
+        monkeypatch.setattr(module, "SessionLocal", session)
+    yield engine
+    engine.dispose()
@@ -37,3 +37,19 @@ def test_question_answer():
     assert att.enter_answer()[0]
     assert not att.has_next_question()
     assert att.user_points[0][0]
+
+
+def test_skip_question():
+    """
+    Tests if a skipped question counts as answered wrong.
+    """
+    quiz = Quiz()
+    quest = QuestionNumber("What is the best number?", "42")
+    quiz.add_question(quest)
+    att = Attempt(quiz)
+    att.input_answer("41")
+
+    assert att.skip_question() == "42"
+    assert not att.has_next_question()
+    assert att.user_points == [(False, quest)]
+    assert not att.user_answers
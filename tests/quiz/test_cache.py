@@ -0,0 +1,82 @@
+"""
+Tests the module quizbot.quiz.cache
+"""
+from quizbot.quiz.cache import QuizCache
+from quizbot.quiz.question_factory import QuestionString
+from quizbot.quiz.quiz import Quiz
+
+
+def save_quiz(name):
+    """
+    Saves a quiz with one question.
+    """
+    quiz = Quiz("me", name)
+    quiz.add_question(QuestionString("Best Telegram bot?", "QuizBot"))
+    quiz.save_to_db()
+    return quiz
+
+
+def test_get(database):
+    """
+    Tests that cached quizzes are new instances and counted as hits.
+    """
+    save_quiz("Bots")
+    cache = QuizCache()
+
+    first = cache.get("Bots", "me")
+    second = cache.get("Bots", "me")
+    assert first.etag == second.etag
+    assert first.questions[0] is not second.questions[0]
+    assert cache.get("Unknown") is None
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 2
+    assert cache.stats()["size"] == 1
+
+
+def test_revalidate(database):
+    """
+    Tests that a stale quiz is reloaded after a new version was saved.
+    """
+    quiz = save_quiz("Bots")
+    cache = QuizCache(revalidate_after=0)
+    assert cache.get("Bots").version == 1
+
+    quiz.questions[0].correct_answer = "BestBot"
+    quiz.save_to_db()
+    reloaded = cache.get("Bots")
+    assert reloaded.version == 2
+    assert reloaded.questions[0].correct_answer == "BestBot"
+
+
+def test_hot_set(database, tmp_path):
+    """
+    Tests saving the popular quizzes and warming up a new cache with them.
+    """
+    for name in ("Bots", "Numbers", "Cities"):
+        save_quiz(name)
+    cache = QuizCache(max_size=2)
+    for name, count in (("Bots", 3), ("Numbers", 1), ("Cities", 2)):
+        for _ in range(count):
+            cache.get(name, "me")
+    assert [name for name, _, _ in cache.hot_quizzes(2)] == ["Bots", "Cities"]
+
+    path = str(tmp_path / "hot.json")
+    cache.save_hot_set(path, limit=2)
+    warm_cache = QuizCache()
+    warm_cache.warm_up(path, background=False)
+    assert warm_cache.stats()["warmup_done"] == 2
+    assert warm_cache.stats()["size"] == 2
+
+    warm_cache.get("Bots", "me")
+    assert warm_cache.stats()["hits"] == 1
+    assert warm_cache.stats()["misses"] == 0
+    assert warm_cache.hot_quizzes(1)[0][0] == "Bots"
+
+
+def test_warm_up_without_file(tmp_path):
+    """
+    Tests that a missing warm-up file is ignored.
+    """
+    cache = QuizCache()
+    assert cache.warm_up(str(tmp_path / "missing.json")) is None
+    assert cache.stats()["warmup_total"] == 0
@@ -0,0 +1,100 @@
+"""
+Tests the module quizbot.quiz.catalog
+"""
+import pytest
+from quizbot.quiz.attempt import Attempt
+from quizbot.quiz.catalog import QuizCatalog, compile_catalog
+from quizbot.quiz.question_factory import QuestionBool, QuestionChoice, \
+    QuestionChoiceSingle, QuestionNumber, QuestionString
+from quizbot.quiz.quiz import Quiz
+
+
+def create_quizzes():
+    """
+    Creates two quizzes with questions of every type.
+    """
+    geography = Quiz("me", "Geography")
+    geography.is_random = True
+    geography.show_results_after_quiz = False
+    geography.add_question(QuestionString("Capital of France?", "Paris"))
+    geography.add_question(QuestionNumber("How many continents?", "7"))
+    choice = QuestionChoice("Countries in Europe?", "France, Spain")
+    choice.add_possible_answer("Peru")
+    choice.is_random = True
+    geography.add_question(choice)
+
+    bots = Quiz("you", "Bots")
+    bots.add_question(QuestionBool("Is QuizBot great?", "True"))
+    single = QuestionChoiceSingle("Best bot?", "QuizBot")
+    single.add_possible_answer("LameBot")
+    bots.add_question(single)
+    return [geography, bots]
+
+
+def test_round_trip(tmp_path):
+    """
+    Tests compiling quizzes and reading them through views.
+    """
+    path = str(tmp_path / "catalog.bin")
+    assert compile_catalog(create_quizzes(), path) == 2
+
+    with QuizCatalog(path) as catalog:
+        assert len(catalog) == 2
+        assert [view.name for view in catalog] == ["Bots", "Geography"]
+
+        geography = catalog.find("Geography")
+        assert geography.author == "me"
+        assert geography.is_random
+        assert not geography.show_results_after_quiz
+        assert geography.show_results_after_question
+
+        questions = geography.questions
+        assert [view.question_type for view in questions] == \
+            ["QuestionString", "QuestionNumber", "QuestionChoice"]
+        assert questions[2].possible_answers == ["France", "Spain", "Peru"]
+        assert questions[2].is_random
+
+        quiz = geography.to_quiz()
+        assert isinstance(quiz.questions[2], QuestionChoice)
+        assert quiz.questions[2].possible_answers == ["France", "Spain", "Peru"]
+
+
+def test_find(tmp_path):
+    """
+    Tests finding quizzes by name and author.
+    """
+    path = str(tmp_path / "catalog.bin")
+    compile_catalog(create_quizzes(), path)
+
+    with QuizCatalog(path) as catalog:
+        assert catalog.find("Bots", "you").name == "Bots"
+        assert catalog.find("Bots", "me") is None
+        assert catalog.find("History") is None
+        with pytest.raises(IndexError):
+            catalog[2]
+
+
+def test_attempt_view(tmp_path):
+    """
+    Tests attempting a quiz view without hydrating the quiz.
+    """
+    path = str(tmp_path / "catalog.bin")
+    compile_catalog(create_quizzes(), path)
+
+    with QuizCatalog(path) as catalog:
+        att = Attempt(catalog.find("Bots"))
+        att.input_answer("True")
+        assert att.enter_answer()[0]
+        att.input_answer("LameBot")
+        assert att.enter_answer() == (False, "QuizBot")
+        assert not att.has_next_question()
+
+
+def test_invalid_file(tmp_path):
+    """
+    Tests opening a file which isn't a catalog.
+    """
+    path = tmp_path / "catalog.bin"
+    path.write_bytes(b"\0" * 64)
+    with pytest.raises(ValueError):
+        QuizCatalog(str(path))
@@ -0,0 +1,89 @@
+"""
+Tests the module quizbot.quiz.codec
+"""
+import pytest
+from quizbot.quiz.codec import decode_quiz, encode_quiz
+from quizbot.quiz.question_factory import QuestionBool, QuestionChoice, \
+    QuestionChoiceSingle, QuestionNumber, QuestionString
+from quizbot.quiz.quiz import Quiz
+
+
+def create_quiz():
+    """
+    Creates a quiz with questions of every type.
+    """
+    quiz = Quiz("me", "Everything 🧐")
+    quiz.is_random = True
+    quiz.show_results_after_question = False
+    quiz.add_question(QuestionString("Best bot?", "QuizBot"))
+    quiz.add_question(QuestionNumber("Best number?", "42"))
+    quiz.add_question(QuestionBool("Is QuizBot great?", "True"))
+    choice = QuestionChoice("Countries in Europe?", "France, Spain")
+    choice.add_possible_answer("Peru")
+    choice.is_random = True
+    quiz.add_question(choice)
+    quiz.add_question(QuestionChoiceSingle("Capital of France?", "Paris"))
+    return quiz
+
+
+def test_round_trip():
+    """
+    Tests encoding and decoding a quiz.
+    """
+    quiz = create_quiz()
+    decoded = decode_quiz(encode_quiz(quiz))
+
+    assert (decoded.name, decoded.author) == ("Everything 🧐", "me")
+    assert decoded.is_random
+    assert decoded.show_results_after_quiz
+    assert not decoded.show_results_after_question
+    assert decoded.bank is None
+    assert [type(question) for question in decoded.questions] == \
+        [type(question) for question in quiz.questions]
+    assert [question.correct_answer for question in decoded.questions] == \
+        [question.correct_answer for question in quiz.questions]
+    assert decoded.questions[3].possible_answers == ["France", "Spain", "Peru"]
+    assert decoded.questions[3].is_random
+    assert not decoded.questions[4].is_random
+
+
+def test_saved_version():
+    """
+    Tests encoding the saved version and the question IDs.
+    """
+    quiz = create_quiz()
+    quiz.id = 7
+    quiz.version = 3
+    quiz.questions[0].mark_saved(11)
+    decoded = decode_quiz(encode_quiz(quiz))
+
+    assert decoded.etag == "7-3"
+    assert decoded.questions[0].question_id == 11
+    assert decoded.questions[0].saved_fingerprint == quiz.questions[0].fingerprint()
+    assert decoded.questions[1].question_id is None
+
+
+def test_bank_draw():
+    """
+    Tests encoding the question bank of a quiz.
+    """
+    quiz = Quiz("me", "Bank")
+    quiz.draw_from_bank("numbers", 10, "tag")
+    decoded = decode_quiz(encode_quiz(quiz))
+
+    assert decoded.questions == []
+    assert (decoded.bank, decoded.bank_draw_count, decoded.bank_stratify_by) == \
+        ("numbers", 10, "tag")
+
+
+def test_invalid_data():
+    """
+    Tests decoding data which isn't an encoded quiz.
+    """
+    data = encode_quiz(create_quiz())
+    with pytest.raises(ValueError):
+        decode_quiz(b"XX" + data[2:])
+    with pytest.raises(ValueError):
+        decode_quiz(data[:-3])
+    with pytest.raises(ValueError):
+        decode_quiz(data[:5])
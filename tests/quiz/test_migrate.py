@@ -0,0 +1,32 @@
+"""
+Tests the module quizbot.quiz.migrate
+"""
+from quizbot.quiz import migrate
+from quizbot.quiz.quiz import Quiz
+
+
+def test_backfill_versions(database):
+    """
+    Test that a quiz saved without versions is migrated to version 1 once.
+    """
+    database.execute(
+        """INSERT INTO quizzes (id, name, author, is_random, show_results_after_quiz,
+                                show_results_after_question, version)
+           VALUES (1, 'Legacy', 'alice', 0, 0, 1, 0)""")
+    for text, answer in (('Capital of France?', 'Paris'), ('Capital of Italy?', 'Rome')):
+        database.execute(
+            """INSERT INTO questions (quiz_id, question_type, question_text, correct_answer)
+               VALUES (1, 'QuestionString', ?, ?)""", (text, answer))
+    assert Quiz.load_from_db('Legacy', 'alice') is None
+
+    assert not migrate.add_version_column()
+    assert migrate.backfill_versions() == 1
+    quiz = Quiz.load_from_db('Legacy', 'alice')
+    assert quiz.version == 1 and not quiz.show_results_after_quiz
+    assert [question.correct_answer for question in quiz.questions] == ['Paris', 'Rome']
+    assert migrate.backfill_versions() == 0
+
+    # Saving the migrated quiz continues with version 2
+    quiz.save_to_db()
+    assert Quiz.get_version('Legacy', 'alice') == (1, 2)
+
@@ -0,0 +1,67 @@
+"""
+Tests the module quizbot.quiz.name_index
+"""
+from quizbot.quiz.name_index import QuizNameIndex
+from quizbot.quiz.question_factory import QuestionString
+from quizbot.quiz.quiz import Quiz
+
+
+def create_index():
+    """
+    Creates an index with a few quizzes.
+    """
+    index = QuizNameIndex()
+    index.load([("World geography", "alice"), ("Geology", "bob"), ("Math", "george"),
+                ("Telegram", "alice")])
+    return index
+
+
+def test_search():
+    """
+    Test that names, words of names and authors are found by their beginning.
+    """
+    index = create_index()
+    assert index.search("geo") == [("Geology", "bob"), ("World geography", "alice"),
+                                   ("Math", "george")]
+    assert index.search("WORLD  geo") == [("World geography", "alice")]
+    assert index.search("alice") == [("Telegram", "alice"), ("World geography", "alice")]
+    assert index.search("geo", limit=1) == [("Geology", "bob")]
+    assert index.search("x") == []
+
+
+def test_update():
+    """
+    Test that quizzes are added, renamed and removed incrementally.
+    """
+    index = create_index()
+    index.add("Geometry", "carol")
+    index.rename("Geology", "bob", "Rocks")
+    index.remove("Math", "george")
+
+    assert index.search("geo") == [("Geometry", "carol"), ("World geography", "alice")]
+    assert index.search("rock") == [("Rocks", "bob")]
+    assert len(index) == 4
+
+
+def test_resolve():
+    """
+    Test that names with several words are told apart from the author.
+    """
+    index = create_index()
+    assert index.resolve("World geography alice") == ("World geography", "alice")
+    assert index.resolve("World geography") == ("World geography", None)
+    assert index.resolve("Telegram alice") == ("Telegram", "alice")
+    assert index.resolve("Unknown quiz") is None
+
+
+def test_load_from_db(database):
+    """
+    Test that the index is loaded from the database.
+    """
+    quiz = Quiz("me", "Best bots")
+    quiz.add_question(QuestionString("Best Telegram bot?", "QuizBot"))
+    quiz.save_to_db()
+    index = QuizNameIndex()
+    index.load()
+
+    assert index.search("bots") == [("Best bots", "me")]
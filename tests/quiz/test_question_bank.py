@@ -0,0 +1,80 @@
+"""
+Tests the module quizbot.quiz.question_bank
+"""
+import pytest
+from quizbot.quiz.attempt import Attempt
+from quizbot.quiz.question_bank import QuestionBank, allocate_quotas
+from quizbot.quiz.question_factory import QuestionChoice, QuestionNumber, QuestionString
+from quizbot.quiz.quiz import Quiz
+
+
+def fill_bank(bank):
+    """
+    Adds 30 geography and 10 history questions to the bank.
+    """
+    for number in range(30):
+        bank.add_question(QuestionNumber("{} + 1?".format(number), str(number + 1)),
+                          tag="geography", difficulty=number % 3)
+    for number in range(10):
+        question = QuestionChoice("Year {}?".format(number), "Yes")
+        question.add_possible_answer("No")
+        bank.add_question(question, tag="history")
+
+
+def test_allocate_quotas():
+    """
+    Tests the proportional split of a sample over strata.
+    """
+    assert allocate_quotas({"a": 30, "b": 10}, 8) == {"a": 6, "b": 2}
+    assert sum(allocate_quotas({"a": 1, "b": 1, "c": 1}, 2).values()) == 2
+    assert allocate_quotas({"a": 2, "b": 1}, 10) == {"a": 2, "b": 1}
+
+
+def test_sample(database):
+    """
+    Tests drawing distinct questions of a bank.
+    """
+    bank = QuestionBank("numbers")
+    fill_bank(bank)
+    assert bank.size() == 40
+
+    questions = bank.sample(12)
+    assert len(questions) == 12
+    assert len({question.question for question in questions}) == 12
+
+    # The whole bank is returned if it is too small
+    assert len(bank.sample(100)) == 40
+    assert bank.sample(0) == []
+    assert QuestionBank("empty").sample(5) == []
+
+
+def test_sample_stratified(database):
+    """
+    Tests stratifying a sample by tag.
+    """
+    bank = QuestionBank("mixed")
+    fill_bank(bank)
+
+    questions = bank.sample(8, stratify_by="tag")
+    assert len(questions) == 8
+    assert sum(isinstance(question, QuestionChoice) for question in questions) == 2
+    assert [question.possible_answers for question in questions
+            if isinstance(question, QuestionChoice)][0] == ["Yes", "No"]
+    assert len(bank.sample(6, stratify_by="difficulty")) == 6
+
+    with pytest.raises(ValueError):
+        bank.sample(3, stratify_by="question_text")
+
+
+def test_quiz_from_bank(database):
+    """
+    Tests attempting a quiz which draws from a bank.
+    """
+    fill_bank(QuestionBank("numbers"))
+    quiz = Quiz("me", "Numbers")
+    quiz.add_question(QuestionString("Best bot?", "QuizBot"))
+    quiz.draw_from_bank("numbers", 5)
+
+    att = Attempt(quiz)
+    assert len(att.questions) == 6
+    assert len(quiz.questions) == 1
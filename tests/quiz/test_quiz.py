@@ -1,8 +1,9 @@
 """
 Tests the module quizbot.quiz.quiz
 """
+import pytest
 from quizbot.quiz.quiz import Quiz
-from quizbot.quiz.question_factory import QuestionString
+from quizbot.quiz.question_factory import QuestionChoice, QuestionString
 
 
 def test_adding_question():
@@ -39,3 +40,119 @@ def test_get_questions():
     # Copy list of question
     list_of_questions = new_quiz.get_questions()
     assert len(list_of_questions) == 1
+
+
+def test_save_and_load(database):
+    """
+    Tests saving a quiz and loading it again.
+    """
+    quiz = Quiz("me", "Bots")
+    quiz.is_random = True
+    quiz.add_question(QuestionString("Best Telegram bot?", "QuizBot"))
+    choice = QuestionChoice("Which bots are great?", "QuizBot")
+    choice.add_possible_answer("LameBot")
+    quiz.add_question(choice)
+    assert quiz.etag is None
+    quiz.save_to_db()
+    assert quiz.version == 1
+
+    loaded = Quiz.load_from_db("Bots")
+    assert loaded.etag == quiz.etag
+    assert loaded.is_random
+    assert [question.question for question in loaded.questions] == \
+        ["Best Telegram bot?", "Which bots are great?"]
+    assert loaded.questions[1].possible_answers == ["QuizBot", "LameBot"]
+    assert Quiz.load_from_db("Bots", "you") is None
+    assert Quiz.get_version("Bots", "me") == (quiz.id, 1)
+
+
+def test_versions(database):
+    """
+    Tests that saving creates a new version which shares unchanged questions.
+    """
+    quiz = Quiz("me", "Bots")
+    quiz.add_question(QuestionString("Best Telegram bot?", "QuizBot"))
+    quiz.add_question(QuestionString("Worst Telegram bot?", "LameBot"))
+    quiz.save_to_db()
+    unchanged_id = quiz.questions[0].question_id
+
+    # Edit the second question and save again
+    edited = Quiz.load_from_db("Bots", "me")
+    edited.questions[1].correct_answer = "SlowBot"
+    edited.show_results_after_quiz = False
+    edited.save_to_db()
+    assert edited.version == 2
+    assert edited.questions[0].question_id == unchanged_id
+    assert edited.questions[1].question_id != quiz.questions[1].question_id
+
+    # The first version is still readable
+    first = Quiz.load_from_db("Bots", version=1)
+    assert first.questions[1].correct_answer == "LameBot"
+    assert first.show_results_after_quiz
+    latest = Quiz.load_from_db("Bots")
+    assert latest.version == 2
+    assert latest.questions[1].correct_answer == "SlowBot"
+    assert not latest.show_results_after_quiz
+    assert Quiz.load_from_db("Bots", version=3) is None
+    assert database.execute("SELECT COUNT(*) FROM questions").scalar() == 3
+
+
+def test_clone(database):
+    """
+    Tests that a clone shares the questions of the original until they are edited.
+    """
+    original = Quiz("me", "Bots")
+    original.show_results_after_quiz = False
+    for number in range(300):
+        original.add_question(QuestionString("Question {}?".format(number), "Answer"))
+    original.save_to_db()
+    assert database.execute("SELECT COUNT(*) FROM questions").scalar() == 300
+
+    assert Quiz.clone("Bots", "me", "My bots", "you") is not None
+    assert Quiz.clone("Unknown", "me", "My bots", "you") is None
+    with pytest.raises(ValueError):
+        Quiz.clone("Bots", "me", "My bots", "you")
+    assert database.execute("SELECT COUNT(*) FROM questions").scalar() == 300
+
+    copy = Quiz.load_from_db("My bots", "you")
+    assert copy.version == 1
+    assert len(copy.questions) == 300
+    assert not copy.show_results_after_quiz
+    assert copy.questions[7].question_id == original.questions[7].question_id
+
+    # Editing the copy doesn't change the original
+    copy.questions[7].correct_answer = "Other answer"
+    copy.save_to_db()
+    assert database.execute("SELECT COUNT(*) FROM questions").scalar() == 301
+    assert Quiz.load_from_db("Bots", "me").questions[7].correct_answer == "Answer"
+    assert Quiz.load_from_db("My bots", "you").questions[7].correct_answer == "Other answer"
+
+
+def test_rename_and_delete(database):
+    """
+    Tests renaming and deleting quizzes, a deleted original leaves the questions of its copy.
+    """
+    original = Quiz("me", "Bots")
+    original.add_question(QuestionString("Best Telegram bot?", "QuizBot"))
+    original.add_question(QuestionString("Worst Telegram bot?", "LameBot"))
+    original.save_to_db()
+    Quiz.clone("Bots", "me", "My bots", "you")
+    Quiz("you", "Other").save_to_db()
+
+    assert Quiz.rename("My bots", "you", "Great bots")
+    assert not Quiz.rename("My bots", "you", "Bots")
+    with pytest.raises(ValueError):
+        Quiz.rename("Great bots", "you", "Other")
+    assert Quiz.get_version("My bots", "you") is None
+
+    assert Quiz.delete("Bots", "me")
+    assert not Quiz.delete("Bots", "me")
+    assert Quiz.load_from_db("Bots", "me") is None
+    copy = Quiz.load_from_db("Great bots", "you")
+    assert [question.correct_answer for question in copy.questions] == ["QuizBot", "LameBot"]
+    assert database.execute("SELECT DISTINCT quiz_id FROM questions").fetchall() == [(copy.id,)]
+
+    assert Quiz.delete("Great bots", "you")
+    assert database.execute("SELECT COUNT(*) FROM questions").scalar() == 0
+    assert database.execute("SELECT COUNT(*) FROM quiz_questions").scalar() == 0
+    assert Quiz.get_version("Other", "you") is not None
@@ -0,0 +1,117 @@
+"""
+Tests the module quizbot.quiz.subscription
+"""
+from types import SimpleNamespace
+from quizbot.quiz import subscription
+
+
+def test_subscribe(database):
+    """
+    Test that a chat is subscribed once and unsubscribed again.
+    """
+    assert subscription.subscribe(-100, 'group')
+    assert not subscription.subscribe(-100, 'group')
+    assert subscription.unsubscribe(-100)
+    assert not subscription.unsubscribe(-100)
+    assert database.execute("SELECT COUNT(*) FROM daily_subscribers").scalar() == 0
+
+
+def test_subscriber_batches(database):
+    """
+    Test that the batches of subscribers follow each other in the order of the chat ID,
+    including the negative IDs of groups.
+    """
+    for chat_id in (5, -3, 12, 1, 8):
+        subscription.subscribe(chat_id)
+    assert subscription.subscriber_batch(None, 2) == [-3, 1]
+    assert subscription.subscriber_batch(1, 2) == [5, 8]
+    assert subscription.subscriber_batch(8, 2) == [12]
+    assert subscription.subscriber_batch(12, 2) == []
+
+
+def test_lease(database):
+    """
+    Test that only one worker holds the lease of a broadcast until it expires
+    and that a checkpoint of a worker without the lease is refused.
+    """
+    run = subscription.start_run('2026-10-19', 'Daily', 'alice')
+    assert run.quiz_name == 'Daily' and run.last_chat_id is None and run.sent == 0
+    assert subscription.start_run('2026-10-19', 'Other').quiz_name == 'Daily'
+
+    assert subscription.claim_run('2026-10-19', 'a', 60, now=1000)
+    assert subscription.claim_run('2026-10-19', 'a', 60, now=1010)
+    assert not subscription.claim_run('2026-10-19', 'b', 60, now=1020)
+    assert subscription.claim_run('2026-10-19', 'b', 60, now=1071)
+    assert not subscription.checkpoint('2026-10-19', 'a', 5, 3, 0, 60)
+    assert subscription.checkpoint('2026-10-19', 'b', 5, 3, 0, 60)
+    assert subscription.load_run('2026-10-19').last_chat_id == 5
+
+    subscription.finish_run('2026-10-19')
+    assert not subscription.claim_run('2026-10-19', 'b', 60)
+
+
+def test_concurrent_start(database, monkeypatch):
+    """
+    Test that a worker which creates the broadcast after another one did, between
+    its check and its insert, gets the existing broadcast.
+    """
+    subscription.start_run('2026-10-19', 'Daily', 'alice')
+    session_local = subscription.SessionLocal
+
+    def racing_session():
+        session = session_local()
+        execute = session.execute
+
+        def racing_execute(statement, *args, **kwargs):
+            if str(statement).startswith('SELECT 1 FROM daily_runs'):
+                # The other worker's row isn't visible yet
+                return SimpleNamespace(first=lambda: None)
+            return execute(statement, *args, **kwargs)
+
+        session.execute = racing_execute
+        return session
+
+    monkeypatch.setattr(subscription, 'SessionLocal', racing_session)
+    assert subscription.start_run('2026-10-19', 'Other').quiz_name == 'Daily'
+    assert database.execute("SELECT COUNT(*) FROM daily_runs").scalar() == 1
+
+
+def test_concurrent_subscribe(database, monkeypatch):
+    """
+    Test that a chat which subscribed at the same time on another worker,
+    between the check and the insert, isn't subscribed again.
+    """
+    subscription.subscribe(-100, 'group')
+    session_local = subscription.SessionLocal
+
+    def racing_session():
+        session = session_local()
+        execute = session.execute
+
+        def racing_execute(statement, *args, **kwargs):
+            if str(statement).startswith('SELECT 1 FROM daily_subscribers'):
+                # The other worker's row isn't visible yet
+                return SimpleNamespace(first=lambda: None)
+            return execute(statement, *args, **kwargs)
+
+        session.execute = racing_execute
+        return session
+
+    monkeypatch.setattr(subscription, 'SessionLocal', racing_session)
+    assert not subscription.subscribe(-100, 'group')
+    assert database.execute("SELECT COUNT(*) FROM daily_subscribers").scalar() == 1
+
+
+def test_failures(database):
+    """
+    Test that repeated failures count the tries and only failures with fewer tries are retried.
+    """
+    subscription.record_failure('2026-10-19', 4, 'Timed out')
+    subscription.record_failure('2026-10-19', -2, 'Timed out')
+    subscription.record_failure('2026-10-19', 4, 'Timed out')
+    subscription.record_failure('2026-10-18', 1, 'Timed out')
+    assert subscription.failure_batch('2026-10-19', None, 10, 3) == [-2, 4]
+    assert subscription.failure_batch('2026-10-19', None, 10, 2) == [-2]
+    assert subscription.failure_batch('2026-10-19', -2, 10, 3) == [4]
+    subscription.clear_failure('2026-10-19', -2)
+    assert subscription.failure_batch('2026-10-19', None, 10, 3) == [4]